@@ -118,6 +118,7 @@ BOOLEAN_COLUMNS = {
     "e2e_fallback_keys_json": ["used"],
     "e2e_room_keys": ["is_verified"],
     "event_edges": ["is_state"],
+    "event_push_counts_rooms": ["pending"],
     "events": ["processed", "outlier", "contains_url"],
     "local_media_repository": ["safe_from_quarantine", "authenticated"],
     "per_user_experimental_features": ["enabled"],
@@ -19,7 +19,18 @@
 #
 #
 
-from typing import Any, Optional
+import sys
+from array import array
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    MutableMapping,
+    Optional,
+    Tuple,
+)
 
 import attr
 
@@ -102,3 +113,140 @@ class UserPresenceState:
             status_msg=None,
             currently_active=False,
         )
+
+
+# The presence states which `PresenceStateTable` can store compactly.
+_TABLE_STATES: Tuple[str, ...] = (
+    PresenceState.OFFLINE,
+    PresenceState.UNAVAILABLE,
+    PresenceState.ONLINE,
+    PresenceState.BUSY,
+)
+_TABLE_STATE_INDICES = {state: index for index, state in enumerate(_TABLE_STATES)}
+
+
+def _is_int64(value: object) -> bool:
+    return isinstance(value, int) and -(2**63) <= value < 2**63
+
+
+class PresenceStateTable(MutableMapping[str, UserPresenceState]):
+    """A map from user ID to `UserPresenceState`, stored compactly.
+
+    Rather than keeping a `UserPresenceState` object (and boxed integers for
+    each of its timestamps) per user, the fields are stored in parallel arrays,
+    with each user assigned a row. Presence states are stored as an index into
+    the known states, and status messages are interned, as most users share a
+    handful of them.
+
+    States which can't be stored in the arrays (e.g. an unknown presence state
+    or a timestamp which isn't an integer) are kept as they are in a separate
+    dict instead.
+
+    `UserPresenceState` objects are created on access, so callers should not
+    rely on getting the same object back.
+    """
+
+    def __init__(self, states: Iterable[UserPresenceState] = ()) -> None:
+        # The row of each user, and the rows which have been freed by deleting
+        # users.
+        self._rows: Dict[str, int] = {}
+        self._free_rows: List[int] = []
+
+        # The states which can't be stored in the arrays.
+        self._other_states: Dict[str, UserPresenceState] = {}
+
+        self._states = bytearray()
+        self._last_active_ts = array("q")
+        self._last_federation_update_ts = array("q")
+        self._last_user_sync_ts = array("q")
+        self._currently_active = bytearray()
+        self._status_msgs: List[Optional[str]] = []
+
+        for state in states:
+            self[state.user_id] = state
+
+    def __getitem__(self, user_id: str) -> UserPresenceState:
+        row = self._rows.get(user_id)
+        if row is None:
+            return self._other_states[user_id]
+
+        return UserPresenceState(
+            user_id=user_id,
+            state=_TABLE_STATES[self._states[row]],
+            last_active_ts=self._last_active_ts[row],
+            last_federation_update_ts=self._last_federation_update_ts[row],
+            last_user_sync_ts=self._last_user_sync_ts[row],
+            status_msg=self._status_msgs[row],
+            currently_active=bool(self._currently_active[row]),
+        )
+
+    def __setitem__(self, user_id: str, state: UserPresenceState) -> None:
+        assert state.user_id == user_id
+
+        # Check that the state fits in the arrays before changing anything, so
+        # that they never get out of step with each other.
+        state_index = (
+            _TABLE_STATE_INDICES.get(state.state)
+            if isinstance(state.state, str)
+            else None
+        )
+        if (
+            state_index is None
+            or not _is_int64(state.last_active_ts)
+            or not _is_int64(state.last_federation_update_ts)
+            or not _is_int64(state.last_user_sync_ts)
+            or not isinstance(state.status_msg, (str, type(None)))
+            or not isinstance(state.currently_active, bool)
+        ):
+            if user_id in self._rows:
+                self._delete_row(user_id)
+            self._other_states[user_id] = state
+            return
+
+        self._other_states.pop(user_id, None)
+
+        status_msg = state.status_msg
+        if status_msg is not None:
+            status_msg = sys.intern(status_msg)
+
+        row = self._rows.get(user_id)
+        if row is None and self._free_rows:
+            row = self._free_rows.pop()
+            self._rows[user_id] = row
+
+        if row is None:
+            self._rows[user_id] = len(self._states)
+            self._states.append(state_index)
+            self._last_active_ts.append(state.last_active_ts)
+            self._last_federation_update_ts.append(state.last_federation_update_ts)
+            self._last_user_sync_ts.append(state.last_user_sync_ts)
+            self._currently_active.append(state.currently_active)
+            self._status_msgs.append(status_msg)
+        else:
+            self._states[row] = state_index
+            self._last_active_ts[row] = state.last_active_ts
+            self._last_federation_update_ts[row] = state.last_federation_update_ts
+            self._last_user_sync_ts[row] = state.last_user_sync_ts
+            self._currently_active[row] = state.currently_active
+            self._status_msgs[row] = status_msg
+
+    def __delitem__(self, user_id: str) -> None:
+        if user_id in self._rows:
+            self._delete_row(user_id)
+        else:
+            del self._other_states[user_id]
+
+    def _delete_row(self, user_id: str) -> None:
+        row = self._rows.pop(user_id)
+        self._status_msgs[row] = None
+        self._free_rows.append(row)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._rows
+        yield from self._other_states
+
+    def __len__(self) -> int:
+        return len(self._rows) + len(self._other_states)
+
+    def __contains__(self, user_id: object) -> bool:
+        return user_id in self._rows or user_id in self._other_states
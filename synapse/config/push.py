@@ -23,7 +23,7 @@ from typing import Any
 
 from synapse.types import JsonDict
 
-from ._base import Config
+from ._base import Config, ConfigError
 
 
 class PushConfig(Config):
@@ -37,6 +37,13 @@ class PushConfig(Config):
             "group_unread_count_by_room", True
         )
 
+        # Whether to calculate push actions for (non-state) events in the
+        # background once they have been persisted, rather than before persisting
+        # them.
+        self.push_actions_in_background = push_config.get(
+            "calculate_actions_in_background", False
+        )
+
         # There was a a 'redact_content' setting but mistakenly read from the
         # 'email'section'. Check for the flag in the 'push' section, and log,
         # but do not honour it to avoid nasty surprises when people upgrade.
@@ -57,6 +64,25 @@ class PushConfig(Config):
             )
             self.push_include_content = not redact_content
 
+        # The maximum number of concurrent requests to each push gateway.
+        self.max_concurrent_gateway_requests = push_config.get(
+            "max_concurrent_gateway_requests", 100
+        )
+        if (
+            not isinstance(self.max_concurrent_gateway_requests, int)
+            or self.max_concurrent_gateway_requests < 1
+        ):
+            raise ConfigError(
+                "'max_concurrent_gateway_requests' must be a positive integer",
+                ("push", "max_concurrent_gateway_requests"),
+            )
+
+        # How long to wait for identical notifications to batch together before
+        # sending them to a push gateway.
+        self.gateway_batch_delay_ms = self.parse_duration(
+            push_config.get("gateway_batch_delay", 0)
+        )
+
         # Whether to apply a random delay to outbound push.
         self.push_jitter_delay_ms = None
         push_jitter_delay = push_config.get("jitter_delay", None)
@@ -38,6 +38,17 @@ class RedisConfig(Config):
         redis_config = config.get("redis") or {}
         self.redis_enabled = redis_config.get("enabled", False)
 
+        # Whether to send replication stream updates in batches (as RDATA_BATCH
+        # commands) rather than one row per RDATA command. Only safe to enable once
+        # every instance understands RDATA_BATCH.
+        self.redis_batch_rdata = redis_config.get("batch_rdata", False)
+
+        # Whether to pack bulk cache invalidations into fewer rows of the caches
+        # stream. Only safe to enable once every instance understands them.
+        self.redis_batch_cache_invalidations = redis_config.get(
+            "batch_cache_invalidations", False
+        )
+
         if not self.redis_enabled:
             return
 
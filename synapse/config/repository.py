@@ -21,7 +21,7 @@
 
 import logging
 import os
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from urllib.request import getproxies_environment  # type: ignore
 
 import attr
@@ -158,6 +158,22 @@ class ContentRepositoryConfig(Config):
             config.get("media_store_path", "media_store")
         )
 
+        media_sendfile_config = config.get("media_sendfile") or {}
+        self.media_sendfile_header: Optional[str] = media_sendfile_config.get("header")
+        self.media_sendfile_path_prefix: str = media_sendfile_config.get(
+            "path_prefix", ""
+        )
+        if self.media_sendfile_header is not None and not isinstance(
+            self.media_sendfile_header, str
+        ):
+            raise ConfigError("Must be a string", ("media_sendfile", "header"))
+        if not isinstance(self.media_sendfile_path_prefix, str):
+            raise ConfigError("Must be a string", ("media_sendfile", "path_prefix"))
+
+        self.enable_media_deduplication = config.get(
+            "enable_media_deduplication", False
+        )
+
         backup_media_store_path = config.get("backup_media_store_path")
 
         synchronous_backup_media_store = config.get(
@@ -217,6 +233,18 @@ class ContentRepositoryConfig(Config):
                 (provider_class, parsed_config, wrapper_config)
             )
 
+        media_local_cache_config = config.get("media_local_cache") or {}
+        self.media_local_cache_max_size: Optional[int] = None
+        if media_local_cache_config.get("max_size") is not None:
+            if not self.media_storage_providers:
+                raise ConfigError(
+                    "Requires `media_storage_providers` to be configured",
+                    ("media_local_cache", "max_size"),
+                )
+            self.media_local_cache_max_size = self.parse_size(
+                media_local_cache_config["max_size"]
+            )
+
         self.dynamic_thumbnails = config.get("dynamic_thumbnails", False)
         self.thumbnail_requirements = parse_thumbnail_requirements(
             config.get("thumbnail_sizes", DEFAULT_THUMBNAIL_SIZES)
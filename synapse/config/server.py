@@ -400,6 +400,13 @@ class ServerConfig(Config):
                 self.presence_router_config,
             ) = load_module(presence_router_config, ("presence", "presence_router"))
 
+        # How long to collect typing notification changes for before notifying
+        # clients and remote servers about them.
+        typing_config = config.get("typing") or {}
+        self.typing_coalesce_window_ms = self.parse_duration(
+            typing_config.get("coalesce_window", 0)
+        )
+
         # Whether to require authentication to retrieve profile data (avatars,
         # display names) of other users through the client API.
         self.require_auth_for_profile_requests = config.get(
@@ -432,6 +432,48 @@ class WorkerConfig(Config):
             new_option_name="update_user_directory_from_worker",
         )
 
+        replication_stream_processing = (
+            config.get("replication_stream_processing") or {}
+        )
+        if not isinstance(replication_stream_processing, dict):
+            raise ConfigError(
+                "Must be a dictionary", ("replication_stream_processing",)
+            )
+
+        # The maximum number of replication streams whose incoming updates are
+        # processed at once. None means there is no limit.
+        max_concurrent_streams = replication_stream_processing.get(
+            "max_concurrent_streams"
+        )
+        if max_concurrent_streams is not None and (
+            not isinstance(max_concurrent_streams, int) or max_concurrent_streams < 1
+        ):
+            raise ConfigError(
+                "Must be a positive integer",
+                ("replication_stream_processing", "max_concurrent_streams"),
+            )
+        self.replication_max_concurrent_streams: Optional[int] = max_concurrent_streams
+
+        # Overrides for the priorities of replication streams: when more streams
+        # have updates waiting than can be processed at once, those with higher
+        # priorities are processed first.
+        stream_priorities = replication_stream_processing.get("stream_priorities") or {}
+        if not isinstance(stream_priorities, dict) or not all(
+            isinstance(stream_name, str) and isinstance(priority, int)
+            for stream_name, priority in stream_priorities.items()
+        ):
+            raise ConfigError(
+                "Must be a mapping from stream name to integer priority",
+                ("replication_stream_processing", "stream_priorities"),
+            )
+        self.replication_stream_priorities: Dict[str, int] = stream_priorities
+
+        # How long a stream can wait to be processed before it is processed ahead
+        # of streams with higher priorities, so that they can't starve it.
+        self.replication_stream_max_wait_ms = self.parse_duration(
+            replication_stream_processing.get("max_wait", "5s")
+        )
+
         outbound_federation_restricted_to = config.get(
             "outbound_federation_restricted_to", None
         )
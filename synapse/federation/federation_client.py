@@ -38,6 +38,7 @@ from typing import (
     Mapping,
     Optional,
     Sequence,
+    Set,
     Tuple,
     TypeVar,
     Union,
@@ -46,6 +47,8 @@ from typing import (
 import attr
 from prometheus_client import Counter
 
+from twisted.internet import defer
+
 from synapse.api.constants import Direction, EventContentFields, EventTypes, Membership
 from synapse.api.errors import (
     CodeMessageException,
@@ -72,9 +75,15 @@ from synapse.federation.federation_base import (
 from synapse.federation.transport.client import SendJoinResponse
 from synapse.http.client import is_unknown_endpoint
 from synapse.http.types import QueryParams
+from synapse.logging.context import (
+    PreserveLoggingContext,
+    current_context,
+    make_deferred_yieldable,
+    run_in_background,
+)
 from synapse.logging.opentracing import SynapseTags, log_kv, set_tag, tag_args, trace
 from synapse.types import JsonDict, StrCollection, UserID, get_domain_from_id
-from synapse.util.async_helpers import concurrently_execute
+from synapse.util.async_helpers import Linearizer, concurrently_execute
 from synapse.util.caches.expiringcache import ExpiringCache
 from synapse.util.retryutils import NotRetryingDestination
 
@@ -334,22 +343,16 @@ class FederationClient(FederationBase):
         if not extremities:
             return None
 
-        transaction_data = await self.transport_layer.backfill(
-            dest, room_id, extremities, limit
-        )
-
-        logger.debug("backfill transaction_data=%r", transaction_data)
-
-        if not isinstance(transaction_data, dict):
-            raise InvalidResponseError("Backfill transaction_data is not a dict.")
-
-        transaction_data_pdus = transaction_data.get("pdus")
-        if not isinstance(transaction_data_pdus, list):
-            raise InvalidResponseError("transaction_data.pdus is not a list.")
-
         room_version = await self.store.get_room_version(room_id)
 
-        pdus = [event_from_pdu_json(p, room_version) for p in transaction_data_pdus]
+        # The PDUs are parsed into events as the response streams in.
+        response = await self.transport_layer.backfill(
+            room_version, dest, room_id, extremities, limit
+        )
+        if response is None:
+            return None
+
+        pdus = response.pdus
 
         # Check signatures and hash of pdus, removing any from the list that fail checks
         pdus[:] = await self._check_sigs_and_hash_for_pulled_events_and_fetch(
@@ -1067,9 +1070,87 @@ class FederationClient(FederationBase):
         """
 
         async def send_request(destination: str) -> SendJoinResult:
-            response = await self._do_send_join(
-                room_version, destination, pdu, omit_members=partial_state
-            )
+            # We check the signatures and hashes of the state and auth chain
+            # events in batches as they stream in, rather than waiting for the
+            # whole (potentially enormous) response first. Note that we limit
+            # how many events we process at a time to keep the memory overhead
+            # from exploding.
+            #
+            # Only these checks are pipelined. The events are auth checked and
+            # persisted by the caller once the whole response has been received,
+            # as they arrive in no particular order and an event can't be auth
+            # checked until its auth events have been.
+            valid_pdus_map: Dict[str, EventBase] = {}
+            check_limiter = Linearizer(name="send_join_checks", max_count=10)
+            pending_checks: List["defer.Deferred[None]"] = []
+            submitted_event_ids: Set[str] = set()
+
+            async def _execute(pdu: EventBase) -> None:
+                valid_pdu = await self._check_sigs_and_hash_and_fetch_one(
+                    pdu=pdu,
+                    origin=destination,
+                    room_version=room_version,
+                )
+
+                if valid_pdu:
+                    valid_pdus_map[valid_pdu.event_id] = valid_pdu
+
+            async def _check_batch(batch: List[EventBase]) -> None:
+                async with check_limiter.queue(destination):
+                    await concurrently_execute(_execute, batch, 1000)
+
+            def _cancel_checks() -> None:
+                defer.DeferredList(pending_checks, consumeErrors=True)
+                for d in pending_checks:
+                    d.cancel()
+
+            logcontext = current_context()
+
+            def _on_event_batch(batch: List[EventBase]) -> None:
+                submitted_event_ids.update(e.event_id for e in batch)
+
+                # This gets called by the HTTP client as the response is read,
+                # so we need to switch back to our logcontext before starting
+                # the checks.
+                with PreserveLoggingContext(logcontext):
+                    pending_checks.append(run_in_background(_check_batch, batch))
+
+            try:
+                response = await self._do_send_join(
+                    room_version,
+                    destination,
+                    pdu,
+                    omit_members=partial_state,
+                    on_event_batch=_on_event_batch,
+                )
+            except Exception:
+                # We're discarding this response, so cancel any checks we started
+                # rather than waiting for them (they may be fetching events from
+                # the remote) before trying the next destination.
+                _cancel_checks()
+                raise
+
+            state = response.state
+            auth_chain = response.auth_events
+
+            # Check anything which wasn't handed to us while streaming.
+            unchecked = [
+                e
+                for e in itertools.chain(state, auth_chain)
+                if e.event_id not in submitted_event_ids
+            ]
+            if unchecked:
+                pending_checks.append(run_in_background(_check_batch, unchecked))
+
+            try:
+                await make_deferred_yieldable(
+                    defer.gatherResults(pending_checks, consumeErrors=True)
+                )
+            except defer.FirstError as dfe:
+                _cancel_checks()
+                # unwrap the error from defer.gatherResults.
+                assert isinstance(dfe.subFailure.value, BaseException)
+                raise dfe.subFailure.value from None
 
             # If an event was returned (and expected to be returned):
             #
@@ -1092,9 +1173,6 @@ class FederationClient(FederationBase):
             else:
                 event = pdu
 
-            state = response.state
-            auth_chain = response.auth_events
-
             create_event = None
             for e in state:
                 if (e.type, e.state_key) == (EventTypes.Create, ""):
@@ -1119,26 +1197,7 @@ class FederationClient(FederationBase):
                 )
 
             logger.info(
-                "Processing from send_join %d events", len(state) + len(auth_chain)
-            )
-
-            # We now go and check the signatures and hashes for the event. Note
-            # that we limit how many events we process at a time to keep the
-            # memory overhead from exploding.
-            valid_pdus_map: Dict[str, EventBase] = {}
-
-            async def _execute(pdu: EventBase) -> None:
-                valid_pdu = await self._check_sigs_and_hash_and_fetch_one(
-                    pdu=pdu,
-                    origin=destination,
-                    room_version=room_version,
-                )
-
-                if valid_pdu:
-                    valid_pdus_map[valid_pdu.event_id] = valid_pdu
-
-            await concurrently_execute(
-                _execute, itertools.chain(state, auth_chain), 10000
+                "Checked %d events from send_join", len(state) + len(auth_chain)
             )
 
             # NB: We *need* to copy to ensure that we don't have multiple
@@ -1228,6 +1287,7 @@ class FederationClient(FederationBase):
         destination: str,
         pdu: EventBase,
         omit_members: bool,
+        on_event_batch: Optional[Callable[[List[EventBase]], None]] = None,
     ) -> SendJoinResponse:
         time_now = self._clock.time_msec()
 
@@ -1239,6 +1299,7 @@ class FederationClient(FederationBase):
                 event_id=pdu.event_id,
                 content=pdu.get_pdu_json(time_now),
                 omit_members=omit_members,
+                on_event_batch=on_event_batch,
             )
         except HttpResponseException as e:
             # If an error is received that is due to an unrecognised endpoint,
@@ -1255,6 +1316,7 @@ class FederationClient(FederationBase):
             room_id=pdu.room_id,
             event_id=pdu.event_id,
             content=pdu.get_pdu_json(time_now),
+            on_event_batch=on_event_batch,
         )
 
     async def send_invite(
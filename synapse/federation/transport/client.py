@@ -51,6 +51,7 @@ from synapse.api.urls import (
     FEDERATION_V2_PREFIX,
 )
 from synapse.events import EventBase, make_event_from_dict
+from synapse.federation.federation_base import event_from_pdu_json
 from synapse.federation.units import Transaction
 from synapse.http.matrixfederationclient import ByteParser, LegacyJsonSendParser
 from synapse.http.types import QueryParams
@@ -144,12 +145,18 @@ class TransportLayerClient:
         )
 
     async def backfill(
-        self, destination: str, room_id: str, event_tuples: Collection[str], limit: int
-    ) -> Optional[Union[JsonDict, list]]:
+        self,
+        room_version: RoomVersion,
+        destination: str,
+        room_id: str,
+        event_tuples: Collection[str],
+        limit: int,
+    ) -> Optional["BackfillResponse"]:
         """Requests `limit` previous PDUs in a given context before list of
         PDUs.
 
         Args:
+            room_version: the version of the room (required to build the event objects)
             destination
             room_id
             event_tuples:
@@ -158,7 +165,8 @@ class TransportLayerClient:
             limit
 
         Returns:
-            Results in a dict received from the remote homeserver.
+            The PDUs received from the remote homeserver, parsed as they were
+            streamed in.
         """
         logger.debug(
             "backfill dest=%s, room_id=%s, event_tuples=%r, limit=%s",
@@ -176,9 +184,14 @@ class TransportLayerClient:
 
         args = {"v": event_tuples, "limit": [str(limit)]}
 
-        return await self.client.get_json(
-            destination, path=path, args=args, try_trailing_slash_on_400=True
+        response = await self.client.get_json(
+            destination,
+            path=path,
+            args=args,
+            try_trailing_slash_on_400=True,
+            parser=_BackfillParser(room_version),
         )
+        return response
 
     async def timestamp_to_event(
         self, destination: str, room_id: str, timestamp: int, direction: Direction
@@ -352,6 +365,7 @@ class TransportLayerClient:
         room_id: str,
         event_id: str,
         content: JsonDict,
+        on_event_batch: Optional[Callable[[List[EventBase]], None]] = None,
     ) -> "SendJoinResponse":
         path = _create_v1_path("/send_join/%s/%s", room_id, event_id)
 
@@ -359,7 +373,9 @@ class TransportLayerClient:
             destination=destination,
             path=path,
             data=content,
-            parser=SendJoinParser(room_version, v1_api=True),
+            parser=SendJoinParser(
+                room_version, v1_api=True, on_event_batch=on_event_batch
+            ),
         )
 
     async def send_join_v2(
@@ -370,6 +386,7 @@ class TransportLayerClient:
         event_id: str,
         content: JsonDict,
         omit_members: bool,
+        on_event_batch: Optional[Callable[[List[EventBase]], None]] = None,
     ) -> "SendJoinResponse":
         path = _create_v2_path("/send_join/%s/%s", room_id, event_id)
         query_params: Dict[str, str] = {}
@@ -381,7 +398,9 @@ class TransportLayerClient:
             path=path,
             args=query_params,
             data=content,
-            parser=SendJoinParser(room_version, v1_api=False),
+            parser=SendJoinParser(
+                room_version, v1_api=False, on_event_batch=on_event_batch
+            ),
         )
 
     async def send_leave_v1(
@@ -961,6 +980,13 @@ class StateRequestResponse:
     state: List[EventBase]
 
 
+@attr.s(slots=True, auto_attribs=True)
+class BackfillResponse:
+    """The parsed response of a `/backfill` request."""
+
+    pdus: List[EventBase]
+
+
 @ijson.coroutine
 def _event_parser(event_dict: JsonDict) -> Generator[None, Tuple[str, Any], None]:
     """Helper function for use with `ijson.kvitems_coro` to parse key-value pairs
@@ -974,16 +1000,53 @@ def _event_parser(event_dict: JsonDict) -> Generator[None, Tuple[str, Any], None
 
 @ijson.coroutine
 def _event_list_parser(
-    room_version: RoomVersion, events: List[EventBase]
+    room_version: RoomVersion,
+    events: List[EventBase],
+    on_event: Optional[Callable[[EventBase], None]] = None,
 ) -> Generator[None, JsonDict, None]:
     """Helper function for use with `ijson.items_coro` to parse an array of
     events and add them to the given list.
+
+    If `on_event` is given, it is also called with each event as it is parsed.
     """
 
     while True:
         obj = yield
         event = make_event_from_dict(obj, room_version)
         events.append(event)
+        if on_event is not None:
+            on_event(event)
+
+
+@ijson.coroutine
+def _pdu_list_parser(
+    room_version: RoomVersion, events: List[EventBase]
+) -> Generator[None, JsonDict, None]:
+    """Helper function for use with `ijson.items_coro` to parse an array of
+    PDUs and add them to the given list.
+
+    Unlike `_event_list_parser`, each PDU is validated as it is received, so
+    that an invalid response is rejected without waiting for the rest of it.
+    """
+    while True:
+        obj = yield
+        if not isinstance(obj, dict):
+            raise ValueError("PDU is not a JSON object")
+        events.append(event_from_pdu_json(obj, room_version))
+
+
+@ijson.coroutine
+def _array_start_parser(
+    prefix: str, on_start: Callable[[], None]
+) -> Generator[None, Tuple[str, str, Any], None]:
+    """Helper function for use with `ijson.parse_coro`
+
+    Calls `on_start` when an array starts at the given prefix.
+    """
+    while True:
+        event_prefix, event, _ = yield
+        if event_prefix == prefix and event == "start_array":
+            on_start()
 
 
 @ijson.coroutine
@@ -1018,6 +1081,12 @@ class SendJoinParser(ByteParser[SendJoinResponse]):
     Args:
         room_version: The version of the room.
         v1_api: Whether the response is in the v1 format.
+        on_event_batch: If given, called with batches of the state and auth chain
+            events as they are parsed, so that the caller can start processing
+            them before the whole response has been received. Each event is
+            passed to this at most once: any events in a final, partial batch
+            are not passed on, so callers must check the returned response for
+            events which they haven't seen.
     """
 
     CONTENT_TYPE = "application/json"
@@ -1027,23 +1096,35 @@ class SendJoinParser(ByteParser[SendJoinResponse]):
     # usage a bit.
     MAX_RESPONSE_SIZE = 500 * 1024 * 1024
 
-    def __init__(self, room_version: RoomVersion, v1_api: bool):
+    # The number of events to accumulate before passing them to `on_event_batch`.
+    EVENT_BATCH_SIZE = 1000
+
+    def __init__(
+        self,
+        room_version: RoomVersion,
+        v1_api: bool,
+        on_event_batch: Optional[Callable[[List[EventBase]], None]] = None,
+    ):
         self._response = SendJoinResponse([], [], event_dict={})
         self._room_version = room_version
         self._coros: List[Generator[None, bytes, None]] = []
 
+        self._on_event_batch = on_event_batch
+        self._event_batch: List[EventBase] = []
+        on_event = self._event_batch.append if on_event_batch is not None else None
+
         # The V1 API has the shape of `[200, {...}]`, which we handle by
         # prefixing with `item.*`.
         prefix = "item." if v1_api else ""
 
         self._coros = [
             ijson.items_coro(
-                _event_list_parser(room_version, self._response.state),
+                _event_list_parser(room_version, self._response.state, on_event),
                 prefix + "state.item",
                 use_float=True,
             ),
             ijson.items_coro(
-                _event_list_parser(room_version, self._response.auth_events),
+                _event_list_parser(room_version, self._response.auth_events, on_event),
                 prefix + "auth_chain.item",
                 use_float=True,
             ),
@@ -1076,9 +1157,24 @@ class SendJoinParser(ByteParser[SendJoinResponse]):
         for c in self._coros:
             c.send(data)
 
+        if len(self._event_batch) >= self.EVENT_BATCH_SIZE:
+            self._flush_event_batch()
+
         return len(data)
 
+    def _flush_event_batch(self) -> None:
+        if self._on_event_batch is None or not self._event_batch:
+            return
+
+        batch = self._event_batch[:]
+        self._event_batch.clear()
+        self._on_event_batch(batch)
+
     def finish(self) -> SendJoinResponse:
+        # We don't flush any remaining events here: if the request failed they
+        # would be discarded anyway, and otherwise the caller picks them up from
+        # the response.
+        self._event_batch.clear()
         _close_coros(self._coros)
 
         if self._response.event_dict:
@@ -1126,6 +1222,47 @@ class _StateParser(ByteParser[StateRequestResponse]):
         return self._response
 
 
+class _BackfillParser(ByteParser[BackfillResponse]):
+    """A parser for the response to `/backfill` requests.
+
+    Each PDU is turned into an event as soon as it has been received, so we
+    never hold both the raw response body and the decoded JSON tree in memory.
+
+    Args:
+        room_version: The version of the room.
+    """
+
+    CONTENT_TYPE = "application/json"
+
+    def __init__(self, room_version: RoomVersion):
+        self._response = BackfillResponse([])
+        self._seen_pdus = False
+        self._coros: List[Generator[None, bytes, None]] = [
+            ijson.items_coro(
+                _pdu_list_parser(room_version, self._response.pdus),
+                "pdus.item",
+                use_float=True,
+            ),
+            ijson.parse_coro(
+                _array_start_parser("pdus", self._on_pdus_start), use_float=True
+            ),
+        ]
+
+    def _on_pdus_start(self) -> None:
+        self._seen_pdus = True
+
+    def write(self, data: bytes) -> int:
+        for c in self._coros:
+            c.send(data)
+        return len(data)
+
+    def finish(self) -> BackfillResponse:
+        _close_coros(self._coros)
+        if not self._seen_pdus:
+            raise ValueError("Backfill response pdus is not a list")
+        return self._response
+
+
 def _close_coros(coros: Iterable[Generator[None, bytes, None]]) -> None:
     """Close each of the given coroutines.
 
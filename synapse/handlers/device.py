@@ -82,6 +82,11 @@ DELETE_DEVICE_MSGS_TASK_NAME = "delete_device_messages"
 MAX_DEVICE_DISPLAY_NAME_LEN = 100
 DELETE_STALE_DEVICES_INTERVAL_MS = 24 * 60 * 60 * 1000
 
+# If up to this many users have changed their devices since a sync, we check
+# which of them share a room with the syncing user rather than looking for
+# device list changes in each of the user's rooms.
+MAX_DEVICE_LIST_CHANGES_TO_CHECK_ROOMS_FOR = 1000
+
 
 class DeviceWorkerHandler:
     device_list_updater: "DeviceListWorkerUpdater"
@@ -185,6 +190,32 @@ class DeviceWorkerHandler:
         if now_token:
             now_device_lists_key = now_token.device_list_key
 
+        # Usually only a few users have changed their devices since
+        # `from_token`, in which case it's much cheaper to check which of them
+        # share a room with the user than to look for changes in each of the
+        # user's rooms.
+        changed_users = await self.store.get_all_devices_changed_if_few(
+            from_token.device_list_key,
+            now_device_lists_key,
+            limit=MAX_DEVICE_LIST_CHANGES_TO_CHECK_ROOMS_FOR,
+        )
+        if changed_users is not None:
+            if not changed_users:
+                return changed_users
+
+            if not isinstance(room_ids, AbstractSet):
+                room_ids = set(room_ids)
+
+            rooms_for_changed_users = await self.store.get_rooms_for_users(
+                changed_users
+            )
+            return {
+                changed_user_id
+                for changed_user_id, rooms in rooms_for_changed_users.items()
+                # We always tell the user about their own devices.
+                if changed_user_id == user_id or not rooms.isdisjoint(room_ids)
+            }
+
         changed_users = await self.store.get_device_list_changes_in_rooms(
             room_ids,
             from_token.device_list_key,
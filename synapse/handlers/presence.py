@@ -74,7 +74,6 @@ automatically be replaced with any information from currently available devices.
 
 import abc
 import contextlib
-import itertools
 import logging
 from bisect import bisect
 from contextlib import contextmanager
@@ -85,11 +84,13 @@ from typing import (
     Any,
     Callable,
     Collection,
+    Container,
     ContextManager,
     Dict,
     Generator,
     Iterable,
     List,
+    Mapping,
     Optional,
     Set,
     Tuple,
@@ -101,7 +102,11 @@ from prometheus_client import Counter
 import synapse.metrics
 from synapse.api.constants import EduTypes, EventTypes, Membership, PresenceState
 from synapse.api.errors import SynapseError
-from synapse.api.presence import UserDevicePresenceState, UserPresenceState
+from synapse.api.presence import (
+    PresenceStateTable,
+    UserDevicePresenceState,
+    UserPresenceState,
+)
 from synapse.appservice import ApplicationService
 from synapse.events.presence_router import PresenceRouter
 from synapse.logging.context import run_in_background
@@ -220,7 +225,7 @@ class BasePresenceHandler(abc.ABC):
 
         active_presence = self.store.take_presence_startup_info()
         # The combined status across all user devices.
-        self.user_to_current_state = {state.user_id: state for state in active_presence}
+        self.user_to_current_state = PresenceStateTable(active_presence)
 
     @abc.abstractmethod
     async def user_syncing(
@@ -947,6 +952,7 @@ class PresenceHandler(BasePresenceHandler):
 
             to_notify = {}  # Changes we want to notify everyone about
             to_federation_ping = {}  # These need sending keep-alives
+            changed = set()  # Users whose state needs persisting
 
             # Only bother handling the last presence change for each user
             new_states_dict = {}
@@ -979,7 +985,10 @@ class PresenceHandler(BasePresenceHandler):
                 if force_notify:
                     should_notify = True
 
-                self.user_to_current_state[user_id] = new_state
+                # Don't bother persisting updates that didn't change anything.
+                if user_id not in self.user_to_current_state or new_state != prev_state:
+                    changed.add(user_id)
+                    self.user_to_current_state[user_id] = new_state
 
                 if should_notify:
                     to_notify[user_id] = new_state
@@ -994,7 +1003,7 @@ class PresenceHandler(BasePresenceHandler):
                 notified_presence_counter.inc(len(to_notify))
                 await self._persist_and_notify(list(to_notify.values()))
 
-            self.unpersisted_users_changes |= {s.user_id for s in new_states}
+            self.unpersisted_users_changes |= changed
             self.unpersisted_users_changes -= set(to_notify.keys())
 
             # Check if we need to resend any presence states to remote hosts. We
@@ -1062,14 +1071,12 @@ class PresenceHandler(BasePresenceHandler):
 
         timers_fired_counter.inc(len(states))
 
-        # Set of user ID & device IDs which are currently syncing.
-        syncing_user_devices = {
-            user_id_device_id
-            for user_id_device_id, count in self._user_device_to_num_current_syncs.items()
-            if count
-        }
-        syncing_user_devices.update(
-            itertools.chain(*self.external_process_to_current_syncs.values())
+        # User ID & device IDs which are currently syncing. This is checked
+        # lazily, rather than collected up front, so that we only do work for
+        # the users whose timers have fired.
+        syncing_user_devices = _SyncingUserDevices(
+            self._user_device_to_num_current_syncs,
+            self.external_process_to_current_syncs.values(),
         )
 
         changes = handle_timeouts(
@@ -1304,13 +1311,22 @@ class PresenceHandler(BasePresenceHandler):
         if not self._track_presence:
             return
 
+        pushes = content.get("push", [])
+        if not isinstance(pushes, list):
+            logger.info("Got presence EDU from %r with invalid 'push'", origin)
+            return
+
         now = self.clock.time_msec()
         updates = []
-        for push in content.get("push", []):
+        for push in pushes:
             # A "push" contains a list of presence that we are probably interested
             # in.
+            if not isinstance(push, dict):
+                logger.info("Got invalid presence update from %r: %r", origin, push)
+                continue
+
             user_id = push.get("user_id", None)
-            if not user_id:
+            if not isinstance(user_id, str) or not user_id:
                 logger.info(
                     "Got presence update from %r with no 'user_id': %r", origin, push
                 )
@@ -1333,14 +1349,37 @@ class PresenceHandler(BasePresenceHandler):
                 )
                 continue
 
+            if not isinstance(presence_state, str) or (
+                presence_state not in self.VALID_PRESENCE
+            ):
+                logger.info(
+                    "Got presence update from %r with unknown 'presence_state': %r",
+                    origin,
+                    push,
+                )
+                continue
+
             new_fields = {"state": presence_state, "last_federation_update_ts": now}
 
+            # Ignore any other fields which are malformed, rather than dropping
+            # the whole update.
             last_active_ago = push.get("last_active_ago", None)
-            if last_active_ago is not None:
+            if (
+                isinstance(last_active_ago, int)
+                and not isinstance(last_active_ago, bool)
+                and 0 <= last_active_ago <= now
+            ):
                 new_fields["last_active_ts"] = now - last_active_ago
 
-            new_fields["status_msg"] = push.get("status_msg", None)
-            new_fields["currently_active"] = push.get("currently_active", False)
+            status_msg = push.get("status_msg", None)
+            new_fields["status_msg"] = (
+                status_msg if isinstance(status_msg, str) else None
+            )
+
+            currently_active = push.get("currently_active", False)
+            new_fields["currently_active"] = (
+                currently_active if isinstance(currently_active, bool) else False
+            )
 
             prev_state = await self.current_state_for_user(user_id)
             updates.append(prev_state.copy_and_replace(**new_fields))
@@ -1997,10 +2036,35 @@ class PresenceEventSource(EventSource[int, UserPresenceState]):
         return self.store.get_current_presence_token()
 
 
+class _SyncingUserDevices:
+    """The (user ID, device ID) pairs which are currently syncing, on this or
+    any other process."""
+
+    def __init__(
+        self,
+        local_syncs: Mapping[Tuple[str, Optional[str]], int],
+        external_syncs: Iterable[AbstractSet[Tuple[str, Optional[str]]]],
+    ):
+        """
+        Args:
+            local_syncs: The number of ongoing syncs on this process, by user ID
+                and device ID.
+            external_syncs: The user ID & device IDs with ongoing syncs on each
+                other process.
+        """
+        self._local_syncs = local_syncs
+        self._external_syncs = external_syncs
+
+    def __contains__(self, user_device: object) -> bool:
+        if self._local_syncs.get(user_device):  # type: ignore[call-overload]
+            return True
+        return any(user_device in syncs for syncs in self._external_syncs)
+
+
 def handle_timeouts(
     user_states: List[UserPresenceState],
     is_mine_fn: Callable[[str], bool],
-    syncing_user_devices: AbstractSet[Tuple[str, Optional[str]]],
+    syncing_user_devices: Container[Tuple[str, Optional[str]]],
     user_to_devices: Dict[str, Dict[Optional[str], UserDevicePresenceState]],
     now: int,
 ) -> List[UserPresenceState]:
@@ -2039,7 +2103,7 @@ def handle_timeouts(
 def handle_timeout(
     state: UserPresenceState,
     is_mine: bool,
-    syncing_device_ids: AbstractSet[Tuple[str, Optional[str]]],
+    syncing_device_ids: Container[Tuple[str, Optional[str]]],
     user_devices: Dict[Optional[str], UserDevicePresenceState],
     now: int,
 ) -> Optional[UserPresenceState]:
@@ -20,7 +20,16 @@
 #
 import logging
 import random
-from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Tuple
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+)
 
 import attr
 
@@ -154,21 +163,27 @@ class FollowerTypingHandler:
         return member.user_id in self._room_typing.get(member.room_id, set())
 
     async def _push_remote(self, member: RoomMember, typing: bool) -> None:
+        await self._push_remote_for_room(member.room_id, {member.user_id: typing})
+
+    async def _push_remote_for_room(
+        self, room_id: str, user_id_to_typing: Mapping[str, bool]
+    ) -> None:
+        """Send the typing state of the given local users in a room to the
+        other servers in the room."""
         if not self.federation:
             return
 
         try:
-            self._member_last_federation_poke[member] = self.clock.time_msec()
-
             now = self.clock.time_msec()
-            self.wheel_timer.insert(
-                now=now, obj=member, then=now + FEDERATION_PING_INTERVAL
-            )
+            for user_id in user_id_to_typing:
+                member = RoomMember(room_id, user_id)
+                self._member_last_federation_poke[member] = now
+                self.wheel_timer.insert(
+                    now=now, obj=member, then=now + FEDERATION_PING_INTERVAL
+                )
 
             hosts: StrCollection = (
-                await self._storage_controllers.state.get_current_hosts_in_room(
-                    member.room_id
-                )
+                await self._storage_controllers.state.get_current_hosts_in_room(room_id)
             )
             hosts = await filter_destinations_by_retry_limiter(
                 hosts,
@@ -178,16 +193,17 @@ class FollowerTypingHandler:
             for domain in hosts:
                 if not self.is_mine_server_name(domain):
                     logger.debug("sending typing update to %s", domain)
-                    self.federation.build_and_send_edu(
-                        destination=domain,
-                        edu_type=EduTypes.TYPING,
-                        content={
-                            "room_id": member.room_id,
-                            "user_id": member.user_id,
-                            "typing": typing,
-                        },
-                        key=member,
-                    )
+                    for user_id, typing in user_id_to_typing.items():
+                        self.federation.build_and_send_edu(
+                            destination=domain,
+                            edu_type=EduTypes.TYPING,
+                            content={
+                                "room_id": room_id,
+                                "user_id": user_id,
+                                "typing": typing,
+                            },
+                            key=RoomMember(room_id, user_id),
+                        )
         except Exception:
             logger.exception("Error pushing typing notif to remotes")
 
@@ -283,6 +299,17 @@ class TypingWriterHandler(FollowerTypingHandler):
             "TypingStreamChangeCache", self._latest_room_serial
         )
 
+        # How long to collect changes in typing for before notifying clients
+        # and remote servers about them. If zero, changes are sent immediately.
+        self._coalesce_window_ms = hs.config.server.typing_coalesce_window_ms
+
+        # The rooms whose typing users have changed, and the latest typing state
+        # of our users that have changed, by room, since the last time changes
+        # were sent.
+        self._pending_rooms: Set[str] = set()
+        self._pending_remote_updates: Dict[str, Dict[str, bool]] = {}
+        self._flush_scheduled = False
+
     def _handle_timeout_for_member(self, now: int, member: RoomMember) -> None:
         super()._handle_timeout_for_member(now, member)
 
@@ -374,9 +401,15 @@ class TypingWriterHandler(FollowerTypingHandler):
     def _push_update(self, member: RoomMember, typing: bool) -> None:
         if self.hs.is_mine_id(member.user_id):
             # Only send updates for changes to our own users.
-            run_as_background_process(
-                "typing._push_remote", self._push_remote, member, typing
-            )
+            if self._coalesce_window_ms:
+                self._pending_remote_updates.setdefault(member.room_id, {})[
+                    member.user_id
+                ] = typing
+                self._schedule_flush()
+            else:
+                run_as_background_process(
+                    "typing._push_remote", self._push_remote, member, typing
+                )
 
         self._push_update_local(member=member, typing=typing)
 
@@ -430,17 +463,58 @@ class TypingWriterHandler(FollowerTypingHandler):
         else:
             room_set.discard(member.user_id)
 
-        self._latest_room_serial += 1
-        self._room_serials[member.room_id] = self._latest_room_serial
-        self._typing_stream_change_cache.entity_has_changed(
-            member.room_id, self._latest_room_serial
-        )
-        self._rooms_updated.add(member.room_id)
+        if self._coalesce_window_ms:
+            self._pending_rooms.add(member.room_id)
+            self._schedule_flush()
+        else:
+            self._notify_rooms_changed([member.room_id])
+
+    def _notify_rooms_changed(self, room_ids: List[str]) -> None:
+        """Advance the typing stream for the given rooms, and wake up anyone
+        listening in them."""
+        for room_id in room_ids:
+            self._latest_room_serial += 1
+            self._room_serials[room_id] = self._latest_room_serial
+            self._typing_stream_change_cache.entity_has_changed(
+                room_id, self._latest_room_serial
+            )
+            self._rooms_updated.add(room_id)
 
         self.notifier.on_new_event(
-            StreamKeyType.TYPING, self._latest_room_serial, rooms=[member.room_id]
+            StreamKeyType.TYPING, self._latest_room_serial, rooms=room_ids
+        )
+
+    def _schedule_flush(self) -> None:
+        """Schedule the pending changes to be sent at the end of the current
+        coalescing window."""
+        if self._flush_scheduled:
+            return
+
+        self._flush_scheduled = True
+        self.clock.call_later(
+            self._coalesce_window_ms / 1000, self._flush_pending_updates
         )
 
+    def _flush_pending_updates(self) -> None:
+        """Send the changes in typing collected during the last coalescing
+        window."""
+        self._flush_scheduled = False
+
+        room_ids = list(self._pending_rooms)
+        self._pending_rooms = set()
+        if room_ids:
+            self._notify_rooms_changed(room_ids)
+
+        remote_updates = self._pending_remote_updates
+        self._pending_remote_updates = {}
+        for room_id, user_id_to_typing in remote_updates.items():
+            run_as_background_process(
+                "typing._push_remote",
+                self._push_remote_for_room,
+                room_id,
+                user_id_to_typing,
+            )
+
     async def get_all_typing_updates(
         self, instance_name: str, last_id: int, current_id: int, limit: int
     ) -> Tuple[List[Tuple[int, list]], int, bool]:
@@ -22,6 +22,7 @@
 
 import logging
 import os
+import re
 import urllib
 from abc import ABC, abstractmethod
 from types import TracebackType
@@ -347,6 +348,8 @@ async def respond_with_multipart_responder(
             media_length,
         )
 
+        # Any `Range` header is ignored, and the whole multipart response is
+        # sent, as the response is more than just the file itself.
         logger.debug("Responding to media request with responder %s", responder)
         if media_length is not None:
             content_length = multipart_consumer.content_length()
@@ -373,6 +376,52 @@ async def respond_with_multipart_responder(
     finish_request(request)
 
 
+# Matches a `Range` header requesting a single range of bytes.
+_SINGLE_BYTE_RANGE_RE = re.compile(rb"^\s*bytes\s*=\s*([0-9]*)-([0-9]*)\s*$", re.I)
+
+# Returned by `parse_byte_range` if none of the requested range is in the file.
+UNSATISFIABLE_RANGE = (-1, -1)
+
+
+def parse_byte_range(range_header: bytes, file_size: int) -> Optional[Tuple[int, int]]:
+    """Parse a `Range` header requesting a single range of bytes, as per
+    RFC 9110 section 14.2.
+
+    Args:
+        range_header: The value of the `Range` header.
+        file_size: The size of the file being requested.
+
+    Returns:
+        The first and last (inclusive) byte offsets requested, clamped to the
+        size of the file; `UNSATISFIABLE_RANGE` if the range starts after the
+        end of the file; or None if the header is invalid or requests multiple
+        ranges, in which case it should be ignored and the whole file sent.
+    """
+    match = _SINGLE_BYTE_RANGE_RE.match(range_header)
+    if match is None:
+        return None
+
+    first, last = (group.decode("ascii") for group in match.groups())
+
+    if first == "":
+        # A suffix range, requesting the last N bytes.
+        if last == "":
+            return None
+        suffix_length = int(last)
+        if suffix_length == 0 or file_size == 0:
+            return UNSATISFIABLE_RANGE
+        return max(file_size - suffix_length, 0), file_size - 1
+
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= file_size:
+        return UNSATISFIABLE_RANGE
+
+    end = int(last) if last else file_size - 1
+    return start, min(end, file_size - 1)
+
+
 async def respond_with_responder(
     request: SynapseRequest,
     responder: "Optional[Responder]",
@@ -404,6 +453,38 @@ async def respond_with_responder(
 
         logger.debug("Responding to media request with responder %s", responder)
         add_file_headers(request, media_type, file_size, upload_name)
+        if responder.delegate_to_proxy(request):
+            finish_request(request)
+            return
+
+        if file_size is not None and responder.supports_ranges:
+            request.setHeader(b"Accept-Ranges", b"bytes")
+
+            # We don't send any validators (e.g. `ETag`), so an `If-Range`
+            # header can never match and the whole file must be sent.
+            range_header = request.getHeader(b"Range")
+            if range_header is not None and request.getHeader(b"If-Range") is None:
+                byte_range = parse_byte_range(range_header, file_size)
+                if byte_range == UNSATISFIABLE_RANGE:
+                    request.setHeader(b"Content-Range", b"bytes */%d" % (file_size,))
+                    respond_with_json(
+                        request,
+                        416,
+                        cs_error("Requested range not satisfiable"),
+                        send_cors=True,
+                    )
+                    return
+
+                if byte_range is not None:
+                    start, end = byte_range
+                    responder.set_range(start, end - start + 1)
+                    request.setResponseCode(206)
+                    request.setHeader(
+                        b"Content-Range",
+                        b"bytes %d-%d/%d" % (start, end, file_size),
+                    )
+                    request.setHeader(b"Content-Length", b"%d" % (end - start + 1,))
+
         try:
             await responder.write_to_consumer(request)
         except Exception as e:
@@ -438,6 +519,34 @@ class Responder(ABC):
         """
         raise NotImplementedError()
 
+    # Whether `set_range` can be used to only write part of the response.
+    supports_ranges = False
+
+    def set_range(self, start: int, length: int) -> None:
+        """Only write the given range of bytes of the response to the consumer.
+
+        Must only be called if `supports_ranges` is true, and before
+        `write_to_consumer`.
+
+        Args:
+            start: The offset of the first byte to write.
+            length: The number of bytes to write.
+        """
+        raise NotImplementedError()
+
+    def delegate_to_proxy(self, request: Request) -> bool:
+        """Ask the reverse proxy in front of us to send the response instead, if
+        possible, by setting the appropriate header on the request.
+
+        Args:
+            request: The request being responded to.
+
+        Returns:
+            True if the reverse proxy will send the response, in which case the
+            request should be finished without writing a body.
+        """
+        return False
+
     def __enter__(self) -> None:  # noqa: B027
         pass
 
@@ -641,6 +750,8 @@ class ThreadedFileSender:
         self.thread_pool = hs.get_media_sender_thread_pool()
 
         self.file: Optional[BinaryIO] = None
+        # The number of bytes left to send, or None to send until EOF.
+        self.remaining: Optional[int] = None
         self.deferred: "Deferred[None]" = Deferred()
         self.consumer: Optional[interfaces.IConsumer] = None
 
@@ -653,12 +764,22 @@ class ThreadedFileSender:
         self.stop_writing = False
 
     def beginFileTransfer(
-        self, file: BinaryIO, consumer: interfaces.IConsumer
+        self,
+        file: BinaryIO,
+        consumer: interfaces.IConsumer,
+        length: Optional[int] = None,
     ) -> "Deferred[None]":
         """
         Begin transferring a file
+
+        Args:
+            file: The file to send, from its current position.
+            consumer: The consumer to send the file to.
+            length: The number of bytes to send, or None to send the rest of
+                the file.
         """
         self.file = file
+        self.remaining = length
         self.consumer = consumer
 
         self.consumer.registerProducer(self, True)
@@ -725,12 +846,20 @@ class ThreadedFileSender:
             # The file should always have been set before we get here.
             assert self.file is not None
 
-            chunk = self.file.read(self.CHUNK_SIZE)
+            if self.remaining is None:
+                chunk = self.file.read(self.CHUNK_SIZE)
+            else:
+                chunk = self.file.read(min(self.CHUNK_SIZE, self.remaining))
+                self.remaining -= len(chunk)
+
             if not chunk:
                 return False
 
             self.reactor.callFromThread(self._write, chunk)
 
+            if self.remaining == 0:
+                return False
+
         return True
 
     def _write(self, chunk: bytes) -> None:
@@ -415,3 +415,16 @@ class MediaFilePaths:
                     _validate_path_component(media_id[0:2]),
                 ),
             ]
+
+    @_wrap_with_jail_check(relative=True)
+    def blob_filepath_rel(self, sha256: str) -> str:
+        """The path of the content-addressed copy of a file with the given
+        (hex encoded) SHA-256 digest."""
+        return os.path.join(
+            "blobs",
+            _validate_path_component(sha256[0:2]),
+            _validate_path_component(sha256[2:4]),
+            _validate_path_component(sha256[4:]),
+        )
+
+    blob_filepath = _wrap_in_base_path(blob_filepath_rel)
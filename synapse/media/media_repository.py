@@ -23,14 +23,17 @@ import errno
 import logging
 import os
 import shutil
+from contextlib import AsyncExitStack
 from io import BytesIO
 from typing import IO, TYPE_CHECKING, Dict, List, Optional, Set, Tuple
 
 import attr
 from matrix_common.types.mxc_uri import MXCUri
+from prometheus_client import Counter, Gauge
 
 import twisted.internet.error
 import twisted.web.http
+from twisted.internet import defer
 from twisted.internet.defer import Deferred
 
 from synapse.api.errors import (
@@ -46,9 +49,15 @@ from synapse.api.ratelimiting import Ratelimiter
 from synapse.config.repository import ThumbnailRequirement
 from synapse.http.server import respond_with_json
 from synapse.http.site import SynapseRequest
-from synapse.logging.context import defer_to_thread
+from synapse.logging.context import (
+    defer_to_thread,
+    defer_to_threadpool,
+    make_deferred_yieldable,
+    run_in_background,
+)
 from synapse.logging.opentracing import trace
 from synapse.media._base import (
+    MAXIMUM_ALLOWED_MAX_TIMEOUT_MS,
     FileInfo,
     Responder,
     ThumbnailInfo,
@@ -65,7 +74,14 @@ from synapse.media.url_previewer import UrlPreviewer
 from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.storage.databases.main.media_repository import LocalMedia, RemoteMedia
 from synapse.types import UserID
-from synapse.util.async_helpers import Linearizer
+from synapse.util.async_helpers import (
+    Linearizer,
+    ObservableDeferred,
+    concurrently_execute,
+    timeout_deferred,
+)
+from synapse.util.caches.response_cache import ResponseCache
+from synapse.util.iterutils import batch_iter
 from synapse.util.retryutils import NotRetryingDestination
 from synapse.util.stringutils import random_string
 
@@ -80,6 +96,85 @@ UPDATE_RECENTLY_ACCESSED_TS = 60 * 1000  # 1 minute
 # How often to run the background job to check for local and remote media
 # that should be purged according to the configured media retention settings.
 MEDIA_RETENTION_CHECK_PERIOD_MS = 60 * 60 * 1000  # 1 hour
+# How often to check whether media needs evicting from the local media store,
+# when `media_local_cache` is configured.
+MEDIA_LOCAL_CACHE_CHECK_PERIOD_MS = 5 * 60 * 1000  # 5 minutes
+# When evicting media from the local media store, the fraction of the maximum
+# size to evict down to.
+MEDIA_LOCAL_CACHE_LOW_WATER_MARK = 0.9
+# Media accessed more recently than this is never evicted, as it may not have
+# finished being stored in the storage providers.
+MEDIA_LOCAL_CACHE_MIN_AGE_MS = 60 * 60 * 1000  # 1 hour
+# The number of media to evict at a time.
+MEDIA_LOCAL_CACHE_EVICTION_BATCH_SIZE = 500
+# The number of media to delete at a time when purging old media.
+MEDIA_PURGE_BATCH_SIZE = 1000
+# The number of media whose files are deleted concurrently when purging old
+# media, to bound the load on the filesystem.
+MEDIA_PURGE_IO_CONCURRENCY = 10
+
+local_media_cache_evictions = Counter(
+    "synapse_media_local_cache_evictions",
+    "Number of media evicted from the local media store",
+)
+
+local_media_cache_size = Gauge(
+    "synapse_media_local_cache_size_bytes",
+    "Size of the media in the local media store that may be evicted",
+)
+
+media_purged = Counter(
+    "synapse_media_purged",
+    "Number of media deleted when purging old media",
+    ["type"],
+)
+
+media_purge_failures = Counter(
+    "synapse_media_purge_failures",
+    "Number of media whose files could not be deleted when purging old media",
+    ["type"],
+)
+
+
+@attr.s(slots=True, auto_attribs=True)
+class MediaPurgeProgress:
+    """The progress of a purge of old local or remote media.
+
+    Attributes:
+        before_ts: Media last accessed before this time is being purged.
+        started_ts: When the purge started.
+        finished_ts: When the purge finished, or None if it is still running.
+        deleted: The number of media deleted so far.
+        failed: The number of media whose files could not be deleted.
+        last_access_ts: For remote media, when the most recently purged media
+            was last accessed.
+    """
+
+    before_ts: int
+    started_ts: int
+    finished_ts: Optional[int] = None
+    deleted: int = 0
+    failed: int = 0
+    last_access_ts: Optional[int] = None
+
+
+def _remove_media_files(path: str, thumbnail_dir: str) -> bool:
+    """Remove a media file and its thumbnails from the local media store.
+
+    This blocks, so should be run on a thread.
+
+    Returns:
+        True if the media file was removed (or didn't exist).
+    """
+    try:
+        os.remove(path)
+    except OSError as e:
+        logger.warning("Failed to remove file: %r: %s", path, e)
+        if e.errno != errno.ENOENT:
+            return False
+
+    shutil.rmtree(thumbnail_dir, ignore_errors=True)
+    return True
 
 
 class MediaRepository:
@@ -105,6 +200,26 @@ class MediaRepository:
 
         self.remote_media_linearizer = Linearizer(name="media_remote")
 
+        # The progress of the most recent purges of old "local" and "remote"
+        # media.
+        self.purge_progress: Dict[str, MediaPurgeProgress] = {}
+
+        # Downloads of remote media that are in progress, so that concurrent
+        # requests for the same media share a single download.
+        self._remote_media_downloads: ResponseCache[Tuple[str, str]] = ResponseCache(
+            self.clock, "remote_media_downloads"
+        )
+        # The generation of thumbnails for freshly downloaded remote media, which
+        # requests for thumbnails of the media wait for.
+        self._remote_media_thumbnailing: Dict[
+            Tuple[str, str], ObservableDeferred[Optional[dict]]
+        ] = {}
+        # Thumbnails of a given size being generated on demand, keyed by the
+        # origin (None for local media), file ID, width, height, method and type.
+        self._exact_thumbnail_generation: ResponseCache[
+            Tuple[Optional[str], str, int, int, str, str]
+        ] = ResponseCache(self.clock, "exact_thumbnail_generation")
+
         self.recently_accessed_remotes: Set[Tuple[str, str]] = set()
         self.recently_accessed_locals: Set[str] = set()
 
@@ -165,6 +280,27 @@ class MediaRepository:
                 MEDIA_RETENTION_CHECK_PERIOD_MS,
             )
 
+        # If configured, the local media store is a cache in front of the
+        # storage providers. We can only evict the media they keep a copy of.
+        self._media_local_cache_max_size = hs.config.media.media_local_cache_max_size
+        self._evict_local_media = any(
+            wrapper_config.store_local
+            for _, _, wrapper_config in hs.config.media.media_storage_providers
+        )
+        self._evict_remote_media = any(
+            wrapper_config.store_remote
+            for _, _, wrapper_config in hs.config.media.media_storage_providers
+        )
+
+        instance_running_jobs = hs.config.media.media_instance_running_background_jobs
+        if self._media_local_cache_max_size is not None and (
+            instance_running_jobs is None
+            or instance_running_jobs == hs.get_instance_name()
+        ):
+            self.clock.looping_call(
+                self._start_evict_from_local_cache, MEDIA_LOCAL_CACHE_CHECK_PERIOD_MS
+            )
+
         if hs.config.media.url_preview_enabled:
             self.url_previewer: Optional[UrlPreviewer] = UrlPreviewer(
                 hs, self, self.media_storage
@@ -182,6 +318,11 @@ class MediaRepository:
             "apply_media_retention_rules", self._apply_media_retention_rules
         )
 
+    def _start_evict_from_local_cache(self) -> Deferred:
+        return run_as_background_process(
+            "evict_media_from_local_cache", self._evict_from_local_cache
+        )
+
     async def _update_recently_accessed(self) -> None:
         remote_media = self.recently_accessed_remotes
         self.recently_accessed_remotes = set()
@@ -193,6 +334,137 @@ class MediaRepository:
             local_media, remote_media, self.clock.time_msec()
         )
 
+        if self._media_local_cache_max_size is not None:
+            run_as_background_process(
+                "prefetch_media_thumbnails",
+                self._prefetch_thumbnails,
+                [(None, media_id) for media_id in local_media] + list(remote_media),
+            )
+
+    async def _prefetch_thumbnails(
+        self, media: List[Tuple[Optional[str], str]]
+    ) -> None:
+        """Fetch the thumbnails of recently accessed media back into the local
+        media store if they have been evicted, as clients are likely to request
+        them soon.
+
+        Args:
+            media: The (origin, media ID) of the media, where the origin is
+                None for local media.
+        """
+
+        async def prefetch(server_name: Optional[str], media_id: str) -> None:
+            if server_name is None:
+                file_id = media_id
+                thumbnails = await self.store.get_local_media_thumbnails(media_id)
+            else:
+                media_info = await self.store.get_cached_remote_media(
+                    server_name, media_id
+                )
+                if media_info is None:
+                    return
+                file_id = media_info.filesystem_id
+                thumbnails = await self.store.get_remote_media_thumbnails(
+                    server_name, media_id
+                )
+
+            for thumbnail in thumbnails:
+                try:
+                    await self.media_storage.ensure_media_is_in_local_cache(
+                        FileInfo(server_name, file_id, thumbnail=thumbnail)
+                    )
+                except NotFoundError:
+                    pass
+
+        await concurrently_execute(lambda m: prefetch(*m), media, 10)
+
+    async def _evict_from_local_cache(self) -> None:
+        """Evict the least recently accessed media (and its thumbnails) from the
+        local media store, if the media that can be evicted has grown larger
+        than `media_local_cache.max_size`.
+
+        Media is evicted in order of when it was last accessed, so we mostly
+        only need to track how far through that order we have evicted. Media
+        accessed since then has usually been fetched back into the local media
+        store, except where only its thumbnails were accessed, so we also track
+        which media has been evicted until it is fetched back.
+        """
+        assert self._media_local_cache_max_size is not None
+
+        position = await self.store.get_media_local_cache_eviction_position()
+        size = await self.store.get_size_of_media_accessed_since(
+            position, self._evict_local_media, self._evict_remote_media
+        )
+        local_media_cache_size.set(size)
+
+        if size <= self._media_local_cache_max_size:
+            return
+
+        target_size = (
+            self._media_local_cache_max_size * MEDIA_LOCAL_CACHE_LOW_WATER_MARK
+        )
+        min_last_access_ts = self.clock.time_msec() - MEDIA_LOCAL_CACHE_MIN_AGE_MS
+
+        logger.info(
+            "Evicting media from the local media store: size %d, target %d",
+            size,
+            target_size,
+        )
+
+        evicted = 0
+        while size > target_size:
+            media, next_position = await self.store.get_media_accessed_since(
+                position,
+                self._evict_local_media,
+                self._evict_remote_media,
+                MEDIA_LOCAL_CACHE_EVICTION_BATCH_SIZE,
+            )
+            if not media:
+                break
+
+            for last_access_ts, origin, media_id, file_id, media_length in media:
+                if last_access_ts >= min_last_access_ts or size <= target_size:
+                    next_position = last_access_ts
+                    break
+
+                if origin is None:
+                    thumbnails = await self.store.get_local_media_thumbnails(media_id)
+                else:
+                    thumbnails = await self.store.get_remote_media_thumbnails(
+                        origin, media_id
+                    )
+
+                if not await self.media_storage.remove_from_local_cache(
+                    origin, file_id, thumbnails
+                ):
+                    # No storage provider has a copy of the media (e.g. because
+                    # storing it failed), so it is the only copy. We skip over
+                    # it, and it will be considered again once it is next
+                    # accessed.
+                    logger.warning(
+                        "Not evicting media %s/%s from the local media store as no"
+                        " storage provider has a copy of it",
+                        origin or self.server_name,
+                        media_id,
+                    )
+                    continue
+
+                await self.store.add_media_local_cache_eviction(origin, file_id)
+                size -= media_length
+                evicted += 1
+                local_media_cache_evictions.inc()
+
+            position = next_position
+            await self.store.update_media_local_cache_eviction_position(position)
+
+            # Media accessed after `min_last_access_ts` is never evicted, so
+            # there is no point fetching it again.
+            if position >= min_last_access_ts:
+                break
+
+        local_media_cache_size.set(size)
+        logger.info("Evicted %d media from the local media store", evicted)
+
     def mark_recently_accessed(self, server_name: Optional[str], media_id: str) -> None:
         """Mark the given media as recently accessed.
 
@@ -524,21 +796,16 @@ class MediaRepository:
 
         self.mark_recently_accessed(server_name, media_id)
 
-        # We linearize here to ensure that we don't try and download remote
-        # media multiple times concurrently
-        key = (server_name, media_id)
-        async with self.remote_media_linearizer.queue(key):
-            responder, media_info = await self._get_remote_media_impl(
-                server_name,
-                media_id,
-                max_timeout_ms,
-                self.download_ratelimiter,
-                ip_address,
-                use_federation_endpoint,
-                allow_authenticated,
-            )
+        responder, media_info = await self._get_remote_media_impl(
+            server_name,
+            media_id,
+            max_timeout_ms,
+            self.download_ratelimiter,
+            ip_address,
+            use_federation_endpoint,
+            allow_authenticated,
+        )
 
-        # We deliberately stream the file outside the lock
         if responder and media_info:
             upload_name = name if name else media_info.upload_name
             await respond_with_responder(
@@ -583,25 +850,27 @@ class MediaRepository:
         ):
             raise FederationDeniedError(server_name)
 
-        # We linearize here to ensure that we don't try and download remote
-        # media multiple times concurrently
-        key = (server_name, media_id)
-        async with self.remote_media_linearizer.queue(key):
-            responder, media_info = await self._get_remote_media_impl(
-                server_name,
-                media_id,
-                max_timeout_ms,
-                self.download_ratelimiter,
-                ip_address,
-                use_federation,
-                allow_authenticated,
-            )
+        responder, media_info = await self._get_remote_media_impl(
+            server_name,
+            media_id,
+            max_timeout_ms,
+            self.download_ratelimiter,
+            ip_address,
+            use_federation,
+            allow_authenticated,
+        )
 
         # Ensure we actually use the responder so that it releases resources
         if responder:
             with responder:
                 pass
 
+        # If the media has only just been downloaded then wait for its thumbnails
+        # to be generated, otherwise the caller won't find them.
+        thumbnailing = self._remote_media_thumbnailing.get((server_name, media_id))
+        if thumbnailing:
+            await make_deferred_yieldable(thumbnailing.observe())
+
         return media_info
 
     async def _get_remote_media_impl(
@@ -661,52 +930,175 @@ class MediaRepository:
             if responder:
                 return responder, media_info
 
-        # Failed to find the file anywhere, lets download it.
+        # Failed to find the file anywhere, lets download it. Concurrent requests
+        # for the media share a single download, which is ratelimited as the
+        # request that starts it. It asks the remote server to wait as long as
+        # any request may for the media to be uploaded, and each request waits
+        # for it for up to its own `max_timeout_ms`.
+        started_download = False
+
+        async def download() -> RemoteMedia:
+            nonlocal started_download
+            started_download = True
+            return await self._download_remote_media(
+                server_name,
+                media_id,
+                MAXIMUM_ALLOWED_MAX_TIMEOUT_MS,
+                download_ratelimiter,
+                ip_address,
+                use_federation_endpoint,
+            )
 
-        try:
-            if not use_federation_endpoint:
-                media_info = await self._download_remote_file(
-                    server_name,
-                    media_id,
-                    max_timeout_ms,
-                    download_ratelimiter,
-                    ip_address,
+        deadline = self.clock.time_msec() + max_timeout_ms
+        while True:
+            started_download = False
+            try:
+                downloaded: RemoteMedia = await make_deferred_yieldable(
+                    timeout_deferred(
+                        run_in_background(
+                            self._remote_media_downloads.wrap,
+                            (server_name, media_id),
+                            download,
+                        ),
+                        max(deadline - self.clock.time_msec(), 0) / 1000,
+                        self.hs.get_reactor(),
+                    )
                 )
-            else:
-                media_info = await self._federation_download_remote_file(
+            except defer.TimeoutError:
+                raise SynapseError(
+                    504, "Timed out waiting for remote media", Codes.NOT_YET_UPLOADED
+                )
+            except SynapseError as e:
+                if started_download or e.errcode != Codes.LIMIT_EXCEEDED:
+                    raise
+
+                # The request that started the download was ratelimited, which
+                # shouldn't affect this one. Wait for the failed download to be
+                # removed from the cache, then try again.
+                await self.clock.sleep(0)
+                continue
+
+            break
+
+        media_info = downloaded
+        if not started_download:
+            # The download was ratelimited as another request, so check this
+            # request could have downloaded the media itself.
+            allowed, _ = await download_ratelimiter.can_do_action(
+                requester=None,
+                key=ip_address,
+                n_actions=media_info.media_length,
+                update=True,
+            )
+            if not allowed:
+                logger.debug(
+                    "Not serving remote media %s/%s: requester exceeds ratelimits",
                     server_name,
                     media_id,
-                    max_timeout_ms,
-                    download_ratelimiter,
-                    ip_address,
+                )
+                raise SynapseError(
+                    429,
+                    "Requested file size exceeds ratelimits",
+                    Codes.LIMIT_EXCEEDED,
                 )
 
-        except SynapseError:
-            raise
-        except Exception as e:
-            # An exception may be because we downloaded media in another
-            # process, so let's check if we magically have the media.
-            media_info = await self.store.get_cached_remote_media(server_name, media_id)
-            if not media_info:
-                raise e
+        responder = await self.media_storage.fetch_media(
+            FileInfo(server_name, media_info.filesystem_id)
+        )
+        return responder, media_info
+
+    async def _download_remote_media(
+        self,
+        server_name: str,
+        media_id: str,
+        max_timeout_ms: int,
+        download_ratelimiter: Ratelimiter,
+        ip_address: str,
+        use_federation_endpoint: bool,
+    ) -> RemoteMedia:
+        """Download remote media into the media store, and start generating its
+        thumbnails.
+
+        This returns as soon as the media has been stored, so that it can be
+        served while the thumbnails are generated. Requests for thumbnails wait
+        for them via `_remote_media_thumbnailing`.
+
+        Args:
+            server_name: Remote server_name where the media originated.
+            media_id: The media ID of the content (as defined by the
+                remote server).
+            max_timeout_ms: the maximum number of milliseconds to wait for the
+                media to be uploaded.
+            download_ratelimiter: a ratelimiter limiting remote media downloads, keyed to
+                requester IP.
+            ip_address: the IP address of the requester
+            use_federation_endpoint: whether to request the remote media over the new federation
+            /download endpoint
+
+        Returns:
+            The media info of the file.
+        """
+        key = (server_name, media_id)
+
+        # We linearize here so that we don't download media while it is being
+        # deleted.
+        async with self.remote_media_linearizer.queue(key):
+            try:
+                if not use_federation_endpoint:
+                    media_info = await self._download_remote_file(
+                        server_name,
+                        media_id,
+                        max_timeout_ms,
+                        download_ratelimiter,
+                        ip_address,
+                    )
+                else:
+                    media_info = await self._federation_download_remote_file(
+                        server_name,
+                        media_id,
+                        max_timeout_ms,
+                        download_ratelimiter,
+                        ip_address,
+                    )
+
+            except SynapseError:
+                raise
+            except Exception as e:
+                # An exception may be because we downloaded media in another
+                # process, so let's check if we magically have the media.
+                cached_media_info = await self.store.get_cached_remote_media(
+                    server_name, media_id
+                )
+                if not cached_media_info:
+                    raise e
+                media_info = cached_media_info
 
-        file_id = media_info.filesystem_id
         if not media_info.media_type:
             media_info = attr.evolve(media_info, media_type="application/octet-stream")
-        file_info = FileInfo(server_name, file_id)
 
         # We generate thumbnails even if another process downloaded the media
-        # as a) it's conceivable that the other download request dies before it
-        # generates thumbnails, but mainly b) we want to be sure the thumbnails
-        # have finished being generated before responding to the client,
-        # otherwise they'll request thumbnails and get a 404 if they're not
-        # ready yet.
-        await self._generate_thumbnails(
-            server_name, media_id, file_id, media_info.media_type
+        # as it's conceivable that the other download request dies before it
+        # generates thumbnails.
+        thumbnailing = ObservableDeferred(
+            run_as_background_process(
+                "generate_remote_media_thumbnails",
+                self._generate_thumbnails,
+                server_name,
+                media_id,
+                media_info.filesystem_id,
+                media_info.media_type,
+            ),
+            consumeErrors=True,
         )
+        self._remote_media_thumbnailing[key] = thumbnailing
 
-        responder = await self.media_storage.fetch_media(file_info)
-        return responder, media_info
+        def on_thumbnailed(_: object) -> None:
+            if self._remote_media_thumbnailing.get(key) is thumbnailing:
+                del self._remote_media_thumbnailing[key]
+
+        thumbnailing.observe().addBoth(on_thumbnailed)
+
+        return media_info
 
     async def _download_remote_file(
         self,
@@ -987,18 +1379,17 @@ class MediaRepository:
             )
             return None
 
-        if thumbnailer.transpose_method is not None:
-            m_width, m_height = thumbnailer.transpose()
+        if t_method not in ("crop", "scale"):
+            return None
 
-        if t_method == "crop":
-            return thumbnailer.crop(t_width, t_height, t_type)
-        elif t_method == "scale":
-            t_width, t_height = thumbnailer.aspect(t_width, t_height)
-            t_width = min(m_width, t_width)
-            t_height = min(m_height, t_height)
-            return thumbnailer.scale(t_width, t_height, t_type)
+        _, thumbnails = thumbnailer.generate_thumbnails(
+            [ThumbnailRequirement(t_width, t_height, t_method, t_type)]
+        )
+        if not thumbnails:
+            return None
 
-        return None
+        (t_byte_source,) = thumbnails.values()
+        return t_byte_source
 
     async def generate_local_exact_thumbnail(
         self,
@@ -1008,6 +1399,34 @@ class MediaRepository:
         t_method: str,
         t_type: str,
         url_cache: bool,
+    ) -> Optional[Tuple[str, FileInfo]]:
+        """Generate and store a thumbnail of the given size for local media.
+
+        Concurrent requests for the same thumbnail share a single generation.
+
+        Returns:
+            The path of the thumbnail and its file info, or None if a thumbnail
+            could not be generated.
+        """
+        return await self._exact_thumbnail_generation.wrap(
+            (None, media_id, t_width, t_height, t_method, t_type),
+            self._generate_local_exact_thumbnail,
+            media_id,
+            t_width,
+            t_height,
+            t_method,
+            t_type,
+            url_cache,
+        )
+
+    async def _generate_local_exact_thumbnail(
+        self,
+        media_id: str,
+        t_width: int,
+        t_height: int,
+        t_method: str,
+        t_type: str,
+        url_cache: bool,
     ) -> Optional[Tuple[str, FileInfo]]:
         input_path = await self.media_storage.ensure_media_is_in_local_cache(
             FileInfo(None, media_id, url_cache=url_cache)
@@ -1026,8 +1445,9 @@ class MediaRepository:
             return None
 
         with thumbnailer:
-            t_byte_source = await defer_to_thread(
+            t_byte_source = await defer_to_threadpool(
                 self.hs.get_reactor(),
+                self.hs.get_thumbnail_thread_pool(),
                 self._generate_thumbnail,
                 thumbnailer,
                 t_width,
@@ -1084,6 +1504,36 @@ class MediaRepository:
         t_height: int,
         t_method: str,
         t_type: str,
+    ) -> Optional[str]:
+        """Generate and store a thumbnail of the given size for remote media.
+
+        Concurrent requests for the same thumbnail share a single generation.
+
+        Returns:
+            The path of the thumbnail, or None if a thumbnail could not be
+            generated.
+        """
+        return await self._exact_thumbnail_generation.wrap(
+            (server_name, file_id, t_width, t_height, t_method, t_type),
+            self._generate_remote_exact_thumbnail,
+            server_name,
+            file_id,
+            media_id,
+            t_width,
+            t_height,
+            t_method,
+            t_type,
+        )
+
+    async def _generate_remote_exact_thumbnail(
+        self,
+        server_name: str,
+        file_id: str,
+        media_id: str,
+        t_width: int,
+        t_height: int,
+        t_method: str,
+        t_type: str,
     ) -> Optional[str]:
         input_path = await self.media_storage.ensure_media_is_in_local_cache(
             FileInfo(server_name, file_id)
@@ -1103,8 +1553,9 @@ class MediaRepository:
             return None
 
         with thumbnailer:
-            t_byte_source = await defer_to_thread(
+            t_byte_source = await defer_to_threadpool(
                 self.hs.get_reactor(),
+                self.hs.get_thumbnail_thread_pool(),
                 self._generate_thumbnail,
                 thumbnailer,
                 t_width,
@@ -1181,6 +1632,20 @@ class MediaRepository:
         if not requirements:
             return None
 
+        # If the file is stored as a blob, we may have already generated the
+        # thumbnails for another copy of it.
+        sha256 = None
+        if self.media_storage.deduplicate and not url_cache:
+            sha256 = await self.media_storage.get_blob_sha256(
+                FileInfo(server_name, file_id)
+            )
+        if sha256 is not None:
+            dimensions = await self._link_blob_thumbnails(
+                server_name, media_id, file_id, media_type, sha256
+            )
+            if dimensions is not None:
+                return dimensions
+
         input_path = await self.media_storage.ensure_media_is_in_local_cache(
             FileInfo(server_name, file_id, url_cache=url_cache)
         )
@@ -1210,53 +1675,23 @@ class MediaRepository:
                 )
                 return None
 
-            if thumbnailer.transpose_method is not None:
-                m_width, m_height = await defer_to_thread(
-                    self.hs.get_reactor(), thumbnailer.transpose
-                )
-
-            # We deduplicate the thumbnail sizes by ignoring the cropped versions if
-            # they have the same dimensions of a scaled one.
-            thumbnails: Dict[Tuple[int, int, str], str] = {}
-            for requirement in requirements:
-                if requirement.method == "crop":
-                    thumbnails.setdefault(
-                        (requirement.width, requirement.height, requirement.media_type),
-                        requirement.method,
-                    )
-                elif requirement.method == "scale":
-                    t_width, t_height = thumbnailer.aspect(
-                        requirement.width, requirement.height
-                    )
-                    t_width = min(m_width, t_width)
-                    t_height = min(m_height, t_height)
-                    thumbnails[(t_width, t_height, requirement.media_type)] = (
-                        requirement.method
-                    )
-
-            # Now we generate the thumbnails for each dimension, store it
-            for (t_width, t_height, t_type), t_method in thumbnails.items():
-                # Generate the thumbnail
-                if t_method == "crop":
-                    t_byte_source = await defer_to_thread(
-                        self.hs.get_reactor(),
-                        thumbnailer.crop,
-                        t_width,
-                        t_height,
-                        t_type,
-                    )
-                elif t_method == "scale":
-                    t_byte_source = await defer_to_thread(
-                        self.hs.get_reactor(),
-                        thumbnailer.scale,
-                        t_width,
-                        t_height,
-                        t_type,
-                    )
-                else:
-                    logger.error("Unrecognized method: %r", t_method)
-                    continue
+            # Generate all of the thumbnails in one go, so that the image only
+            # needs to be decoded once.
+            (m_width, m_height), thumbnails = await defer_to_threadpool(
+                self.hs.get_reactor(),
+                self.hs.get_thumbnail_thread_pool(),
+                thumbnailer.generate_thumbnails,
+                requirements,
+            )
 
+            # Now we store the thumbnail for each dimension
+            blob_thumbnails = []
+            for (
+                t_width,
+                t_height,
+                t_type,
+                t_method,
+            ), t_byte_source in thumbnails.items():
                 if not t_byte_source:
                     continue
 
@@ -1286,49 +1721,116 @@ class MediaRepository:
 
                     t_len = os.path.getsize(fname)
 
+                    thumbnail = ThumbnailInfo(
+                        width=t_width,
+                        height=t_height,
+                        method=t_method,
+                        type=t_type,
+                        length=t_len,
+                    )
+
                     # Write to database
-                    if server_name:
-                        # Multiple remote media download requests can race (when
-                        # using multiple media repos), so this may throw a violation
-                        # constraint exception. If it does we'll delete the newly
-                        # generated thumbnail from disk (as we're in the ctx
-                        # manager).
-                        #
-                        # However: we've already called `finish()` so we may have
-                        # also written to the storage providers. This is preferable
-                        # to the alternative where we call `finish()` *after* this,
-                        # where we could end up having an entry in the DB but fail
-                        # to write the files to the storage providers.
-                        try:
-                            await self.store.store_remote_media_thumbnail(
-                                server_name,
-                                media_id,
-                                file_id,
-                                t_width,
-                                t_height,
-                                t_type,
-                                t_method,
-                                t_len,
-                            )
-                        except Exception as e:
-                            thumbnail_exists = (
-                                await self.store.get_remote_media_thumbnail(
-                                    server_name,
-                                    media_id,
-                                    t_width,
-                                    t_height,
-                                    t_type,
-                                )
-                            )
-                            if not thumbnail_exists:
-                                raise e
-                    else:
-                        await self.store.store_local_thumbnail(
-                            media_id, t_width, t_height, t_type, t_method, t_len
-                        )
+                    await self._store_thumbnail_info(
+                        server_name, media_id, file_id, thumbnail
+                    )
+
+                blob_thumbnails.append(
+                    (thumbnail, os.path.relpath(fname, self.primary_base_path))
+                )
+
+        if sha256 is not None and blob_thumbnails:
+            await self.store.store_media_blob_thumbnails(
+                sha256, media_type, m_width, m_height, blob_thumbnails
+            )
 
         return {"width": m_width, "height": m_height}
 
+    async def _link_blob_thumbnails(
+        self,
+        server_name: Optional[str],
+        media_id: str,
+        file_id: str,
+        media_type: str,
+        sha256: str,
+    ) -> Optional[dict]:
+        """Store the thumbnails previously generated for another copy of the
+        same file as links to them.
+
+        Returns:
+            Dict with "width" and "height" keys of original image, or None if
+            the thumbnails need generating.
+        """
+        blob_thumbnails = await self.store.get_media_blob_thumbnails(sha256, media_type)
+        if blob_thumbnails is None:
+            return None
+
+        (m_width, m_height), thumbnails = blob_thumbnails
+        for thumbnail, path in thumbnails:
+            file_info = FileInfo(
+                server_name=server_name, file_id=file_id, thumbnail=thumbnail
+            )
+            fname = await self.media_storage.link_file(path, file_info)
+            if fname is None:
+                # The media the thumbnails were generated for has probably
+                # since been deleted.
+                return None
+
+            await self._store_thumbnail_info(server_name, media_id, file_id, thumbnail)
+
+        logger.debug("Linked thumbnails for %s to those of blob %s", file_id, sha256)
+        return {"width": m_width, "height": m_height}
+
+    async def _store_thumbnail_info(
+        self,
+        server_name: Optional[str],
+        media_id: str,
+        file_id: str,
+        thumbnail: ThumbnailInfo,
+    ) -> None:
+        """Write a stored thumbnail to the database."""
+        if server_name:
+            # Multiple remote media download requests can race (when
+            # using multiple media repos), so this may throw a violation
+            # constraint exception. If it does we'll delete the newly
+            # generated thumbnail from disk (as the caller is in the ctx
+            # manager).
+            #
+            # However: we've already called `finish()` so we may have
+            # also written to the storage providers. This is preferable
+            # to the alternative where we call `finish()` *after* this,
+            # where we could end up having an entry in the DB but fail
+            # to write the files to the storage providers.
+            try:
+                await self.store.store_remote_media_thumbnail(
+                    server_name,
+                    media_id,
+                    file_id,
+                    thumbnail.width,
+                    thumbnail.height,
+                    thumbnail.type,
+                    thumbnail.method,
+                    thumbnail.length,
+                )
+            except Exception as e:
+                thumbnail_exists = await self.store.get_remote_media_thumbnail(
+                    server_name,
+                    media_id,
+                    thumbnail.width,
+                    thumbnail.height,
+                    thumbnail.type,
+                )
+                if not thumbnail_exists:
+                    raise e
+        else:
+            await self.store.store_local_thumbnail(
+                media_id,
+                thumbnail.width,
+                thumbnail.height,
+                thumbnail.type,
+                thumbnail.method,
+                thumbnail.length,
+            )
+
     async def _apply_media_retention_rules(self) -> None:
         """
         Purge old local and remote media according to the media retention rules
@@ -1371,39 +1873,101 @@ class MediaRepository:
             )
 
     async def delete_old_remote_media(self, before_ts: int) -> Dict[str, int]:
-        old_media = await self.store.get_remote_media_ids(
-            before_ts, include_quarantined_media=False
+        """Delete the remote media that was last accessed before the given time
+        from this server, in batches.
+
+        The progress of the purge is available in `purge_progress`.
+
+        Args:
+            before_ts: Unix timestamp in ms.
+
+        Returns:
+            The number of media deleted.
+        """
+        progress = MediaPurgeProgress(
+            before_ts=before_ts, started_ts=self.clock.time_msec()
         )
+        self.purge_progress["remote"] = progress
 
-        deleted = 0
+        try:
+            after: Optional[Tuple[int, str, str]] = None
+            while True:
+                old_media = await self.store.get_remote_media_ids(
+                    before_ts,
+                    include_quarantined_media=False,
+                    after=after,
+                    limit=MEDIA_PURGE_BATCH_SIZE,
+                )
+                if not old_media:
+                    break
 
-        for origin, media_id, file_id in old_media:
-            key = (origin, media_id)
+                origin, media_id, _, last_access_ts = old_media[-1]
+                after = (last_access_ts, origin, media_id)
 
-            logger.info("Deleting: %r", key)
+                await self._purge_remote_media_batch(old_media, progress)
+                progress.last_access_ts = last_access_ts
+        finally:
+            progress.finished_ts = self.clock.time_msec()
 
-            # TODO: Should we delete from the backup store
+        return {"deleted": progress.deleted}
 
-            async with self.remote_media_linearizer.queue(key):
-                full_path = self.filepaths.remote_media_filepath(origin, file_id)
-                try:
-                    os.remove(full_path)
-                except OSError as e:
-                    logger.warning("Failed to remove file: %r", full_path)
-                    if e.errno == errno.ENOENT:
-                        pass
-                    else:
-                        continue
-
-                thumbnail_dir = self.filepaths.remote_media_thumbnail_dir(
-                    origin, file_id
+    async def _purge_remote_media_batch(
+        self,
+        old_media: List[Tuple[str, str, str, int]],
+        progress: MediaPurgeProgress,
+    ) -> None:
+        """Delete a batch of remote media, as returned by `get_remote_media_ids`.
+
+        The files are deleted concurrently on the reactor's thread pool, and then
+        the media whose files were deleted is removed from the DB.
+        """
+        deleted = set()
+
+        async def delete_files(media: Tuple[str, str, str, int]) -> None:
+            origin, media_id, file_id, _ = media
+            removed = await defer_to_thread(
+                self.hs.get_reactor(),
+                _remove_media_files,
+                self.filepaths.remote_media_filepath(origin, file_id),
+                self.filepaths.remote_media_thumbnail_dir(origin, file_id),
+            )
+            if removed:
+                deleted.add(media)
+
+        # TODO: Should we delete from the backup store
+
+        async with AsyncExitStack() as stack:
+            # Hold the lock for each media so that it isn't downloaded again
+            # while it is being deleted.
+            for origin, media_id, _, _ in old_media:
+                await stack.enter_async_context(
+                    self.remote_media_linearizer.queue((origin, media_id))
                 )
-                shutil.rmtree(thumbnail_dir, ignore_errors=True)
 
-                await self.store.delete_remote_media(origin, media_id)
-                deleted += 1
+            await concurrently_execute(
+                delete_files, old_media, MEDIA_PURGE_IO_CONCURRENCY
+            )
 
-        return {"deleted": deleted}
+            await self.media_storage.remove_blob_refs(
+                [(origin, file_id) for origin, _, file_id, _ in deleted]
+            )
+            await self.store.remove_media_local_cache_evictions(
+                [(origin, file_id) for origin, _, file_id, _ in deleted]
+            )
+            await self.store.delete_remote_media_batch(
+                [(origin, media_id) for origin, media_id, _, _ in deleted]
+            )
+
+        logger.info(
+            "Purged %d remote media (failed to delete %d)",
+            len(deleted),
+            len(old_media) - len(deleted),
+        )
+
+        progress.deleted += len(deleted)
+        progress.failed += len(old_media) - len(deleted)
+        media_purged.labels("remote").inc(len(deleted))
+        media_purge_failures.labels("remote").inc(len(old_media) - len(deleted))
 
     async def delete_local_media_ids(
         self, media_ids: List[str]
@@ -1442,48 +2006,83 @@ class MediaRepository:
         Returns:
             A tuple of (list of deleted media IDs, total deleted media IDs).
         """
-        old_media = await self.store.get_local_media_ids(
-            before_ts,
-            size_gt,
-            keep_profiles,
-            include_quarantined_media=delete_quarantined_media,
-            include_protected_media=delete_protected_media,
+        progress = MediaPurgeProgress(
+            before_ts=before_ts, started_ts=self.clock.time_msec()
         )
-        return await self._remove_local_media_from_disk(old_media)
+        self.purge_progress["local"] = progress
+
+        try:
+            old_media = await self.store.get_local_media_ids(
+                before_ts,
+                size_gt,
+                keep_profiles,
+                include_quarantined_media=delete_quarantined_media,
+                include_protected_media=delete_protected_media,
+            )
+            return await self._remove_local_media_from_disk(old_media, progress)
+        finally:
+            progress.finished_ts = self.clock.time_msec()
 
     async def _remove_local_media_from_disk(
-        self, media_ids: List[str]
+        self,
+        media_ids: List[str],
+        progress: Optional[MediaPurgeProgress] = None,
     ) -> Tuple[List[str], int]:
         """
         Delete local or remote media from this server. Removes media files,
         any thumbnails and cached URLs.
 
+        The media is deleted in batches: the files of each batch are deleted
+        concurrently on the reactor's thread pool, and then the media whose files
+        were deleted is removed from the DB.
+
         Args:
             media_ids: List of media_id to delete
+            progress: If given, updated as the media is deleted.
         Returns:
             A tuple of (list of deleted media IDs, total deleted media IDs).
         """
-        removed_media = []
-        for media_id in media_ids:
-            logger.info("Deleting media with ID '%s'", media_id)
-            full_path = self.filepaths.local_media_filepath(media_id)
-            try:
-                os.remove(full_path)
-            except OSError as e:
-                logger.warning("Failed to remove file: %r: %s", full_path, e)
-                if e.errno == errno.ENOENT:
-                    pass
-                else:
-                    continue
+        removed_media: List[str] = []
+
+        for batch in batch_iter(media_ids, MEDIA_PURGE_BATCH_SIZE):
+            deleted = set()
+
+            async def delete_files(media_id: str) -> None:
+                logger.info("Deleting media with ID '%s'", media_id)
+                removed = await defer_to_thread(
+                    self.hs.get_reactor(),
+                    _remove_media_files,
+                    self.filepaths.local_media_filepath(media_id),
+                    self.filepaths.local_media_thumbnail_dir(media_id),
+                )
+                if removed:
+                    deleted.add(media_id)
+
+            await concurrently_execute(delete_files, batch, MEDIA_PURGE_IO_CONCURRENCY)
+
+            # Keep the order the media was given in.
+            removed = [media_id for media_id in batch if media_id in deleted]
 
-            thumbnail_dir = self.filepaths.local_media_thumbnail_dir(media_id)
-            shutil.rmtree(thumbnail_dir, ignore_errors=True)
+            await self.media_storage.remove_blob_refs(
+                [(None, media_id) for media_id in removed]
+            )
+            await self.store.remove_media_local_cache_evictions(
+                [(self.server_name, media_id) for media_id in removed]
+            )
+
+            await self.store.delete_remote_media_batch(
+                [(self.server_name, media_id) for media_id in removed]
+            )
 
-            await self.store.delete_remote_media(self.server_name, media_id)
+            await self.store.delete_url_cache(removed)
+            await self.store.delete_url_cache_media(removed)
 
-            await self.store.delete_url_cache((media_id,))
-            await self.store.delete_url_cache_media((media_id,))
+            removed_media.extend(removed)
 
-            removed_media.append(media_id)
+            if progress is not None:
+                progress.deleted += len(removed)
+                progress.failed += len(batch) - len(removed)
+            media_purged.labels("local").inc(len(removed))
+            media_purge_failures.labels("local").inc(len(batch) - len(removed))
 
         return removed_media, len(removed_media)
@@ -19,6 +19,8 @@
 #
 #
 import contextlib
+import errno
+import hashlib
 import json
 import logging
 import os
@@ -33,6 +35,7 @@ from typing import (
     AsyncIterator,
     BinaryIO,
     Callable,
+    Collection,
     List,
     Optional,
     Sequence,
@@ -44,11 +47,13 @@ from typing import (
 from uuid import uuid4
 
 import attr
+from prometheus_client import Counter
 from zope.interface import implementer
 
 from twisted.internet import interfaces
 from twisted.internet.defer import Deferred
 from twisted.internet.interfaces import IConsumer
+from twisted.web.server import Request
 
 from synapse.api.errors import NotFoundError
 from synapse.logging.context import defer_to_thread, run_in_background
@@ -58,7 +63,7 @@ from synapse.util import Clock
 from synapse.util.file_consumer import BackgroundFileConsumer
 
 from ..types import JsonDict
-from ._base import FileInfo, Responder
+from ._base import FileInfo, Responder, ThumbnailInfo
 from .filepath import MediaFilePaths
 
 if TYPE_CHECKING:
@@ -69,6 +74,16 @@ logger = logging.getLogger(__name__)
 
 CRLF = b"\r\n"
 
+local_media_cache_hits = Counter(
+    "synapse_media_local_cache_hits",
+    "Number of media files fetched from the local media store",
+)
+
+local_media_cache_misses = Counter(
+    "synapse_media_local_cache_misses",
+    "Number of media files fetched from storage providers",
+)
+
 
 class MediaStorage:
     """Responsible for storing/fetching files from local sources.
@@ -94,6 +109,11 @@ class MediaStorage:
         self.storage_providers = storage_providers
         self._spam_checker_module_callbacks = hs.get_module_api_callbacks().spam_checker
         self.clock = hs.get_clock()
+        self.store = hs.get_datastores().main
+        self.deduplicate = hs.config.media.enable_media_deduplication
+        self.local_cache_enabled = (
+            hs.config.media.media_local_cache_max_size is not None
+        )
 
     @trace_with_opname("MediaStorage.store_file")
     async def store_file(self, source: IO, file_info: FileInfo) -> str:
@@ -149,10 +169,22 @@ class MediaStorage:
         dirname = os.path.dirname(fname)
         os.makedirs(dirname, exist_ok=True)
 
+        if self.deduplicate:
+            # The file may be a link to a blob, which we mustn't write through.
+            try:
+                os.remove(fname)
+            except FileNotFoundError:
+                pass
+
+        hashing_writer = None
         try:
             with start_active_span("writing to main media repo"):
                 with open(fname, "wb") as f:
-                    yield f, fname
+                    if self._should_deduplicate(file_info):
+                        hashing_writer = _HashingWriter(f)
+                        yield cast(BinaryIO, hashing_writer), fname
+                    else:
+                        yield f, fname
 
             with start_active_span("writing to other storage providers"):
                 spam_check = (
@@ -181,6 +213,219 @@ class MediaStorage:
 
             raise e from None
 
+        if hashing_writer is not None:
+            with start_active_span("linking to blob"):
+                await self._link_to_blob(
+                    path,
+                    file_info,
+                    hashing_writer.sha256.hexdigest(),
+                    hashing_writer.length,
+                )
+
+    def _should_deduplicate(self, file_info: FileInfo) -> bool:
+        """Whether the file should be stored as a link to a blob.
+
+        Thumbnails are instead linked to the thumbnails of other media with the
+        same content (see `link_file`), and the URL cache is cleared out by path
+        so its files don't reference blobs.
+        """
+        return (
+            self.deduplicate and file_info.thumbnail is None and not file_info.url_cache
+        )
+
+    async def _link_to_blob(
+        self, path: str, file_info: FileInfo, sha256: str, length: int
+    ) -> None:
+        """Replace the file at `path` with a link to the blob with its content,
+        making the file the blob if there isn't one.
+
+        Failures are logged rather than raised, as the file has been stored
+        either way.
+        """
+        try:
+            await self.store.add_media_blob_ref(
+                media_origin=file_info.server_name or self.hs.hostname,
+                file_id=file_info.file_id,
+                path=path,
+                sha256=sha256,
+                media_length=length,
+            )
+        except Exception:
+            logger.exception("Failed to record blob for %s", path)
+            return
+
+        fname = os.path.join(self.local_media_directory, path)
+        blob_fname = self.filepaths.blob_filepath(sha256)
+        try:
+            os.makedirs(os.path.dirname(blob_fname), exist_ok=True)
+            try:
+                os.link(fname, blob_fname)
+                logger.debug("Stored new blob %s", sha256)
+            except FileExistsError:
+                _replace_with_link(blob_fname, fname)
+                logger.debug("Linked %s to existing blob %s", path, sha256)
+        except OSError as e:
+            # We still count the reference, so that removing the blob later is
+            # not affected.
+            logger.warning("Failed to link %s to blob %s: %s", path, sha256, e)
+
+    async def link_file(self, source_path: str, file_info: FileInfo) -> Optional[str]:
+        """Store the file described by `file_info` as a link to an existing
+        file in the local media store, which must not be written to afterwards.
+
+        Args:
+            source_path: The path of the existing file, relative to the media
+                store.
+            file_info: Info about the file to store
+
+        Returns:
+            The absolute path of the stored file, or None if it could not be
+            linked, e.g. because the existing file has been deleted.
+        """
+        path = self._file_info_to_path(file_info)
+        fname = os.path.join(self.local_media_directory, path)
+        source_fname = os.path.join(self.local_media_directory, source_path)
+
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        try:
+            _replace_with_link(source_fname, fname)
+        except OSError as e:
+            logger.info("Failed to link %s to %s: %s", path, source_path, e)
+            return None
+
+        try:
+            for provider in self.storage_providers:
+                with start_active_span(str(provider)):
+                    await provider.store_file(path, file_info)
+        except Exception:
+            try:
+                os.remove(fname)
+            except Exception:
+                pass
+            raise
+
+        return fname
+
+    async def get_blob_sha256(self, file_info: FileInfo) -> Optional[str]:
+        """Get the digest of the blob that the file described by `file_info`
+        links to, if any."""
+        return await self.store.get_media_blob_sha256(
+            self._file_info_to_path(file_info)
+        )
+
+    async def remove_blob_refs(
+        self, media: Collection[Tuple[Optional[str], str]]
+    ) -> None:
+        """Remove the references to blobs held by media files and their
+        thumbnails, deleting any blobs that are no longer referenced.
+
+        Should be called when deleting the media's files.
+
+        Args:
+            media: The (server name, file ID) of each media, where the server
+                name is None for local media.
+        """
+        unreferenced = await self.store.remove_media_blob_refs(
+            [
+                (server_name or self.hs.hostname, file_id)
+                for server_name, file_id in media
+            ]
+        )
+        for sha256 in unreferenced:
+            blob_fname = self.filepaths.blob_filepath(sha256)
+            logger.debug("Deleting unreferenced blob %s", sha256)
+            try:
+                os.remove(blob_fname)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    logger.warning("Failed to remove blob %r: %s", blob_fname, e)
+
+    async def remove_from_local_cache(
+        self,
+        server_name: Optional[str],
+        file_id: str,
+        thumbnails: Sequence[ThumbnailInfo],
+    ) -> bool:
+        """Remove a media file and its thumbnails from the local media store,
+        leaving the copies in the storage providers.
+
+        Files are only removed if a storage provider has a copy of them, as
+        storing a file in a storage provider may have failed, or the file may
+        have been stored before the storage provider was configured.
+
+        Args:
+            server_name: The server name if remote media, else None if local
+            file_id: Local file ID
+            thumbnails: The thumbnails of the media.
+
+        Returns:
+            Whether the media file is no longer in the local media store. If it
+            still is, its thumbnails are left in place too.
+        """
+        file_info = FileInfo(server_name, file_id)
+        path = self._file_info_to_path(file_info)
+        fname = os.path.join(self.local_media_directory, path)
+
+        # The file may have already been removed, e.g. if it was evicted before
+        # but only its thumbnails have been fetched back since.
+        if os.path.exists(fname) and not await self._is_in_storage_provider(file_info):
+            return False
+
+        blob_fname = None
+        try:
+            if os.stat(fname).st_nlink > 1:
+                sha256 = await self.store.get_media_blob_sha256(path)
+                if sha256 is not None:
+                    blob_fname = self.filepaths.blob_filepath(sha256)
+            os.remove(fname)
+        except FileNotFoundError:
+            pass
+
+        # The blob only takes up space while there are other links to it.
+        # Removing it here doesn't affect its reference count.
+        if blob_fname is not None:
+            try:
+                if os.stat(blob_fname).st_nlink == 1:
+                    os.remove(blob_fname)
+            except FileNotFoundError:
+                pass
+
+        for thumbnail in thumbnails:
+            thumbnail_info = FileInfo(server_name, file_id, thumbnail=thumbnail)
+            thumbnail_fname = os.path.join(
+                self.local_media_directory, self._file_info_to_path(thumbnail_info)
+            )
+            if not os.path.exists(thumbnail_fname):
+                continue
+
+            if await self._is_in_storage_provider(thumbnail_info):
+                try:
+                    os.remove(thumbnail_fname)
+                except FileNotFoundError:
+                    pass
+
+        return True
+
+    async def _is_in_storage_provider(self, file_info: FileInfo) -> bool:
+        """Check whether any of the storage providers has a copy of the given
+        file.
+        """
+        path = self._file_info_to_path(file_info)
+        for provider in self.storage_providers:
+            try:
+                res: Any = await provider.fetch(path, file_info)
+            except Exception:
+                logger.warning(
+                    "Failed to check for %s on %s", path, provider, exc_info=True
+                )
+                continue
+
+            if res:
+                with res:
+                    return True
+
+        return False
+
     async def fetch_media(self, file_info: FileInfo) -> Optional[Responder]:
         """Attempts to fetch media described by file_info from the local cache
         and configured storage providers.
@@ -207,16 +452,42 @@ class MediaStorage:
 
         for path in paths:
             local_path = os.path.join(self.local_media_directory, path)
-            if os.path.exists(local_path):
-                logger.debug("responding with local file %s", local_path)
-                return FileResponder(self.hs, open(local_path, "rb"))
-            logger.debug("local file %s did not exist", local_path)
+            try:
+                # The file may be evicted from the local cache at any time, so
+                # we just try to open it.
+                open_file = open(local_path, "rb")
+            except FileNotFoundError:
+                logger.debug("local file %s did not exist", local_path)
+                continue
+
+            logger.debug("responding with local file %s", local_path)
+            local_media_cache_hits.inc()
+            return FileResponder(self.hs, open_file, sendfile_path=path)
+
+        if self.local_cache_enabled:
+            # Fetch the file back into the local cache, so that it's there for
+            # the next request.
+            try:
+                local_path = await self.ensure_media_is_in_local_cache(file_info)
+            except NotFoundError:
+                pass
+            else:
+                logger.debug("responding with newly cached file %s", local_path)
+                local_media_cache_misses.inc()
+                return FileResponder(
+                    self.hs,
+                    open(local_path, "rb"),
+                    sendfile_path=os.path.relpath(
+                        local_path, self.local_media_directory
+                    ),
+                )
 
         for provider in self.storage_providers:
             for path in paths:
                 res: Any = await provider.fetch(path, file_info)
                 if res:
                     logger.debug("Streaming %s from %s", path, provider)
+                    local_media_cache_misses.inc()
                     return res
                 logger.debug("%s not found on %s", path, provider)
 
@@ -258,12 +529,32 @@ class MediaStorage:
         for provider in self.storage_providers:
             res: Any = await provider.fetch(path, file_info)
             if res:
-                with res:
-                    consumer = BackgroundFileConsumer(
-                        open(local_path, "wb"), self.reactor
+                # Write to a temporary file first, so that nothing reads the
+                # file before it is complete.
+                tmp_path = "%s.%s.part" % (local_path, uuid4().hex)
+                try:
+                    with res:
+                        consumer = BackgroundFileConsumer(
+                            open(tmp_path, "wb"), self.reactor
+                        )
+                        await res.write_to_consumer(consumer)
+                        await consumer.wait()
+                    os.replace(tmp_path, local_path)
+                except Exception:
+                    try:
+                        os.remove(tmp_path)
+                    except Exception:
+                        pass
+                    raise
+
+                if (
+                    self.local_cache_enabled
+                    and not file_info.thumbnail
+                    and not file_info.url_cache
+                ):
+                    await self.store.remove_media_local_cache_evictions(
+                        [(file_info.server_name or self.hs.hostname, file_info.file_id)]
                     )
-                    await res.write_to_consumer(consumer)
-                    await consumer.wait()
                 return local_path
 
         raise NotFoundError()
@@ -311,6 +602,35 @@ class MediaStorage:
         return self.filepaths.local_media_filepath_rel(file_info.file_id)
 
 
+def _replace_with_link(source: str, dest: str) -> None:
+    """Atomically replace `dest` with a hard link to `source`."""
+    tmp_dest = "%s.%s.link" % (dest, uuid4().hex)
+    os.link(source, tmp_dest)
+    try:
+        os.replace(tmp_dest, dest)
+    except Exception:
+        os.remove(tmp_dest)
+        raise
+
+
+class _HashingWriter:
+    """Wraps a file being written to, calculating the SHA-256 digest and length
+    of what is written."""
+
+    def __init__(self, f: BinaryIO):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+        self.length = 0
+
+    def write(self, data: bytes) -> int:
+        self.sha256.update(data)
+        self.length += len(data)
+        return self._f.write(data)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._f, name)
+
+
 @trace
 def _write_file_synchronously(source: IO, dest: IO) -> None:
     """Write `source` to the file like `dest` synchronously. Should be called
@@ -330,14 +650,47 @@ class FileResponder(Responder):
     Args:
         open_file: A file like object to be streamed to the client,
             is closed when finished streaming.
+        sendfile_path: The path of the file relative to the local media store,
+            if it is in the local media store. If `media_sendfile` is
+            configured the file will be sent by the reverse proxy instead.
     """
 
-    def __init__(self, hs: "HomeServer", open_file: BinaryIO):
+    supports_ranges = True
+
+    def __init__(
+        self,
+        hs: "HomeServer",
+        open_file: BinaryIO,
+        sendfile_path: Optional[str] = None,
+    ):
         self.hs = hs
         self.open_file = open_file
+        self.sendfile_path = sendfile_path
+
+        # The number of bytes to send, if only part of the file is requested.
+        self.length: Optional[int] = None
+
+    def set_range(self, start: int, length: int) -> None:
+        self.open_file.seek(start)
+        self.length = length
 
     def write_to_consumer(self, consumer: IConsumer) -> Deferred:
-        return ThreadedFileSender(self.hs).beginFileTransfer(self.open_file, consumer)
+        return ThreadedFileSender(self.hs).beginFileTransfer(
+            self.open_file, consumer, self.length
+        )
+
+    def delegate_to_proxy(self, request: Request) -> bool:
+        sendfile_header = self.hs.config.media.media_sendfile_header
+        if sendfile_header is None or self.sendfile_path is None:
+            return False
+
+        request.setHeader(
+            sendfile_header,
+            self.hs.config.media.media_sendfile_path_prefix + self.sendfile_path,
+        )
+        # The reverse proxy replaces our (empty) body with the file.
+        request.setHeader(b"Content-Length", b"0")
+        return True
 
     def __exit__(
         self,
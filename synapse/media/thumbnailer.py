@@ -22,12 +22,15 @@
 import logging
 from io import BytesIO
 from types import TracebackType
-from typing import TYPE_CHECKING, List, Optional, Tuple, Type
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple, Type
 
 from PIL import Image
 
 from synapse.api.errors import Codes, NotFoundError, SynapseError, cs_error
-from synapse.config.repository import THUMBNAIL_SUPPORTED_MEDIA_FORMAT_MAP
+from synapse.config.repository import (
+    THUMBNAIL_SUPPORTED_MEDIA_FORMAT_MAP,
+    ThumbnailRequirement,
+)
 from synapse.http.server import respond_with_json
 from synapse.http.site import SynapseRequest
 from synapse.logging.opentracing import trace
@@ -59,11 +62,41 @@ EXIF_TRANSPOSE_MAPPINGS = {
     8: Image.ROTATE_90,
 }
 
+# The transpositions which swap the width and height of the image.
+SIZE_SWAPPING_TRANSPOSE_METHODS = {
+    Image.TRANSPOSE,
+    Image.ROTATE_270,
+    Image.TRANSVERSE,
+    Image.ROTATE_90,
+}
+
+# Thumbnails are resized from an image at least this many times larger than
+# them (in each dimension) where possible, rather than from the full size image.
+# The smaller image is much cheaper to resize from, and is either decoded at a
+# reduced size (for JPEGs) or reduced from the full size image by a power of
+# two. This matches Pillow's own `Image.thumbnail`.
+REDUCING_GAP = 2
+
+# The image modes that we reduce by powers of two before resizing. Images with
+# transparency are left out, as their colour channels need to be premultiplied
+# by the alpha channel before they can be reduced.
+REDUCIBLE_MODES = {"RGB", "CMYK"}
+
 
 class ThumbnailError(Exception):
     """An error occurred generating a thumbnail."""
 
 
+def _aspect(
+    width: int, height: int, max_width: int, max_height: int
+) -> Tuple[int, int]:
+    """See `Thumbnailer.aspect`."""
+    if max_width * height < max_height * width:
+        return max_width, max((max_width * height) // width, 1)
+    else:
+        return max((max_height * width) // height, 1), max_height
+
+
 class Thumbnailer:
     FORMATS = {"image/jpeg": "JPEG", "image/png": "PNG"}
 
@@ -89,6 +122,10 @@ class Thumbnailer:
 
         self.width, self.height = self.image.size
         self.transpose_method = None
+
+        # Progressively smaller copies of the image, each half the size of the
+        # one before, used as the starting point for resizing.
+        self._reduced_images: List[Image.Image] = []
         try:
             # We don't use ImageOps.exif_transpose since it crashes with big EXIF
             #
@@ -128,6 +165,86 @@ class Thumbnailer:
             self.image.info["exif"] = None
         return self.image.size
 
+    def draft(self, max_width: int, max_height: int) -> None:
+        """Configure the image to be decoded at a reduced size, if supported by
+        the image format (i.e. for JPEGs), while still leaving enough pixels to
+        produce thumbnails of the given size.
+
+        Must be called before the image is loaded, e.g. by `transpose`.
+
+        Args:
+            max_width: The largest width of thumbnail that will be generated,
+                after any transposition.
+            max_height: The largest height of thumbnail that will be generated,
+                after any transposition.
+        """
+        if self.transpose_method in SIZE_SWAPPING_TRANSPOSE_METHODS:
+            max_width, max_height = max_height, max_width
+
+        self.image.draft(
+            self.image.mode, (max_width * REDUCING_GAP, max_height * REDUCING_GAP)
+        )
+        self.width, self.height = self.image.size
+
+    @trace
+    def generate_thumbnails(
+        self, requirements: Iterable[ThumbnailRequirement]
+    ) -> Tuple[Tuple[int, int], Dict[Tuple[int, int, str, str], BytesIO]]:
+        """Generates thumbnails of the image for all of the given requirements,
+        only decoding the image once.
+
+        Thumbnails are generated from largest to smallest, so that the smaller
+        ones can be resized from reduced copies of the image.
+
+        Returns:
+            The size of the image (after any transposition) as (width, height),
+            and a map from (width, height, media type, method) to the bytes of
+            the encoded thumbnail, ready to be written to disk.
+        """
+        m_width, m_height = self.width, self.height
+        if self.transpose_method in SIZE_SWAPPING_TRANSPOSE_METHODS:
+            m_width, m_height = m_height, m_width
+
+        # We deduplicate the thumbnail sizes by ignoring the cropped versions if
+        # they have the same dimensions of a scaled one.
+        thumbnails: Dict[Tuple[int, int, str], str] = {}
+        for requirement in requirements:
+            if requirement.method == "crop":
+                thumbnails.setdefault(
+                    (requirement.width, requirement.height, requirement.media_type),
+                    requirement.method,
+                )
+            elif requirement.method == "scale":
+                t_width, t_height = _aspect(
+                    m_width, m_height, requirement.width, requirement.height
+                )
+                t_width = min(m_width, t_width)
+                t_height = min(m_height, t_height)
+                thumbnails[(t_width, t_height, requirement.media_type)] = (
+                    requirement.method
+                )
+
+        if not thumbnails:
+            return (m_width, m_height), {}
+
+        self.draft(
+            max(t_width for t_width, _, _ in thumbnails),
+            max(t_height for _, t_height, _ in thumbnails),
+        )
+        self.transpose()
+
+        results: Dict[Tuple[int, int, str, str], BytesIO] = {}
+        for (t_width, t_height, t_type), t_method in sorted(
+            thumbnails.items(), key=lambda item: item[0][0] * item[0][1], reverse=True
+        ):
+            if t_method == "crop":
+                t_byte_source = self.crop(t_width, t_height, t_type)
+            else:
+                t_byte_source = self.scale(t_width, t_height, t_type)
+            results[(t_width, t_height, t_type, t_method)] = t_byte_source
+
+        return (m_width, m_height), results
+
     def aspect(self, max_width: int, max_height: int) -> Tuple[int, int]:
         """Calculate the largest size that preserves aspect ratio which
         fits within the given rectangle::
@@ -141,10 +258,29 @@ class Thumbnailer:
             max_height: The largest possible height.
         """
 
-        if max_width * self.height < max_height * self.width:
-            return max_width, max((max_width * self.height) // self.width, 1)
-        else:
-            return max((max_height * self.width) // self.height, 1), max_height
+        return _aspect(self.width, self.height, max_width, max_height)
+
+    def _get_image_to_resize(self, width: int, height: int) -> Image.Image:
+        """Get the smallest reduced copy of the image that is still at least
+        `REDUCING_GAP` times the given size, or the image itself if there isn't
+        one."""
+        if self.image.mode not in REDUCIBLE_MODES:
+            return self.image
+
+        image = self.image
+        for level in range(len(self._reduced_images) + 1):
+            if (
+                image.width < 2 * REDUCING_GAP * width
+                or image.height < 2 * REDUCING_GAP * height
+            ):
+                # Reducing the image any further would leave it too small.
+                break
+
+            if level == len(self._reduced_images):
+                self._reduced_images.append(image.reduce(2))
+            image = self._reduced_images[level]
+
+        return image
 
     def _resize(self, width: int, height: int) -> Image.Image:
         # 1-bit or 8-bit color palette images need converting to RGB
@@ -159,7 +295,9 @@ class Thumbnailer:
             else:
                 with self.image:
                     self.image = self.image.convert("RGB")
-        return self.image.resize((width, height), Image.LANCZOS)
+        return self._get_image_to_resize(width, height).resize(
+            (width, height), Image.LANCZOS
+        )
 
     @trace
     def scale(self, width: int, height: int, output_type: str) -> BytesIO:
@@ -232,6 +370,9 @@ class Thumbnailer:
 
         image.close()
 
+        for reduced_image in getattr(self, "_reduced_images", ()):
+            reduced_image.close()
+
     def __enter__(self) -> "Thumbnailer":
         """Make `Thumbnailer` a context manager that calls `close` on
         `__exit__`.
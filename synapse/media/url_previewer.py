@@ -39,7 +39,11 @@ from twisted.internet.error import DNSLookupError
 
 from synapse.api.errors import Codes, SynapseError
 from synapse.http.client import SimpleHttpClient
-from synapse.logging.context import make_deferred_yieldable, run_in_background
+from synapse.logging.context import (
+    defer_to_thread,
+    make_deferred_yieldable,
+    run_in_background,
+)
 from synapse.media._base import FileInfo, get_filename_from_headers
 from synapse.media.media_storage import MediaStorage
 from synapse.media.oembed import OEmbedProvider
@@ -64,6 +68,10 @@ ONE_HOUR = 60 * 60 * 1000
 ONE_DAY = 24 * ONE_HOUR
 IMAGE_CACHE_EXPIRY_MS = 2 * ONE_DAY
 
+# The name of the lock taken out while previewing a URL, so that only one media
+# worker previews a given URL at a time.
+_URL_PREVIEW_LOCK_NAME = "url_preview"
+
 
 @attr.s(slots=True, frozen=True, auto_attribs=True)
 class DownloadResult:
@@ -167,6 +175,8 @@ class UrlPreviewer:
         media_storage: MediaStorage,
     ):
         self.clock = hs.get_clock()
+        self._reactor = hs.get_reactor()
+        self._worker_locks = hs.get_worker_locks_handler()
         self.filepaths = media_repo.filepaths
         self.max_spider_size = hs.config.media.max_spider_size
         self.server_name = hs.hostname
@@ -244,6 +254,31 @@ class UrlPreviewer:
         """
         # check the URL cache in the DB (which will also provide us with
         # historical previews, if we have any)
+        og = await self._get_cached_preview(url, ts)
+        if og is not None:
+            return og
+
+        # Only one worker previews a URL at a time, so that concurrent previews
+        # of the same URL on different media workers share a single fetch: the
+        # others wait for the lock and then use the preview stored in the DB.
+        async with self._worker_locks.acquire_lock(_URL_PREVIEW_LOCK_NAME, url):
+            og = await self._get_cached_preview(url, ts)
+            if og is not None:
+                return og
+
+            return await self._build_preview(url, user)
+
+    async def _get_cached_preview(self, url: str, ts: int) -> Optional[bytes]:
+        """Get a successful preview of the URL from the DB, if one is still valid
+        at the given timestamp.
+
+        Args:
+            url: The URL to preview.
+            ts: The timestamp requested for the preview.
+
+        Returns:
+            json-encoded og data, or None if there is no valid preview.
+        """
         cache_result = await self.store.get_url_cache(url, ts)
         if (
             cache_result
@@ -256,6 +291,18 @@ class UrlPreviewer:
                 return cache_result.og.encode("utf8")
             return cache_result.og
 
+        return None
+
+    async def _build_preview(self, url: str, user: UserID) -> bytes:
+        """Download the URL and build a preview, storing it in the DB.
+
+        Args:
+            url: The URL to preview.
+            user: The user requesting the preview.
+
+        Returns:
+            json-encoded og data
+        """
         # If this URL can be accessed via an allowed oEmbed, use that instead.
         url_to_download = url
         oembed_url = self._oembed.get_oembed_url(url)
@@ -276,7 +323,7 @@ class UrlPreviewer:
                 None, file_id, file_id, media_info.media_type, url_cache=True
             )
 
-            og = {
+            og: JsonDict = {
                 "og:description": media_info.download_name,
                 "og:image": f"mxc://{self.server_name}/{media_info.filesystem_id}",
                 "og:image:type": media_info.media_type,
@@ -291,16 +338,21 @@ class UrlPreviewer:
 
             # define our OG response for this media
         elif _is_html(media_info.media_type):
-            # TODO: somehow stop a big HTML tree from exploding synapse's RAM
-
-            with open(media_info.filename, "rb") as file:
-                body = file.read()
+            # Parsing large HTML documents can take a while, so do it off the
+            # reactor.
+            oembed_url, og_from_html = await defer_to_thread(
+                self._reactor, self._parse_html, media_info
+            )
+            if og_from_html is not None:
+                # Fetch the image from the HTML while we fetch any oEmbed
+                # information, as the oEmbed response rarely replaces it.
+                html_image_url = og_from_html.get("og:image")
+                html_image_og: Optional["Deferred[JsonDict]"] = None
+                if html_image_url:
+                    html_image_og = run_in_background(
+                        self._fetch_image_url, user, media_info, html_image_url
+                    )
 
-            tree = decode_body(body, media_info.uri, media_info.media_type)
-            if tree is not None:
-                # Check if this HTML document points to oEmbed information and
-                # defer to that.
-                oembed_url = self._oembed.autodiscover_from_html(tree)
                 og_from_oembed: JsonDict = {}
                 # Only download to the oEmbed URL if it is allowed.
                 if oembed_url:
@@ -324,16 +376,22 @@ class UrlPreviewer:
                             url, oembed_info, expiration_ms
                         )
 
-                # Parse Open Graph information from the HTML in case the oEmbed
-                # response failed or is incomplete.
-                og_from_html = parse_html_to_open_graph(tree)
-
                 # Compile the Open Graph response by using the scraped
                 # information from the HTML and overlaying any information
                 # from the oEmbed response.
                 og = {**og_from_html, **og_from_oembed}
 
-                await self._precache_image_url(user, media_info, og)
+                # Pre-cache the image, reusing the one from the HTML unless the
+                # oEmbed response replaced it.
+                image_url = og.pop("og:image", None)
+                image_og: JsonDict = {}
+                if html_image_og is not None:
+                    html_image = await make_deferred_yieldable(html_image_og)
+                    if image_url == html_image_url:
+                        image_og = html_image
+                if image_url and image_url != html_image_url:
+                    image_og = await self._fetch_image_url(user, media_info, image_url)
+                og.update(image_og)
             else:
                 og = {}
 
@@ -656,6 +714,24 @@ class UrlPreviewer:
         if not image_url:
             return
 
+        og.update(await self._fetch_image_url(user, media_info, image_url))
+
+    async def _fetch_image_url(
+        self, user: UserID, media_info: MediaInfo, image_url: str
+    ) -> JsonDict:
+        """
+        Fetch an image referenced by a preview and generate its thumbnails.
+
+        Args:
+            user: The user requesting the preview.
+            media_info: The media being previewed.
+            image_url: The URL of the image, which may be relative to the
+                previewed page.
+
+        Returns:
+            The Open Graph information describing the cached image, or an empty
+            dictionary if it could not be fetched.
+        """
         # The image URL from the HTML might be relative to the previewed page,
         # convert it to a URL which can be requested directly.
         url_parts = urlparse(image_url)
@@ -674,8 +750,9 @@ class UrlPreviewer:
                 image_url,
                 e,
             )
-            return
+            return {}
 
+        og: JsonDict = {}
         if _is_media(image_info.media_type):
             # TODO: make sure we don't choke on white-on-transparent images
             file_id = image_info.filesystem_id
@@ -692,6 +769,41 @@ class UrlPreviewer:
             og["og:image:type"] = image_info.media_type
             og["matrix:image:size"] = image_info.media_length
 
+        return og
+
+    def _parse_html(
+        self, media_info: MediaInfo
+    ) -> Tuple[Optional[str], Optional[JsonDict]]:
+        """
+        Parse a downloaded HTML document. This blocks, so should be run on a
+        thread.
+
+        Args:
+            media_info: The HTML document being previewed.
+
+        Returns:
+            A tuple of:
+                The oEmbed URL the document points to, if any.
+                The Open Graph information scraped from the document, or None
+                if it could not be parsed.
+        """
+        # TODO: somehow stop a big HTML tree from exploding synapse's RAM
+
+        with open(media_info.filename, "rb") as file:
+            body = file.read()
+
+        tree = decode_body(body, media_info.uri, media_info.media_type)
+        if tree is None:
+            return None, None
+
+        # Check if this HTML document points to oEmbed information and defer to
+        # that.
+        oembed_url = self._oembed.autodiscover_from_html(tree)
+
+        # Parse Open Graph information from the HTML in case the oEmbed
+        # response failed or is incomplete.
+        return oembed_url, parse_html_to_open_graph(tree)
+
     async def _handle_oembed_response(
         self, url: str, media_info: MediaInfo, expiration_ms: int
     ) -> Tuple[JsonDict, Optional[str], int]:
@@ -717,7 +829,9 @@ class UrlPreviewer:
         with open(media_info.filename, "rb") as file:
             body = file.read()
 
-        oembed_response = self._oembed.parse_oembed_response(url, body)
+        oembed_response = await defer_to_thread(
+            self._reactor, self._oembed.parse_oembed_response, url, body
+        )
         open_graph_result = oembed_response.open_graph_result
 
         # Use the cache age from the oEmbed result, if one was given.
@@ -43,6 +43,12 @@ and event_push_summary_stream_ordering tables.
 Since push actions block an event from being persisted the generation of push
 actions is performance sensitive.
 
+Alternatively, if `push.calculate_actions_in_background` is enabled, step 1 is
+skipped for non-state events. Instead, once the event has been persisted, the
+BackgroundPushActionsProcessor on each pusher instance calculates the push
+actions for the users it handles, and inserts them directly into the
+event_push_actions table.
+
 The general interaction of the classes are:
 
         +---------------------------------------------+
@@ -172,7 +178,7 @@ class Pusher(metaclass=abc.ABCMeta):
         # When new events arrive, we'll be given a window of new events: we
         # should honour this rather than just looking for anything higher
         # because of potential out-of-order event serialisation.
-        self.max_stream_ordering = self.store.get_room_max_stream_ordering()
+        self.max_stream_ordering = hs.get_pusherpool().get_max_push_stream_ordering()
 
     def on_new_notifications(self, max_token: RoomStreamToken) -> None:
         # We just use the minimum stream ordering and ignore the vector clock
@@ -0,0 +1,197 @@
+#
+# This file is licensed under the Affero General Public License (AGPL) version 3.
+#
+# Copyright (C) 2024 New Vector, Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# See the GNU Affero General Public License for more details:
+# <https://www.gnu.org/licenses/agpl-3.0.html>.
+#
+
+import logging
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Collection,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from synapse.events import EventBase
+from synapse.events.snapshot import EventContext
+from synapse.metrics import LaterGauge
+from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.types import RoomStreamToken
+
+if TYPE_CHECKING:
+    from synapse.server import HomeServer
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundPushActionsProcessor:
+    """Calculates push actions for events after they have been persisted.
+
+    When `push.calculate_actions_in_background` is enabled, push rules are not
+    evaluated for non-state events before they are persisted. Instead, each pusher
+    instance follows the events stream, calculating the push actions for the
+    users it handles, and keeps track of how far it has got in the DB so that it
+    can catch up after a restart.
+
+    Pushers must not look for push actions beyond `position`, as they may not
+    have been calculated yet.
+    """
+
+    # The maximum number of events to calculate push actions for at once.
+    BATCH_SIZE = 100
+
+    def __init__(
+        self, hs: "HomeServer", on_processed: Callable[[RoomStreamToken], None]
+    ):
+        """
+        Args:
+            hs: The homeserver.
+            on_processed: Called with the new position whenever push actions
+                have been calculated for more events.
+        """
+        self._store = hs.get_datastores().main
+        self._storage_controllers = hs.get_storage_controllers()
+        self._bulk_push_rule_evaluator = hs.get_bulk_push_rule_evaluator()
+        self._on_processed = on_processed
+
+        self._instance_name = hs.get_instance_name()
+        self._pusher_shard_config = hs.config.worker.pusher_shard_config
+
+        # The (inclusive) stream ordering up to which we've calculated push
+        # actions. None until we've started.
+        self._position: Optional[int] = None
+
+        # Whether we're currently calculating push actions.
+        self._is_processing = False
+
+        LaterGauge(
+            "synapse_push_background_actions_lag",
+            "The number of stream orderings that push actions are yet to be "
+            "calculated for",
+            [],
+            lambda: (
+                self._store.get_room_max_stream_ordering() - self._position
+                if self._position is not None
+                else 0
+            ),
+        )
+
+    @property
+    def position(self) -> Optional[int]:
+        """The (inclusive) stream ordering up to which push actions have been
+        calculated, or None if we haven't started yet."""
+        return self._position
+
+    async def start(self) -> None:
+        """Load our position from the DB, and catch up on any events we've missed.
+
+        If we've never calculated push actions in the background before, we start
+        from the current position of the events stream.
+        """
+        position = await self._store.get_background_push_actions_position()
+        if position is None:
+            position = self._store.get_room_max_stream_ordering()
+            await self._store.add_background_push_actions([], position)
+
+        self._position = position
+        self.notify_new_events()
+
+    def notify_new_events(self) -> None:
+        """Called when new events have been persisted."""
+        if self._position is None or self._is_processing:
+            return
+
+        self._is_processing = True
+        run_as_background_process("background_push_actions", self._process)
+
+    async def _process(self) -> None:
+        try:
+            await self._unsafe_process()
+        finally:
+            self._is_processing = False
+
+    async def _unsafe_process(self) -> None:
+        assert self._position is not None
+
+        while True:
+            max_stream_ordering = self._store.get_room_max_stream_ordering()
+            if self._position >= max_stream_ordering:
+                return
+
+            rows = await self._store.get_events_for_background_push_actions(
+                self._position, max_stream_ordering, self.BATCH_SIZE
+            )
+            if len(rows) >= self.BATCH_SIZE:
+                upto_stream_ordering = rows[-1][0]
+            else:
+                upto_stream_ordering = max_stream_ordering
+
+            push_actions = await self._calculate_push_actions(
+                [event_id for _, event_id in rows]
+            )
+            await self._store.add_background_push_actions(
+                push_actions, upto_stream_ordering
+            )
+
+            self._position = upto_stream_ordering
+            self._on_processed(RoomStreamToken(stream=upto_stream_ordering))
+
+    async def _calculate_push_actions(
+        self, event_ids: Collection[str]
+    ) -> List[Tuple[EventBase, Dict[str, Collection[Union[Mapping, str]]], bool, str]]:
+        """Calculate the push actions for the given persisted events, for the
+        users we handle."""
+        if not event_ids:
+            return []
+
+        # Rejected events are not returned, as we don't push for them.
+        events = await self._store.get_events_as_list(event_ids)
+        # We don't wait for full state, as that could hold up push for all rooms.
+        # This matches what happens when calculating push actions before
+        # persisting events in rooms with partial state.
+        state_groups = await self._storage_controllers.state.get_state_group_for_events(
+            [event.event_id for event in events], await_full_state=False
+        )
+
+        push_actions = []
+        for event in events:
+            # These are all non-state events, so the state before the event is the
+            # same as the state after it.
+            state_group = state_groups[event.event_id]
+            context = EventContext.with_state(
+                storage=self._storage_controllers,
+                state_group=state_group,
+                state_group_before_event=state_group,
+                state_delta_due_to_event={},
+                partial_state=False,
+                state_group_deltas={},
+            )
+
+            result = (
+                await self._bulk_push_rule_evaluator.action_for_persisted_event_by_user(
+                    event, context, self._should_handle_user
+                )
+            )
+            if result is not None:
+                actions_by_user, count_as_unread, thread_id = result
+                push_actions.append(
+                    (event, actions_by_user, count_as_unread, thread_id)
+                )
+
+        return push_actions
+
+    def _should_handle_user(self, user_id: str) -> bool:
+        return self._pusher_shard_config.should_handle(self._instance_name, user_id)
@@ -23,6 +23,7 @@ import logging
 from typing import (
     TYPE_CHECKING,
     Any,
+    Callable,
     Collection,
     Dict,
     List,
@@ -54,7 +55,7 @@ from synapse.state import POWER_KEY
 from synapse.storage.databases.main.roommember import EventIdMembership
 from synapse.storage.roommember import ProfileInfo
 from synapse.synapse_rust.push import FilteredPushRules, PushRuleEvaluator
-from synapse.types import JsonValue
+from synapse.types import JsonValue, get_localpart_from_id
 from synapse.types.state import StateFilter
 from synapse.util import unwrapFirstError
 from synapse.util.async_helpers import gather_results
@@ -120,6 +121,76 @@ def _should_count_as_unread(event: EventBase, context: EventContext) -> bool:
     return False
 
 
+class _SharedRuleSetEvaluator:
+    """Wraps a `PushRuleEvaluator` for an event to avoid re-evaluating the same
+    push rules for many users.
+
+    The outcome of a set of push rules only depends on the user it is evaluated
+    for through conditions which match against their user ID, localpart or display
+    name. If none of those appear anywhere in the event, no such condition can
+    match, so the outcome is the same as evaluating the rules for no user at all.
+    In that case the result is shared between all users with the same
+    `FilteredPushRules` object (which the store shares between users with
+    identical rules), so each distinct set of rules is evaluated at most once.
+    """
+
+    def __init__(
+        self,
+        evaluator: PushRuleEvaluator,
+        flattened_event: Mapping[str, JsonValue],
+        related_events: Mapping[str, Mapping[str, JsonValue]],
+    ):
+        self._evaluator = evaluator
+
+        # All the strings in the event (and related events), case-folded, which
+        # we search for any mention of a user.
+        strings: List[str] = []
+        for flattened in (flattened_event, *related_events.values()):
+            for value in flattened.values():
+                if isinstance(value, str):
+                    strings.append(value)
+                elif isinstance(value, list):
+                    strings.extend(v for v in value if isinstance(v, str))
+        self._haystack = "\n".join(strings).casefold()
+
+        # Map from the `id` of a `FilteredPushRules` to the outcome of evaluating
+        # it without a user.
+        self._results_by_rules: Dict[int, Collection[Union[Mapping, str]]] = {}
+
+        # The number of times the underlying evaluator has been run.
+        self.evaluations = 0
+
+    def _may_mention(self, user_id: str, display_name: Optional[str]) -> bool:
+        """Whether any user-specific condition could match the given user."""
+        haystack = self._haystack
+        if user_id.casefold() in haystack:
+            return True
+        if get_localpart_from_id(user_id).casefold() in haystack:
+            return True
+        if display_name:
+            # Display names are matched as globs, so any glob characters could
+            # cause them to match anything.
+            if any(c in display_name for c in "*?["):
+                return True
+            if display_name.casefold() in haystack:
+                return True
+        return False
+
+    def run(
+        self, rules: FilteredPushRules, user_id: str, display_name: Optional[str]
+    ) -> Collection[Union[Mapping, str]]:
+        if self._may_mention(user_id, display_name):
+            self.evaluations += 1
+            return self._evaluator.run(rules, user_id, display_name)
+
+        actions = self._results_by_rules.get(id(rules))
+        if actions is None:
+            self.evaluations += 1
+            actions = self._evaluator.run(rules, None, None)
+            self._results_by_rules[id(rules)] = actions
+        return actions
+
+
 class BulkPushRuleEvaluator:
     """Calculates the outcome of push rules for an event for all users in the
     room at once.
@@ -131,6 +202,9 @@ class BulkPushRuleEvaluator:
         self.clock = hs.get_clock()
         self._event_auth_handler = hs.get_event_auth_handler()
         self.should_calculate_push_rules = self.hs.config.push.enable_push
+        self._push_actions_in_background = (
+            self.hs.config.push.push_actions_in_background
+        )
 
         self._related_event_match_enabled = self.hs.config.experimental.msc3664_enabled
 
@@ -144,12 +218,18 @@ class BulkPushRuleEvaluator:
     async def _get_rules_for_event(
         self,
         event: EventBase,
+        should_handle_user: Optional[Callable[[str], bool]] = None,
     ) -> Mapping[str, FilteredPushRules]:
         """Get the push rules for all users who may need to be notified about
         the event.
 
         Note: this does not check if the user is allowed to see the event.
 
+        Args:
+            event: The event to get push rules for.
+            should_handle_user: If given, only users for which this returns True
+                are considered.
+
         Returns:
             Mapping of user ID to their push rules.
         """
@@ -196,6 +276,9 @@ class BulkPushRuleEvaluator:
             if invited and self.hs.is_mine_id(invited) and invited not in local_users:
                 local_users.append(invited)
 
+        if should_handle_user is not None:
+            local_users = [u for u in local_users if should_handle_user(u)]
+
         if not local_users:
             return {}
 
@@ -316,6 +399,10 @@ class BulkPushRuleEvaluator:
         """Given a list of events and their associated contexts, evaluate the push rules
         for each event, check if the message should increment the unread count, and
         insert the results into the event_push_actions_staging table.
+
+        If push actions are calculated in the background, non-state events are
+        skipped: their push actions are calculated by the
+        `BackgroundPushActionsProcessor` once they have been persisted.
         """
         if not self.should_calculate_push_rules:
             return
@@ -324,8 +411,35 @@ class BulkPushRuleEvaluator:
         # database we can check in the batch.
         event_id_to_event = {e.event_id: e for e, _ in events_and_context}
         for event, context in events_and_context:
+            if self._push_actions_in_background and not event.is_state():
+                continue
             await self._action_for_event_by_user(event, context, event_id_to_event)
 
+    async def action_for_persisted_event_by_user(
+        self,
+        event: EventBase,
+        context: EventContext,
+        should_handle_user: Callable[[str], bool],
+    ) -> Optional[Tuple[Dict[str, Collection[Union[Mapping, str]]], bool, str]]:
+        """Evaluate the push rules for an event which has already been persisted.
+
+        Args:
+            event: The persisted event.
+            context: The context of the persisted event.
+            should_handle_user: Only users for which this returns True have their
+                push rules evaluated.
+
+        Returns:
+            None if no users should have push actions for the event. Otherwise, a
+            mapping of user ID to their push actions, whether the event should
+            increment unread counts, and the thread the event is in.
+        """
+        if not self.should_calculate_push_rules:
+            return None
+        return await self._calculate_actions_for_event(
+            event, context, {}, should_handle_user
+        )
+
     @measure_func("action_for_event_by_user")
     async def _action_for_event_by_user(
         self,
@@ -333,6 +447,31 @@ class BulkPushRuleEvaluator:
         context: EventContext,
         event_id_to_event: Mapping[str, EventBase],
     ) -> None:
+        result = await self._calculate_actions_for_event(
+            event, context, event_id_to_event
+        )
+        if result is None:
+            return
+
+        actions_by_user, count_as_unread, thread_id = result
+
+        # Mark in the DB staging area the push actions for users who should be
+        # notified for this event. (This will then get handled when we persist
+        # the event)
+        await self.store.add_push_actions_to_staging(
+            event.event_id,
+            actions_by_user,
+            count_as_unread,
+            thread_id,
+        )
+
+    async def _calculate_actions_for_event(
+        self,
+        event: EventBase,
+        context: EventContext,
+        event_id_to_event: Mapping[str, EventBase],
+        should_handle_user: Optional[Callable[[str], bool]] = None,
+    ) -> Optional[Tuple[Dict[str, Collection[Union[Mapping, str]]], bool, str]]:
         if (
             not event.internal_metadata.is_notifiable()
             or event.room_id in self.hs.config.server.rooms_to_exclude_from_sync
@@ -343,7 +482,7 @@ class BulkPushRuleEvaluator:
             # The historical messages also do not have the proper `context.current_state_ids`
             # and `state_groups` because they have `prev_events` that aren't persisted yet
             # (historical messages persisted in reverse-chronological order).
-            return
+            return None
 
         # Disable counting as unread unless the experimental configuration is
         # enabled, as it can cause additional (unwanted) rows to be added to the
@@ -352,7 +491,7 @@ class BulkPushRuleEvaluator:
         if self.hs.config.experimental.msc2654_enabled:
             count_as_unread = _should_count_as_unread(event, context)
 
-        rules_by_user = await self._get_rules_for_event(event)
+        rules_by_user = await self._get_rules_for_event(event, should_handle_user)
         actions_by_user: Dict[str, Collection[Union[Mapping, str]]] = {}
 
         # Gather a bunch of info in parallel.
@@ -426,8 +565,9 @@ class BulkPushRuleEvaluator:
         # Pull out any user and room mentions.
         has_mentions = EventContentFields.MENTIONS in event.content
 
+        flattened_event = _flatten_dict(event)
         evaluator = PushRuleEvaluator(
-            _flatten_dict(event),
+            flattened_event,
             has_mentions,
             room_member_count,
             sender_power_level,
@@ -438,6 +578,9 @@ class BulkPushRuleEvaluator:
             self.hs.config.experimental.msc1767_enabled,  # MSC3931 flag
             self.hs.config.experimental.msc4210_enabled,
         )
+        shared_evaluator = _SharedRuleSetEvaluator(
+            evaluator, flattened_event, related_events
+        )
 
         for uid, rules in rules_by_user.items():
             if event.sender == uid:
@@ -463,7 +606,7 @@ class BulkPushRuleEvaluator:
                 # current user, it'll be added to the dict later.
                 actions_by_user[uid] = []
 
-            actions = evaluator.run(rules, uid, display_name)
+            actions = shared_evaluator.run(rules, uid, display_name)
             if "notify" in actions:
                 # Push rules say we should notify the user of this event
                 actions_by_user[uid] = actions
@@ -471,7 +614,7 @@ class BulkPushRuleEvaluator:
         # If there aren't any actions then we can skip the rest of the
         # processing.
         if not actions_by_user:
-            return
+            return None
 
         # This is a check for the case where user joins a room without being
         # allowed to see history, and then the server receives a delayed event
@@ -488,15 +631,7 @@ class BulkPushRuleEvaluator:
         for user_id in set(actions_by_user).difference(uids_with_visibility):
             actions_by_user.pop(user_id, None)
 
-        # Mark in the DB staging area the push actions for users who should be
-        # notified for this event. (This will then get handled when we persist
-        # the event)
-        await self.store.add_push_actions_to_staging(
-            event.event_id,
-            actions_by_user,
-            count_as_unread,
-            thread_id,
-        )
+        return actions_by_user, count_as_unread, thread_id
 
 
 MemberMap = Dict[str, Optional[EventIdMembership]]
@@ -0,0 +1,206 @@
+#
+# This file is licensed under the Affero General Public License (AGPL) version 3.
+#
+# Copyright (C) 2024 New Vector, Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# See the GNU Affero General Public License for more details:
+# <https://www.gnu.org/licenses/agpl-3.0.html>.
+#
+
+"""Sends notifications to push gateways on behalf of HTTP pushers.
+
+A busy room can cause notifications for thousands of pushers to be sent at once,
+most of them to the same handful of push gateways. Rather than each pusher
+making its own request, they all go through a shared `PushGatewayDispatcher`,
+which:
+
+  * limits the number of requests in flight to each gateway, so that requests
+    reuse the idle connections kept in the HTTP client's connection pool rather
+    than opening (and then closing) a new connection each;
+  * batches together identical notifications for the same user (i.e. the same
+    notification being sent to each of a user's devices) into a single request
+    listing all of the devices, as allowed by the push gateway API.
+
+Notifications for different users are never batched together, even if their
+content is identical: if a request fails, the pushers of every device in it
+retry, and devices that the gateway had already notified would otherwise get a
+duplicate notification on behalf of an unrelated user.
+"""
+
+import logging
+import urllib.parse
+from typing import TYPE_CHECKING, Dict, List, Mapping, Tuple, Union
+
+from prometheus_client import Counter, Histogram
+
+from twisted.internet import defer
+
+from synapse.logging.context import PreserveLoggingContext, make_deferred_yieldable
+from synapse.metrics import LaterGauge
+from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.types import JsonDict, JsonMapping
+from synapse.util import json_encoder
+from synapse.util.async_helpers import Linearizer
+
+if TYPE_CHECKING:
+    from synapse.server import HomeServer
+
+logger = logging.getLogger(__name__)
+
+gateway_requests_counter = Counter(
+    "synapse_http_httppusher_gateway_requests",
+    "Number of requests made to each push gateway",
+    ["gateway"],
+)
+
+gateway_failed_requests_counter = Counter(
+    "synapse_http_httppusher_gateway_requests_failed",
+    "Number of requests to each push gateway which failed",
+    ["gateway"],
+)
+
+gateway_devices_counter = Counter(
+    "synapse_http_httppusher_gateway_devices",
+    "Number of devices notified via each push gateway",
+    ["gateway"],
+)
+
+gateway_request_time = Histogram(
+    "synapse_http_httppusher_gateway_request_time_seconds",
+    "Time taken by requests to each push gateway, including waiting for a free "
+    "connection",
+    ["gateway"],
+)
+
+gateway_batch_size = Histogram(
+    "synapse_http_httppusher_gateway_batch_size",
+    "Number of devices included in each request to a push gateway",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, "+Inf"),
+)
+
+
+class PushGatewayDispatcher:
+    """Sends notifications to push gateways, sharing connections and batching
+    identical notifications between pushers.
+    """
+
+    def __init__(self, hs: "HomeServer"):
+        self._clock = hs.get_clock()
+        self._http_client = hs.get_proxied_blocklisted_http_client()
+        self._batch_delay = hs.config.push.gateway_batch_delay_ms / 1000
+
+        # Limits the number of concurrent requests to each gateway URL.
+        self._gateway_limiter = Linearizer(
+            name="push_gateway_requests",
+            max_count=hs.config.push.max_concurrent_gateway_requests,
+            clock=self._clock,
+        )
+
+        # The devices waiting to be sent a notification, and the deferreds to
+        # resolve with the result, by gateway URL, user ID and notification
+        # content. A batch stops accepting new devices once it is being sent.
+        self._pending_batches: Dict[
+            Tuple[str, str, str],
+            List[Tuple[JsonMapping, "defer.Deferred[List[str]]"]],
+        ] = {}
+
+        LaterGauge(
+            "synapse_http_httppusher_gateway_queued_devices",
+            "Number of devices waiting to be sent a notification via each push "
+            "gateway",
+            ["gateway"],
+            self._get_queued_devices_by_gateway,
+        )
+
+    def _get_queued_devices_by_gateway(self) -> Mapping[Tuple[str, ...], int]:
+        counts: Dict[Tuple[str, ...], int] = {}
+        for (url, _, _), batch in self._pending_batches.items():
+            gateway = (urllib.parse.urlparse(url).netloc,)
+            counts[gateway] = counts.get(gateway, 0) + len(batch)
+        return counts
+
+    async def send_notification(
+        self, url: str, user_id: str, notification: JsonMapping, device: JsonMapping
+    ) -> Union[bool, List[str]]:
+        """Send a notification to a device via a push gateway.
+
+        Args:
+            url: The URL of the push gateway's notify endpoint.
+            user_id: The user the device belongs to.
+            notification: The `notification` to send, without the `devices`.
+            device: The device to send the notification to.
+
+        Returns:
+            False if an error occurred when calling the push gateway, otherwise
+            a list of rejected push keys (which will either be empty or contain
+            the push key of the given device).
+        """
+        key = (url, user_id, json_encoder.encode(notification))
+
+        d: "defer.Deferred[List[str]]" = defer.Deferred()
+        batch = self._pending_batches.get(key)
+        if batch is None:
+            batch = self._pending_batches[key] = []
+            run_as_background_process(
+                "push_gateway_send", self._send_batch, key, notification
+            )
+        batch.append((device, d))
+
+        try:
+            rejected = await make_deferred_yieldable(d)
+        except Exception as e:
+            logger.warning(
+                "Failed to push data to %s for pushkey %s: %s %s",
+                url,
+                device.get("pushkey"),
+                type(e),
+                e,
+            )
+            return False
+
+        # The gateway may have rejected the push keys of the user's other devices
+        # in the batch, which their pushers will handle.
+        return [pushkey for pushkey in rejected if pushkey == device.get("pushkey")]
+
+    async def _send_batch(
+        self, key: Tuple[str, str, str], notification: JsonMapping
+    ) -> None:
+        """Send a notification to all the devices that are batched up under the
+        given key, once there is a free connection to the gateway."""
+        url, _, _ = key
+        gateway = urllib.parse.urlparse(url).netloc
+
+        # Wait for any other devices that are being sent this notification.
+        await self._clock.sleep(self._batch_delay)
+
+        with gateway_request_time.labels(gateway).time():
+            async with self._gateway_limiter.queue(url):
+                batch = self._pending_batches.pop(key)
+
+                content: JsonDict = dict(notification)
+                content["devices"] = [device for device, _ in batch]
+                gateway_batch_size.observe(len(batch))
+                gateway_requests_counter.labels(gateway).inc()
+
+                try:
+                    resp = await self._http_client.post_json_get_json(
+                        url, {"notification": content}
+                    )
+                except Exception as e:
+                    gateway_failed_requests_counter.labels(gateway).inc()
+                    with PreserveLoggingContext():
+                        for _, d in batch:
+                            d.errback(e)
+                    return
+
+        gateway_devices_counter.labels(gateway).inc(len(batch))
+
+        rejected = resp.get("rejected", []) if isinstance(resp, dict) else []
+        with PreserveLoggingContext():
+            for _, d in batch:
+                d.callback(rejected)
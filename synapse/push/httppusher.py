@@ -149,7 +149,7 @@ class HttpPusher(Pusher):
             )
 
         self.url = url
-        self.http_client = hs.get_proxied_blocklisted_http_client()
+        self._gateway_dispatcher = hs.get_push_gateway_dispatcher()
         self.data_minus_url = {}
         self.data_minus_url.update(self.data)
         del self.data_minus_url["url"]
@@ -391,8 +391,6 @@ class HttpPusher(Pusher):
             rejected push keys otherwise. If this array is empty, the push fully
             succeeded.
         """
-        content = content.copy()
-
         data = self.data_minus_url.copy()
         if default_payload:
             data.setdefault("default_payload", {}).update(default_payload)
@@ -406,24 +404,9 @@ class HttpPusher(Pusher):
         if tweaks:
             device["tweaks"] = tweaks
 
-        content["devices"] = [device]
-
-        try:
-            resp = await self.http_client.post_json_get_json(
-                self.url, {"notification": content}
-            )
-        except Exception as e:
-            logger.warning(
-                "Failed to push data to %s: %s %s",
-                self.name,
-                type(e),
-                e,
-            )
-            return False
-        rejected = []
-        if "rejected" in resp:
-            rejected = resp["rejected"]
-        return rejected
+        return await self._gateway_dispatcher.send_notification(
+            self.url, self.user_id, content, device
+        )
 
     async def dispatch_push_event(
         self,
@@ -510,27 +493,22 @@ class HttpPusher(Pusher):
             badge: number of unread messages
         """
         logger.debug("Sending updated badge count %d to %s", badge, self.name)
-        d = {
-            "notification": {
-                "id": "",
-                "type": None,
-                "sender": "",
-                "counts": {"unread": badge},
-                "devices": [
-                    {
-                        "app_id": self.app_id,
-                        "pushkey": self.pushkey,
-                        "pushkey_ts": int(self.pushkey_ts / 1000),
-                        "data": self.data_minus_url,
-                    }
-                ],
-            }
+        notification = {
+            "id": "",
+            "type": None,
+            "sender": "",
+            "counts": {"unread": badge},
         }
-        try:
-            await self.http_client.post_json_get_json(self.url, d)
-            http_badges_processed_counter.inc()
-        except Exception as e:
-            logger.warning(
-                "Failed to send badge count to %s: %s %s", self.name, type(e), e
-            )
+        device = {
+            "app_id": self.app_id,
+            "pushkey": self.pushkey,
+            "pushkey_ts": int(self.pushkey_ts / 1000),
+            "data": self.data_minus_url,
+        }
+        res = await self._gateway_dispatcher.send_notification(
+            self.url, self.user_id, notification, device
+        )
+        if res is False:
             http_badges_failed_counter.inc()
+        else:
+            http_badges_processed_counter.inc()
@@ -30,6 +30,7 @@ from synapse.metrics.background_process_metrics import (
     wrap_as_background_process,
 )
 from synapse.push import Pusher, PusherConfig, PusherConfigException
+from synapse.push.background_actions import BackgroundPushActionsProcessor
 from synapse.push.pusher import PusherFactory
 from synapse.replication.http.push import ReplicationRemovePusherRestServlet
 from synapse.types import JsonDict, RoomStreamToken, StrCollection
@@ -92,6 +93,14 @@ class PusherPool:
         # map from user id to app_id:pushkey to pusher
         self.pushers: Dict[str, Dict[str, Pusher]] = {}
 
+        # If push actions are calculated in the background, we only poke the
+        # pushers once they've been calculated.
+        self._background_push_actions: Optional[BackgroundPushActionsProcessor] = None
+        if self._should_start_pushers and hs.config.push.push_actions_in_background:
+            self._background_push_actions = BackgroundPushActionsProcessor(
+                hs, self._notify_pushers
+            )
+
         self._account_validity_handler = hs.get_account_validity_handler()
 
     def start(self) -> None:
@@ -253,7 +262,28 @@ class PusherPool:
                 )
                 await self.remove_pusher(p.app_id, p.pushkey, p.user_name)
 
+    def get_max_push_stream_ordering(self) -> int:
+        """Get the highest stream ordering that it's safe for pushers to look for
+        push actions up to."""
+        if self._background_push_actions:
+            position = self._background_push_actions.position
+            if position is not None:
+                return position
+
+            # Pushers can be added before we've loaded the position. They'll be
+            # poked once push actions have been calculated.
+        return self.store.get_room_max_stream_ordering()
+
     def on_new_notifications(self, max_token: RoomStreamToken) -> None:
+        if self._background_push_actions:
+            # The push actions for the new events may not have been calculated
+            # yet: the pushers get poked once they have been.
+            self._background_push_actions.notify_new_events()
+            return
+
+        self._notify_pushers(max_token)
+
+    def _notify_pushers(self, max_token: RoomStreamToken) -> None:
         if not self.pushers:
             # nothing to do here.
             return
@@ -363,6 +393,18 @@ class PusherPool:
 
     async def _start_pushers(self) -> None:
         """Start all the pushers"""
+        if self._background_push_actions:
+            # We need to know how far push actions have been calculated before
+            # starting the pushers.
+            await self._background_push_actions.start()
+            position = self._background_push_actions.position
+            assert position is not None
+            self._last_room_stream_id_seen = position
+        else:
+            # Push actions are being calculated before persisting, so forget how
+            # far we'd got in the background in case it gets re-enabled later.
+            await self.store.reset_background_push_actions_position()
+
         pushers = await self.store.get_enabled_pushers()
 
         # Stagger starting up the pushers so we don't completely drown the
@@ -168,6 +168,63 @@ class RdataCommand(Command):
         return "RDATA-" + self.stream_name
 
 
+class RdataBatchCommand(Command):
+    """Sent by server when a subscribed stream has a batch of updates.
+
+    This is equivalent to sending an RDATA for each of the updates, but is much
+    cheaper to send and to parse when there are many rows.
+
+    Format::
+
+        RDATA_BATCH <stream_name> <instance_name> <updates_json>
+
+    Where `<updates_json>` is a JSON list of `[<token>, <row>]` pairs, ordered by
+    token. All the rows for a given token are always sent in the same command.
+
+    Instances will only send this if `redis.batch_rdata` is enabled, which
+    should only be done once every instance understands the command.
+
+    An example::
+
+        RDATA_BATCH caches master [[8, ["get_user_by_id", ["@foo:example.com"], 1]], [9, ...]]
+    """
+
+    __slots__ = ["stream_name", "instance_name", "updates"]
+
+    NAME = "RDATA_BATCH"
+
+    def __init__(
+        self,
+        stream_name: str,
+        instance_name: str,
+        updates: List[Tuple[int, StreamRow]],
+    ):
+        self.stream_name = stream_name
+        self.instance_name = instance_name
+        self.updates = updates
+
+    @classmethod
+    def from_line(cls: Type["RdataBatchCommand"], line: str) -> "RdataBatchCommand":
+        stream_name, instance_name, updates_json = line.split(" ", 2)
+        return cls(
+            stream_name,
+            instance_name,
+            [(int(token), row) for token, row in json_decoder.decode(updates_json)],
+        )
+
+    def to_line(self) -> str:
+        return " ".join(
+            (
+                self.stream_name,
+                self.instance_name,
+                json_encoder.encode(self.updates),
+            )
+        )
+
+    def get_logcontext_id(self) -> str:
+        return "RDATA_BATCH-" + self.stream_name
+
+
 class PositionCommand(Command):
     """Sent by an instance to tell others the stream position without needing to
     send an RDATA.
@@ -508,6 +565,7 @@ class NewActiveTaskCommand(_SimpleCommand):
 _COMMANDS: Tuple[Type[Command], ...] = (
     ServerCommand,
     RdataCommand,
+    RdataBatchCommand,
     PositionCommand,
     ErrorCommand,
     PingCommand,
@@ -529,6 +587,7 @@ COMMAND_MAP = {cmd.NAME: cmd for cmd in _COMMANDS}
 VALID_SERVER_COMMANDS = (
     ServerCommand.NAME,
     RdataCommand.NAME,
+    RdataBatchCommand.NAME,
     PositionCommand.NAME,
     ErrorCommand.NAME,
     PingCommand.NAME,
@@ -36,7 +36,7 @@ from typing import (
     Union,
 )
 
-from prometheus_client import Counter
+from prometheus_client import Counter, Histogram
 
 from twisted.internet.protocol import ReconnectingClientFactory
 
@@ -49,6 +49,7 @@ from synapse.replication.tcp.commands import (
     LockReleasedCommand,
     NewActiveTaskCommand,
     PositionCommand,
+    RdataBatchCommand,
     RdataCommand,
     RemoteServerUpCommand,
     ReplicateCommand,
@@ -89,12 +90,35 @@ remove_pusher_counter = Counter("synapse_replication_tcp_resource_remove_pusher"
 
 user_ip_cache_counter = Counter("synapse_replication_tcp_resource_user_ip_cache", "")
 
+# how long inbound RDATA/POSITION commands wait in the queue before processing
+command_queue_wait_time = Histogram(
+    "synapse_replication_tcp_command_queue_wait_time_seconds",
+    "Time inbound RDATA/POSITION commands spent queued before being processed",
+    ["stream_name"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, "+Inf"),
+)
+
 
-# the type of the entries in _command_queues_by_stream
+# the type of the entries in _command_queues_by_stream: the command, the
+# connection it arrived on, and the time (in ms) it was received.
 _StreamCommandQueue = Deque[
-    Tuple[Union[RdataCommand, PositionCommand], IReplicationConnection]
+    Tuple[
+        Union[RdataCommand, RdataBatchCommand, PositionCommand],
+        IReplicationConnection,
+        int,
+    ]
 ]
 
+# The default priorities of streams for processing of inbound commands. Streams not
+# listed here have priority 0. These streams are small and latency-sensitive, so
+# shouldn't get stuck behind bulk streams such as the events stream.
+_DEFAULT_STREAM_PRIORITIES = {
+    TypingStream.NAME: 10,
+    ReceiptsStream.NAME: 10,
+    PresenceStream.NAME: 10,
+    ToDeviceStream.NAME: 10,
+}
+
 
 class ReplicationCommandHandler:
     """Handles incoming commands from replication as well as sending commands
@@ -220,11 +244,34 @@ class ReplicationCommandHandler:
         # When POSITION or RDATA commands arrive, we stick them in a queue and process
         # them in order in a separate background process.
 
-        # the streams which are currently being processed by _unsafe_process_queue
-        self._processing_streams: Set[str] = set()
+        # the streams which are currently being processed by _unsafe_process_queue,
+        # and their precedence when they were started (see
+        # `_waiting_stream_order`).
+        self._processing_streams: Dict[str, Tuple[int, int]] = {}
+
+        # the streams which have commands queued, but which are waiting for one of
+        # the other streams to finish processing before they can be processed,
+        # and when they started waiting.
+        self._waiting_streams: Dict[str, int] = {}
+
+        # the maximum number of streams to process at once, if any.
+        self._max_concurrent_streams = (
+            hs.config.worker.replication_max_concurrent_streams
+        )
 
-        # for each stream, a queue of commands that are awaiting processing, and the
-        # connection that they arrived on.
+        # the priority of each stream: when streams are waiting to be processed,
+        # the highest-priority streams are processed first.
+        self._stream_priorities = {
+            **_DEFAULT_STREAM_PRIORITIES,
+            **hs.config.worker.replication_stream_priorities,
+        }
+
+        # how long a stream can wait before it jumps ahead of higher priority
+        # streams, so that it can't be starved by them.
+        self._max_stream_wait_ms = hs.config.worker.replication_stream_max_wait_ms
+
+        # for each stream, a queue of commands that are awaiting processing, the
+        # connection that they arrived on, and when they arrived.
         self._command_queues_by_stream = {
             stream_name: _StreamCommandQueue() for stream_name in self._streams
         }
@@ -243,6 +290,18 @@ class ReplicationCommandHandler:
             },
         )
 
+        LaterGauge(
+            "synapse_replication_tcp_command_queue_lag_seconds",
+            "Age of the oldest inbound RDATA/POSITION command queued for processing",
+            ["stream_name"],
+            lambda: {
+                (stream_name,): (
+                    (self._clock.time_msec() - queue[0][2]) / 1000 if queue else 0
+                )
+                for stream_name, queue in self._command_queues_by_stream.items()
+            },
+        )
+
         self._is_master = hs.config.worker.worker_app is None
 
         self._federation_sender = None
@@ -299,7 +358,9 @@ class ReplicationCommandHandler:
             self._channels_to_subscribe_to.append(channel_name)
 
     def _add_command_to_stream_queue(
-        self, conn: IReplicationConnection, cmd: Union[RdataCommand, PositionCommand]
+        self,
+        conn: IReplicationConnection,
+        cmd: Union[RdataCommand, RdataBatchCommand, PositionCommand],
     ) -> None:
         """Queue the given received command for processing
 
@@ -312,40 +373,122 @@ class ReplicationCommandHandler:
             logger.error("Got %s for unknown stream: %s", cmd.NAME, stream_name)
             return
 
-        queue.append((cmd, conn))
+        queue.append((cmd, conn, self._clock.time_msec()))
 
-        # if we're already processing this stream, there's nothing more to do:
-        # the new entry on the queue will get picked up in due course
+        # if we're already processing this stream (or it is waiting its turn),
+        # there's nothing more to do: the new entry on the queue will get picked
+        # up in due course
         if stream_name in self._processing_streams:
             return
+        if stream_name in self._waiting_streams:
+            return
+
+        if not self._has_capacity():
+            self._waiting_streams[stream_name] = self._clock.time_msec()
+            return
+
+        self._start_processing_stream(stream_name)
+
+    def _has_capacity(self) -> bool:
+        """Whether another stream can be processed without exceeding the
+        configured concurrency limit."""
+        return (
+            self._max_concurrent_streams is None
+            or len(self._processing_streams) < self._max_concurrent_streams
+        )
+
+    def _start_processing_stream(
+        self, stream_name: str, order: Optional[Tuple[int, int]] = None
+    ) -> None:
+        """Fire off a background process to process the queue for the given stream.
 
-        # fire off a background process to start processing the queue.
+        Args:
+            stream_name
+            order: the precedence of the stream, if it was waiting. Defaults to
+                its priority.
+        """
+        assert stream_name not in self._processing_streams
+
+        self._waiting_streams.pop(stream_name, None)
+        self._processing_streams[stream_name] = order or (
+            0,
+            self._stream_priorities.get(stream_name, 0),
+        )
         run_as_background_process(
             "process-replication-data", self._unsafe_process_queue, stream_name
         )
 
-    async def _unsafe_process_queue(self, stream_name: str) -> None:
-        """Processes the command queue for the given stream, until it is empty
+    def _waiting_stream_order(self, stream_name: str, now: int) -> Tuple[int, int]:
+        """The key to order waiting streams by, in ascending order of precedence.
 
-        Does not check if there is already a thread processing the queue, hence "unsafe"
+        Streams are ordered by priority, except that streams which have waited
+        longer than the maximum wait come first, longest waiting first.
         """
-        assert stream_name not in self._processing_streams
+        waited = now - self._waiting_streams[stream_name]
+        if waited >= self._max_stream_wait_ms:
+            return (1, waited)
+        return (0, self._stream_priorities.get(stream_name, 0))
+
+    def _start_waiting_streams(self) -> None:
+        """Start processing waiting streams, highest precedence first, until we
+        run out of capacity."""
+        now = self._clock.time_msec()
+        while self._waiting_streams and self._has_capacity():
+            stream_name = max(
+                self._waiting_streams,
+                key=lambda s: self._waiting_stream_order(s, now),
+            )
+            self._start_processing_stream(
+                stream_name, self._waiting_stream_order(stream_name, now)
+            )
 
-        self._processing_streams.add(stream_name)
+    def _should_yield(self, stream_name: str) -> bool:
+        """Whether the processing of the given stream should pause to let a
+        waiting stream run, because it has a higher precedence.
+
+        A stream which was started because it had waited too long keeps that
+        precedence while it runs, so that it isn't immediately interrupted by
+        higher priority streams again.
+        """
+        if not self._waiting_streams:
+            return False
+
+        now = self._clock.time_msec()
+        order = self._processing_streams[stream_name]
+        return any(
+            self._waiting_stream_order(s, now) > order for s in self._waiting_streams
+        )
+
+    async def _unsafe_process_queue(self, stream_name: str) -> None:
+        """Processes the command queue for the given stream, until it is empty, or
+        until a waiting stream with a higher priority needs to run.
+
+        Must only be called via `_start_processing_stream`: does not check if there
+        is already a thread processing the queue, hence "unsafe"
+        """
+        queue = self._command_queues_by_stream[stream_name]
         try:
-            queue = self._command_queues_by_stream.get(stream_name)
             while queue:
-                cmd, conn = queue.popleft()
+                if self._should_yield(stream_name):
+                    # Give up our slot, and go back to waiting our turn.
+                    self._waiting_streams[stream_name] = self._clock.time_msec()
+                    break
+
+                cmd, conn, received_ts = queue.popleft()
+                command_queue_wait_time.labels(stream_name).observe(
+                    (self._clock.time_msec() - received_ts) / 1000
+                )
                 try:
                     await self._process_command(cmd, conn, stream_name)
                 except Exception:
                     logger.exception("Failed to handle command %s", cmd)
         finally:
-            self._processing_streams.discard(stream_name)
+            self._processing_streams.pop(stream_name, None)
+            self._start_waiting_streams()
 
     async def _process_command(
         self,
-        cmd: Union[PositionCommand, RdataCommand],
+        cmd: Union[PositionCommand, RdataCommand, RdataBatchCommand],
         conn: IReplicationConnection,
         stream_name: str,
     ) -> None:
@@ -353,6 +496,8 @@ class ReplicationCommandHandler:
             await self._process_position(stream_name, conn, cmd)
         elif isinstance(cmd, RdataCommand):
             await self._process_rdata(stream_name, conn, cmd)
+        elif isinstance(cmd, RdataBatchCommand):
+            await self._process_rdata_batch(stream_name, conn, cmd)
         else:
             # This shouldn't be possible
             raise Exception("Unrecognised command %s in stream queue", cmd.NAME)
@@ -558,24 +703,81 @@ class ReplicationCommandHandler:
         rows = self._pending_batches.pop(stream_name, [])
         rows.append(row)
 
+        await self._process_rows(stream_name, cmd.instance_name, cmd.token, rows)
+
+    def on_RDATA_BATCH(
+        self, conn: IReplicationConnection, cmd: RdataBatchCommand
+    ) -> None:
+        if cmd.instance_name == self._instance_name:
+            # Ignore RDATA_BATCH that are just our own echoes
+            return
+
+        stream_name = cmd.stream_name
+        inbound_rdata_count.labels(stream_name).inc(len(cmd.updates))
+
+        # As with RDATA, we queue the command so that it gets processed in order
+        # with other updates and POSITIONs for the stream.
+        self._add_command_to_stream_queue(conn, cmd)
+
+    async def _process_rdata_batch(
+        self, stream_name: str, conn: IReplicationConnection, cmd: RdataBatchCommand
+    ) -> None:
+        """Process an RDATA_BATCH command
+
+        Called after the command has been popped off the queue of inbound commands
+        """
+        parse_row = STREAMS_MAP[stream_name].parse_row
+        try:
+            updates = [(token, parse_row(row)) for token, row in cmd.updates]
+        except Exception as e:
+            raise Exception(
+                "Failed to parse RDATA_BATCH: %r %r" % (stream_name, cmd.updates)
+            ) from e
+
+        # As with RDATA, drop the rows until we've processed a POSITION for this
+        # stream on this connection.
+        sbc = self._streams_by_connection.get(conn)
+        if not sbc or stream_name not in sbc:
+            logger.debug(
+                "Discarding RDATA_BATCH for unconnected stream %s", stream_name
+            )
+            return
+
+        # Hand the rows on in groups which share a token, which is what we'd
+        # have done had they been sent as individual RDATA commands.
+        rows = self._pending_batches.pop(stream_name, [])
+        for i, (token, row) in enumerate(updates):
+            rows.append(row)
+            if i + 1 < len(updates) and updates[i + 1][0] == token:
+                continue
+
+            await self._process_rows(stream_name, cmd.instance_name, token, rows)
+            rows = []
+
+    async def _process_rows(
+        self, stream_name: str, instance_name: str, token: int, rows: list
+    ) -> None:
+        """Hand a complete batch of rows for the given token to `on_rdata`, unless
+        we've already seen them.
+        """
         stream = self._streams[stream_name]
 
         # Find where we previously streamed up to.
-        current_token = stream.current_token(cmd.instance_name)
+        current_token = stream.current_token(instance_name)
 
         # Discard this data if this token is earlier than the current
         # position. Note that streams can be reset (in which case you
         # expect an earlier token), but that must be preceded by a
         # POSITION command.
-        if cmd.token <= current_token:
+        if token <= current_token:
             logger.debug(
                 "Discarding RDATA from stream %s at position %s before previous position %s",
                 stream_name,
-                cmd.token,
+                token,
                 current_token,
             )
         else:
-            await self.on_rdata(stream_name, cmd.instance_name, cmd.token, rows)
+            await self.on_rdata(stream_name, instance_name, token, rows)
 
     async def on_rdata(
         self, stream_name: str, instance_name: str, token: int, rows: list
@@ -840,6 +1042,14 @@ class ReplicationCommandHandler:
         """
         self.send_command(RdataCommand(stream_name, self._instance_name, token, data))
 
+    def stream_updates(self, stream_name: str, updates: List[Tuple[int, Any]]) -> None:
+        """Called when a batch of new updates is available to stream to Redis
+        subscribers, as a single `RDATA_BATCH`.
+
+        All the rows for a given token must be included in the same call.
+        """
+        self.send_command(RdataBatchCommand(stream_name, self._instance_name, updates))
+
     def on_lock_released(
         self, instance_name: str, lock_name: str, lock_key: str
     ) -> None:
@@ -45,6 +45,9 @@ stream_updates_counter = Counter(
 
 logger = logging.getLogger(__name__)
 
+# The number of rows to try and send in each RDATA_BATCH command.
+_RDATA_BATCH_SIZE = 500
+
 
 class ReplicationStreamProtocolFactory(ServerFactory):
     """Factory for new replication connections."""
@@ -84,6 +87,7 @@ class ReplicationStreamer:
         self._instance_name = hs.get_instance_name()
 
         self._replication_torture_level = hs.config.server.replication_torture_level
+        self._batch_rdata = hs.config.redis.redis_batch_rdata
 
         self.notifier.add_replication_callback(self.on_notifier_poke)
 
@@ -266,20 +270,31 @@ class ReplicationStreamer:
                             )
                             continue
 
-                        # Some streams return multiple rows with the same stream IDs,
-                        # we need to make sure they get sent out in batches. We do
-                        # this by setting the current token to all but the last of
-                        # a series of updates with the same token to have a None
-                        # token. See RdataCommand for more details.
-                        batched_updates = _batch_updates(updates)
-
-                        for token, row in batched_updates:
-                            try:
-                                self.command_handler.stream_update(
-                                    stream.NAME, token, row
-                                )
-                            except Exception:
-                                logger.exception("Failed to replicate")
+                        if self._batch_rdata:
+                            # Send the updates as a few large RDATA_BATCH commands,
+                            # rather than a command per row.
+                            for chunk in _chunk_updates(updates, _RDATA_BATCH_SIZE):
+                                try:
+                                    self.command_handler.stream_updates(
+                                        stream.NAME, chunk
+                                    )
+                                except Exception:
+                                    logger.exception("Failed to replicate")
+                        else:
+                            # Some streams return multiple rows with the same stream
+                            # IDs, we need to make sure they get sent out in batches.
+                            # We do this by setting the current token to all but the
+                            # last of a series of updates with the same token to have
+                            # a None token. See RdataCommand for more details.
+                            batched_updates = _batch_updates(updates)
+
+                            for token, row in batched_updates:
+                                try:
+                                    self.command_handler.stream_update(
+                                        stream.NAME, token, row
+                                    )
+                                except Exception:
+                                    logger.exception("Failed to replicate")
 
                         # The last token we send may not match the current
                         # token, in which case we want to send out a `POSITION`
@@ -332,3 +347,34 @@ def _batch_updates(
 
     new_updates.append(updates[-1])
     return new_updates
+
+
+def _chunk_updates(
+    updates: List[Tuple[Token, StreamRow]], chunk_size: int
+) -> List[List[Tuple[Token, StreamRow]]]:
+    """Splits a list of updates of form [(token, row)] into chunks of roughly
+    `chunk_size` updates, without splitting up updates which share a token. This
+    is used to implement RDATA_BATCH.
+
+    For example, with a chunk size of 2:
+
+        [(1, _), (1, _), (1, _), (2, _), (3, _)]
+
+    becomes:
+
+        [[(1, _), (1, _), (1, _)], [(2, _), (3, _)]]
+    """
+    chunks: List[List[Tuple[Token, StreamRow]]] = []
+    chunk: List[Tuple[Token, StreamRow]] = []
+    for i, update in enumerate(updates):
+        chunk.append(update)
+        if len(chunk) >= chunk_size and (
+            i + 1 == len(updates) or updates[i + 1][0] != update[0]
+        ):
+            chunks.append(chunk)
+            chunk = []
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
@@ -258,6 +258,34 @@ class PurgeMediaCacheRestServlet(RestServlet):
         return HTTPStatus.OK, ret
 
 
+class PurgeMediaStatusRestServlet(RestServlet):
+    """Get the progress of the most recent purges of old local and remote media
+    on this media repository.
+    """
+
+    PATTERNS = admin_patterns("/purge_media_cache/status$")
+
+    def __init__(self, hs: "HomeServer"):
+        self.media_repository = hs.get_media_repository()
+        self.auth = hs.get_auth()
+
+    async def on_GET(self, request: SynapseRequest) -> Tuple[int, JsonDict]:
+        await assert_requester_is_admin(self.auth, request)
+
+        ret: JsonDict = {}
+        for media_type in ("local", "remote"):
+            progress = self.media_repository.purge_progress.get(media_type)
+            if progress is None:
+                ret[media_type] = None
+            else:
+                ret[media_type] = {
+                    "running": progress.finished_ts is None,
+                    **attr.asdict(progress),
+                }
+
+        return HTTPStatus.OK, ret
+
+
 class DeleteMediaByID(RestServlet):
     """Delete local media by a given ID. Removes it from this server."""
 
@@ -456,6 +484,7 @@ def register_servlets_for_media_repo(hs: "HomeServer", http_server: HttpServer)
     Media repo specific APIs.
     """
     PurgeMediaCacheRestServlet(hs).register(http_server)
+    PurgeMediaStatusRestServlet(hs).register(http_server)
     QuarantineMediaInRoom(hs).register(http_server)
     QuarantineMediaByID(hs).register(http_server)
     UnquarantineMediaByID(hs).register(http_server)
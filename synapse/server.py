@@ -28,6 +28,7 @@
 import abc
 import functools
 import logging
+import os
 from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Type, TypeVar, cast
 
 from typing_extensions import TypeAlias
@@ -131,6 +132,7 @@ from synapse.module_api import ModuleApi
 from synapse.module_api.callbacks import ModuleApiCallbacks
 from synapse.notifier import Notifier, ReplicationNotifier
 from synapse.push.bulk_push_rule_evaluator import BulkPushRuleEvaluator
+from synapse.push.gateway_dispatcher import PushGatewayDispatcher
 from synapse.push.pusherpool import PusherPool
 from synapse.replication.tcp.client import ReplicationDataHandler
 from synapse.replication.tcp.external_cache import ExternalCache
@@ -688,6 +690,10 @@ class HomeServer(metaclass=abc.ABCMeta):
     def get_pusherpool(self) -> PusherPool:
         return PusherPool(self)
 
+    @cache_in_self
+    def get_push_gateway_dispatcher(self) -> PushGatewayDispatcher:
+        return PushGatewayDispatcher(self)
+
     @cache_in_self
     def get_media_repository_resource(self) -> MediaRepositoryResource:
         # build the media repo resource. This indirects through the HomeServer
@@ -967,6 +973,28 @@ class HomeServer(metaclass=abc.ABCMeta):
 
         return media_threadpool
 
+    @cache_in_self
+    def get_thumbnail_thread_pool(self) -> ThreadPool:
+        """Fetch the threadpool used to generate thumbnails, so that thumbnailing
+        large images doesn't hold up other work on the reactor's threadpool."""
+
+        # Thumbnailing is CPU bound (and Pillow releases the GIL while decoding,
+        # resizing and encoding images), so there's no point having more threads
+        # than CPUs.
+        thumbnail_threadpool = ThreadPool(
+            name="thumbnail_threadpool", minthreads=1, maxthreads=os.cpu_count() or 1
+        )
+
+        thumbnail_threadpool.start()
+        self.get_reactor().addSystemEventTrigger(
+            "during", "shutdown", thumbnail_threadpool.stop
+        )
+
+        # Register the threadpool with our metrics.
+        register_threadpool("thumbnail", thumbnail_threadpool)
+
+        return thumbnail_threadpool
+
     @cache_in_self
     def get_delayed_events_handler(self) -> DelayedEventsHandler:
         return DelayedEventsHandler(self)
@@ -115,10 +115,6 @@ class SQLBaseStore(metaclass=ABCMeta):
             self._attempt_to_invalidate_cache("get_member_counts", (room_id,))
             self._attempt_to_invalidate_cache("get_local_users_in_room", (room_id,))
 
-            # There's no easy way of invalidating this cache for just the users
-            # that have changed, so we just clear the entire thing.
-            self._attempt_to_invalidate_cache("does_pair_of_users_share_a_room", None)
-
         for user_id in members_changed:
             self._attempt_to_invalidate_cache(
                 "get_user_in_room_with_profile", (room_id, user_id)
@@ -157,7 +153,6 @@ class SQLBaseStore(metaclass=ABCMeta):
         self._attempt_to_invalidate_cache("get_number_joined_users_in_room", (room_id,))
         self._attempt_to_invalidate_cache("get_member_counts", (room_id,))
         self._attempt_to_invalidate_cache("get_local_users_in_room", (room_id,))
-        self._attempt_to_invalidate_cache("does_pair_of_users_share_a_room", None)
         self._attempt_to_invalidate_cache("get_user_in_room_with_profile", None)
         self._attempt_to_invalidate_cache("get_rooms_for_user", None)
         self._attempt_to_invalidate_cache(
@@ -205,6 +200,34 @@ class SQLBaseStore(metaclass=ABCMeta):
 
         return True
 
+    def _attempt_to_invalidate_cache_bulk(
+        self, cache_name: str, key_tuples: Iterable[Collection[Any]]
+    ) -> bool:
+        """A bulk version of `_attempt_to_invalidate_cache`.
+
+        Looks up the cache of the given name once, then invalidates each of the
+        given entries in turn, ignoring if the cache doesn't exist.
+
+        Args:
+            cache_name
+            key_tuples: Entries to invalidate. For caches backed by a `TreeCache`
+                these may be prefixes of full keys, in which case the whole subtree
+                is invalidated.
+        """
+
+        try:
+            cache = getattr(self, cache_name)
+        except AttributeError:
+            cache = self.external_cached_functions.get(cache_name)
+            if not cache:
+                return False
+
+        invalidate_method = getattr(cache, "invalidate_local", cache.invalidate)
+        for key in key_tuples:
+            invalidate_method(tuple(key))
+
+        return True
+
     def register_external_cached_function(
         self, cache_name: str, func: CachedFunction
     ) -> None:
@@ -50,6 +50,7 @@ from synapse.types.state import StateFilter
 from synapse.util.async_helpers import Linearizer
 from synapse.util.caches import intern_string
 from synapse.util.caches.descriptors import cached
+from synapse.util.caches.lrucache import LruCache
 from synapse.util.cancellation import cancellable
 from synapse.util.metrics import Measure
 
@@ -78,6 +79,14 @@ class StateStorageController:
         # at a time. Keyed by room_id.
         self._joined_host_linearizer = Linearizer("_JoinedHostsCache")
 
+        # Cache of the `history_visibility` and a user's membership in a state
+        # group, used by `get_history_visibility_and_membership_for_events`. Keyed
+        # by (state group, user ID). State groups are immutable, so this never
+        # needs invalidating.
+        self._visibility_state_by_group: LruCache[
+            Tuple[int, str], Tuple[Optional[str], Optional[str]]
+        ] = LruCache(max_size=100000, cache_name="state_group_visibility")
+
     def notify_event_un_partial_stated(self, event_id: str) -> None:
         self._partial_state_events_tracker.notify_un_partial_stated(event_id)
 
@@ -263,6 +272,88 @@ class StateStorageController:
 
         return {event: event_to_state[event] for event in event_ids}
 
+    @trace
+    @tag_args
+    async def get_history_visibility_and_membership_for_events(
+        self, event_ids: Collection[str], user_id: str
+    ) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+        """Get the `history_visibility` of the room and the membership of the
+        given user after each of the given events.
+
+        This is the only state needed to decide whether the user can see the
+        events. Unlike `get_state_for_events`, the result is cached per state
+        group, so the state events only need to be fetched the first time we
+        see each state group. As state groups are points in the room DAG
+        (rather than in the stream), this is correct across forks and backfill.
+
+        Args:
+            event_ids: The events to fetch the state after.
+            user_id: The user to get the membership of.
+
+        Returns:
+            A dict of event_id -> (history_visibility, membership). Either entry
+            is None if there is no such (non-rejected) state event. The
+            `history_visibility` is the raw value from the event content, and so
+            may not be a valid visibility.
+
+        Raises:
+            RuntimeError if we don't have a state group for one or more of the events
+               (ie they are outliers or unknown)
+        """
+        member_key = (EventTypes.Member, user_id)
+        state_filter = StateFilter.from_types(
+            ((EventTypes.RoomHistoryVisibility, ""), member_key)
+        )
+        event_to_groups = await self.get_state_group_for_events(
+            event_ids,
+            await_full_state=state_filter.must_await_full_state(self._is_mine_id),
+        )
+
+        group_to_result: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+        missing_groups = set()
+        for group in set(event_to_groups.values()):
+            cached_result = self._visibility_state_by_group.get((group, user_id))
+            if cached_result is None:
+                missing_groups.add(group)
+            else:
+                group_to_result[group] = cached_result
+
+        if missing_groups:
+            group_to_state = await self.stores.state._get_state_for_groups(
+                missing_groups, state_filter
+            )
+            state_event_map = await self.stores.main.get_events(
+                [ev_id for sd in group_to_state.values() for ev_id in sd.values()],
+                get_prev_content=False,
+            )
+
+            for group, state in group_to_state.items():
+                history_visibility = None
+                visibility_event = state_event_map.get(
+                    state.get((EventTypes.RoomHistoryVisibility, ""), "")
+                )
+                if visibility_event is not None:
+                    content_visibility = visibility_event.content.get(
+                        "history_visibility"
+                    )
+                    if isinstance(content_visibility, str):
+                        history_visibility = content_visibility
+
+                membership = None
+                membership_event = state_event_map.get(state.get(member_key, ""))
+                if membership_event is not None:
+                    membership = membership_event.membership
+
+                group_to_result[group] = (history_visibility, membership)
+                self._visibility_state_by_group.set(
+                    (group, user_id), group_to_result[group]
+                )
+
+        return {
+            event_id: group_to_result[group]
+            for event_id, group in event_to_groups.items()
+        }
+
     @trace
     @tag_args
     @cancellable
@@ -22,7 +22,18 @@
 
 import itertools
 import logging
-from typing import TYPE_CHECKING, Any, Collection, Iterable, List, Optional, Tuple
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Collection,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
 from synapse.api.constants import EventTypes
 from synapse.config._base import Config
@@ -63,6 +74,17 @@ PURGE_HISTORY_CACHE_NAME = "ph_cache_fake"
 # As above, but for invalidating room caches on room deletion
 DELETE_ROOM_CACHE_NAME = "dr_cache_fake"
 
+# As above, but for invalidating many entries of a single cache at once. The keys
+# of such a row are the name of the cache followed by each key-tuple to
+# invalidate, each of which is prefixed by its length. See
+# `_encode_bulk_invalidation`.
+BULK_INVALIDATION_CACHE_NAME = "bulk_cache_fake"
+
+# The maximum number of key components to pack into a single bulk invalidation
+# row. Max line length is 16K, and keys are generally no longer than 255
+# characters (e.g. user IDs), so 50 should be safe.
+BULK_INVALIDATION_MAX_KEYS_PER_ROW = 50
+
 # How long between cache invalidation table cleanups, once we have caught up
 # with the backlog.
 REGULAR_CLEANUP_INTERVAL_MS = Config.parse_duration("1h")
@@ -89,6 +111,9 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
         super().__init__(database, db_conn, hs)
 
         self._instance_name = hs.get_instance_name()
+        self._batch_cache_invalidations = (
+            hs.config.redis.redis_batch_cache_invalidations
+        )
 
         self.db_pool.updates.register_background_index_update(
             update_name="cache_invalidation_index_by_instance",
@@ -209,6 +234,10 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
                     backfilled=True,
                 )
         elif stream_name == CachesStream.NAME:
+            # Invalidations of individual cache entries are grouped by cache, so
+            # that each cache is only looked up once for the batch of rows.
+            invalidations_by_cache: Dict[str, List[Sequence[Any]]] = {}
+
             for row in rows:
                 if row.cache_func == CURRENT_STATE_CACHE_NAME:
                     if row.keys is None:
@@ -236,8 +265,23 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
                     room_id = row.keys[0]
                     self._invalidate_caches_for_room_events(room_id)
                     self._invalidate_caches_for_room(room_id)
+                elif row.cache_func == BULK_INVALIDATION_CACHE_NAME:
+                    if row.keys is None:
+                        raise Exception(
+                            "Can't send an 'invalidate all' for bulk invalidation"
+                        )
+
+                    cache_name, key_tuples = _decode_bulk_invalidation(row.keys)
+                    invalidations_by_cache.setdefault(cache_name, []).extend(key_tuples)
+                elif row.keys is None:
+                    self._attempt_to_invalidate_cache(row.cache_func, None)
                 else:
-                    self._attempt_to_invalidate_cache(row.cache_func, row.keys)
+                    invalidations_by_cache.setdefault(row.cache_func, []).append(
+                        row.keys
+                    )
+
+            for cache_name, cache_keys in invalidations_by_cache.items():
+                self._attempt_to_invalidate_cache_bulk(cache_name, cache_keys)
 
         super().process_replication_rows(stream_name, instance_name, token, rows)
 
@@ -672,8 +716,11 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
     ) -> None:
         """Announce the invalidation of multiple (but not all) cache entries.
 
-        This is more efficient than repeated calls to the non-bulk version. It should
-        NOT be used to invalidating the entire cache: use
+        This is more efficient than repeated calls to the non-bulk version: the
+        key-tuples are de-duplicated and, if `redis.batch_cache_invalidations` is
+        enabled, packed into as few stream rows as possible (see
+        `_encode_bulk_invalidation`), which workers then apply in a single pass.
+        It should NOT be used to invalidating the entire cache: use
         `_send_invalidation_to_replication` with keys=None.
 
         Note that this does *not* invalidate the cache locally.
@@ -686,7 +733,30 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
         if isinstance(self.database_engine, PostgresEngine):
             assert self._cache_id_gen is not None
 
-            stream_ids = self._cache_id_gen.get_next_mult_txn(txn, len(key_tuples))
+            coalesced_key_tuples = _coalesce_key_tuples(key_tuples)
+            if len(coalesced_key_tuples) == 1:
+                # There's no point wrapping up a single invalidation.
+                self._send_invalidation_to_replication(
+                    txn, cache_name, coalesced_key_tuples[0]
+                )
+                return
+
+            rows: List[Tuple[str, List[Any]]]
+            if self._batch_cache_invalidations:
+                rows = [
+                    (BULK_INVALIDATION_CACHE_NAME, row_keys)
+                    for row_keys in _encode_bulk_invalidation(
+                        cache_name, coalesced_key_tuples
+                    )
+                ]
+            else:
+                # Workers running older versions don't understand bulk
+                # invalidation rows, so send a row per key-tuple.
+                rows = [
+                    (cache_name, list(key_tuple)) for key_tuple in coalesced_key_tuples
+                ]
+
+            stream_ids = self._cache_id_gen.get_next_mult_txn(txn, len(rows))
             ts = self._clock.time_msec()
             txn.call_after(self.hs.get_notifier().on_new_replication_data)
             self.db_pool.simple_insert_many_txn(
@@ -700,14 +770,14 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
                     "invalidation_ts",
                 ),
                 values=[
-                    # We convert key_tuples to a list here because psycopg2 serialises
-                    # lists as pq arrrays, but serialises tuples as "composite types".
-                    # (We need an array because the `keys` column has type `[]text`.)
-                    # See:
+                    # Note that the keys must be a list rather than a tuple, because
+                    # psycopg2 serialises lists as pq arrrays, but serialises tuples
+                    # as "composite types". (We need an array because the `keys`
+                    # column has type `[]text`.) See:
                     #     https://www.psycopg.org/docs/usage.html#adapt-list
                     #     https://www.psycopg.org/docs/usage.html#adapt-tuple
-                    (stream_id, self._instance_name, cache_name, list(key_tuple), ts)
-                    for stream_id, key_tuple in zip(stream_ids, key_tuples)
+                    (stream_id, self._instance_name, row_cache_name, row_keys, ts)
+                    for stream_id, (row_cache_name, row_keys) in zip(stream_ids, rows)
                 ],
             )
 
@@ -817,3 +887,77 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
             "clean_up_old_cache_invalidations",
             _clean_up_batch_of_old_cache_invalidations_txn,
         )
+
+
+def _coalesce_key_tuples(
+    key_tuples: Iterable[Tuple[Any, ...]],
+) -> List[Tuple[Any, ...]]:
+    """De-duplicate a collection of key-tuples to invalidate.
+
+    Any key-tuple which has a (strictly shorter) prefix in the collection is
+    dropped too: such prefixes can only be used with caches backed by a
+    `TreeCache`, where invalidating the prefix invalidates the whole subtree.
+
+    Order is otherwise preserved.
+    """
+    unique_key_tuples = list(dict.fromkeys(tuple(k) for k in key_tuples))
+
+    prefixes = {k for k in unique_key_tuples if len(k) > 0}
+    min_length = min((len(k) for k in prefixes), default=0)
+
+    return [
+        key_tuple
+        for key_tuple in unique_key_tuples
+        if not any(key_tuple[:i] in prefixes for i in range(min_length, len(key_tuple)))
+    ]
+
+
+def _encode_bulk_invalidation(
+    cache_name: str, key_tuples: Iterable[Tuple[Any, ...]]
+) -> Iterator[List[Any]]:
+    """Pack the given key-tuples into the keys of as few bulk invalidation
+    rows as possible.
+
+    The keys of each row are the name of the cache followed by the key-tuples,
+    each prefixed by its length. For example, invalidating `("a", "b")` and
+    `("c", "d")` in `foo` results in the keys `["foo", "2", "a", "b", "2", "c",
+    "d"]`.
+
+    Each row contains at most `BULK_INVALIDATION_MAX_KEYS_PER_ROW` key
+    components (other than the length prefixes), except where a single
+    key-tuple is longer than that.
+    """
+    row_keys: List[Any] = [cache_name]
+    num_keys = 0
+    for key_tuple in key_tuples:
+        if num_keys and num_keys + len(key_tuple) > BULK_INVALIDATION_MAX_KEYS_PER_ROW:
+            yield row_keys
+            row_keys = [cache_name]
+            num_keys = 0
+
+        row_keys.append(str(len(key_tuple)))
+        row_keys.extend(key_tuple)
+        num_keys += len(key_tuple)
+
+    if num_keys:
+        yield row_keys
+
+
+def _decode_bulk_invalidation(
+    keys: Sequence[Any],
+) -> Tuple[str, List[Tuple[Any, ...]]]:
+    """The inverse of `_encode_bulk_invalidation`, for a single row.
+
+    Returns:
+        The name of the cache, and the key-tuples to invalidate in it.
+    """
+    cache_name = keys[0]
+    key_tuples = []
+
+    idx = 1
+    while idx < len(keys):
+        length = int(keys[idx])
+        key_tuples.append(tuple(keys[idx + 1 : idx + 1 + length]))
+        idx += 1 + length
+
+    return cache_name, key_tuples
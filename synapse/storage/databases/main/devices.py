@@ -870,6 +870,39 @@ class DeviceWorkerStore(RoomMemberWorkerStore, EndToEndKeyWorkerStore):
         )
         return {device[0]: db_to_json(device[1]) for device in devices}
 
+    async def get_all_devices_changed_if_few(
+        self, from_key: int, to_key: int, limit: int
+    ) -> Optional[Set[str]]:
+        """Get all users whose devices have changed in the given range, if we
+        can tell from the stream change cache that there are at most `limit` of
+        them.
+
+        Args:
+            from_key: The minimum device lists stream token to query device list
+                changes for, exclusive.
+            to_key: The maximum device lists stream token to query device list
+                changes for, inclusive.
+            limit: The maximum number of users that may have changed their
+                devices.
+
+        Returns:
+            The set of user_ids whose devices have changed since `from_key`
+            (exclusive) until `to_key` (inclusive), or None if `from_key` is
+            too old for the cache or more than `limit` users may have changed.
+        """
+        result = self._device_list_stream_cache.get_all_entities_changed(from_key)
+        if not result.hit:
+            return None
+
+        user_ids = set(result.entities)
+        if len(user_ids) > limit:
+            return None
+
+        if not user_ids:
+            return set()
+
+        return await self.get_users_whose_devices_changed(from_key, user_ids, to_key)
+
     @cancellable
     async def get_all_devices_changed(
         self,
@@ -77,6 +77,22 @@ Since read receipts are almost always for recent events, scanning the
 `event_push_actions` table in this case is unlikely to be a problem. Even if it
 is a problem, it is temporary until the background job handles the new read
 receipt.
+
+
+Even so, calculating the counts this way takes a number of queries per room on
+every sync. So after the counts for a user / room have been calculated, a
+background process stores them in `event_push_counts` (with the user / room
+recorded in `event_push_counts_rooms`), and from then on they are maintained
+incrementally: they are incremented in the same transaction that inserts new
+push actions, and are reset in the same transaction that inserts a new read
+receipt. If the receipt is for an older event, the push actions after it are
+counted again, in the same way as `event_push_summary` is updated for the
+receipt. Reading the counts for a materialized user / room is then a single
+lookup.
+
+Only users whose counts have been materialized have rows in `event_push_counts`,
+and rows are deleted when the user leaves the room, or when history in the room
+is purged.
 """
 
 import logging
@@ -85,9 +101,11 @@ from typing import (
     TYPE_CHECKING,
     Collection,
     Dict,
+    Iterable,
     List,
     Mapping,
     Optional,
+    Set,
     Tuple,
     Union,
     cast,
@@ -95,8 +113,12 @@ from typing import (
 
 import attr
 
-from synapse.api.constants import MAIN_TIMELINE, ReceiptTypes
-from synapse.metrics.background_process_metrics import wrap_as_background_process
+from synapse.api.constants import MAIN_TIMELINE, Membership, ReceiptTypes
+from synapse.events import EventBase
+from synapse.metrics.background_process_metrics import (
+    run_as_background_process,
+    wrap_as_background_process,
+)
 from synapse.storage._base import SQLBaseStore, db_to_json, make_in_list_sql_clause
 from synapse.storage.database import (
     DatabasePool,
@@ -104,8 +126,10 @@ from synapse.storage.database import (
     LoggingTransaction,
     PostgresEngine,
 )
+from synapse.storage.databases.main.cache import CacheInvalidationWorkerStore
 from synapse.storage.databases.main.receipts import ReceiptsWorkerStore
 from synapse.storage.databases.main.stream import StreamWorkerStore
+from synapse.storage.engines._base import IsolationLevel
 from synapse.types import JsonDict, StrCollection
 from synapse.util import json_encoder
 from synapse.util.caches.descriptors import cached
@@ -253,7 +277,9 @@ def _deserialize_action(actions: str, is_highlight: bool) -> List[Union[dict, st
         return DEFAULT_NOTIF_ACTION
 
 
-class EventPushActionsWorkerStore(ReceiptsWorkerStore, StreamWorkerStore, SQLBaseStore):
+class EventPushActionsWorkerStore(
+    ReceiptsWorkerStore, StreamWorkerStore, CacheInvalidationWorkerStore, SQLBaseStore
+):
     def __init__(
         self,
         database: DatabasePool,
@@ -288,6 +314,15 @@ class EventPushActionsWorkerStore(ReceiptsWorkerStore, StreamWorkerStore, SQLBas
                 self._clear_old_push_actions_staging, 30 * 60 * 1000
             )
 
+            self._prune_event_push_counts_loop = self._clock.looping_call(
+                self._prune_event_push_counts, 60 * 60 * 1000
+            )
+
+        # User / room pairs whose unread counts we're yet to start maintaining
+        # incrementally. See `_materialize_event_push_counts`.
+        self._event_push_counts_to_materialize: Set[Tuple[str, str]] = set()
+        self._is_materializing_event_push_counts = False
+
         self.db_pool.updates.register_background_index_update(
             "event_push_summary_unique_index2",
             index_name="event_push_summary_unique_index2",
@@ -374,6 +409,12 @@ class EventPushActionsWorkerStore(ReceiptsWorkerStore, StreamWorkerStore, SQLBas
     def _get_unread_counts_by_room_for_user_txn(
         self, txn: LoggingTransaction, user_id: str
     ) -> Dict[str, int]:
+        # If we've materialized the counts for all the user's joined rooms, we can
+        # just read them.
+        materialized_counts = self._get_event_push_counts_by_room_txn(txn, user_id)
+        if materialized_counts is not None:
+            return materialized_counts
+
         receipt_types_clause, args = make_in_list_sql_clause(
             self.database_engine,
             "receipt_type",
@@ -532,7 +573,30 @@ class EventPushActionsWorkerStore(ReceiptsWorkerStore, StreamWorkerStore, SQLBas
         room_id: str,
         user_id: str,
     ) -> RoomNotifCounts:
-        # Get the stream ordering of the user's latest receipt in the room.
+        materialized_counts = self._get_event_push_counts_txn(txn, room_id, user_id)
+        if materialized_counts is not None:
+            return materialized_counts
+
+        stream_ordering = self._get_unthreaded_receipt_stream_ordering_txn(
+            txn, room_id, user_id
+        )
+        counts = self._get_unread_counts_by_pos_txn(
+            txn, room_id, user_id, stream_ordering
+        )
+
+        # Start maintaining the counts incrementally, so that next time they can
+        # just be read.
+        txn.call_after(
+            self._schedule_event_push_counts_materialization, room_id, user_id
+        )
+
+        return counts
+
+    def _get_unthreaded_receipt_stream_ordering_txn(
+        self, txn: LoggingTransaction, room_id: str, user_id: str
+    ) -> int:
+        """Get the stream ordering of the user's latest unthreaded read receipt in
+        the room, or of their membership event if they haven't sent one."""
         result = self.get_last_unthreaded_receipt_for_user_txn(
             txn,
             user_id,
@@ -542,24 +606,20 @@ class EventPushActionsWorkerStore(ReceiptsWorkerStore, StreamWorkerStore, SQLBas
 
         if result:
             _, stream_ordering = result
-
-        else:
-            # If the user has no receipts in the room, retrieve the stream ordering for
-            # the latest membership event from this user in this room (which we assume is
-            # a join).
-            event_id = self.db_pool.simple_select_one_onecol_txn(
-                txn=txn,
-                table="local_current_membership",
-                keyvalues={"room_id": room_id, "user_id": user_id},
-                retcol="event_id",
-            )
-
-            stream_ordering = self.get_stream_id_for_event_txn(txn, event_id)
-
-        return self._get_unread_counts_by_pos_txn(
-            txn, room_id, user_id, stream_ordering
+            return stream_ordering
+
+        # If the user has no receipts in the room, retrieve the stream ordering for
+        # the latest membership event from this user in this room (which we assume is
+        # a join).
+        event_id = self.db_pool.simple_select_one_onecol_txn(
+            txn=txn,
+            table="local_current_membership",
+            keyvalues={"room_id": room_id, "user_id": user_id},
+            retcol="event_id",
         )
 
+        return self.get_stream_id_for_event_txn(txn, event_id)
+
     def _get_unread_counts_by_pos_txn(
         self,
         txn: LoggingTransaction,
@@ -842,6 +902,924 @@ class EventPushActionsWorkerStore(ReceiptsWorkerStore, StreamWorkerStore, SQLBas
         txn.execute(sql, args)
         return cast(List[Tuple[int, int, str]], txn.fetchall())
 
+    def _get_event_push_counts_txn(
+        self, txn: LoggingTransaction, room_id: str, user_id: str
+    ) -> Optional[RoomNotifCounts]:
+        """Get the incrementally maintained unread counts for a user in a room.
+
+        Returns:
+            The counts, or None if they have not been materialized for this
+            user/room yet.
+        """
+        pending = self.db_pool.simple_select_one_onecol_txn(
+            txn,
+            table="event_push_counts_rooms",
+            keyvalues={"user_id": user_id, "room_id": room_id},
+            retcol="pending",
+            allow_none=True,
+        )
+        if pending is None or pending:
+            return None
+
+        rows = cast(
+            List[Tuple[str, int, int, int]],
+            self.db_pool.simple_select_list_txn(
+                txn,
+                table="event_push_counts",
+                keyvalues={"user_id": user_id, "room_id": room_id},
+                retcols=("thread_id", "notif_count", "unread_count", "highlight_count"),
+            ),
+        )
+
+        main_counts = NotifCounts()
+        thread_counts: Dict[str, NotifCounts] = {}
+        for thread_id, notif_count, unread_count, highlight_count in rows:
+            counts = NotifCounts(
+                notify_count=notif_count,
+                unread_count=unread_count,
+                highlight_count=highlight_count,
+            )
+            if thread_id == MAIN_TIMELINE:
+                main_counts = counts
+            elif notif_count or unread_count or highlight_count:
+                thread_counts[thread_id] = counts
+
+        return RoomNotifCounts(main_counts, thread_counts)
+
+    def _get_event_push_counts_by_room_txn(
+        self, txn: LoggingTransaction, user_id: str
+    ) -> Optional[Dict[str, int]]:
+        """Get the incrementally maintained notification counts by room for a user.
+
+        Returns:
+            A map of room ID to notification count, or None if the counts have not
+            been materialized for all of the user's joined rooms yet.
+        """
+        txn.execute(
+            """
+            SELECT 1 FROM local_current_membership AS m
+            WHERE m.user_id = ? AND m.membership = ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM event_push_counts_rooms AS r
+                    WHERE r.user_id = m.user_id AND r.room_id = m.room_id
+                        AND NOT r.pending
+                )
+            LIMIT 1
+            """,
+            (user_id, Membership.JOIN),
+        )
+        if txn.fetchone():
+            return None
+
+        txn.execute(
+            """
+            SELECT room_id, SUM(notif_count) FROM event_push_counts
+            WHERE user_id = ?
+            GROUP BY room_id
+            """,
+            (user_id,),
+        )
+
+        room_to_count: Dict[str, int] = defaultdict(int)
+        for room_id, notif_count in txn:
+            if notif_count:
+                room_to_count[room_id] = notif_count
+        return room_to_count
+
+    def _schedule_event_push_counts_materialization(
+        self, room_id: str, user_id: str
+    ) -> None:
+        """Start maintaining the unread counts for a user in a room incrementally,
+        in the background."""
+        self._event_push_counts_to_materialize.add((room_id, user_id))
+        if self._is_materializing_event_push_counts:
+            return
+
+        self._is_materializing_event_push_counts = True
+        run_as_background_process(
+            "materialize_event_push_counts",
+            self._materialize_pending_event_push_counts,
+        )
+
+    async def _materialize_pending_event_push_counts(self) -> None:
+        try:
+            while self._event_push_counts_to_materialize:
+                room_user_pairs = self._event_push_counts_to_materialize
+                self._event_push_counts_to_materialize = set()
+                try:
+                    await self._materialize_event_push_counts(room_user_pairs)
+                except Exception:
+                    logger.exception("Failed to materialize unread counts")
+        finally:
+            self._is_materializing_event_push_counts = False
+
+    async def _materialize_event_push_counts(
+        self, room_user_pairs: Collection[Tuple[str, str]]
+    ) -> None:
+        """Start maintaining the unread counts for the given rooms and users
+        incrementally.
+
+        This happens in two steps. First we add pending rows to
+        `event_push_counts_rooms`, from which point new push actions, receipts and
+        redactions update the counts. Then, once every event which might have been
+        persisted without seeing the pending rows has been persisted, we calculate
+        the counts from the summary and push actions and store them. If the
+        summary isn't up to date with the user's receipts yet, we try again later.
+
+        Args:
+            room_user_pairs: The room ID and user ID pairs to materialize the
+                counts for.
+        """
+        room_user_pairs = await self.db_pool.runInteraction(
+            "add_pending_event_push_counts",
+            self._add_pending_event_push_counts_txn,
+            room_user_pairs,
+        )
+        if not room_user_pairs:
+            return
+
+        # Events are assigned their stream orderings before they're persisted, so
+        # this is an upper bound on the stream orderings of events that were being
+        # persisted before the pending rows were added.
+        max_stream_ordering = await self._stream_id_gen.get_max_allocated_token()
+        if not await self._wait_for_push_actions(max_stream_ordering):
+            logger.warning(
+                "Timed out waiting for push actions up to %d to be persisted",
+                max_stream_ordering,
+            )
+            await self.db_pool.runInteraction(
+                "remove_pending_event_push_counts",
+                self._remove_pending_event_push_counts_txn,
+                room_user_pairs,
+            )
+            return
+
+        for room_id, user_id in room_user_pairs:
+            calculated = await self.db_pool.runInteraction(
+                "calculate_event_push_counts",
+                self._calculate_event_push_counts_txn,
+                room_id,
+                user_id,
+                isolation_level=IsolationLevel.READ_COMMITTED,
+            )
+            if not calculated:
+                self._clock.call_later(
+                    30,
+                    self._schedule_event_push_counts_materialization,
+                    room_id,
+                    user_id,
+                )
+
+    def _add_pending_event_push_counts_txn(
+        self, txn: LoggingTransaction, room_user_pairs: Iterable[Tuple[str, str]]
+    ) -> List[Tuple[str, str]]:
+        """Add pending rows to `event_push_counts_rooms` for the given rooms and
+        users, if they are still joined to the room and don't already have one.
+
+        Returns:
+            The room ID and user ID pairs whose rows are pending.
+        """
+        pending = []
+        for room_id, user_id in room_user_pairs:
+            membership = self.db_pool.simple_select_one_onecol_txn(
+                txn,
+                table="local_current_membership",
+                keyvalues={"user_id": user_id, "room_id": room_id},
+                retcol="membership",
+                allow_none=True,
+            )
+            if membership != Membership.JOIN:
+                continue
+
+            self.db_pool.simple_upsert_txn(
+                txn,
+                table="event_push_counts_rooms",
+                keyvalues={"user_id": user_id, "room_id": room_id},
+                values={},
+                insertion_values={
+                    "receipt_stream_ordering": self._get_unthreaded_receipt_stream_ordering_txn(
+                        txn, room_id, user_id
+                    ),
+                    "pending": True,
+                },
+            )
+            if self.db_pool.simple_select_one_onecol_txn(
+                txn,
+                table="event_push_counts_rooms",
+                keyvalues={"user_id": user_id, "room_id": room_id},
+                retcol="pending",
+            ):
+                pending.append((room_id, user_id))
+
+        return pending
+
+    def _remove_pending_event_push_counts_txn(
+        self, txn: LoggingTransaction, room_user_pairs: Iterable[Tuple[str, str]]
+    ) -> None:
+        for room_id, user_id in room_user_pairs:
+            self.db_pool.simple_delete_txn(
+                txn,
+                table="event_push_counts_rooms",
+                keyvalues={"user_id": user_id, "room_id": room_id, "pending": True},
+            )
+
+    async def _wait_for_push_actions(self, stream_ordering: int) -> bool:
+        """Wait until the push actions for every event up to the given stream
+        ordering have been persisted.
+
+        Returns:
+            False if we gave up waiting.
+        """
+        for _ in range(60):
+            if self.get_room_max_stream_ordering() >= stream_ordering:
+                background_position = await self.db_pool.runInteraction(
+                    "get_background_push_actions_position",
+                    self._get_background_push_actions_position_txn,
+                )
+                if background_position is None or background_position >= (
+                    stream_ordering
+                ):
+                    return True
+
+            await self._clock.sleep(1)
+
+        return False
+
+    def _lock_rooms_for_event_push_counts_txn(
+        self, txn: LoggingTransaction, room_ids: Collection[str], exclusive: bool
+    ) -> None:
+        """Lock the given rooms' rows in `rooms` before changing their unread counts.
+
+        Adding push actions to the counts (when persisting events, or when they
+        are calculated in the background) takes a shared lock. Calculating the
+        counts from scratch and updating them for a read receipt take an
+        exclusive lock, as they must not miss push actions being counted
+        concurrently. So they wait for the others to commit, and then see their
+        changes (as they run with READ COMMITTED).
+
+        A transaction must only lock a room once, at the strength it needs:
+        upgrading a shared lock to an exclusive one deadlocks with another
+        transaction doing the same.
+
+        Annoyingly SQLite doesn't support row level locking, but it only allows one
+        writer at a time anyway.
+        """
+        if not isinstance(self.database_engine, PostgresEngine) or not room_ids:
+            return
+
+        clause, args = make_in_list_sql_clause(
+            self.database_engine, "room_id", sorted(room_ids)
+        )
+        txn.execute(
+            f"""
+            SELECT room_id FROM rooms WHERE {clause}
+            ORDER BY room_id
+            FOR {"UPDATE" if exclusive else "SHARE"}
+            """,
+            args,
+        )
+
+    def _calculate_event_push_counts_txn(
+        self, txn: LoggingTransaction, room_id: str, user_id: str
+    ) -> bool:
+        """Calculate the unread counts for a user in a room from the summary and
+        push actions, and store them so that they can be maintained incrementally.
+
+        Must be run with READ COMMITTED, as it locks the room first.
+
+        Returns:
+            False if the counts couldn't be calculated yet, and we should try again
+            later.
+        """
+        self._lock_rooms_for_event_push_counts_txn(txn, [room_id], exclusive=True)
+
+        # The user may have left the room (or the pending row been pruned) while we
+        # were waiting.
+        membership = self.db_pool.simple_select_one_onecol_txn(
+            txn,
+            table="local_current_membership",
+            keyvalues={"user_id": user_id, "room_id": room_id},
+            retcol="membership",
+            allow_none=True,
+        )
+        pending = self.db_pool.simple_select_one_onecol_txn(
+            txn,
+            table="event_push_counts_rooms",
+            keyvalues={"user_id": user_id, "room_id": room_id},
+            retcol="pending",
+            allow_none=True,
+        )
+        if membership != Membership.JOIN or pending is None:
+            self._remove_event_push_counts_txn(txn, room_id, user_id)
+            return True
+        if not pending:
+            # Another instance got there first.
+            return True
+
+        receipt_types_clause, receipt_types_args = make_in_list_sql_clause(
+            self.database_engine,
+            "receipt_type",
+            (ReceiptTypes.READ, ReceiptTypes.READ_PRIVATE),
+        )
+
+        # The summary's counts are only valid once the user's latest receipts have
+        # been processed (see `_handle_new_receipts_for_notifs_txn`). Until then
+        # they may include push actions that have since been read.
+        txn.execute(
+            f"""
+            SELECT MAX(stream_id) FROM receipts_linearized
+            WHERE user_id = ? AND room_id = ? AND {receipt_types_clause}
+            """,
+            (user_id, room_id, *receipt_types_args),
+        )
+        latest_receipt_stream_id = cast(Tuple[Optional[int]], txn.fetchone())[0]
+        processed_receipt_stream_id = self.db_pool.simple_select_one_onecol_txn(
+            txn,
+            table="event_push_summary_last_receipt_stream_id",
+            keyvalues={},
+            retcol="stream_id",
+        )
+        if (
+            latest_receipt_stream_id is not None
+            and latest_receipt_stream_id > processed_receipt_stream_id
+        ):
+            return False
+
+        unthreaded_receipt_stream_ordering = (
+            self._get_unthreaded_receipt_stream_ordering_txn(txn, room_id, user_id)
+        )
+        counts = self._get_unread_counts_by_pos_txn(
+            txn, room_id, user_id, unthreaded_receipt_stream_ordering
+        )
+
+        # Threaded receipts which are more recent than the unthreaded receipt move
+        # the point after which push actions count for that thread.
+        txn.execute(
+            f"""
+            SELECT thread_id, MAX(event_stream_ordering) FROM receipts_linearized
+            WHERE user_id = ? AND room_id = ? AND thread_id IS NOT NULL
+                AND event_stream_ordering > ? AND {receipt_types_clause}
+            GROUP BY thread_id
+            """,
+            (user_id, room_id, unthreaded_receipt_stream_ordering, *receipt_types_args),
+        )
+        thread_receipts: Dict[str, int] = dict(
+            cast(List[Tuple[str, int]], txn.fetchall())
+        )
+
+        # Any push actions that have been counted must be for events in the room
+        # we can see, which gives us an upper bound on their stream ordering.
+        txn.execute(
+            "SELECT MAX(stream_ordering) FROM events WHERE room_id = ?", (room_id,)
+        )
+        row = txn.fetchone()
+        max_stream_ordering = (
+            row[0] if row and row[0] is not None else unthreaded_receipt_stream_ordering
+        )
+
+        thread_counts = {MAIN_TIMELINE: counts.main_timeline, **counts.threads}
+        for thread_id in thread_receipts:
+            thread_counts.setdefault(thread_id, NotifCounts())
+
+        # Clear out any counts for other threads that were incremented while the
+        # counts were pending.
+        thread_id_clause, thread_id_args = make_in_list_sql_clause(
+            self.database_engine, "thread_id", thread_counts
+        )
+        txn.execute(
+            f"""
+            DELETE FROM event_push_counts
+            WHERE user_id = ? AND room_id = ? AND NOT {thread_id_clause}
+            """,
+            (user_id, room_id, *thread_id_args),
+        )
+
+        self.db_pool.simple_upsert_many_txn(
+            txn,
+            table="event_push_counts",
+            key_names=("user_id", "room_id", "thread_id"),
+            key_values=[(user_id, room_id, thread_id) for thread_id in thread_counts],
+            value_names=(
+                "notif_count",
+                "unread_count",
+                "highlight_count",
+                "stream_ordering",
+                "receipt_stream_ordering",
+            ),
+            value_values=[
+                (
+                    thread_count.notify_count,
+                    thread_count.unread_count,
+                    thread_count.highlight_count,
+                    max_stream_ordering,
+                    thread_receipts.get(thread_id, unthreaded_receipt_stream_ordering),
+                )
+                for thread_id, thread_count in thread_counts.items()
+            ],
+        )
+
+        self.db_pool.simple_update_one_txn(
+            txn,
+            table="event_push_counts_rooms",
+            keyvalues={"user_id": user_id, "room_id": room_id},
+            updatevalues={
+                "receipt_stream_ordering": unthreaded_receipt_stream_ordering,
+                "pending": False,
+            },
+        )
+
+        return True
+
+    def _remove_event_push_counts_txn(
+        self, txn: LoggingTransaction, room_id: str, user_id: str
+    ) -> None:
+        """Stop maintaining the unread counts for a user in a room."""
+        for table in ("event_push_counts", "event_push_counts_rooms"):
+            self.db_pool.simple_delete_txn(
+                txn, table=table, keyvalues={"user_id": user_id, "room_id": room_id}
+            )
+
+    def _add_to_event_push_counts_txn(
+        self,
+        txn: LoggingTransaction,
+        push_actions: Iterable[Tuple[str, str, str, int, int, int, int]],
+    ) -> None:
+        """Increment the unread counts for newly inserted push actions.
+
+        Only the counts of users whose counts have been materialized are updated.
+        Push actions for events that the user has already read are ignored. This
+        can happen if push actions are inserted out of order, e.g. when they are
+        calculated in the background.
+
+        Args:
+            txn: The database transaction.
+            push_actions: Tuples of user ID, room ID, thread ID, whether the
+                action notifies, whether it counts as unread, whether it is a
+                highlight, and the stream ordering of the event.
+        """
+        push_actions_by_room: Dict[str, List[Tuple[str, str, int, int, int, int]]] = (
+            defaultdict(list)
+        )
+        for (
+            user_id,
+            room_id,
+            thread_id,
+            notif,
+            unread,
+            highlight,
+            stream_ordering,
+        ) in push_actions:
+            push_actions_by_room[room_id].append(
+                (user_id, thread_id, notif, unread, highlight, stream_ordering)
+            )
+
+        increments: Dict[Tuple[str, str, str, int], NotifCounts] = {}
+        receipts: Dict[Tuple[str, str], int] = {}
+        for room_id, room_push_actions in push_actions_by_room.items():
+            # Usually only a handful of the room's members have materialized counts.
+            rows = cast(
+                List[Tuple[str, int]],
+                self.db_pool.simple_select_list_txn(
+                    txn,
+                    table="event_push_counts_rooms",
+                    keyvalues={"room_id": room_id},
+                    retcols=("user_id", "receipt_stream_ordering"),
+                ),
+            )
+            if not rows:
+                continue
+            room_receipts = dict(rows)
+
+            for (
+                user_id,
+                thread_id,
+                notif,
+                unread,
+                highlight,
+                stream_ordering,
+            ) in room_push_actions:
+                receipt_stream_ordering = room_receipts.get(user_id)
+                if (
+                    receipt_stream_ordering is None
+                    or receipt_stream_ordering >= stream_ordering
+                ):
+                    continue
+
+                receipts[(user_id, room_id)] = receipt_stream_ordering
+                counts = increments.setdefault(
+                    (user_id, room_id, thread_id, stream_ordering), NotifCounts()
+                )
+                counts.notify_count += notif
+                counts.unread_count += unread
+                counts.highlight_count += highlight
+
+        if not increments:
+            return
+
+        if isinstance(self.database_engine, PostgresEngine):
+            greatest = "GREATEST"
+        else:
+            greatest = "MAX"
+
+        # New rows start from the user's unthreaded receipt.
+        sql = f"""
+            INSERT INTO event_push_counts (
+                user_id, room_id, thread_id, notif_count, unread_count,
+                highlight_count, stream_ordering, receipt_stream_ordering
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, room_id, thread_id) DO UPDATE SET
+                notif_count = event_push_counts.notif_count + EXCLUDED.notif_count,
+                unread_count = event_push_counts.unread_count + EXCLUDED.unread_count,
+                highlight_count
+                    = event_push_counts.highlight_count + EXCLUDED.highlight_count,
+                stream_ordering = {greatest}(
+                    event_push_counts.stream_ordering, EXCLUDED.stream_ordering
+                )
+            WHERE event_push_counts.receipt_stream_ordering < EXCLUDED.stream_ordering
+        """
+        txn.execute_batch(
+            sql,
+            [
+                (
+                    user_id,
+                    room_id,
+                    thread_id,
+                    counts.notify_count,
+                    counts.unread_count,
+                    counts.highlight_count,
+                    stream_ordering,
+                    receipts[(user_id, room_id)],
+                )
+                for (
+                    user_id,
+                    room_id,
+                    thread_id,
+                    stream_ordering,
+                ), counts in increments.items()
+            ],
+        )
+
+    def _add_staged_push_actions_to_event_push_counts_txn(
+        self, txn: LoggingTransaction, events: Collection[EventBase]
+    ) -> None:
+        """Increment the unread counts for the staged push actions of events that
+        are being persisted."""
+        event_positions: Dict[str, Tuple[str, int]] = {}
+        for event in events:
+            assert event.internal_metadata.stream_ordering is not None
+            event_positions[event.event_id] = (
+                event.room_id,
+                event.internal_metadata.stream_ordering,
+            )
+
+        push_actions = []
+        for room_id in {room_id for room_id, _ in event_positions.values()}:
+            # Only fetch the push actions for users whose counts have been
+            # materialized, rather than for every member of the room.
+            clause, args = make_in_list_sql_clause(
+                self.database_engine,
+                "s.event_id",
+                [
+                    event_id
+                    for event_id, (event_room_id, _) in event_positions.items()
+                    if event_room_id == room_id
+                ],
+            )
+            txn.execute(
+                f"""
+                SELECT s.event_id, s.user_id, s.thread_id, s.notif, s.unread,
+                    s.highlight
+                FROM event_push_actions_staging AS s
+                INNER JOIN event_push_counts_rooms AS r USING (user_id)
+                WHERE r.room_id = ? AND {clause}
+                """,
+                (room_id, *args),
+            )
+
+            for event_id, user_id, thread_id, notif, unread, highlight in txn:
+                _, stream_ordering = event_positions[event_id]
+                push_actions.append(
+                    (
+                        user_id,
+                        room_id,
+                        thread_id,
+                        notif,
+                        unread,
+                        highlight,
+                        stream_ordering,
+                    )
+                )
+
+        self._add_to_event_push_counts_txn(txn, push_actions)
+
+    def _remove_event_from_event_push_counts_txn(
+        self, txn: LoggingTransaction, room_id: str, event_id: str
+    ) -> None:
+        """Decrement the unread counts for the push actions of an event that is
+        being redacted. Must be called before the push actions are deleted."""
+        txn.execute(
+            """
+            SELECT user_id, thread_id, notif, unread, highlight, stream_ordering
+            FROM event_push_actions
+            INNER JOIN event_push_counts_rooms AS r USING (user_id, room_id)
+            WHERE room_id = ? AND event_id = ?
+            """,
+            (room_id, event_id),
+        )
+        rows = cast(List[Tuple[str, str, int, int, int, int]], txn.fetchall())
+        if not rows:
+            return
+
+        txn.execute_batch(
+            """
+            UPDATE event_push_counts SET
+                notif_count = notif_count - ?,
+                unread_count = unread_count - ?,
+                highlight_count = highlight_count - ?
+            WHERE user_id = ? AND room_id = ? AND thread_id = ?
+                AND receipt_stream_ordering < ?
+            """,
+            [
+                (
+                    notif,
+                    unread,
+                    highlight,
+                    user_id,
+                    room_id,
+                    thread_id,
+                    stream_ordering,
+                )
+                for user_id, thread_id, notif, unread, highlight, stream_ordering in rows
+            ],
+        )
+
+    def _insert_linearized_receipt_txn(
+        self,
+        txn: LoggingTransaction,
+        room_id: str,
+        receipt_type: str,
+        user_id: str,
+        event_id: str,
+        thread_id: Optional[str],
+        data: JsonDict,
+        stream_id: int,
+    ) -> Optional[int]:
+        rx_ts = super()._insert_linearized_receipt_txn(
+            txn, room_id, receipt_type, user_id, event_id, thread_id, data, stream_id
+        )
+
+        # Read receipts from our own users reset their unread counts.
+        if (
+            rx_ts is not None
+            and receipt_type in (ReceiptTypes.READ, ReceiptTypes.READ_PRIVATE)
+            and self.hs.is_mine_id(user_id)
+        ):
+            stream_ordering = self.get_stream_id_for_event_txn(
+                txn, event_id, allow_none=True
+            )
+            if stream_ordering is not None:
+                # Make sure no new push actions are counted while we're updating
+                # the counts, as we'd otherwise clear them too.
+                self._lock_rooms_for_event_push_counts_txn(
+                    txn, [room_id], exclusive=True
+                )
+                self._update_event_push_counts_for_receipt_txn(
+                    txn, room_id, user_id, thread_id, stream_ordering
+                )
+
+        return rx_ts
+
+    def _update_event_push_counts_for_receipt_txn(
+        self,
+        txn: LoggingTransaction,
+        room_id: str,
+        user_id: str,
+        thread_id: Optional[str],
+        receipt_stream_ordering: int,
+    ) -> None:
+        """Update the unread counts for a user in a room after they have sent a
+        read receipt.
+
+        Usually the receipt is for the latest event in the thread, and so the
+        counts can simply be cleared. Otherwise we count the push actions after
+        the receipt again.
+
+        The caller must hold an exclusive lock on the room, see
+        `_lock_rooms_for_event_push_counts_txn`.
+
+        Args:
+            txn: The database transaction.
+            room_id: The room the receipt is in.
+            user_id: The user who sent the receipt.
+            thread_id: The thread the receipt is for, or None for an unthreaded
+                receipt.
+            receipt_stream_ordering: The stream ordering of the receipt's event.
+        """
+        pending = self.db_pool.simple_select_one_onecol_txn(
+            txn,
+            table="event_push_counts_rooms",
+            keyvalues={"user_id": user_id, "room_id": room_id},
+            retcol="pending",
+            allow_none=True,
+        )
+        if pending is None or pending:
+            # Either we're not maintaining the counts for this user/room, or we're
+            # about to calculate them from scratch (and will see this receipt).
+            return
+
+        unthreaded_receipt_stream_ordering = self.db_pool.simple_select_one_onecol_txn(
+            txn,
+            table="event_push_counts_rooms",
+            keyvalues={"user_id": user_id, "room_id": room_id},
+            retcol="receipt_stream_ordering",
+        )
+
+        # The threads whose counts the receipt applies to, and the stream ordering
+        # of the latest push action that has been counted for them.
+        threads_to_update: Dict[str, int]
+
+        if thread_id is None:
+            # An unthreaded receipt applies to every thread in the room.
+            if unthreaded_receipt_stream_ordering >= receipt_stream_ordering:
+                return
+
+            self.db_pool.simple_update_one_txn(
+                txn,
+                table="event_push_counts_rooms",
+                keyvalues={"user_id": user_id, "room_id": room_id},
+                updatevalues={"receipt_stream_ordering": receipt_stream_ordering},
+            )
+            txn.execute(
+                """
+                SELECT thread_id, stream_ordering FROM event_push_counts
+                WHERE user_id = ? AND room_id = ? AND receipt_stream_ordering < ?
+                """,
+                (user_id, room_id, receipt_stream_ordering),
+            )
+            threads_to_update = dict(cast(List[Tuple[str, int]], txn.fetchall()))
+        else:
+            row = cast(
+                Optional[Tuple[int, int]],
+                self.db_pool.simple_select_one_txn(
+                    txn,
+                    table="event_push_counts",
+                    keyvalues={
+                        "user_id": user_id,
+                        "room_id": room_id,
+                        "thread_id": thread_id,
+                    },
+                    retcols=("stream_ordering", "receipt_stream_ordering"),
+                    allow_none=True,
+                ),
+            )
+            if row is None:
+                # Nothing has been counted in the thread. Add a row for it anyway,
+                # so that any later push actions in it are counted from this
+                # receipt.
+                self.db_pool.simple_insert_txn(
+                    txn,
+                    table="event_push_counts",
+                    values={
+                        "user_id": user_id,
+                        "room_id": room_id,
+                        "thread_id": thread_id,
+                        "notif_count": 0,
+                        "unread_count": 0,
+                        "highlight_count": 0,
+                        "stream_ordering": receipt_stream_ordering,
+                        "receipt_stream_ordering": max(
+                            receipt_stream_ordering, unthreaded_receipt_stream_ordering
+                        ),
+                    },
+                )
+                return
+
+            counted_stream_ordering, thread_receipt_stream_ordering = row
+            if thread_receipt_stream_ordering >= receipt_stream_ordering:
+                return
+            threads_to_update = {thread_id: counted_stream_ordering}
+
+        if not threads_to_update:
+            return
+
+        new_counts: Dict[str, Tuple[int, int, int]] = {}
+        if any(
+            stream_ordering > receipt_stream_ordering
+            for stream_ordering in threads_to_update.values()
+        ):
+            # Some of the push actions that have been counted are still unread, so
+            # we count them again. This is how `_handle_new_receipts_for_notifs_txn`
+            # recalculates the summary for the receipt, so the counts agree with
+            # the summary once the receipt has been processed: the summary's
+            # current counts include push actions from before the receipt, and so
+            # can't be used.
+            for (
+                notif_count,
+                unread_count,
+                unread_thread_id,
+            ) in self._get_notif_unread_count_for_user_room(
+                txn, room_id, user_id, receipt_stream_ordering, thread_id=thread_id
+            ):
+                new_counts[unread_thread_id] = (notif_count, unread_count, 0)
+
+            # Highlights are never deleted from `event_push_actions`.
+            thread_clause = "" if thread_id is None else "AND thread_id = ?"
+            txn.execute(
+                f"""
+                SELECT thread_id, COUNT(*) FROM event_push_actions
+                WHERE user_id = ? AND room_id = ? AND stream_ordering > ?
+                    AND highlight = 1 {thread_clause}
+                GROUP BY thread_id
+                """,
+                (
+                    user_id,
+                    room_id,
+                    receipt_stream_ordering,
+                    *(() if thread_id is None else (thread_id,)),
+                ),
+            )
+            for highlight_thread_id, highlight_count in txn:
+                notif_count, unread_count, _ = new_counts.get(
+                    highlight_thread_id, (0, 0, 0)
+                )
+                new_counts[highlight_thread_id] = (
+                    notif_count,
+                    unread_count,
+                    highlight_count,
+                )
+
+        txn.execute_batch(
+            """
+            UPDATE event_push_counts SET
+                notif_count = ?, unread_count = ?, highlight_count = ?,
+                receipt_stream_ordering = ?
+            WHERE user_id = ? AND room_id = ? AND thread_id = ?
+            """,
+            [
+                (
+                    *new_counts.get(update_thread_id, (0, 0, 0)),
+                    receipt_stream_ordering,
+                    user_id,
+                    room_id,
+                    update_thread_id,
+                )
+                for update_thread_id in threads_to_update
+            ],
+        )
+
+    @wrap_as_background_process("prune_event_push_counts")
+    async def _prune_event_push_counts(self) -> None:
+        """Stop maintaining the unread counts for users who have left rooms, and
+        delete the rows for threads that have been read since."""
+
+        def _prune_event_push_counts_txn(txn: LoggingTransaction) -> bool:
+            batch_size = 1000
+            txn.execute(
+                """
+                SELECT user_id, room_id FROM event_push_counts_rooms AS r
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM local_current_membership AS m
+                    WHERE m.user_id = r.user_id AND m.room_id = r.room_id
+                        AND m.membership = ?
+                )
+                LIMIT ?
+                """,
+                (Membership.JOIN, batch_size),
+            )
+            rows = txn.fetchall()
+            for table in ("event_push_counts", "event_push_counts_rooms"):
+                self.db_pool.simple_delete_many_batch_txn(
+                    txn, table=table, keys=("user_id", "room_id"), values=rows
+                )
+
+            return len(rows) >= batch_size
+
+        while await self.db_pool.runInteraction(
+            "prune_event_push_counts", _prune_event_push_counts_txn
+        ):
+            # We sleep to ensure that we don't overwhelm the DB.
+            await self._clock.sleep(1.0)
+
+        # A thread which has been read before the user's unthreaded receipt doesn't
+        # need a row: if new push actions arrive in it, they'll be counted from the
+        # unthreaded receipt anyway.
+        await self.db_pool.execute(
+            "prune_read_thread_event_push_counts",
+            """
+            DELETE FROM event_push_counts
+            WHERE thread_id != ?
+                AND notif_count = 0 AND unread_count = 0 AND highlight_count = 0
+                AND receipt_stream_ordering <= (
+                    SELECT r.receipt_stream_ordering FROM event_push_counts_rooms AS r
+                    WHERE r.user_id = event_push_counts.user_id
+                        AND r.room_id = event_push_counts.room_id
+                        AND NOT r.pending
+                )
+            """,
+            MAIN_TIMELINE,
+        )
+
     async def get_push_action_users_in_range(
         self, min_stream_ordering: int, max_stream_ordering: int
     ) -> List[str]:
@@ -1231,6 +2209,207 @@ class EventPushActionsWorkerStore(ReceiptsWorkerStore, StreamWorkerStore, SQLBas
                 "Error removing push actions after event persistence failure"
             )
 
+    async def get_background_push_actions_position(self) -> Optional[int]:
+        """Get the (inclusive) stream ordering up to which this instance has
+        calculated push actions in the background, if it has started doing so.
+
+        See `push.calculate_actions_in_background`.
+        """
+        return await self.db_pool.simple_select_one_onecol(
+            table="event_push_actions_background_position",
+            keyvalues={"instance_name": self._instance_name},
+            retcol="stream_ordering",
+            allow_none=True,
+            desc="get_background_push_actions_position",
+        )
+
+    async def reset_background_push_actions_position(self) -> None:
+        """Forget how far this instance has calculated push actions in the
+        background.
+
+        Called when background calculation is disabled, so that if it's enabled
+        again later we start from the current position rather than recalculating
+        the push actions for events that have been persisted in the meantime.
+        """
+        await self.db_pool.simple_delete(
+            table="event_push_actions_background_position",
+            keyvalues={"instance_name": self._instance_name},
+            desc="reset_background_push_actions_position",
+        )
+
+    async def get_events_for_background_push_actions(
+        self, from_stream_ordering: int, to_stream_ordering: int, limit: int
+    ) -> List[Tuple[int, str]]:
+        """Get the non-state events which need their push actions calculating in
+        the background, between the given stream orderings.
+
+        Args:
+            from_stream_ordering: The (exclusive) lower bound.
+            to_stream_ordering: The (inclusive) upper bound.
+            limit: The maximum number of events to return.
+
+        Returns:
+            A list of stream ordering and event ID, in stream order.
+        """
+
+        def get_events_for_background_push_actions_txn(
+            txn: LoggingTransaction,
+        ) -> List[Tuple[int, str]]:
+            sql = """
+                SELECT stream_ordering, event_id FROM events
+                WHERE ? < stream_ordering AND stream_ordering <= ?
+                    AND state_key IS NULL AND NOT outlier
+                ORDER BY stream_ordering ASC
+                LIMIT ?
+            """
+            txn.execute(sql, (from_stream_ordering, to_stream_ordering, limit))
+            return cast(List[Tuple[int, str]], txn.fetchall())
+
+        return await self.db_pool.runInteraction(
+            "get_events_for_background_push_actions",
+            get_events_for_background_push_actions_txn,
+        )
+
+    async def add_background_push_actions(
+        self,
+        push_actions: Collection[
+            Tuple[EventBase, Dict[str, Collection[Union[Mapping, str]]], bool, str]
+        ],
+        stream_ordering: int,
+    ) -> None:
+        """Insert push actions that were calculated in the background for
+        persisted events, and record how far we've got.
+
+        Args:
+            push_actions: Tuples of the event, a mapping of user ID to their
+                push actions, whether the event should increment unread counts,
+                and the thread the event is in.
+            stream_ordering: The (inclusive) stream ordering up to which push
+                actions have now been calculated.
+        """
+
+        def add_background_push_actions_txn(txn: LoggingTransaction) -> None:
+            self._lock_rooms_for_event_push_counts_txn(
+                txn,
+                {event.room_id for event, _, _, _ in push_actions},
+                exclusive=False,
+            )
+
+            # Some of the events may already have push actions, e.g. if they were
+            # calculated before the events were persisted while background
+            # calculation was disabled, so we skip those rather than violating
+            # the unique constraint (and counting them twice).
+            existing = set(
+                self.db_pool.simple_select_many_txn(
+                    txn,
+                    table="event_push_actions",
+                    column="event_id",
+                    iterable=[event.event_id for event, _, _, _ in push_actions],
+                    keyvalues={},
+                    retcols=("event_id", "user_id"),
+                )
+            )
+            new_actions = [
+                (event, user_id, actions, count_as_unread, thread_id)
+                for event, user_id_actions, count_as_unread, thread_id in push_actions
+                for user_id, actions in user_id_actions.items()
+                if (event.event_id, user_id) not in existing
+            ]
+
+            self.db_pool.simple_insert_many_txn(
+                txn,
+                table="event_push_actions",
+                keys=(
+                    "room_id",
+                    "event_id",
+                    "user_id",
+                    "actions",
+                    "stream_ordering",
+                    "topological_ordering",
+                    "notif",
+                    "highlight",
+                    "unread",
+                    "thread_id",
+                ),
+                values=[
+                    (
+                        event.room_id,
+                        event.event_id,
+                        user_id,
+                        _serialize_action(actions, _action_has_highlight(actions)),
+                        event.internal_metadata.stream_ordering,
+                        event.depth,
+                        1 if "notify" in actions else 0,
+                        1 if _action_has_highlight(actions) else 0,
+                        int(count_as_unread),
+                        thread_id,
+                    )
+                    for event, user_id, actions, count_as_unread, thread_id in new_actions
+                ],
+            )
+
+            # The unread counts were cached when the events were persisted, before
+            # they had any push actions.
+            self._invalidate_cache_and_stream_bulk(
+                txn,
+                self.get_unread_event_push_actions_by_room_for_user,
+                {(event.room_id,) for event, _, _, _, _ in new_actions},
+            )
+
+            counted_actions = []
+            for event, user_id, actions, count_as_unread, thread_id in new_actions:
+                assert event.internal_metadata.stream_ordering is not None
+                counted_actions.append(
+                    (
+                        user_id,
+                        event.room_id,
+                        thread_id,
+                        1 if "notify" in actions else 0,
+                        int(count_as_unread),
+                        1 if _action_has_highlight(actions) else 0,
+                        event.internal_metadata.stream_ordering,
+                    )
+                )
+            self._add_to_event_push_counts_txn(txn, counted_actions)
+
+            self.db_pool.simple_upsert_txn(
+                txn,
+                table="event_push_actions_background_position",
+                keyvalues={"instance_name": self._instance_name},
+                values={"stream_ordering": stream_ordering},
+            )
+
+        await self.db_pool.runInteraction(
+            "add_background_push_actions", add_background_push_actions_txn
+        )
+
+    def _get_background_push_actions_position_txn(
+        self, txn: LoggingTransaction
+    ) -> Optional[int]:
+        """Get the stream ordering up to which all pusher instances have calculated
+        push actions in the background, or None if we're not calculating push
+        actions in the background.
+        """
+        if not self.hs.config.push.push_actions_in_background:
+            return None
+
+        instances = self.hs.config.worker.pusher_shard_config.instances
+        if not instances:
+            return None
+
+        clause, args = make_in_list_sql_clause(
+            self.database_engine, "instance_name", instances
+        )
+        txn.execute(
+            f"""
+            SELECT MIN(stream_ordering) FROM event_push_actions_background_position
+            WHERE {clause}
+            """,
+            args,
+        )
+        row = txn.fetchone()
+        return row[0] if row else None
+
     @wrap_as_background_process("event_push_action_stream_orderings")
     async def _find_stream_orderings_for_times(self) -> None:
         await self.db_pool.runInteraction(
@@ -1596,6 +2775,15 @@ class EventPushActionsWorkerStore(ReceiptsWorkerStore, StreamWorkerStore, SQLBas
             rotate_to_stream_ordering = self._stream_id_gen.get_current_token()
             caught_up = True
 
+        # If push actions are calculated in the background, then they may still be
+        # added for events up to the point they've been calculated to.
+        background_position = self._get_background_push_actions_position_txn(txn)
+        if background_position is not None:
+            rotate_to_stream_ordering = min(
+                rotate_to_stream_ordering,
+                max(background_position, old_rotate_stream_ordering),
+            )
+
         logger.info("Rotating notifications up to: %s", rotate_to_stream_ordering)
 
         self._rotate_notifs_before_txn(
@@ -3199,6 +3199,10 @@ class PersistEventsStore:
         """
 
         if notifiable_events:
+            self.store._add_staged_push_actions_to_event_push_counts_txn(
+                txn, notifiable_events
+            )
+
             txn.execute_batch(
                 sql,
                 (
@@ -3226,6 +3230,8 @@ class PersistEventsStore:
     def _remove_push_actions_for_event_id_txn(
         self, txn: LoggingTransaction, room_id: str, event_id: str
     ) -> None:
+        self.store._remove_event_from_event_push_counts_txn(txn, room_id, event_id)
+
         txn.execute(
             "DELETE FROM event_push_actions WHERE room_id = ? AND event_id = ?",
             (room_id, event_id),
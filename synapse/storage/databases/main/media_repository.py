@@ -41,6 +41,9 @@ from synapse.storage.database import (
     DatabasePool,
     LoggingDatabaseConnection,
     LoggingTransaction,
+    make_in_list_sql_clause,
+    make_tuple_comparison_clause,
+    make_tuple_in_list_sql_clause,
 )
 from synapse.types import JsonDict, UserID
 
@@ -154,6 +157,29 @@ class MediaRepositoryBackgroundUpdateStore(SQLBaseStore):
             unique=True,
         )
 
+        # Used to find the least recently accessed media.
+        self.db_pool.updates.register_background_index_update(
+            update_name="local_media_repository_last_access_ts_idx",
+            index_name="local_media_repository_last_access_ts",
+            table="local_media_repository",
+            columns=["last_access_ts"],
+        )
+
+        self.db_pool.updates.register_background_index_update(
+            update_name="local_media_repository_not_accessed_created_ts_idx",
+            index_name="local_media_repository_not_accessed_created_ts",
+            table="local_media_repository",
+            columns=["created_ts"],
+            where_clause="last_access_ts IS NULL",
+        )
+
+        self.db_pool.updates.register_background_index_update(
+            update_name="remote_media_cache_last_access_ts_idx",
+            index_name="remote_media_cache_last_access_ts",
+            table="remote_media_cache",
+            columns=["last_access_ts"],
+        )
+
         self.db_pool.updates.register_background_update_handler(
             BG_UPDATE_REMOVE_MEDIA_REPO_INDEX_WITHOUT_METHOD_2,
             self._drop_media_index_without_method,
@@ -835,56 +861,86 @@ class MediaRepositoryStore(MediaRepositoryBackgroundUpdateStore):
         )
 
     async def get_remote_media_ids(
-        self, before_ts: int, include_quarantined_media: bool
-    ) -> List[Tuple[str, str, str]]:
+        self,
+        before_ts: int,
+        include_quarantined_media: bool,
+        after: Optional[Tuple[int, str, str]] = None,
+        limit: int = 1000,
+    ) -> List[Tuple[str, str, str, int]]:
         """
-        Retrieve a list of server name, media ID tuples from the remote media cache.
+        Retrieve a batch of server name, media ID tuples from the remote media
+        cache, in the order they were last accessed.
 
         Args:
             before_ts: Only retrieve IDs from media that was either last accessed
                 (or if never accessed, created) before the given UNIX timestamp in ms.
             include_quarantined_media: If False, exclude media IDs from the results that have
                 been marked as quarantined.
+            after: If given, only retrieve media after this position, given as
+                the (last access time, server name, media ID) of the last media
+                in the previous batch.
+            limit: The maximum number of media to retrieve.
 
         Returns:
             A list of tuples containing:
                 * The server name of homeserver where the media originates from,
                 * The ID of the media.
                 * The filesystem ID.
+                * When the media was last accessed.
         """
 
-        sql = """
-        SELECT media_origin, media_id, filesystem_id
-        FROM remote_media_cache
-        WHERE last_access_ts < ?
-        """
+        clauses = ["last_access_ts < ?"]
+        args: List[object] = [before_ts]
+
+        if after is not None:
+            after_ts, after_origin, after_media_id = after
+            clause, after_args = make_tuple_comparison_clause(
+                [
+                    ("last_access_ts", after_ts),
+                    ("media_origin", after_origin),
+                    ("media_id", after_media_id),
+                ]
+            )
+            clauses.append(clause)
+            args.extend(after_args)
 
         if include_quarantined_media is False:
             # Only include media that has not been quarantined
-            sql += """
-            AND quarantined_by IS NULL
-            """
+            clauses.append("quarantined_by IS NULL")
+
+        sql = f"""
+            SELECT media_origin, media_id, filesystem_id, last_access_ts
+            FROM remote_media_cache
+            WHERE {" AND ".join(clauses)}
+            ORDER BY last_access_ts, media_origin, media_id
+            LIMIT ?
+        """
+        args.append(limit)
 
         return cast(
-            List[Tuple[str, str, str]],
-            await self.db_pool.execute("get_remote_media_ids", sql, before_ts),
+            List[Tuple[str, str, str, int]],
+            await self.db_pool.execute("get_remote_media_ids", sql, *args),
         )
 
-    async def delete_remote_media(self, media_origin: str, media_id: str) -> None:
-        def delete_remote_media_txn(txn: LoggingTransaction) -> None:
-            self.db_pool.simple_delete_txn(
-                txn,
-                "remote_media_cache",
-                keyvalues={"media_origin": media_origin, "media_id": media_id},
-            )
-            self.db_pool.simple_delete_txn(
-                txn,
-                "remote_media_cache_thumbnails",
-                keyvalues={"media_origin": media_origin, "media_id": media_id},
-            )
+    async def delete_remote_media_batch(
+        self, media: Collection[Tuple[str, str]]
+    ) -> None:
+        """Delete the given remote media, and their thumbnails, from the DB.
+
+        Args:
+            media: The (server name, media ID) of the media to delete.
+        """
+        if not media:
+            return
+
+        def delete_remote_media_batch_txn(txn: LoggingTransaction) -> None:
+            for table in ("remote_media_cache", "remote_media_cache_thumbnails"):
+                self.db_pool.simple_delete_many_batch_txn(
+                    txn, table, ("media_origin", "media_id"), media
+                )
 
         await self.db_pool.runInteraction(
-            "delete_remote_media", delete_remote_media_txn
+            "delete_remote_media_batch", delete_remote_media_batch_txn
         )
 
     async def get_expired_url_cache(self, now_ts: int) -> List[str]:
@@ -946,3 +1002,415 @@ class MediaRepositoryStore(MediaRepositoryBackgroundUpdateStore):
         await self.db_pool.runInteraction(
             "delete_url_cache_media", _delete_url_cache_media_txn
         )
+
+    async def add_media_blob_ref(
+        self,
+        media_origin: str,
+        file_id: str,
+        path: str,
+        sha256: str,
+        media_length: int,
+    ) -> None:
+        """Record that the file at `path` in the media store is a link to the
+        blob with the given digest, creating the blob if needed.
+
+        Args:
+            media_origin: The server the media came from, our own server name
+                for local media.
+            file_id: The media ID for local media, or filesystem ID for remote
+                media.
+            path: The path of the file relative to the media store.
+            sha256: The hex encoded SHA-256 digest of the file.
+            media_length: The length of the file.
+        """
+
+        def _add_media_blob_ref_txn(txn: LoggingTransaction) -> None:
+            existing = self.db_pool.simple_select_one_onecol_txn(
+                txn,
+                "media_blob_refs",
+                {"path": path},
+                "sha256",
+                allow_none=True,
+            )
+            if existing is not None:
+                # Each path is only counted once.
+                return
+
+            self.db_pool.simple_insert_txn(
+                txn,
+                "media_blob_refs",
+                {
+                    "media_origin": media_origin,
+                    "file_id": file_id,
+                    "path": path,
+                    "sha256": sha256,
+                },
+            )
+            txn.execute(
+                """
+                INSERT INTO media_blobs (sha256, media_length, refcount)
+                VALUES (?, ?, 1)
+                ON CONFLICT (sha256) DO UPDATE SET refcount = media_blobs.refcount + 1
+                """,
+                (sha256, media_length),
+            )
+
+        await self.db_pool.runInteraction("add_media_blob_ref", _add_media_blob_ref_txn)
+
+    async def get_media_blob_sha256(self, path: str) -> Optional[str]:
+        """Get the digest of the blob that the file at `path` links to, if any."""
+        return await self.db_pool.simple_select_one_onecol(
+            "media_blob_refs",
+            {"path": path},
+            "sha256",
+            allow_none=True,
+            desc="get_media_blob_sha256",
+        )
+
+    async def remove_media_blob_refs(
+        self, media: Collection[Tuple[str, str]]
+    ) -> List[str]:
+        """Remove the references to blobs from the files of the given media,
+        including their thumbnails.
+
+        Args:
+            media: The (origin, file ID) of each media, where the origin is our
+                own server name for local media.
+
+        Returns:
+            The digests of the blobs which are no longer referenced, and so
+            should be deleted.
+        """
+        if not media:
+            return []
+
+        def _remove_media_blob_refs_txn(txn: LoggingTransaction) -> List[str]:
+            clause, args = make_tuple_in_list_sql_clause(
+                txn.database_engine, ("media_origin", "file_id"), media
+            )
+            txn.execute(f"SELECT sha256 FROM media_blob_refs WHERE {clause}", args)
+            sha256s = cast(List[Tuple[str]], txn.fetchall())
+            if not sha256s:
+                return []
+
+            self.db_pool.simple_delete_many_batch_txn(
+                txn, "media_blob_refs", ("media_origin", "file_id"), media
+            )
+            txn.execute_batch(
+                "UPDATE media_blobs SET refcount = refcount - 1 WHERE sha256 = ?",
+                sha256s,
+            )
+
+            sql = "SELECT sha256 FROM media_blobs WHERE refcount <= 0 AND "
+            clause, args = make_in_list_sql_clause(
+                txn.database_engine, "sha256", {sha256 for (sha256,) in sha256s}
+            )
+            txn.execute(sql + clause, args)
+            unreferenced = [sha256 for (sha256,) in txn]
+
+            for table in ("media_blobs", "media_blob_thumbnails"):
+                self.db_pool.simple_delete_many_txn(
+                    txn, table, "sha256", unreferenced, {}
+                )
+
+            return unreferenced
+
+        return await self.db_pool.runInteraction(
+            "remove_media_blob_refs", _remove_media_blob_refs_txn
+        )
+
+    async def get_media_blob_thumbnails(
+        self, sha256: str, media_type: str
+    ) -> Optional[Tuple[Tuple[int, int], List[Tuple[ThumbnailInfo, str]]]]:
+        """Get the thumbnails generated for the blob with the given digest, when
+        stored with the given content type.
+
+        Returns:
+            None if no thumbnails have been generated, otherwise the dimensions
+            of the image and a list of the thumbnails, along with the path
+            (relative to the media store) of a file to link to for each.
+        """
+        rows = cast(
+            List[Tuple[int, int, int, int, str, str, int, str]],
+            await self.db_pool.simple_select_list(
+                "media_blob_thumbnails",
+                {"sha256": sha256, "media_type": media_type},
+                (
+                    "image_width",
+                    "image_height",
+                    "thumbnail_width",
+                    "thumbnail_height",
+                    "thumbnail_method",
+                    "thumbnail_type",
+                    "thumbnail_length",
+                    "path",
+                ),
+                desc="get_media_blob_thumbnails",
+            ),
+        )
+        if not rows:
+            return None
+
+        return (rows[0][0], rows[0][1]), [
+            (
+                ThumbnailInfo(
+                    width=row[2],
+                    height=row[3],
+                    method=row[4],
+                    type=row[5],
+                    length=row[6],
+                ),
+                row[7],
+            )
+            for row in rows
+        ]
+
+    async def store_media_blob_thumbnails(
+        self,
+        sha256: str,
+        media_type: str,
+        image_width: int,
+        image_height: int,
+        thumbnails: List[Tuple[ThumbnailInfo, str]],
+    ) -> None:
+        """Record the thumbnails generated for the blob with the given digest.
+
+        Args:
+            sha256: The digest of the blob.
+            media_type: The content type the media was stored with.
+            image_width: The width of the image.
+            image_height: The height of the image.
+            thumbnails: The thumbnails, along with the path of each relative to
+                the media store.
+        """
+
+        def _store_media_blob_thumbnails_txn(txn: LoggingTransaction) -> None:
+            for thumbnail, path in thumbnails:
+                self.db_pool.simple_upsert_txn(
+                    txn,
+                    "media_blob_thumbnails",
+                    keyvalues={
+                        "sha256": sha256,
+                        "media_type": media_type,
+                        "thumbnail_width": thumbnail.width,
+                        "thumbnail_height": thumbnail.height,
+                        "thumbnail_type": thumbnail.type,
+                        "thumbnail_method": thumbnail.method,
+                    },
+                    values={
+                        "image_width": image_width,
+                        "image_height": image_height,
+                        "thumbnail_length": thumbnail.length,
+                        "path": path,
+                    },
+                )
+
+        await self.db_pool.runInteraction(
+            "store_media_blob_thumbnails", _store_media_blob_thumbnails_txn
+        )
+
+    async def get_media_local_cache_eviction_position(self) -> int:
+        """Get the last access time before which media has been evicted from
+        the local media store."""
+        return await self.db_pool.simple_select_one_onecol(
+            "media_local_cache_eviction_position",
+            {},
+            "last_access_ts",
+            desc="get_media_local_cache_eviction_position",
+        )
+
+    async def update_media_local_cache_eviction_position(
+        self, last_access_ts: int
+    ) -> None:
+        await self.db_pool.simple_update_one(
+            "media_local_cache_eviction_position",
+            {},
+            {"last_access_ts": last_access_ts},
+            desc="update_media_local_cache_eviction_position",
+        )
+
+    async def add_media_local_cache_eviction(
+        self, server_name: Optional[str], file_id: str
+    ) -> None:
+        """Record that the given media has been evicted from the local media
+        store.
+
+        Args:
+            server_name: The origin of the media, or None for local media.
+            file_id: The file ID of the media.
+        """
+        await self.db_pool.simple_upsert(
+            "media_local_cache_evictions",
+            keyvalues={
+                "media_origin": server_name or self.server_name,
+                "file_id": file_id,
+            },
+            values={},
+            desc="add_media_local_cache_eviction",
+        )
+
+    async def remove_media_local_cache_evictions(
+        self, media: Collection[Tuple[str, str]]
+    ) -> None:
+        """Record that the given media is no longer evicted from the local
+        media store, as it has been fetched back or deleted.
+
+        Args:
+            media: The (origin, file ID) of each media, where the origin is our
+                own server name for local media.
+        """
+        if not media:
+            return
+
+        await self.db_pool.runInteraction(
+            "remove_media_local_cache_evictions",
+            self.db_pool.simple_delete_many_batch_txn,
+            "media_local_cache_evictions",
+            ("media_origin", "file_id"),
+            media,
+        )
+
+    def _media_accessed_clauses(
+        self, op: str, include_local: bool, include_remote: bool
+    ) -> List[Tuple[str, List[str]]]:
+        """Get the queries selecting (last access time, origin, media ID, file
+        ID, length) of media in the local media store where the last access
+        time compares with `op` to the first query argument.
+
+        Local media which has never been accessed is treated as last accessed
+        when it was created. URL preview media is excluded, as it is expired
+        separately.
+
+        Returns:
+            A list of the queries and the arguments that follow the last access
+            time.
+        """
+        clauses = []
+        if include_local:
+            not_evicted = """
+                NOT EXISTS (
+                    SELECT 1 FROM media_local_cache_evictions AS e
+                    WHERE e.media_origin = ? AND e.file_id = media_id
+                )
+            """
+            clauses.append(
+                (
+                    f"""
+                    SELECT last_access_ts, NULL, media_id, media_id, media_length
+                    FROM local_media_repository
+                    WHERE last_access_ts {op} ?
+                        AND media_length IS NOT NULL AND url_cache IS NULL
+                        AND {not_evicted}
+                    """,
+                    [self.server_name],
+                )
+            )
+            clauses.append(
+                (
+                    f"""
+                    SELECT created_ts, NULL, media_id, media_id, media_length
+                    FROM local_media_repository
+                    WHERE last_access_ts IS NULL AND created_ts {op} ?
+                        AND media_length IS NOT NULL AND url_cache IS NULL
+                        AND {not_evicted}
+                    """,
+                    [self.server_name],
+                )
+            )
+        if include_remote:
+            clauses.append(
+                (
+                    f"""
+                    SELECT last_access_ts, media_origin, media_id, filesystem_id,
+                        media_length
+                    FROM remote_media_cache AS r
+                    WHERE last_access_ts {op} ?
+                        AND NOT EXISTS (
+                            SELECT 1 FROM media_local_cache_evictions AS e
+                            WHERE e.media_origin = r.media_origin
+                                AND e.file_id = r.filesystem_id
+                        )
+                    """,
+                    [],
+                )
+            )
+        return clauses
+
+    async def get_size_of_media_accessed_since(
+        self, since_ts: int, include_local: bool, include_remote: bool
+    ) -> int:
+        """Get the total length of the local and/or remote media in the local
+        media store last accessed at or after the given time.
+        """
+
+        def _get_size_of_media_accessed_since_txn(txn: LoggingTransaction) -> int:
+            total = 0
+            for clause, args in self._media_accessed_clauses(
+                ">=", include_local, include_remote
+            ):
+                txn.execute(
+                    "SELECT COALESCE(SUM(media_length), 0) FROM (%s) AS media"
+                    % (clause,),
+                    (since_ts, *args),
+                )
+                row = txn.fetchone()
+                assert row is not None
+                total += row[0]
+            return total
+
+        return await self.db_pool.runInteraction(
+            "get_size_of_media_accessed_since", _get_size_of_media_accessed_since_txn
+        )
+
+    async def get_media_accessed_since(
+        self, since_ts: int, include_local: bool, include_remote: bool, limit: int
+    ) -> Tuple[List[Tuple[int, Optional[str], str, str, int]], int]:
+        """Get the least recently accessed of the local and/or remote media in
+        the local media store last accessed at or after the given time.
+
+        Args:
+            since_ts: The time to get media accessed at or after.
+            include_local: Whether to include local media.
+            include_remote: Whether to include remote media.
+            limit: The rough number of media to return. More may be returned,
+                so that all media accessed at the same time is returned
+                together.
+
+        Returns:
+            A list of (last access time, origin, media ID, file ID, length) of the
+            media in order of last access, where the origin is None for local
+            media, and the time to get the next media from.
+        """
+
+        def _get_media_accessed_since_txn(
+            txn: LoggingTransaction,
+        ) -> Tuple[List[Tuple[int, Optional[str], str, str, int]], int]:
+            rows: List[Tuple[int, Optional[str], str, str, int]] = []
+            for clause, args in self._media_accessed_clauses(
+                ">=", include_local, include_remote
+            ):
+                txn.execute(
+                    clause + " ORDER BY 1 ASC LIMIT ?", (since_ts, *args, limit)
+                )
+                rows.extend(cast(List[Tuple[int, Optional[str], str, str, int]], txn))
+
+            if not rows:
+                return [], since_ts
+
+            rows.sort(key=lambda row: row[0])
+            last_ts = rows[min(limit, len(rows)) - 1][0]
+
+            # Return all of the media accessed at the last time, so that the
+            # next batch can start after it.
+            rows = [row for row in rows if row[0] < last_ts]
+            for clause, args in self._media_accessed_clauses(
+                "=", include_local, include_remote
+            ):
+                txn.execute(clause, (last_ts, *args))
+                rows.extend(cast(List[Tuple[int, Optional[str], str, str, int]], txn))
+
+            return rows, last_ts + 1
+
+        return await self.db_pool.runInteraction(
+            "get_media_accessed_since", _get_media_accessed_since_txn
+        )
@@ -258,6 +258,14 @@ class PurgeEventsStore(StateGroupWorkerStore, CacheInvalidationWorkerStore):
                 (room_id,),
             )
 
+        # The unread counts may include the push actions we just deleted, so stop
+        # maintaining them incrementally. They'll be calculated again the next time
+        # they're needed.
+        for table in ("event_push_counts", "event_push_counts_rooms"):
+            logger.info("[purge] removing unread counts from %s", table)
+
+            txn.execute("DELETE FROM %s WHERE room_id = ?" % (table,), (room_id,))
+
         # Mark all state and own events as outliers
         logger.info("[purge] marking remaining events as outliers")
         txn.execute(
@@ -473,6 +481,8 @@ class PurgeEventsStore(StateGroupWorkerStore, CacheInvalidationWorkerStore):
             # no useful index, but let's clear them anyway
             "appservice_room_list",
             "e2e_room_keys",
+            "event_push_counts",
+            "event_push_counts_rooms",
             "event_push_summary",
             "pusher_throttle",
             "room_account_data",
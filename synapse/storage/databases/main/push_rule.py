@@ -59,6 +59,7 @@ from synapse.types import JsonDict
 from synapse.util import json_encoder, unwrapFirstError
 from synapse.util.async_helpers import gather_results
 from synapse.util.caches.descriptors import cached, cachedList
+from synapse.util.caches.lrucache import LruCache
 from synapse.util.caches.stream_change_cache import StreamChangeCache
 
 if TYPE_CHECKING:
@@ -171,6 +172,31 @@ class PushRulesWorkerStore(
         self._push_rule_id_gen = IdGenerator(db_conn, "push_rules", "id")
         self._push_rules_enable_id_gen = IdGenerator(db_conn, "push_rules_enable", "id")
 
+        # Most users have identical push rules (usually just the defaults), so we
+        # share a single `FilteredPushRules` between users with the same rules.
+        # This saves memory, and lets the `BulkPushRuleEvaluator` evaluate each
+        # distinct set of rules only once per event.
+        self._interned_push_rules: LruCache[
+            Tuple[Tuple[Tuple[str, int, str, str], ...], Tuple[Tuple[str, bool], ...]],
+            FilteredPushRules,
+        ] = LruCache(max_size=5000, cache_name="interned_push_rules")
+
+    def _load_interned_rules(
+        self,
+        rawrules: List[Tuple[str, int, str, str]],
+        enabled_map: Dict[str, bool],
+    ) -> FilteredPushRules:
+        """As `_load_rules`, but returns the same `FilteredPushRules` object for
+        identical rules."""
+        key = (tuple(rawrules), tuple(sorted(enabled_map.items())))
+        filtered_rules = self._interned_push_rules.get(key)
+        if filtered_rules is None:
+            filtered_rules = _load_rules(
+                rawrules, enabled_map, self.hs.config.experimental
+            )
+            self._interned_push_rules.set(key, filtered_rules)
+        return filtered_rules
+
     def get_max_push_rules_stream_id(self) -> int:
         """Get the position of the push rules stream.
 
@@ -222,10 +248,8 @@ class PushRulesWorkerStore(
 
         enabled_map = await self.get_push_rules_enabled_for_user(user_id)
 
-        return _load_rules(
-            [(row[0], row[1], row[3], row[4]) for row in rows],
-            enabled_map,
-            self.hs.config.experimental,
+        return self._load_interned_rules(
+            [(row[0], row[1], row[3], row[4]) for row in rows], enabled_map
         )
 
     async def get_push_rules_enabled_for_user(self, user_id: str) -> Dict[str, bool]:
@@ -311,8 +335,8 @@ class PushRulesWorkerStore(
         results: Dict[str, FilteredPushRules] = {}
 
         for user_id, rules in raw_rules.items():
-            results[user_id] = _load_rules(
-                rules, enabled_map_by_user.get(user_id, {}), self.hs.config.experimental
+            results[user_id] = self._load_interned_rules(
+                rules, enabled_map_by_user.get(user_id, {})
             )
 
         return results
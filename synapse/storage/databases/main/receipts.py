@@ -66,6 +66,9 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+# How often to drop old receipts from the in-memory receipts snapshot.
+RECENT_RECEIPTS_PRUNE_MS = 5 * 60 * 1000
+
 
 @attr.s(auto_attribs=True, slots=True, frozen=True)
 class ReceiptInRoom:
@@ -118,6 +121,16 @@ class ReceiptInRoom:
         return content
 
 
+@attr.s(auto_attribs=True, slots=True, frozen=True)
+class _RecentReceipt:
+    """A receipt held in the in-memory receipts snapshot, along with its
+    position in the receipts stream."""
+
+    stream_id: int
+    instance_name: str
+    receipt: ReceiptInRoom
+
+
 class ReceiptsWorkerStore(SQLBaseStore):
     def __init__(
         self,
@@ -163,6 +176,22 @@ class ReceiptsWorkerStore(SQLBaseStore):
             prefilled_cache=receipts_stream_prefill,
         )
 
+        # A snapshot of the latest receipt for each (receipt type, user, thread)
+        # in each room that has been written since `_recent_receipts_since`.
+        # Only one receipt is kept per key, just as in `receipts_linearized`, so
+        # incremental syncs from after that position can be served from memory
+        # rather than rebuilding the receipts from the database for every sync.
+        self._recent_receipts: Dict[
+            str, Dict[Tuple[str, str, Optional[str]], _RecentReceipt]
+        ] = {}
+        self._recent_receipts_since = max_receipts_stream_id.get_max_stream_pos()
+
+        # The position that `_recent_receipts_since` will be moved up to the next
+        # time we prune the snapshot. Pruning every `RECENT_RECEIPTS_PRUNE_MS`
+        # means that the snapshot always covers at least that long.
+        self._recent_receipts_prune_to = self._recent_receipts_since
+        self._clock.looping_call(self._prune_recent_receipts, RECENT_RECEIPTS_PRUNE_MS)
+
     def get_max_receipt_stream_id(self) -> MultiWriterStreamToken:
         """Get the current max stream ID for receipts stream"""
 
@@ -355,6 +384,12 @@ class ReceiptsWorkerStore(SQLBaseStore):
                 room_ids, from_key.stream
             )
 
+            recent_results = self._get_recent_receipts_for_rooms(
+                room_ids, to_key, from_key
+            )
+            if recent_results is not None:
+                return list(recent_results.values())
+
         results = await self._get_linearized_receipts_for_rooms(
             room_ids, to_key, from_key=from_key
         )
@@ -386,8 +421,107 @@ class ReceiptsWorkerStore(SQLBaseStore):
             ):
                 return []
 
+            recent_results = self._get_recent_receipts_for_rooms(
+                [room_id], to_key, from_key
+            )
+            if recent_results is not None:
+                return list(recent_results.values())
+
         return await self._get_linearized_receipts_for_room(room_id, to_key, from_key)
 
+    def _get_recent_receipts_for_rooms(
+        self,
+        room_ids: Iterable[str],
+        to_key: MultiWriterStreamToken,
+        from_key: MultiWriterStreamToken,
+    ) -> Optional[Dict[str, JsonMapping]]:
+        """Get receipts for the given rooms from the in-memory receipts
+        snapshot.
+
+        Returns:
+            A map from room ID to receipt EDU, for those rooms with receipts
+            between the given keys, or None if the snapshot doesn't go back as
+            far as `from_key`.
+        """
+        if from_key.stream < self._recent_receipts_since:
+            return None
+
+        results: Dict[str, JsonMapping] = {}
+        for room_id in room_ids:
+            recent_receipts = self._recent_receipts.get(room_id)
+            if not recent_receipts:
+                continue
+
+            receipts = [
+                recent.receipt
+                for recent in recent_receipts.values()
+                if MultiWriterStreamToken.is_stream_position_in_range(
+                    from_key, to_key, recent.instance_name, recent.stream_id
+                )
+            ]
+            if receipts:
+                results[room_id] = {
+                    "room_id": room_id,
+                    "type": EduTypes.RECEIPT,
+                    "content": ReceiptInRoom.merge_to_content(receipts),
+                }
+
+        return results
+
+    def _add_recent_receipt(
+        self,
+        room_id: str,
+        receipt_type: str,
+        user_id: str,
+        event_id: str,
+        thread_id: Optional[str],
+        data: JsonMapping,
+        instance_name: str,
+        stream_id: int,
+    ) -> None:
+        """Record a newly written receipt in the in-memory receipts snapshot,
+        replacing any earlier receipt from the user of the same type and
+        thread."""
+        if stream_id <= self._recent_receipts_since:
+            return
+
+        recent_receipts = self._recent_receipts.setdefault(room_id, {})
+        key = (receipt_type, user_id, thread_id)
+        existing = recent_receipts.get(key)
+        if existing is not None and existing.stream_id > stream_id:
+            return
+
+        recent_receipts[key] = _RecentReceipt(
+            stream_id=stream_id,
+            instance_name=instance_name,
+            receipt=ReceiptInRoom(
+                receipt_type=receipt_type,
+                user_id=user_id,
+                event_id=event_id,
+                thread_id=thread_id,
+                data=data,
+            ),
+        )
+
+    def _prune_recent_receipts(self) -> None:
+        """Drop receipts from the in-memory receipts snapshot that were written
+        before the last time we pruned it."""
+        self._recent_receipts_since = self._recent_receipts_prune_to
+        self._recent_receipts_prune_to = (
+            self.get_max_receipt_stream_id().get_max_stream_pos()
+        )
+
+        for room_id in list(self._recent_receipts):
+            recent_receipts = {
+                key: recent
+                for key, recent in self._recent_receipts[room_id].items()
+                if recent.stream_id > self._recent_receipts_since
+            }
+            if recent_receipts:
+                self._recent_receipts[room_id] = recent_receipts
+            else:
+                del self._recent_receipts[room_id]
+
     @cached(tree=True)
     async def _get_linearized_receipts_for_room(
         self,
@@ -889,6 +1023,16 @@ class ReceiptsWorkerStore(SQLBaseStore):
                     row.room_id, row.receipt_type, row.user_id
                 )
                 self._receipts_stream_cache.entity_has_changed(row.room_id, token)
+                self._add_recent_receipt(
+                    row.room_id,
+                    row.receipt_type,
+                    row.user_id,
+                    row.event_id,
+                    row.thread_id,
+                    row.data,
+                    instance_name,
+                    token,
+                )
 
         return super().process_replication_rows(stream_name, instance_name, token, rows)
 
@@ -975,6 +1119,17 @@ class ReceiptsWorkerStore(SQLBaseStore):
         txn.call_after(
             self._receipts_stream_cache.entity_has_changed, room_id, stream_id
         )
+        txn.call_after(
+            self._add_recent_receipt,
+            room_id,
+            receipt_type,
+            user_id,
+            event_id,
+            thread_id,
+            data,
+            self._instance_name,
+            stream_id,
+        )
 
         keyvalues = {
             "room_id": room_id,
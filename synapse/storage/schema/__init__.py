@@ -153,6 +153,15 @@ Changes in SCHEMA_VERSION = 87
 Changes in SCHEMA_VERSION = 88
     - MSC4140: Add `delayed_events` table that keeps track of events that are to
       be posted in response to a resettable timeout or an on-demand action.
+    - Add `event_push_actions_background_position` table to track the progress of
+      calculating push actions in the background.
+    - Add `event_push_counts` and `event_push_counts_rooms` tables to maintain
+      unread counts incrementally.
+    - Add `media_blobs`, `media_blob_refs` and `media_blob_thumbnails` tables for
+      content-addressed media storage.
+    - Add indices on the last access time of media, and the
+      `media_local_cache_eviction_position` table to track evicting media from the
+      local media store.
 """
 
 
@@ -0,0 +1,20 @@
+--
+-- This file is licensed under the Affero General Public License (AGPL) version 3.
+--
+-- Copyright (C) 2024 New Vector, Ltd
+--
+-- This program is free software: you can redistribute it and/or modify
+-- it under the terms of the GNU Affero General Public License as
+-- published by the Free Software Foundation, either version 3 of the
+-- License, or (at your option) any later version.
+--
+-- See the GNU Affero General Public License for more details:
+-- <https://www.gnu.org/licenses/agpl-3.0.html>.
+
+-- When `push.calculate_actions_in_background` is enabled, tracks for each pusher
+-- instance the (inclusive) stream ordering up to which push actions have been
+-- calculated for the users it handles.
+CREATE TABLE event_push_actions_background_position (
+    instance_name TEXT NOT NULL PRIMARY KEY,
+    stream_ordering BIGINT NOT NULL
+);
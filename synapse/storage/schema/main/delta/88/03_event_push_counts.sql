@@ -0,0 +1,49 @@
+--
+-- This file is licensed under the Affero General Public License (AGPL) version 3.
+--
+-- Copyright (C) 2024 New Vector, Ltd
+--
+-- This program is free software: you can redistribute it and/or modify
+-- it under the terms of the GNU Affero General Public License as
+-- published by the Free Software Foundation, either version 3 of the
+-- License, or (at your option) any later version.
+--
+-- See the GNU Affero General Public License for more details:
+-- <https://www.gnu.org/licenses/agpl-3.0.html>.
+
+-- Incrementally maintained per-user, per-room, per-thread unread counts. These
+-- are updated as push actions are inserted and as read receipts arrive, so that
+-- the counts can be read without aggregating `event_push_actions`.
+CREATE TABLE event_push_counts (
+    user_id TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    notif_count BIGINT NOT NULL,
+    unread_count BIGINT NOT NULL,
+    highlight_count BIGINT NOT NULL,
+    -- The (inclusive) stream ordering of the latest push action that has been
+    -- counted.
+    stream_ordering BIGINT NOT NULL,
+    -- Push actions at or before this stream ordering have been read.
+    receipt_stream_ordering BIGINT NOT NULL
+);
+
+CREATE UNIQUE INDEX event_push_counts_unique ON event_push_counts(user_id, room_id, thread_id);
+CREATE INDEX event_push_counts_room_id ON event_push_counts(room_id);
+
+-- The user/room pairs whose counts are maintained in `event_push_counts`, along
+-- with the user's latest unthreaded read receipt in the room (or their join, if
+-- they have not sent one).
+--
+-- Rows are added in the background after the counts for the user/room are
+-- calculated the slow way. They are pending until the counts have been
+-- calculated and stored in `event_push_counts`.
+CREATE TABLE event_push_counts_rooms (
+    user_id TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    receipt_stream_ordering BIGINT NOT NULL,
+    pending BOOLEAN NOT NULL
+);
+
+CREATE UNIQUE INDEX event_push_counts_rooms_unique ON event_push_counts_rooms(user_id, room_id);
+CREATE INDEX event_push_counts_rooms_room_id ON event_push_counts_rooms(room_id);
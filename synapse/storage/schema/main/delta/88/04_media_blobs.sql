@@ -0,0 +1,59 @@
+--
+-- This file is licensed under the Affero General Public License (AGPL) version 3.
+--
+-- Copyright (C) 2024 New Vector, Ltd
+--
+-- This program is free software: you can redistribute it and/or modify
+-- it under the terms of the GNU Affero General Public License as
+-- published by the Free Software Foundation, either version 3 of the
+-- License, or (at your option) any later version.
+--
+-- See the GNU Affero General Public License for more details:
+-- <https://www.gnu.org/licenses/agpl-3.0.html>.
+
+-- Content-addressed storage of media files, used when
+-- `enable_media_deduplication` is on. Each distinct file is stored once, keyed
+-- by its SHA-256 digest, and the files in the media store are hard links to it.
+CREATE TABLE media_blobs (
+    sha256 TEXT NOT NULL PRIMARY KEY,
+    media_length BIGINT NOT NULL,
+    -- The number of rows in `media_blob_refs` for this blob.
+    refcount BIGINT NOT NULL
+);
+
+-- The files in the media store which link to a blob.
+CREATE TABLE media_blob_refs (
+    -- The server the media came from, including our own server name for local
+    -- media.
+    media_origin TEXT NOT NULL,
+    -- The media ID for local media, or the filesystem ID for remote media.
+    file_id TEXT NOT NULL,
+    -- The path of the file, relative to the media store.
+    path TEXT NOT NULL,
+    sha256 TEXT NOT NULL
+);
+
+CREATE UNIQUE INDEX media_blob_refs_path ON media_blob_refs(path);
+CREATE INDEX media_blob_refs_file_id ON media_blob_refs(media_origin, file_id);
+
+-- The thumbnails generated for each blob, so that other media with the same
+-- content can link to them rather than generating them again. Which thumbnails
+-- are generated depends on the content type the media was stored with.
+CREATE TABLE media_blob_thumbnails (
+    sha256 TEXT NOT NULL,
+    media_type TEXT NOT NULL,
+    -- The dimensions of the image.
+    image_width INTEGER NOT NULL,
+    image_height INTEGER NOT NULL,
+    thumbnail_width INTEGER NOT NULL,
+    thumbnail_height INTEGER NOT NULL,
+    thumbnail_type TEXT NOT NULL,
+    thumbnail_method TEXT NOT NULL,
+    thumbnail_length INTEGER NOT NULL,
+    -- The path of a thumbnail file to link to, relative to the media store.
+    path TEXT NOT NULL
+);
+
+CREATE UNIQUE INDEX media_blob_thumbnails_key ON media_blob_thumbnails(
+    sha256, media_type, thumbnail_width, thumbnail_height, thumbnail_type, thumbnail_method
+);
@@ -0,0 +1,43 @@
+--
+-- This file is licensed under the Affero General Public License (AGPL) version 3.
+--
+-- Copyright (C) 2024 New Vector, Ltd
+--
+-- This program is free software: you can redistribute it and/or modify
+-- it under the terms of the GNU Affero General Public License as
+-- published by the Free Software Foundation, either version 3 of the
+-- License, or (at your option) any later version.
+--
+-- See the GNU Affero General Public License for more details:
+-- <https://www.gnu.org/licenses/agpl-3.0.html>.
+
+-- Indices to find media by when it was last accessed (or, for local media that
+-- has never been accessed, when it was created).
+INSERT INTO background_updates (ordering, update_name, progress_json) VALUES
+    (8805, 'local_media_repository_last_access_ts_idx', '{}');
+
+INSERT INTO background_updates (ordering, update_name, progress_json) VALUES
+    (8805, 'local_media_repository_not_accessed_created_ts_idx', '{}');
+
+INSERT INTO background_updates (ordering, update_name, progress_json) VALUES
+    (8805, 'remote_media_cache_last_access_ts_idx', '{}');
+
+-- When `media_local_cache` is configured, media last accessed before this time
+-- has been evicted from the local media store.
+CREATE TABLE media_local_cache_eviction_position (
+    Lock CHAR(1) NOT NULL DEFAULT 'X' UNIQUE,  -- Makes sure this table only has one row.
+    last_access_ts BIGINT NOT NULL,
+    CHECK (Lock='X')
+);
+
+INSERT INTO media_local_cache_eviction_position (last_access_ts) VALUES (0);
+
+-- Media which has been evicted from the local media store, and not fetched
+-- back since. Accessing the thumbnails of media doesn't fetch the media itself
+-- back, so we can't rely on the eviction position alone.
+CREATE TABLE media_local_cache_evictions (
+    media_origin TEXT NOT NULL,  -- Our own server name for local media.
+    file_id TEXT NOT NULL
+);
+
+CREATE UNIQUE INDEX media_local_cache_evictions_key ON media_local_cache_evictions (media_origin, file_id);
@@ -19,35 +19,55 @@
 #
 #
 import logging
-from typing import Generic, Hashable, List, Set, TypeVar
-
-import attr
+from typing import Dict, Generic, Hashable, List, Optional, Set, Tuple, TypeVar
 
 logger = logging.getLogger(__name__)
 
 T = TypeVar("T", bound=Hashable)
 
 
-@attr.s(slots=True, frozen=True, auto_attribs=True)
-class _Entry(Generic[T]):
-    end_key: int
-    elements: Set[T] = attr.Factory(set)
-
-
 class WheelTimer(Generic[T]):
     """Stores arbitrary objects that will be returned after their timers have
     expired.
+
+    This is a hierarchical timing wheel: the bottom level has a slot for each of
+    the next `wheel_size` buckets, and each level above it has slots covering
+    `wheel_size` times as many buckets as the level below. Objects are inserted
+    into the lowest level with a slot covering the bucket they expire in, and
+    are moved down to a lower level when the slot they are in comes around.
+    Inserting and fetching therefore take constant time per object, however many
+    objects there are and however far in the future they expire.
     """
 
-    def __init__(self, bucket_size: int = 5000) -> None:
+    def __init__(
+        self, bucket_size: int = 5000, wheel_size: int = 64, levels: int = 4
+    ) -> None:
         """
         Args:
             bucket_size: Size of buckets in ms. Corresponds roughly to the
                 accuracy of the timer.
+            wheel_size: The number of slots in each level of the wheel.
+            levels: The number of levels in the wheel. Objects which expire more
+                than `wheel_size ** levels` buckets in the future are kept in
+                the top level until they come into range.
         """
         self.bucket_size: int = bucket_size
-        self.entries: List[_Entry[T]] = []
-        self.current_tick: int = 0
+        self._wheel_size = wheel_size
+
+        # The slots for each level, each holding the objects in the slot along
+        # with the bucket they expire in.
+        self._levels: List[List[Set[Tuple[int, T]]]] = [
+            [set() for _ in range(wheel_size)] for _ in range(levels)
+        ]
+        # The number of entries in each level.
+        self._level_sizes: List[int] = [0] * levels
+
+        # The bucket up to which (inclusive) objects have been fetched. None
+        # until the timer is first used.
+        self.current_tick: Optional[int] = None
+
+        # Objects which had already expired when they were inserted.
+        self._expired: Set[T] = set()
 
     def insert(self, now: int, obj: T, then: int) -> None:
         """Inserts object into timer.
@@ -60,38 +80,50 @@ class WheelTimer(Generic[T]):
         then_key = int(then / self.bucket_size) + 1
         now_key = int(now / self.bucket_size)
 
-        if self.entries:
-            min_key = self.entries[0].end_key
-            max_key = self.entries[-1].end_key
-
-            if min_key < now_key - 10:
-                # If we have ten buckets that are due and still nothing has
-                # called `fetch()` then we likely have a bug that is causing a
-                # memory leak.
-                logger.warning(
-                    "Inserting into a wheel timer that hasn't been read from recently. Item: %s",
-                    obj,
-                )
-
-            if then_key <= max_key:
-                # The max here is to protect against inserts for times in the past
-                self.entries[max(min_key, then_key) - min_key].elements.add(obj)
-                return
-
-        next_key = now_key + 1
-        if self.entries:
-            last_key = self.entries[-1].end_key
-        else:
-            last_key = next_key
-
-        # Handle the case when `then` is in the past and `entries` is empty.
-        then_key = max(last_key, then_key)
-
-        # Add empty entries between the end of the current list and when we want
-        # to insert. This ensures there are no gaps.
-        self.entries.extend(_Entry(key) for key in range(last_key, then_key + 1))
-
-        self.entries[-1].elements.add(obj)
+        if self.current_tick is None:
+            self.current_tick = now_key
+        elif self.current_tick < now_key - 10 and len(self):
+            # If we have ten buckets that are due and still nothing has
+            # called `fetch()` then we likely have a bug that is causing a
+            # memory leak.
+            logger.warning(
+                "Inserting into a wheel timer that hasn't been read from recently. Item: %s",
+                obj,
+            )
+
+        self._insert(obj, then_key)
+
+    def _insert(self, obj: T, then_key: int) -> None:
+        """Adds an object to the slot for the bucket it expires in, relative to
+        `current_tick`.
+        """
+        assert self.current_tick is not None
+
+        # Objects inserted for times in the past are returned by the next fetch.
+        if then_key <= self.current_tick:
+            self._expired.add(obj)
+            return
+
+        # Find the lowest level that reaches `then_key`. Slots in level `n`
+        # cover `wheel_size ** n` buckets, and the level covers the next
+        # `wheel_size ** (n + 1)` buckets after the current one.
+        delta = then_key - self.current_tick - 1
+        span = 1
+        level = 0
+        while delta >= span * self._wheel_size and level < len(self._levels) - 1:
+            span *= self._wheel_size
+            level += 1
+
+        # Objects which expire beyond the end of the wheel go in the last slot
+        # of the top level, and are reinserted from there as they come into
+        # range.
+        slot_key = min(then_key, self.current_tick + span * self._wheel_size)
+
+        slot = self._levels[level][(slot_key // span) % self._wheel_size]
+        entry = (then_key, obj)
+        if entry not in slot:
+            slot.add(entry)
+            self._level_sizes[level] += 1
 
     def fetch(self, now: int) -> List[T]:
         """Fetch any objects that have timed out
@@ -104,11 +136,61 @@ class WheelTimer(Generic[T]):
         """
         now_key = int(now / self.bucket_size)
 
-        ret: List[T] = []
-        while self.entries and self.entries[0].end_key <= now_key:
-            ret.extend(self.entries.pop(0).elements)
-
-        return ret
+        # A dict rather than a set to preserve insertion order.
+        ret: Dict[T, None] = dict.fromkeys(self._expired)
+        self._expired.clear()
+
+        current_tick = now_key if self.current_tick is None else self.current_tick
+        while current_tick < now_key:
+            lowest_level = next(
+                (level for level, size in enumerate(self._level_sizes) if size),
+                None,
+            )
+            if lowest_level is None:
+                # The wheel is empty, so we can skip straight to the end.
+                current_tick = now_key
+                break
+
+            # Nothing can happen until the next bucket at which a slot in the
+            # lowest non-empty level comes around.
+            span = self._wheel_size**lowest_level
+            key = min((current_tick // span + 1) * span, now_key)
+
+            # Objects moved down from higher levels are inserted relative to the
+            # previous bucket.
+            self.current_tick = key - 1
+
+            # Move down the objects in any slots of the higher levels which
+            # start at this bucket, from the top down.
+            for level in range(len(self._levels) - 1, 0, -1):
+                span = self._wheel_size**level
+                if key % span != 0 or not self._level_sizes[level]:
+                    continue
+
+                slot_index = (key // span) % self._wheel_size
+                slot = self._levels[level][slot_index]
+                self._levels[level][slot_index] = set()
+                self._level_sizes[level] -= len(slot)
+                for then_key, obj in slot:
+                    self._insert(obj, then_key)
+
+            slot_index = key % self._wheel_size
+            slot = self._levels[0][slot_index]
+            if slot:
+                self._levels[0][slot_index] = set()
+                self._level_sizes[0] -= len(slot)
+                for then_key, obj in slot:
+                    if then_key <= key:
+                        ret[obj] = None
+                    else:
+                        # This can only happen if the wheel only has one level.
+                        self._insert(obj, then_key)
+
+            current_tick = key
+
+        self.current_tick = current_tick
+
+        return list(ret)
 
     def __len__(self) -> int:
-        return sum(len(entry.elements) for entry in self.entries)
+        return len(self._expired) + sum(self._level_sizes)
@@ -117,12 +117,12 @@ async def filter_events_for_client(
                 [event.event_id for event in events],
             )
 
-    types = (_HISTORY_VIS_KEY, (EventTypes.Member, user_id))
-
     # we exclude outliers at this point, and then handle them separately later
-    event_id_to_state = await storage.state.get_state_for_events(
-        frozenset(e.event_id for e in events if not e.internal_metadata.outlier),
-        state_filter=StateFilter.from_types(types),
+    event_id_to_state = (
+        await storage.state.get_history_visibility_and_membership_for_events(
+            frozenset(e.event_id for e in events if not e.internal_metadata.outlier),
+            user_id,
+        )
     )
 
     # Get the users who are ignored by the requesting user.
@@ -140,7 +140,12 @@ async def filter_events_for_client(
             ] = await storage.main.get_retention_policy_for_room(room_id)
 
     def allowed(event: EventBase) -> Optional[EventBase]:
+        visibility_state: Optional[Tuple[str, Optional[str]]] = None
         state_after_event = event_id_to_state.get(event.event_id)
+        if state_after_event is not None:
+            history_visibility, membership = state_after_event
+            visibility_state = (_effective_visibility(history_visibility), membership)
+
         filtered = _check_client_allowed_to_see_event(
             user_id=user_id,
             event=event,
@@ -149,7 +154,7 @@ async def filter_events_for_client(
             sender_ignored=event.sender in ignore_list,
             always_include_ids=always_include_ids,
             retention_policy=retention_policies[event.room_id],
-            state=state_after_event,
+            visibility_state=visibility_state,
             is_peeking=is_peeking,
             sender_erased=erased_senders.get(event.sender, False),
         )
@@ -158,24 +163,21 @@ async def filter_events_for_client(
 
         # Annotate the event with the user's membership after the event.
         #
-        # Normally we just look in `state_after_event`, but if the event is an outlier
+        # Normally we just look in `visibility_state`, but if the event is an outlier
         # we won't have such a state. The only outliers that are returned here are the
         # user's own membership event, so we can just inspect that.
 
-        user_membership_event: Optional[EventBase]
+        user_membership: Optional[str]
         if event.type == EventTypes.Member and event.state_key == user_id:
-            user_membership_event = event
-        elif state_after_event is not None:
-            user_membership_event = state_after_event.get((EventTypes.Member, user_id))
+            user_membership = event.membership
+        elif visibility_state is not None:
+            user_membership = visibility_state[1]
         else:
             # unreachable!
             raise Exception("Missing state for event that is not user's own membership")
 
-        user_membership = (
-            user_membership_event.membership
-            if user_membership_event
-            else Membership.LEAVE
-        )
+        if user_membership is None:
+            user_membership = Membership.LEAVE
 
         # Copy the event before updating the unsigned data: this shouldn't be persisted
         # to the cache!
@@ -238,17 +240,23 @@ async def filter_event_for_clients_with_state(
         ignored_by = await store.ignored_by(event.sender)
         retention_policy = await store.get_retention_policy_for_room(event.room_id)
 
-        for user_id in user_ids:
-            if (
-                _check_filter_send_to_client(
-                    event,
-                    store.clock,
-                    retention_policy,
-                    sender_ignored=user_id in ignored_by,
-                )
-                == _CheckFilter.DENIED
-            ):
-                allowed_user_ids.discard(user_id)
+        # The result of the check only depends on whether the user ignores the
+        # sender, so we check once for each case rather than once per user.
+        if (
+            _check_filter_send_to_client(
+                event, store.clock, retention_policy, sender_ignored=False
+            )
+            == _CheckFilter.DENIED
+        ):
+            return set()
+
+        if (
+            _check_filter_send_to_client(
+                event, store.clock, retention_policy, sender_ignored=True
+            )
+            == _CheckFilter.DENIED
+        ):
+            allowed_user_ids.difference_update(ignored_by)
 
     if event.internal_metadata.outlier:
         # Normally these can't be seen by clients, but we make an exception for
@@ -273,23 +281,88 @@ async def filter_event_for_clients_with_state(
     ):
         return allowed_user_ids
 
-    # The history visibility isn't lax, so we now need to fetch the membership
-    # events of all the users.
+    # The history visibility isn't lax, so we now need the membership of all the
+    # users. We only need the membership itself, so look those up in bulk rather
+    # than loading all of the membership events.
+    member_state_ids = await context.get_prev_state_ids(
+        StateFilter.from_types(
+            (EventTypes.Member, user_id) for user_id in allowed_user_ids
+        )
+    )
+    event_id_to_membership = await store.get_membership_from_event_ids(
+        member_state_ids.values()
+    )
 
-    filter_list = []
+    user_to_membership: Dict[str, Optional[str]] = {}
     for user_id in allowed_user_ids:
-        filter_list.append((EventTypes.Member, user_id))
-    filter_list.append((EventTypes.RoomHistoryVisibility, ""))
+        member_event_id = member_state_ids.get((EventTypes.Member, user_id))
+        event_id_membership = (
+            event_id_to_membership.get(member_event_id) if member_event_id else None
+        )
+        user_to_membership[user_id] = (
+            event_id_membership.membership if event_id_membership else None
+        )
 
-    state_filter = StateFilter.from_types(filter_list)
-    state_map = await _get_state_map(store, event, context, state_filter)
+    # The state after a membership event includes the event itself, which may
+    # not have been persisted yet.
+    if event.type == EventTypes.Member and event.state_key in user_to_membership:
+        user_to_membership[event.state_key] = event.membership
 
-    # Now we check whether the membership allows each user to see the event.
-    return {
-        user_id
-        for user_id in allowed_user_ids
-        if _check_membership(user_id, event, visibility, state_map, is_peeking).allowed
-    }
+    return _filter_users_by_membership(
+        event, visibility, user_to_membership, is_peeking
+    )
+
+
+def _filter_users_by_membership(
+    event: EventBase,
+    visibility: str,
+    user_to_membership: Mapping[str, Optional[str]],
+    is_peeking: bool,
+) -> Set[str]:
+    """Check which users can see the event due to their membership.
+
+    Whether a user can see the event only depends on their membership (unless the
+    event is their own membership event), so rather than checking each user in
+    turn we check each distinct membership once.
+
+    Args:
+        event: the event to be checked
+        visibility: The effective history visibility of the room at the event
+        user_to_membership: map from the user IDs to check to their membership in
+            the state at the event, or None if they have no membership event
+        is_peeking: Whether the users are peeking into the room
+
+    Returns:
+        The user IDs that can see the event.
+    """
+    own_membership_user_id: Optional[str] = None
+    if event.type == EventTypes.Member and event.state_key in user_to_membership:
+        own_membership_user_id = event.state_key
+
+    membership_to_users: Dict[Optional[str], List[str]] = {}
+    for user_id, membership in user_to_membership.items():
+        if user_id != own_membership_user_id:
+            membership_to_users.setdefault(membership, []).append(user_id)
+
+    allowed_user_ids: Set[str] = set()
+    for membership, membership_user_ids in membership_to_users.items():
+        # Any of the users will do, as they all have the same membership.
+        if _check_membership(
+            membership_user_ids[0], event, visibility, membership, is_peeking
+        ).allowed:
+            allowed_user_ids.update(membership_user_ids)
+
+    if own_membership_user_id is not None:
+        if _check_membership(
+            own_membership_user_id,
+            event,
+            visibility,
+            user_to_membership[own_membership_user_id],
+            is_peeking,
+        ).allowed:
+            allowed_user_ids.add(own_membership_user_id)
+
+    return allowed_user_ids
 
 
 async def _get_state_map(
@@ -326,7 +399,7 @@ def _check_client_allowed_to_see_event(
     always_include_ids: FrozenSet[str],
     sender_ignored: bool,
     retention_policy: RetentionPolicy,
-    state: Optional[StateMap[EventBase]],
+    visibility_state: Optional[Tuple[str, Optional[str]]],
     sender_erased: bool,
 ) -> Optional[EventBase]:
     """Check with the given user is allowed to see the given event
@@ -342,7 +415,8 @@ def _check_client_allowed_to_see_event(
         always_include_ids
         sender_ignored: Whether the user is ignoring the event sender
         retention_policy: The retention policy of the room
-        state: The state at the event, unless its an outlier
+        visibility_state: The effective history visibility of the room and the
+            user's membership (if any) after the event, unless its an outlier
         sender_erased: Whether the event sender has been marked as "erased"
 
     Returns:
@@ -390,11 +464,11 @@ def _check_client_allowed_to_see_event(
         )
         return None
 
-    if state is None:
+    if visibility_state is None:
         raise Exception("Missing state for non-outlier event")
 
-    # get the room_visibility at the time of the event.
-    visibility = get_effective_room_visibility_from_state(state)
+    # get the room_visibility and the user's membership at the time of the event.
+    visibility, membership = visibility_state
 
     # Check if the room has lax history visibility, allowing us to skip
     # membership checks.
@@ -408,7 +482,9 @@ def _check_client_allowed_to_see_event(
     ):
         return event
 
-    membership_result = _check_membership(user_id, event, visibility, state, is_peeking)
+    membership_result = _check_membership(
+        user_id, event, visibility, membership, is_peeking
+    )
     if not membership_result.allowed:
         filtered_event_logger.debug(
             "_check_client_allowed_to_see_event(event=%s): Filtered out event because the user can't see the event because of their membership, membership_result.allowed=%s membership_result.joined=%s",
@@ -447,10 +523,19 @@ def _check_membership(
     user_id: str,
     event: EventBase,
     visibility: str,
-    state: StateMap[EventBase],
+    membership_at_event: Optional[str],
     is_peeking: bool,
 ) -> _CheckMembershipReturn:
-    """Check whether the user can see the event due to their membership"""
+    """Check whether the user can see the event due to their membership
+
+    Args:
+        user_id
+        event
+        visibility: The effective history visibility of the room at the event
+        membership_at_event: The user's membership in the state at the event, or
+            None if they have no membership event
+        is_peeking
+    """
     # If the event is the user's own membership event, use the 'most joined'
     # membership
     membership = None
@@ -481,9 +566,7 @@ def _check_membership(
 
     # otherwise, get the user's membership at the time of the event.
     if membership is None:
-        membership_event = state.get((EventTypes.Member, user_id), None)
-        if membership_event:
-            membership = membership_event.membership
+        membership = membership_at_event
 
     # if the user was a member of the room at the time of the event,
     # they can see it.
@@ -607,12 +690,16 @@ def get_effective_room_visibility_from_state(state: StateMap[EventBase]) -> str:
     if not visibility_event:
         return HistoryVisibility.SHARED
 
-    visibility = visibility_event.content.get(
-        "history_visibility", HistoryVisibility.SHARED
-    )
-    if visibility not in VISIBILITY_PRIORITY:
-        visibility = HistoryVisibility.SHARED
-    return visibility
+    return _effective_visibility(visibility_event.content.get("history_visibility"))
+
+
+def _effective_visibility(history_visibility: Optional[str]) -> str:
+    """Get the actual history vis from the `history_visibility` in the content of
+    a history_visibility event, which may be missing or invalid.
+    """
+    if history_visibility not in VISIBILITY_PRIORITY:
+        return HistoryVisibility.SHARED
+    return history_visibility
 
 
 async def filter_events_for_server(
@@ -1,4 +1,16 @@
-from . import logging, lrucache, lrucache_evict
+from . import (
+    logging,
+    lrucache,
+    lrucache_evict,
+    media_download,
+    media_download_sendfile,
+    presence_timeouts,
+    push_gateway,
+    push_rule_evaluation,
+    replication_rdata,
+    replication_rdata_batch,
+    thumbnails,
+)
 
 SUITES = [
     (logging, 1000),
@@ -6,4 +18,14 @@ SUITES = [
     (logging, None),
     (lrucache, None),
     (lrucache_evict, None),
+    (media_download, 10),
+    (media_download_sendfile, 1000),
+    (presence_timeouts, 100000),
+    (presence_timeouts, 1000000),
+    (push_gateway, 1000),
+    (push_gateway, 10000),
+    (push_rule_evaluation, 10),
+    (replication_rdata, 10000),
+    (replication_rdata_batch, 10000),
+    (thumbnails, 10),
 ]
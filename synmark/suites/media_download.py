@@ -0,0 +1,103 @@
+#
+# This file is licensed under the Affero General Public License (AGPL) version 3.
+#
+# Copyright (C) 2024 New Vector, Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# See the GNU Affero General Public License for more details:
+# <https://www.gnu.org/licenses/agpl-3.0.html>.
+#
+
+import os
+import tempfile
+from typing import Any, Dict, Optional, Union
+from unittest.mock import Mock
+
+from pyperf import perf_counter
+from zope.interface import implementer
+
+from twisted.internet.interfaces import IConsumer, IPushProducer
+from twisted.python.threadpool import ThreadPool
+
+from synapse.media._base import respond_with_responder
+from synapse.media.media_storage import FileResponder
+from synapse.types import ISynapseReactor
+
+# The size of the file being downloaded.
+FILE_SIZE = 16 * 1024 * 1024
+
+
+@implementer(IConsumer)
+class _Request:
+    """Just enough of a request to respond to, which discards what is written."""
+
+    def __init__(self) -> None:
+        self._disconnected = False
+        self.producer: Optional[IPushProducer] = None
+        self.headers: Dict[bytes, Union[str, bytes]] = {}
+        self.written = 0
+
+    def setHeader(self, name: Union[str, bytes], value: Union[str, bytes]) -> None:
+        self.headers[name if isinstance(name, bytes) else name.encode()] = value
+
+    def registerProducer(self, producer: Any, streaming: bool) -> None:
+        self.producer = producer
+
+    def unregisterProducer(self) -> None:
+        self.producer = None
+
+    def write(self, data: bytes) -> None:
+        self.written += len(data)
+
+    def finish(self) -> None:
+        pass
+
+
+async def download(
+    reactor: ISynapseReactor, loops: int, sendfile_header: Optional[str]
+) -> float:
+    """Time responding to `loops` downloads of a local media file."""
+    thread_pool = ThreadPool(name="media_threadpool", minthreads=1, maxthreads=50)
+    thread_pool.start()
+
+    hs = Mock()
+    hs.get_reactor.return_value = reactor
+    hs.get_media_sender_thread_pool.return_value = thread_pool
+    hs.config.media.media_sendfile_header = sendfile_header
+    hs.config.media.media_sendfile_path_prefix = "/_synapse_media_store/"
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "media")
+        with open(path, "wb") as f:
+            f.write(os.urandom(FILE_SIZE))
+
+        start = perf_counter()
+
+        for _ in range(loops):
+            request = _Request()
+            responder = FileResponder(hs, open(path, "rb"), sendfile_path="media")
+            await respond_with_responder(
+                request,  # type: ignore[arg-type]
+                responder,
+                "video/mp4",
+                FILE_SIZE,
+            )
+            if sendfile_header is None:
+                assert request.written == FILE_SIZE
+
+        end = perf_counter() - start
+
+    thread_pool.stop()
+
+    return end
+
+
+async def main(reactor: ISynapseReactor, loops: int) -> float:
+    """
+    Benchmark streaming `loops` downloads of a 16 MiB local media file.
+    """
+    return await download(reactor, loops, sendfile_header=None)
@@ -0,0 +1,25 @@
+#
+# This file is licensed under the Affero General Public License (AGPL) version 3.
+#
+# Copyright (C) 2024 New Vector, Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# See the GNU Affero General Public License for more details:
+# <https://www.gnu.org/licenses/agpl-3.0.html>.
+#
+
+from synapse.types import ISynapseReactor
+
+from .media_download import download
+
+
+async def main(reactor: ISynapseReactor, loops: int) -> float:
+    """
+    Benchmark `loops` downloads of a 16 MiB local media file, when sending the
+    file is delegated to the reverse proxy with `media_sendfile`.
+    """
+    return await download(reactor, loops, sendfile_header="X-Accel-Redirect")
@@ -0,0 +1,114 @@
+#
+# This file is licensed under the Affero General Public License (AGPL) version 3.
+#
+# Copyright (C) 2024 New Vector, Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# See the GNU Affero General Public License for more details:
+# <https://www.gnu.org/licenses/agpl-3.0.html>.
+#
+
+from typing import Dict, Optional, Tuple
+
+from pyperf import perf_counter
+
+from synapse.api.constants import PresenceState
+from synapse.api.presence import UserDevicePresenceState, UserPresenceState
+from synapse.handlers.presence import (
+    FEDERATION_PING_INTERVAL,
+    FEDERATION_TIMEOUT,
+    IDLE_TIMER,
+    SYNC_ONLINE_TIMEOUT,
+    _SyncingUserDevices,
+    handle_timeouts,
+)
+from synapse.types import ISynapseReactor
+from synapse.util.wheel_timer import WheelTimer
+
+# How long to simulate, in timeout ticks of five seconds.
+TICKS = 12
+
+
+def _is_mine(user_id: str) -> bool:
+    return user_id.endswith(":local")
+
+
+async def main(reactor: ISynapseReactor, loops: int) -> float:
+    """
+    Benchmark processing presence timeouts for `loops` online users over one
+    minute, half of them local. Most of the local users keep syncing, so
+    their timers keep being reset.
+    """
+    now = 1_700_000_000_000
+
+    wheel: WheelTimer[str] = WheelTimer()
+    states: Dict[str, UserPresenceState] = {}
+    devices: Dict[str, Dict[Optional[str], UserDevicePresenceState]] = {}
+    syncs: Dict[Tuple[str, Optional[str]], int] = {}
+
+    for i in range(loops):
+        # Spread out when users were last active over the last few minutes.
+        last_active = now - (i * 7919) % (4 * 60 * 1000)
+
+        if i % 2:
+            user_id = "@user%d:remote" % (i,)
+            wheel.insert(now, user_id, last_active + FEDERATION_TIMEOUT)
+        else:
+            user_id = "@user%d:local" % (i,)
+            devices[user_id] = {
+                None: UserDevicePresenceState(
+                    user_id=user_id,
+                    device_id=None,
+                    state=PresenceState.ONLINE,
+                    last_active_ts=last_active,
+                    last_sync_ts=last_active,
+                )
+            }
+            if i % 8:
+                syncs[(user_id, None)] = 1
+
+            wheel.insert(now, user_id, last_active + IDLE_TIMER)
+            wheel.insert(now, user_id, last_active + SYNC_ONLINE_TIMEOUT)
+            wheel.insert(now, user_id, last_active + FEDERATION_PING_INTERVAL)
+
+        states[user_id] = UserPresenceState(
+            user_id=user_id,
+            state=PresenceState.ONLINE,
+            last_active_ts=last_active,
+            last_federation_update_ts=last_active,
+            last_user_sync_ts=last_active,
+            status_msg=None,
+            currently_active=True,
+        )
+
+    syncing_user_devices = _SyncingUserDevices(syncs, [])
+
+    start = perf_counter()
+
+    for _ in range(TICKS):
+        now += 5000
+
+        users_to_check = set(wheel.fetch(now))
+        changes = handle_timeouts(
+            [states[user_id] for user_id in users_to_check],
+            is_mine_fn=_is_mine,
+            syncing_user_devices=syncing_user_devices,
+            user_to_devices=devices,
+            now=now,
+        )
+        for state in changes:
+            states[state.user_id] = state
+
+        # Users that are still syncing get a new sync timer each time they
+        # sync.
+        for user_id in users_to_check:
+            if (user_id, None) in syncing_user_devices:
+                wheel.insert(now, user_id, now + SYNC_ONLINE_TIMEOUT)
+
+    end = perf_counter() - start
+
+    return end
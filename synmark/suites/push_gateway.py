@@ -0,0 +1,106 @@
+#
+# This file is licensed under the Affero General Public License (AGPL) version 3.
+#
+# Copyright (C) 2024 New Vector, Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# See the GNU Affero General Public License for more details:
+# <https://www.gnu.org/licenses/agpl-3.0.html>.
+#
+
+from typing import Optional
+from unittest.mock import Mock
+
+from pyperf import perf_counter
+
+from twisted.internet import defer
+from twisted.internet.address import IPv4Address, IPv6Address
+from twisted.internet.interfaces import IAddress
+from twisted.internet.protocol import Protocol
+from twisted.web.resource import Resource
+from twisted.web.server import Request, Site
+
+from synapse.http.client import SimpleHttpClient
+from synapse.push.gateway_dispatcher import PushGatewayDispatcher
+from synapse.types import ISynapseReactor
+from synapse.util import Clock
+
+# The number of devices each user has, all of which are sent the same
+# notification.
+DEVICES_PER_USER = 4
+
+
+class Gateway(Resource):
+    """A push gateway which accepts every notification."""
+
+    isLeaf = True
+
+    def render_POST(self, request: Request) -> bytes:
+        request.setHeader(b"Content-Type", b"application/json")
+        return b'{"rejected": []}'
+
+
+class CountingSite(Site):
+    """Counts the connections made to the gateway."""
+
+    connections = 0
+
+    def buildProtocol(self, addr: IAddress) -> Optional[Protocol]:
+        self.connections += 1
+        return super().buildProtocol(addr)
+
+
+async def main(reactor: ISynapseReactor, loops: int) -> float:
+    """
+    Benchmark how long it takes to send a notification to each of `loops`
+    devices via a local push gateway.
+    """
+    site = CountingSite(Gateway())
+    port = reactor.listenTCP(0, site, backlog=50, interface="127.0.0.1")
+    address = port.getHost()
+    assert isinstance(address, (IPv4Address, IPv6Address))
+    url = "http://%s:%d/_matrix/push/v1/notify" % (address.host, address.port)
+
+    # A fake homeserver, with just enough to create the HTTP client and
+    # dispatcher.
+    hs = Mock()
+    hs.get_reactor.return_value = reactor
+    hs.get_clock.return_value = Clock(reactor)
+    hs.version_string = "synmark"
+    hs.config.server.user_agent_suffix = None
+    hs.config.caches.global_factor = 1.0
+    hs.config.push.max_concurrent_gateway_requests = 100
+    hs.config.push.gateway_batch_delay_ms = 0
+    hs.get_proxied_blocklisted_http_client.return_value = SimpleHttpClient(hs)
+
+    dispatcher = PushGatewayDispatcher(hs)
+
+    start = perf_counter()
+
+    results = await defer.gatherResults(
+        [
+            defer.ensureDeferred(
+                dispatcher.send_notification(
+                    url,
+                    "@user%d:synmark" % (i // DEVICES_PER_USER),
+                    {"event_id": "$event%d" % (i // DEVICES_PER_USER)},
+                    {"app_id": "synmark", "pushkey": "pushkey%d" % i},
+                )
+            )
+            for i in range(loops)
+        ],
+        consumeErrors=True,
+    )
+
+    end = perf_counter() - start
+
+    assert all(result == [] for result in results), "Failed to send notifications"
+    assert site.connections <= 100, "Made %d connections" % site.connections
+
+    port.stopListening()
+
+    return end
@@ -0,0 +1,54 @@
+#
+# This file is licensed under the Affero General Public License (AGPL) version 3.
+#
+# Copyright (C) 2023 New Vector, Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# See the GNU Affero General Public License for more details:
+# <https://www.gnu.org/licenses/agpl-3.0.html>.
+#
+
+from pyperf import perf_counter
+
+from synapse.push.bulk_push_rule_evaluator import _SharedRuleSetEvaluator
+from synapse.synapse_rust.push import FilteredPushRules, PushRuleEvaluator, PushRules
+from synapse.types import ISynapseReactor
+
+# The number of local users in the room.
+NUM_USERS = 30000
+
+
+async def main(reactor: ISynapseReactor, loops: int) -> float:
+    """
+    Benchmark evaluating push rules for `loops` events in a room with
+    `NUM_USERS` local users, all of whom have the default push rules.
+    """
+    rules = FilteredPushRules(PushRules([]), {}, False, False, False, False, False)
+    users = [(f"@user{i}:test", f"User {i}") for i in range(NUM_USERS)]
+
+    start = perf_counter()
+
+    for i in range(loops):
+        flattened_event = {
+            "type": "m.room.message",
+            "sender": "@sender:test",
+            "content.msgtype": "m.text",
+            "content.body": f"Message {i} for User 42",
+        }
+        evaluator = _SharedRuleSetEvaluator(
+            PushRuleEvaluator(
+                flattened_event, False, NUM_USERS, 0, {}, {}, False, (), False, False
+            ),
+            flattened_event,
+            {},
+        )
+        for user_id, display_name in users:
+            evaluator.run(rules, user_id, display_name)
+
+    end = perf_counter() - start
+
+    return end
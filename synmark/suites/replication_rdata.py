@@ -0,0 +1,45 @@
+#
+# This file is licensed under the Affero General Public License (AGPL) version 3.
+#
+# Copyright (C) 2023 New Vector, Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# See the GNU Affero General Public License for more details:
+# <https://www.gnu.org/licenses/agpl-3.0.html>.
+#
+
+
+from pyperf import perf_counter
+
+from synapse.replication.tcp.commands import RdataCommand, parse_command_from_line
+from synapse.types import ISynapseReactor
+
+
+def make_row(i: int) -> tuple:
+    """Returns a replication row roughly the shape of an `events` stream row."""
+    return (
+        "ev",
+        (f"$event{i}", "!room:example.com", "m.room.message", None, None, None),
+    )
+
+
+async def main(reactor: ISynapseReactor, loops: int) -> float:
+    """
+    Benchmark encoding and decoding `loops` replication rows, sent as one RDATA
+    command per row.
+    """
+    updates = [(i, make_row(i)) for i in range(loops)]
+
+    start = perf_counter()
+
+    for token, row in updates:
+        cmd = RdataCommand("events", "master", token, row)
+        parse_command_from_line(f"{cmd.NAME} {cmd.to_line()}")
+
+    end = perf_counter() - start
+
+    return end
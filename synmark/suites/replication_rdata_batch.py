@@ -0,0 +1,39 @@
+#
+# This file is licensed under the Affero General Public License (AGPL) version 3.
+#
+# Copyright (C) 2023 New Vector, Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# See the GNU Affero General Public License for more details:
+# <https://www.gnu.org/licenses/agpl-3.0.html>.
+#
+
+
+from pyperf import perf_counter
+
+from synapse.replication.tcp.commands import RdataBatchCommand, parse_command_from_line
+from synapse.replication.tcp.resource import _RDATA_BATCH_SIZE, _chunk_updates
+from synapse.types import ISynapseReactor
+from synmark.suites.replication_rdata import make_row
+
+
+async def main(reactor: ISynapseReactor, loops: int) -> float:
+    """
+    Benchmark encoding and decoding `loops` replication rows, sent as
+    RDATA_BATCH commands.
+    """
+    updates = [(i, make_row(i)) for i in range(loops)]
+
+    start = perf_counter()
+
+    for chunk in _chunk_updates(updates, _RDATA_BATCH_SIZE):
+        cmd = RdataBatchCommand("events", "master", chunk)
+        parse_command_from_line(f"{cmd.NAME} {cmd.to_line()}")
+
+    end = perf_counter() - start
+
+    return end
@@ -0,0 +1,68 @@
+#
+# This file is licensed under the Affero General Public License (AGPL) version 3.
+#
+# Copyright (C) 2024 New Vector, Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# See the GNU Affero General Public License for more details:
+# <https://www.gnu.org/licenses/agpl-3.0.html>.
+#
+
+import os
+import tempfile
+
+from PIL import Image
+from pyperf import perf_counter
+
+from synapse.config.repository import (
+    DEFAULT_THUMBNAIL_SIZES,
+    parse_thumbnail_requirements,
+)
+from synapse.media.thumbnailer import Thumbnailer
+from synapse.types import ISynapseReactor
+
+# The sizes of the uploads to thumbnail, as (width, height).
+JPEG_SIZE = (4000, 3000)
+PNG_SIZE = (2000, 1500)
+
+
+def _make_image(path: str, size: tuple, format: str) -> None:
+    # A fractal has enough detail that it doesn't compress unrealistically well.
+    with Image.effect_mandelbrot(size, (-2.0, -1.2, 1.0, 1.2), 100) as image:
+        with Image.merge(
+            "RGB", (image, image.transpose(Image.FLIP_LEFT_RIGHT), image)
+        ) as rgb:
+            rgb.save(path, format)
+
+
+async def main(reactor: ISynapseReactor, loops: int) -> float:
+    """
+    Benchmark generating the default set of thumbnails for `loops` uploads,
+    alternating between a large JPEG and a large PNG.
+    """
+    requirements = parse_thumbnail_requirements(DEFAULT_THUMBNAIL_SIZES)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        uploads = [
+            (os.path.join(tmpdir, "upload.jpg"), requirements["image/jpeg"]),
+            (os.path.join(tmpdir, "upload.png"), requirements["image/png"]),
+        ]
+        _make_image(uploads[0][0], JPEG_SIZE, "JPEG")
+        _make_image(uploads[1][0], PNG_SIZE, "PNG")
+
+        start = perf_counter()
+
+        for i in range(loops):
+            path, upload_requirements = uploads[i % 2]
+            with Thumbnailer(path) as thumbnailer:
+                _, thumbnails = thumbnailer.generate_thumbnails(upload_requirements)
+            for thumbnail in thumbnails.values():
+                thumbnail.close()
+
+        end = perf_counter() - start
+
+    return end
@@ -0,0 +1,103 @@
+#
+# This file is licensed under the Affero General Public License (AGPL) version 3.
+#
+# Copyright (C) 2024 New Vector, Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# See the GNU Affero General Public License for more details:
+# <https://www.gnu.org/licenses/agpl-3.0.html>.
+#
+
+from synapse.api.constants import PresenceState
+from synapse.api.presence import PresenceStateTable, UserPresenceState
+
+from tests import unittest
+
+
+class PresenceStateTableTestCase(unittest.TestCase):
+    def test_round_trip(self) -> None:
+        """States are returned as they were stored, and can be replaced."""
+        online = UserPresenceState(
+            user_id="@alice:test",
+            state=PresenceState.ONLINE,
+            last_active_ts=1_700_000_000_000,
+            last_federation_update_ts=1_700_000_000_001,
+            last_user_sync_ts=1_700_000_000_002,
+            status_msg="Hello",
+            currently_active=True,
+        )
+        bob = UserPresenceState.default("@bob:test")
+
+        table = PresenceStateTable([online, bob])
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table["@alice:test"], online)
+        self.assertEqual(table["@bob:test"], bob)
+        self.assertIsNone(table.get("@carol:test"))
+
+        busy = online.copy_and_replace(
+            state=PresenceState.BUSY, status_msg=None, currently_active=False
+        )
+        table["@alice:test"] = busy
+        self.assertEqual(table["@alice:test"], busy)
+        self.assertEqual(table["@bob:test"], bob)
+
+    def test_delete(self) -> None:
+        """Deleted users are removed, and their rows are reused."""
+        table = PresenceStateTable(
+            [
+                UserPresenceState.default("@alice:test"),
+                UserPresenceState.default("@bob:test"),
+            ]
+        )
+
+        del table["@alice:test"]
+        self.assertNotIn("@alice:test", table)
+        self.assertEqual(list(table), ["@bob:test"])
+
+        carol = UserPresenceState.default("@carol:test").copy_and_replace(
+            state=PresenceState.UNAVAILABLE, last_active_ts=10
+        )
+        table["@carol:test"] = carol
+        self.assertEqual(table["@carol:test"], carol)
+        self.assertEqual(table["@bob:test"], UserPresenceState.default("@bob:test"))
+        self.assertEqual(len(table), 2)
+
+    def test_unusual_states(self) -> None:
+        """States which can't be stored compactly are still stored, without
+        affecting the other users."""
+        alice = UserPresenceState.default("@alice:test").copy_and_replace(
+            state=PresenceState.ONLINE, status_msg="Hello"
+        )
+        table = PresenceStateTable([alice])
+
+        unusual = [
+            alice.copy_and_replace(state="dancing"),
+            alice.copy_and_replace(last_active_ts=1.5),
+            alice.copy_and_replace(last_user_sync_ts=2**64),
+            alice.copy_and_replace(status_msg=["Hello"]),
+            alice.copy_and_replace(currently_active="yes"),
+        ]
+        for index, state in enumerate(unusual):
+            user_id = f"@user{index}:test"
+            table[user_id] = state.copy_and_replace(user_id=user_id)
+
+        self.assertEqual(len(table), len(unusual) + 1)
+        self.assertEqual(table["@alice:test"], alice)
+        for index, state in enumerate(unusual):
+            user_id = f"@user{index}:test"
+            self.assertEqual(table[user_id], state.copy_and_replace(user_id=user_id))
+
+        # A user can move between the arrays and the separate states.
+        table["@alice:test"] = unusual[0]
+        self.assertEqual(table["@alice:test"], unusual[0])
+        table["@alice:test"] = alice
+        self.assertEqual(table["@alice:test"], alice)
+        self.assertEqual(len(table), len(unusual) + 1)
+
+        del table["@user0:test"]
+        self.assertNotIn("@user0:test", table)
+        self.assertEqual(len(table), len(unusual))
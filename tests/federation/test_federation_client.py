@@ -19,14 +19,24 @@
 #
 #
 
+import json
+from typing import List
 from unittest import mock
 
+import attr
+
 import twisted.web.client
 from twisted.internet import defer
+from twisted.internet.interfaces import IProtocol
+from twisted.python.failure import Failure
 from twisted.test.proto_helpers import MemoryReactor
+from twisted.web.client import ResponseDone
+from twisted.web.http_headers import Headers
 
+from synapse.api.errors import SynapseError
 from synapse.api.room_versions import RoomVersions
-from synapse.events import EventBase
+from synapse.events import EventBase, make_event_from_dict
+from synapse.federation.transport.client import SendJoinParser
 from synapse.rest import admin
 from synapse.rest.client import login, room
 from synapse.server import HomeServer
@@ -36,6 +46,18 @@ from tests.test_utils import FakeResponse, event_injection
 from tests.unittest import FederatingHomeserverTestCase
 
 
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class _ChunkedFakeResponse(FakeResponse):
+    """A FakeResponse which delivers its body in chunks."""
+
+    chunk_size: int = 1
+
+    def deliverBody(self, protocol: IProtocol) -> None:
+        for i in range(0, len(self.body), self.chunk_size):
+            protocol.dataReceived(self.body[i : i + self.chunk_size])
+        protocol.connectionLost(Failure(ResponseDone()))
+
+
 class FederationClientTest(FederatingHomeserverTestCase):
     servlets = [
         admin.register_servlets,
@@ -149,6 +171,156 @@ class FederationClientTest(FederatingHomeserverTestCase):
             ["m.room.create", "m.room.member", "m.room.power_levels"],
         )
 
+    def test_send_join(self) -> None:
+        """The state and auth chain in a /send_join response have their signatures
+        checked, and any which fail are dropped."""
+        create_event_dict = self.add_hashes_and_signatures_from_other_server(
+            {
+                "room_id": self.test_room_id,
+                "type": "m.room.create",
+                "state_key": "",
+                "sender": self.creator,
+                "content": {"creator": self.creator, "room_version": "9"},
+                "prev_events": [],
+                "auth_events": [],
+                "origin_server_ts": 500,
+            }
+        )
+        member_event_dict = self.add_hashes_and_signatures_from_other_server(
+            {
+                "room_id": self.test_room_id,
+                "type": "m.room.member",
+                "sender": self.creator,
+                "state_key": self.creator,
+                "content": {"membership": "join"},
+                "prev_events": [],
+                "auth_events": [],
+                "origin_server_ts": 600,
+            }
+        )
+        # This event is missing its signatures, so should be dropped.
+        unsigned_event_dict = {
+            "room_id": self.test_room_id,
+            "type": "m.room.power_levels",
+            "sender": self.creator,
+            "state_key": "",
+            "content": {},
+            "prev_events": [],
+            "auth_events": [],
+            "origin_server_ts": 700,
+            "depth": 1,
+            "hashes": {"sha256": "aGFzaA"},
+            "signatures": {},
+        }
+
+        self._mock_agent.request.side_effect = lambda *args, **kwargs: defer.succeed(
+            FakeResponse.json(
+                payload={
+                    "origin": self.OTHER_SERVER_NAME,
+                    "state": [
+                        create_event_dict,
+                        member_event_dict,
+                        unsigned_event_dict,
+                    ],
+                    "auth_chain": [create_event_dict],
+                }
+            )
+        )
+
+        join_event = make_event_from_dict(
+            {
+                "room_id": self.test_room_id,
+                "type": "m.room.member",
+                "sender": "@joiner:test",
+                "state_key": "@joiner:test",
+                "content": {"membership": "join"},
+                "prev_events": [],
+                "auth_events": [],
+                "origin_server_ts": 800,
+                "depth": 2,
+            },
+            RoomVersions.V9,
+        )
+
+        result = self.get_success(
+            self.hs.get_federation_client().send_join(
+                [self.OTHER_SERVER_NAME], join_event, RoomVersions.V9
+            )
+        )
+
+        self.assertEqual(result.origin, self.OTHER_SERVER_NAME)
+        self.assertCountEqual(
+            [e.type for e in result.state], ["m.room.create", "m.room.member"]
+        )
+        self.assertEqual([e.type for e in result.auth_chain], ["m.room.create"])
+
+    def test_send_join_cancels_checks_on_error(self) -> None:
+        """If reading the /send_join response fails, any signature checks which
+        were started while it streamed in are cancelled rather than awaited."""
+        create_event_dict = self.add_hashes_and_signatures_from_other_server(
+            {
+                "room_id": self.test_room_id,
+                "type": "m.room.create",
+                "state_key": "",
+                "sender": self.creator,
+                "content": {"creator": self.creator, "room_version": "9"},
+                "prev_events": [],
+                "auth_events": [],
+                "origin_server_ts": 500,
+            }
+        )
+
+        # The response is invalid after the first event, which arrives in an
+        # earlier chunk.
+        first_chunk = b'{"state": [' + json.dumps(create_event_dict).encode()
+        self._mock_agent.request.side_effect = lambda *args, **kwargs: defer.succeed(
+            _ChunkedFakeResponse(
+                body=first_chunk + b", !",
+                headers=Headers({"Content-Type": ["application/json"]}),
+                chunk_size=len(first_chunk),
+            )
+        )
+
+        # The signature checks never complete.
+        check_deferreds: List["defer.Deferred[None]"] = []
+
+        def check_sigs(*args: object, **kwargs: object) -> "defer.Deferred[None]":
+            d: "defer.Deferred[None]" = defer.Deferred()
+            check_deferreds.append(d)
+            return d
+
+        federation_client = self.hs.get_federation_client()
+
+        join_event = make_event_from_dict(
+            {
+                "room_id": self.test_room_id,
+                "type": "m.room.member",
+                "sender": "@joiner:test",
+                "state_key": "@joiner:test",
+                "content": {"membership": "join"},
+                "prev_events": [],
+                "auth_events": [],
+                "origin_server_ts": 800,
+                "depth": 2,
+            },
+            RoomVersions.V9,
+        )
+
+        with mock.patch.object(
+            SendJoinParser, "EVENT_BATCH_SIZE", 1
+        ), mock.patch.object(
+            federation_client, "_check_sigs_and_hash_and_fetch_one", new=check_sigs
+        ):
+            self.get_failure(
+                federation_client.send_join(
+                    [self.OTHER_SERVER_NAME], join_event, RoomVersions.V9
+                ),
+                SynapseError,
+            )
+
+        self.assertEqual(len(check_deferreds), 1)
+        self.assertTrue(check_deferreds[0].called)
+
     def test_get_pdu_returns_nothing_when_event_does_not_exist(self) -> None:
         """No event should be returned when the event does not exist"""
         pulled_pdu_info = self.get_success(
@@ -147,6 +147,28 @@ class FederationMediaDownloadsTest(unittest.FederatingHomeserverTestCase):
         found_file = any(SMALL_PNG in field for field in stripped_bytes)
         self.assertTrue(found_file)
 
+    def test_file_download_ignores_range(self) -> None:
+        """Range headers are not applied to the multipart federation response."""
+        content = io.BytesIO(b"file_to_stream")
+        content_uri = self.get_success(
+            self.media_repo.create_content(
+                "text/plain",
+                "test_upload",
+                content,
+                46,
+                UserID.from_string("@user_id:whatever.org"),
+            )
+        )
+        channel = self.make_signed_federation_request(
+            "GET",
+            f"/_matrix/federation/v1/media/download/{content_uri.media_id}",
+            custom_headers=[("Range", "bytes=0-3")],
+        )
+        self.pump()
+        self.assertEqual(200, channel.code)
+        self.assertIsNone(channel.headers.getRawHeaders("Content-Range"))
+        self.assertIn("file_to_stream", channel.text_body)
+
 
 class FederationThumbnailTest(unittest.FederatingHomeserverTestCase):
     def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
@@ -25,8 +25,9 @@ from unittest.mock import Mock
 
 import ijson.common
 
+from synapse.api.errors import SynapseError
 from synapse.api.room_versions import RoomVersions
-from synapse.federation.transport.client import SendJoinParser
+from synapse.federation.transport.client import SendJoinParser, _BackfillParser
 from synapse.types import JsonDict
 from synapse.util import ExceptionBundle
 
@@ -114,6 +115,43 @@ class SendJoinParserTestCase(TestCase):
         # We should be able to tell the field is not present.
         self.assertEqual(parse({}), None)
 
+    def test_event_batches(self) -> None:
+        """Check that events are handed to the callback in batches as they stream in."""
+        batches: List[List[str]] = []
+        parser = SendJoinParser(
+            RoomVersions.V1,
+            False,
+            on_event_batch=lambda batch: batches.append([e.event_id for e in batch]),
+        )
+        parser.EVENT_BATCH_SIZE = 2
+
+        def make_event(event_id: str) -> JsonDict:
+            return {
+                "content": {},
+                "event_id": event_id,
+                "room_id": "!somewhere:example.org",
+                "type": "m.room.minimal_pdu",
+            }
+
+        response = {
+            "state": [make_event("$state1"), make_event("$state2")],
+            "auth_chain": [make_event("$auth1")],
+        }
+        serialised_response = json.dumps(response).encode()
+
+        # Send the state to the parser: only the first full batch should have
+        # been passed on.
+        split = serialised_response.index(b'"auth_chain"')
+        parser.write(serialised_response[:split])
+        self.assertEqual(batches, [["$state1", "$state2"]])
+
+        # The remaining partial batch is not passed on, but is in the response.
+        parser.write(serialised_response[split:])
+        parsed_response = parser.finish()
+        self.assertEqual(batches, [["$state1", "$state2"]])
+        self.assertEqual(len(parsed_response.state), 2)
+        self.assertEqual(len(parsed_response.auth_events), 1)
+
     def test_errors_closing_coroutines(self) -> None:
         """Check we close all coroutines, even if closing the first raises an Exception.
 
@@ -156,3 +194,56 @@ class SendJoinParserTestCase(TestCase):
         coro_1.close.assert_called()
         coro_2.close.assert_called()
         coro_3.close.assert_called()
+
+
+class BackfillParserTestCase(TestCase):
+    def _make_pdu(self, event_id: str, depth: int) -> JsonDict:
+        return {
+            "content": {},
+            "depth": depth,
+            "event_id": event_id,
+            "room_id": "!somewhere:example.org",
+            "type": "m.room.minimal_pdu",
+        }
+
+    def test_multiple_writes(self) -> None:
+        """Test that the parser builds events as the response streams in."""
+        parser = _BackfillParser(RoomVersions.V1)
+        response = {
+            "origin": "matrix.org",
+            "origin_server_ts": 1234,
+            "pdus": [self._make_pdu("$event1", 1), self._make_pdu("$event2", 2)],
+        }
+        serialised_response = json.dumps(response).encode()
+
+        # Send the data to the parser a few bytes at a time.
+        for i in range(0, len(serialised_response), 10):
+            parser.write(serialised_response[i : i + 10])
+
+        parsed_response = parser.finish()
+        self.assertEqual(
+            [e.event_id for e in parsed_response.pdus], ["$event1", "$event2"]
+        )
+
+    def test_missing_pdus(self) -> None:
+        """A response without a list of PDUs is rejected."""
+        responses: List[object] = [{"origin": "matrix.org"}, {"pdus": {}}, []]
+        for response in responses:
+            parser = _BackfillParser(RoomVersions.V1)
+            parser.write(json.dumps(response).encode())
+            with self.assertRaises(ValueError):
+                parser.finish()
+
+    def test_empty_pdus(self) -> None:
+        """A response with an empty list of PDUs parses to an empty list."""
+        parser = _BackfillParser(RoomVersions.V1)
+        parser.write(json.dumps({"origin": "matrix.org", "pdus": []}).encode())
+        self.assertEqual(parser.finish().pdus, [])
+
+    def test_invalid_pdu(self) -> None:
+        """Invalid PDUs are rejected as soon as they are received."""
+        parser = _BackfillParser(RoomVersions.V1)
+        response = {"pdus": [self._make_pdu("$event1", -1)]}
+
+        with self.assertRaises(SynapseError):
+            parser.write(json.dumps(response).encode())
@@ -20,7 +20,7 @@
 #
 #
 
-from typing import Optional
+from typing import Optional, Set
 from unittest import mock
 
 from twisted.internet.defer import ensureDeferred
@@ -31,10 +31,10 @@ from synapse.api.errors import NotFoundError, SynapseError
 from synapse.appservice import ApplicationService
 from synapse.handlers.device import MAX_DEVICE_DISPLAY_NAME_LEN, DeviceHandler
 from synapse.rest import admin
-from synapse.rest.client import devices, login, register
+from synapse.rest.client import devices, login, register, room
 from synapse.server import HomeServer
 from synapse.storage.databases.main.appservice import _make_exclusive_regex
-from synapse.types import JsonDict, create_requester
+from synapse.types import JsonDict, StreamToken, create_requester
 from synapse.util import Clock
 from synapse.util.task_scheduler import TaskScheduler
 
@@ -451,6 +451,61 @@ class DeviceTestCase(unittest.HomeserverTestCase):
         )
 
 
+class DeviceChangesInSharedRoomsTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+    ]
+
+    def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
+        handler = hs.get_device_handler()
+        assert isinstance(handler, DeviceHandler)
+        self.handler = handler
+        self.store = hs.get_datastores().main
+
+        self.user_id = self.register_user("user", "pass")
+        self.tok = self.login("user", "pass")
+        self.other_user_id = self.register_user("other", "pass")
+        other_tok = self.login("other", "pass")
+        self.stranger_id = self.register_user("stranger", "pass")
+
+        self.room_id = self.helper.create_room_as(self.user_id, tok=self.tok)
+        self.helper.join(self.room_id, self.other_user_id, tok=other_tok)
+
+    def _get_device_changes(self, from_token: StreamToken) -> Set[str]:
+        return self.get_success(
+            self.handler.get_device_changes_in_shared_rooms(
+                self.user_id, [self.room_id], from_token
+            )
+        )
+
+    def test_device_changes_in_shared_rooms(self) -> None:
+        """Only device changes of users who share a room with the user, or of
+        the user themselves, are returned."""
+        from_token = self.hs.get_event_sources().get_current_token()
+
+        for user_id in (self.user_id, self.other_user_id, self.stranger_id):
+            self.get_success(
+                self.handler.check_device_registered(
+                    user_id=user_id, device_id="NEW_DEVICE"
+                )
+            )
+
+        expected = {self.user_id, self.other_user_id}
+        self.assertEqual(self._get_device_changes(from_token), expected)
+
+        # The same changes are found by looking at each of the user's rooms when
+        # too many users have changed their devices.
+        with mock.patch(
+            "synapse.handlers.device.MAX_DEVICE_LIST_CHANGES_TO_CHECK_ROOMS_FOR", 1
+        ):
+            self.assertEqual(self._get_device_changes(from_token), expected)
+
+        now_token = self.hs.get_event_sources().get_current_token()
+        self.assertEqual(self._get_device_changes(now_token), set())
+
+
 class DehydrationTestCase(unittest.HomeserverTestCase):
     servlets = [
         admin.register_servlets_for_client_rest_resource,
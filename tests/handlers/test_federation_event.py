@@ -31,7 +31,10 @@ from synapse.event_auth import (
 )
 from synapse.events import make_event_from_dict
 from synapse.events.snapshot import EventContext
-from synapse.federation.transport.client import StateRequestResponse
+from synapse.federation.transport.client import (
+    BackfillResponse,
+    StateRequestResponse,
+)
 from synapse.logging.context import LoggingContext
 from synapse.rest import admin
 from synapse.rest.client import login, room
@@ -549,23 +552,23 @@ class FederationEventHandlerTests(unittest.FederatingHomeserverTestCase):
         )
 
         # We expect an outbound request to /backfill, so stub that out
-        self.mock_federation_transport_client.backfill.return_value = {
-            "origin": self.OTHER_SERVER_NAME,
-            "origin_server_ts": 123,
-            "pdus": [
+        self.mock_federation_transport_client.backfill.return_value = BackfillResponse(
+            pdus=[
                 # This is one of the important aspects of this test: we include
                 # `pulled_event_without_signatures` so it fails the signature check
                 # when we filter down the backfill response down to events which
                 # have valid signatures in
                 # `_check_sigs_and_hash_for_pulled_events_and_fetch`
-                pulled_event_without_signatures.get_pdu_json(),
+                make_event_from_dict(
+                    pulled_event_without_signatures.get_pdu_json(), room_version
+                ),
                 # Then later when we process this valid signature event, when we
                 # fetch the missing `prev_event`s, we want to make sure that we
                 # backoff and don't try and fetch `pulled_event_without_signatures`
                 # again since we know it just had an invalid signature.
-                pulled_event.get_pdu_json(),
+                make_event_from_dict(pulled_event.get_pdu_json(), room_version),
             ],
-        }
+        )
 
         # Keep track of the count and make sure we don't make any of these requests
         event_endpoint_requested_count = 0
@@ -733,13 +736,9 @@ class FederationEventHandlerTests(unittest.FederatingHomeserverTestCase):
         )
 
         # We expect an outbound request to /backfill, so stub that out
-        self.mock_federation_transport_client.backfill.return_value = {
-            "origin": self.OTHER_SERVER_NAME,
-            "origin_server_ts": 123,
-            "pdus": [
-                pulled_event.get_pdu_json(),
-            ],
-        }
+        self.mock_federation_transport_client.backfill.return_value = BackfillResponse(
+            pdus=[make_event_from_dict(pulled_event.get_pdu_json(), room_version)],
+        )
 
         # The function under test: try to backfill and process the pulled event
         with LoggingContext("test"):
@@ -1575,6 +1575,44 @@ class PresenceHandlerTestCase(BaseMultiWorkerStreamTestCase):
         state = self.get_success(self.presence_handler.get_state(self.user_id_obj))
         self.assertEqual(state.state, PresenceState.ONLINE)
 
+    def test_incoming_presence_malformed(self) -> None:
+        """Malformed presence updates from remote servers are dropped, and
+        malformed optional fields are ignored."""
+        assert isinstance(self.presence_handler, PresenceHandler)
+        self.get_success(
+            self.presence_handler.incoming_presence(
+                "remote",
+                {
+                    "push": [
+                        "not a dict",
+                        {"user_id": ["@alice:remote"], "presence": "online"},
+                        {"user_id": "@bob:remote", "presence": ["online"]},
+                        {"user_id": "@bob:remote", "presence": "dancing"},
+                        {
+                            "user_id": "@carol:remote",
+                            "presence": PresenceState.ONLINE,
+                            "last_active_ago": 1.5,
+                            "status_msg": {"text": "Hello"},
+                            "currently_active": "yes",
+                        },
+                    ]
+                },
+            )
+        )
+
+        bob = self.get_success(
+            self.presence_handler.get_state(UserID.from_string("@bob:remote"))
+        )
+        self.assertEqual(bob.state, PresenceState.OFFLINE)
+
+        carol = self.get_success(
+            self.presence_handler.get_state(UserID.from_string("@carol:remote"))
+        )
+        self.assertEqual(carol.state, PresenceState.ONLINE)
+        self.assertEqual(carol.last_active_ts, 0)
+        self.assertIsNone(carol.status_msg)
+        self.assertFalse(carol.currently_active)
+
 
 class PresenceFederationQueueTestCase(unittest.HomeserverTestCase):
     def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
@@ -262,6 +262,63 @@ class TypingNotificationsTestCase(unittest.HomeserverTestCase):
             backoff_on_all_error_codes=True,
         )
 
+    @override_config(
+        {"federation_sender_instances": None, "typing": {"coalesce_window": "1s"}}
+    )
+    def test_coalesced_typing(self) -> None:
+        """Changes in typing during the coalescing window are sent as a single
+        update to clients and remote servers."""
+        self.room_members = [U_APPLE, U_ONION]
+
+        requester = create_requester(U_APPLE)
+        self.get_success(
+            self.handler.started_typing(
+                target_user=U_APPLE, requester=requester, room_id=ROOM_ID, timeout=20000
+            )
+        )
+        self.get_success(
+            self.handler.stopped_typing(
+                target_user=U_APPLE, requester=requester, room_id=ROOM_ID
+            )
+        )
+        self.get_success(
+            self.handler.started_typing(
+                target_user=U_APPLE, requester=requester, room_id=ROOM_ID, timeout=20000
+            )
+        )
+
+        # Nothing is sent until the end of the window.
+        self.on_new_event.assert_not_called()
+        self.mock_federation_client.put_json.assert_not_called()
+        self.assertEqual(self.event_source.get_current_key(), 0)
+
+        self.reactor.advance(1)
+
+        self.on_new_event.assert_called_once_with(
+            StreamKeyType.TYPING, 1, rooms=[ROOM_ID]
+        )
+        self.assertEqual(self.event_source.get_current_key(), 1)
+
+        # Only the final state is sent over federation.
+        expected_transaction = _expect_edu_transaction(
+            EduTypes.TYPING,
+            content={
+                "room_id": ROOM_ID,
+                "user_id": U_APPLE.to_string(),
+                "typing": True,
+            },
+        )
+        expected_transaction["origin_server_ts"] = 1001000
+        self.mock_federation_client.put_json.assert_called_once_with(
+            "farm",
+            path="/_matrix/federation/v1/send/1000000",
+            data=expected_transaction,
+            json_data_callback=ANY,
+            long_retries=True,
+            try_trailing_slash_on_400=True,
+            backoff_on_all_error_codes=True,
+        )
+
     def test_started_typing_remote_recv(self) -> None:
         self.room_members = [U_APPLE, U_ONION]
 
@@ -20,7 +20,12 @@
 
 from unittest.mock import Mock
 
-from synapse.media._base import add_file_headers, get_filename_from_headers
+from synapse.media._base import (
+    UNSATISFIABLE_RANGE,
+    add_file_headers,
+    get_filename_from_headers,
+    parse_byte_range,
+)
 
 from tests import unittest
 
@@ -86,3 +91,27 @@ class AddFileHeadersTests(unittest.TestCase):
         request.reset_mock()
         add_file_headers(request, "text/html", 0, None)
         request.setHeader.assert_any_call(b"Content-Disposition", b"attachment")
+
+
+class ParseByteRangeTests(unittest.TestCase):
+    # input -> expected result, for a file of 100 bytes
+    TEST_CASES = {
+        b"bytes=0-": (0, 99),
+        b"bytes=10-19": (10, 19),
+        b"Bytes = 10-19": (10, 19),
+        b"bytes=95-200": (95, 99),
+        b"bytes=-10": (90, 99),
+        b"bytes=-200": (0, 99),
+        b"bytes=100-": UNSATISFIABLE_RANGE,
+        b"bytes=-0": UNSATISFIABLE_RANGE,
+        # Invalid headers and multiple ranges are ignored.
+        b"bytes=19-10": None,
+        b"bytes=-": None,
+        b"bytes=0-9,20-29": None,
+        b"items=0-9": None,
+        b"bytes=a-b": None,
+    }
+
+    def tests(self) -> None:
+        for hdr, expected in self.TEST_CASES.items():
+            self.assertEqual(parse_byte_range(hdr, 100), expected, hdr)
@@ -18,6 +18,7 @@
 # [This file includes modifications made by New Vector Limited]
 #
 #
+import hashlib
 import os
 import shutil
 import tempfile
@@ -40,13 +41,14 @@ from twisted.web.http_headers import Headers
 from twisted.web.iweb import UNKNOWN_LENGTH, IResponse
 from twisted.web.resource import Resource
 
-from synapse.api.errors import Codes, HttpResponseException
+from synapse.api.errors import Codes, HttpResponseException, SynapseError
 from synapse.api.ratelimiting import Ratelimiter
 from synapse.events import EventBase
 from synapse.http.types import QueryParams
 from synapse.logging.context import make_deferred_yieldable
 from synapse.media._base import FileInfo, ThumbnailInfo
 from synapse.media.filepath import MediaFilePaths
+from synapse.media.media_repository import MEDIA_LOCAL_CACHE_MIN_AGE_MS
 from synapse.media.media_storage import MediaStorage, ReadableFileWrapper
 from synapse.media.storage_provider import FileStorageProviderBackend
 from synapse.media.thumbnailer import ThumbnailProvider
@@ -55,7 +57,7 @@ from synapse.module_api.callbacks.spamchecker_callbacks import load_legacy_spam_
 from synapse.rest import admin
 from synapse.rest.client import login, media
 from synapse.server import HomeServer
-from synapse.types import JsonDict, RoomAlias
+from synapse.types import JsonDict, RoomAlias, UserID
 from synapse.util import Clock
 
 from tests import unittest
@@ -335,7 +337,7 @@ class MediaRepoTests(unittest.HomeserverTestCase):
         )
         self.assertEqual(
             self.fetches[0][3],
-            {"allow_remote": "false", "timeout_ms": "20000", "allow_redirect": "true"},
+            {"allow_remote": "false", "timeout_ms": "60000", "allow_redirect": "true"},
         )
 
         headers = {
@@ -731,6 +733,185 @@ class MediaRepoTests(unittest.HomeserverTestCase):
         self.pump()
         self.assertEqual(channel.code, 200)
 
+    def test_concurrent_requests_share_download(self) -> None:
+        """Concurrent requests for the same remote media only download it once."""
+        params = "?width=32&height=32&method=scale"
+        channels = [
+            self.make_request(
+                "GET",
+                f"/_matrix/media/v3/download/{self.media_id}",
+                shorthand=False,
+                await_result=False,
+            ),
+            self.make_request(
+                "GET",
+                f"/_matrix/media/v3/download/{self.media_id}",
+                shorthand=False,
+                await_result=False,
+            ),
+            self.make_request(
+                "GET",
+                f"/_matrix/media/r0/thumbnail/{self.media_id}{params}",
+                shorthand=False,
+                await_result=False,
+            ),
+        ]
+        self.pump()
+
+        self.assertEqual(len(self.fetches), 1)
+
+        headers = {
+            b"Content-Length": [b"%d" % (len(self.test_image.data))],
+            b"Content-Type": [self.test_image.content_type],
+        }
+        self.fetches[0][0].callback(
+            (self.test_image.data, (len(self.test_image.data), headers))
+        )
+        self.pump()
+
+        self.assertEqual(len(self.fetches), 1)
+        for channel in channels[:2]:
+            self.assertEqual(channel.code, 200)
+            self.assertEqual(channel.result.get("body", b""), self.test_image.data)
+        if self.test_image.expected_found:
+            self.assertEqual(channels[2].code, 200)
+
+    def test_concurrent_requests_ratelimited_separately(self) -> None:
+        """A request that joins a download started by another request is
+        ratelimited by its own IP once the size of the media is known."""
+        limited_ip = "10.0.0.1"
+        self.media_repo.download_ratelimiter.record_action(
+            requester=None, key=limited_ip, n_actions=600 * 1024 * 1024
+        )
+
+        channel = self.make_request(
+            "GET",
+            f"/_matrix/media/v3/download/{self.media_id}",
+            shorthand=False,
+            await_result=False,
+        )
+        limited_channel = self.make_request(
+            "GET",
+            f"/_matrix/media/v3/download/{self.media_id}",
+            shorthand=False,
+            await_result=False,
+            client_ip=limited_ip,
+        )
+        self.pump()
+        self.assertEqual(len(self.fetches), 1)
+
+        headers = {
+            b"Content-Length": [b"%d" % (len(self.test_image.data))],
+            b"Content-Type": [self.test_image.content_type],
+        }
+        self.fetches[0][0].callback(
+            (self.test_image.data, (len(self.test_image.data), headers))
+        )
+        self.pump()
+
+        self.assertEqual(channel.code, 200)
+        self.assertEqual(channel.result.get("body", b""), self.test_image.data)
+        self.assertEqual(limited_channel.code, 429)
+
+    def test_ratelimited_download_retried_for_other_requests(self) -> None:
+        """If the request that started a download is ratelimited, requests
+        waiting for the download start another one."""
+        limited_channel = self.make_request(
+            "GET",
+            f"/_matrix/media/v3/download/{self.media_id}",
+            shorthand=False,
+            await_result=False,
+        )
+        channel = self.make_request(
+            "GET",
+            f"/_matrix/media/v3/download/{self.media_id}",
+            shorthand=False,
+            await_result=False,
+            client_ip="10.0.0.1",
+        )
+        self.pump()
+        self.assertEqual(len(self.fetches), 1)
+
+        # The federation client rejects the download once it sees the size of
+        # the media.
+        self.fetches[0][0].errback(
+            SynapseError(
+                429, "Requested file size exceeds ratelimits", Codes.LIMIT_EXCEEDED
+            )
+        )
+        self.pump()
+        self.assertEqual(limited_channel.code, 429)
+        self.assertEqual(len(self.fetches), 2)
+
+        headers = {
+            b"Content-Length": [b"%d" % (len(self.test_image.data))],
+            b"Content-Type": [self.test_image.content_type],
+        }
+        self.fetches[1][0].callback(
+            (self.test_image.data, (len(self.test_image.data), headers))
+        )
+        self.pump()
+
+        self.assertEqual(channel.code, 200)
+        self.assertEqual(channel.result.get("body", b""), self.test_image.data)
+
+    def test_concurrent_requests_time_out_separately(self) -> None:
+        """Each request waits for a shared download for up to its own
+        `timeout_ms`."""
+        channel = self.make_request(
+            "GET",
+            f"/_matrix/media/v3/download/{self.media_id}",
+            shorthand=False,
+            await_result=False,
+        )
+        short_channel = self.make_request(
+            "GET",
+            f"/_matrix/media/v3/download/{self.media_id}?timeout_ms=1000",
+            shorthand=False,
+            await_result=False,
+        )
+        self.pump()
+        self.assertEqual(len(self.fetches), 1)
+
+        self.reactor.advance(1.5)
+        self.assertEqual(short_channel.code, 504)
+        self.assertEqual(short_channel.json_body["errcode"], Codes.NOT_YET_UPLOADED)
+
+        headers = {
+            b"Content-Length": [b"%d" % (len(self.test_image.data))],
+            b"Content-Type": [self.test_image.content_type],
+        }
+        self.fetches[0][0].callback(
+            (self.test_image.data, (len(self.test_image.data), headers))
+        )
+        self.pump()
+
+        self.assertEqual(channel.code, 200)
+        self.assertEqual(channel.result.get("body", b""), self.test_image.data)
+
+    def test_concurrent_exact_thumbnails_share_generation(self) -> None:
+        """Concurrent requests for a thumbnail of the same size only generate it
+        once."""
+        generation: "Deferred[Optional[str]]" = Deferred()
+        generate = Mock(return_value=make_deferred_yieldable(generation))
+        self.media_repo._generate_remote_exact_thumbnail = generate  # type: ignore[method-assign]
+
+        results = [
+            defer.ensureDeferred(
+                self.media_repo.generate_remote_exact_thumbnail(
+                    "example.com", "file_id", "12345", 32, 32, "scale", "image/png"
+                )
+            )
+            for _ in range(2)
+        ]
+        self.pump()
+
+        generate.assert_called_once()
+
+        generation.callback("/path/to/thumbnail")
+        for result in results:
+            self.assertEqual(self.get_success(result), "/path/to/thumbnail")
+
 
 class TestSpamCheckerLegacy:
     """A spam checker module that rejects all media that includes the bytes
@@ -1124,3 +1305,283 @@ class RemoteDownloadLimiterTestCase(unittest.HomeserverTestCase):
         )
         assert channel.code == 502
         assert channel.json_body["errcode"] == "M_TOO_LARGE"
+
+
+class MediaDeduplicationTestCase(unittest.HomeserverTestCase):
+    def default_config(self) -> JsonDict:
+        config = super().default_config()
+        config["enable_media_deduplication"] = True
+        return config
+
+    def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
+        self.media_repo = hs.get_media_repository()
+        self.store = hs.get_datastores().main
+        self.filepaths = MediaFilePaths(hs.config.media.media_store_path)
+        self.user = UserID.from_string("@user:test")
+
+        image = Image.new("RGB", (100, 80), (255, 0, 0))
+        png = BytesIO()
+        image.save(png, "PNG")
+        self.png = png.getvalue()
+
+    def _upload(self, content: bytes, media_type: str = "image/png") -> str:
+        mxc = self.get_success(
+            self.media_repo.create_content(
+                media_type, None, BytesIO(content), len(content), self.user
+            )
+        )
+        return mxc.media_id
+
+    def test_duplicate_uploads_share_blob(self) -> None:
+        """Uploads with the same content are links to the same blob, which is
+        deleted along with the last of them."""
+        media_id_1 = self._upload(self.png)
+        media_id_2 = self._upload(self.png)
+        other_media_id = self._upload(b"something else", "text/plain")
+
+        sha256 = hashlib.sha256(self.png).hexdigest()
+        blob_path = self.filepaths.blob_filepath(sha256)
+        blob_inode = os.stat(blob_path).st_ino
+        for media_id in (media_id_1, media_id_2):
+            path = self.filepaths.local_media_filepath(media_id)
+            self.assertEqual(os.stat(path).st_ino, blob_inode)
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), self.png)
+
+            self.assertEqual(
+                self.get_success(
+                    self.store.get_media_blob_sha256(
+                        self.filepaths.local_media_filepath_rel(media_id)
+                    )
+                ),
+                sha256,
+            )
+
+        self.assertNotEqual(
+            os.stat(self.filepaths.local_media_filepath(other_media_id)).st_ino,
+            blob_inode,
+        )
+
+        # The thumbnails for the second upload are links to those of the first.
+        thumbnails_1 = self.get_success(
+            self.store.get_local_media_thumbnails(media_id_1)
+        )
+        thumbnails_2 = self.get_success(
+            self.store.get_local_media_thumbnails(media_id_2)
+        )
+        self.assertGreater(len(thumbnails_1), 0)
+        self.assertCountEqual(thumbnails_1, thumbnails_2)
+        for t in thumbnails_1:
+            path_1, path_2 = (
+                self.filepaths.local_media_thumbnail(
+                    media_id, t.width, t.height, t.type, t.method
+                )
+                for media_id in (media_id_1, media_id_2)
+            )
+            self.assertEqual(os.stat(path_1).st_ino, os.stat(path_2).st_ino)
+
+        # The blob is kept until all of the media linking to it is deleted.
+        self.get_success(self.media_repo.delete_local_media_ids([media_id_1]))
+        self.assertTrue(os.path.exists(blob_path))
+        self.get_success(self.media_repo.delete_local_media_ids([media_id_2]))
+        self.assertFalse(os.path.exists(blob_path))
+
+    def test_thumbnails_regenerated_if_deleted(self) -> None:
+        """Thumbnails are generated again if the media they were generated for
+        has been deleted."""
+        media_id_1 = self._upload(self.png)
+        media_id_2 = self._upload(self.png)
+        self.get_success(self.media_repo.delete_local_media_ids([media_id_1]))
+
+        media_id_3 = self._upload(self.png)
+        thumbnails = self.get_success(self.store.get_local_media_thumbnails(media_id_3))
+        self.assertGreater(len(thumbnails), 0)
+        for t in thumbnails:
+            path_2, path_3 = (
+                self.filepaths.local_media_thumbnail(
+                    media_id, t.width, t.height, t.type, t.method
+                )
+                for media_id in (media_id_2, media_id_3)
+            )
+            self.assertTrue(os.path.exists(path_3))
+            # The thumbnails of the second upload are still linked to those of
+            # the deleted first upload, rather than the new ones.
+            self.assertNotEqual(os.stat(path_2).st_ino, os.stat(path_3).st_ino)
+
+
+class MediaLocalCacheTestCase(unittest.HomeserverTestCase):
+    needs_threadpool = True
+
+    def default_config(self) -> JsonDict:
+        config = super().default_config()
+
+        self.backup_dir = tempfile.mkdtemp(prefix="synapse-tests-")
+        self.addCleanup(shutil.rmtree, self.backup_dir)
+        config["media_storage_providers"] = [
+            {
+                "module": "file_system",
+                "store_local": True,
+                "store_remote": True,
+                "store_synchronous": True,
+                "config": {"directory": self.backup_dir},
+            }
+        ]
+        config["media_local_cache"] = {"max_size": 100}
+        return config
+
+    def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
+        self.media_repo = hs.get_media_repository()
+        self.filepaths = MediaFilePaths(hs.config.media.media_store_path)
+        self.user = UserID.from_string("@user:test")
+
+    def _upload(self, content: bytes) -> str:
+        d = defer.ensureDeferred(
+            self.media_repo.create_content(
+                "text/plain", None, BytesIO(content), len(content), self.user
+            )
+        )
+        self.wait_on_thread(d)
+        return self.get_success(d).media_id
+
+    def test_evict_least_recently_accessed(self) -> None:
+        """The least recently accessed media is evicted from the local media
+        store when it grows too large, and fetched back when next accessed."""
+        media_ids = []
+        for i in range(3):
+            media_ids.append(self._upload(b"%d" % (i,) * 40))
+            self.reactor.advance(1)
+
+        # Accessing the oldest media makes it the most recently accessed.
+        self.media_repo.mark_recently_accessed(None, media_ids[0])
+        self.get_success(self.media_repo._update_recently_accessed())
+
+        # Recently accessed media isn't evicted.
+        self.get_success(self.media_repo._evict_from_local_cache())
+        self._assert_in_local_cache(media_ids, [True, True, True])
+
+        # Evicting the least recently accessed media takes the media down to
+        # under 90 bytes.
+        self.reactor.advance(2 * 60 * 60)
+        self.get_success(self.media_repo._evict_from_local_cache())
+        self._assert_in_local_cache(media_ids, [True, False, True])
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(
+                    self.backup_dir,
+                    self.filepaths.local_media_filepath_rel(media_ids[1]),
+                )
+            )
+        )
+
+        # Fetching evicted media puts it back in the local media store.
+        # This uses a real blocking threadpool so we have to wait for it to be
+        # actually done.
+        d = defer.ensureDeferred(
+            self.media_repo.media_storage.fetch_media(FileInfo(None, media_ids[1]))
+        )
+        self.wait_on_thread(d)
+        responder = self.get_success(d)
+        assert responder is not None
+        with responder:
+            pass
+        with open(self.filepaths.local_media_filepath(media_ids[1]), "rb") as f:
+            self.assertEqual(f.read(), b"1" * 40)
+
+        # Evicting again evicts the next least recently accessed media.
+        self.media_repo.mark_recently_accessed(None, media_ids[1])
+        self.get_success(self.media_repo._update_recently_accessed())
+        self.reactor.advance(2 * 60 * 60)
+        self.get_success(self.media_repo._evict_from_local_cache())
+        self._assert_in_local_cache(media_ids, [True, True, False])
+
+    def test_only_evict_media_in_storage_provider(self) -> None:
+        """Media is not evicted from the local media store if no storage
+        provider has a copy of it."""
+        media_ids = []
+        for i in range(3):
+            media_ids.append(self._upload(b"%d" % (i,) * 40))
+            self.reactor.advance(1)
+
+        # Simulate storing the least recently accessed media in the storage
+        # provider having failed.
+        os.remove(
+            os.path.join(
+                self.backup_dir, self.filepaths.local_media_filepath_rel(media_ids[0])
+            )
+        )
+
+        self.reactor.advance(2 * 60 * 60)
+        self.get_success(self.media_repo._evict_from_local_cache())
+        self._assert_in_local_cache(media_ids, [True, False, True])
+
+    def test_evicted_media_accessed_through_thumbnails(self) -> None:
+        """Evicted media which is only accessed through its thumbnails doesn't
+        count towards the size of the local media store until it is fetched
+        back."""
+        media_ids = []
+        for i in range(3):
+            media_ids.append(self._upload(b"%d" % (i,) * 40))
+            self.reactor.advance(1)
+
+        self.reactor.advance(2 * 60 * 60)
+        self.get_success(self.media_repo._evict_from_local_cache())
+        self._assert_in_local_cache(media_ids, [False, True, True])
+
+        # Requesting a thumbnail marks the media as recently accessed, without
+        # fetching it back.
+        self.media_repo.mark_recently_accessed(None, media_ids[0])
+        self.get_success(self.media_repo._update_recently_accessed())
+
+        store = self.hs.get_datastores().main
+        position = self.get_success(store.get_media_local_cache_eviction_position())
+        self.assertEqual(
+            self.get_success(
+                store.get_size_of_media_accessed_since(position, True, False)
+            ),
+            80,
+        )
+
+        self.reactor.advance(2 * 60 * 60)
+        self.get_success(self.media_repo._evict_from_local_cache())
+        self._assert_in_local_cache(media_ids, [False, True, True])
+
+        # Once it is fetched back, it counts again.
+        d = defer.ensureDeferred(
+            self.media_repo.media_storage.fetch_media(FileInfo(None, media_ids[0]))
+        )
+        self.wait_on_thread(d)
+        responder = self.get_success(d)
+        assert responder is not None
+        with responder:
+            pass
+        self.assertEqual(
+            self.get_success(
+                store.get_size_of_media_accessed_since(position, True, False)
+            ),
+            120,
+        )
+
+    def test_evict_stops_at_recently_accessed_media(self) -> None:
+        """Eviction stops when the least recently accessed media was accessed
+        exactly the minimum age ago."""
+        self.reactor.advance(2 * 60 * 60)
+        media_ids = [self._upload(b"%d" % (i,) * 40) for i in range(3)]
+
+        self.get_success(
+            self.hs.get_datastores().main.update_cached_last_access_time(
+                media_ids, [], self.clock.time_msec() - MEDIA_LOCAL_CACHE_MIN_AGE_MS
+            )
+        )
+        self.get_success(self.media_repo._evict_from_local_cache())
+        self._assert_in_local_cache(media_ids, [True, True, True])
+
+    def _assert_in_local_cache(
+        self, media_ids: List[str], expected: List[bool]
+    ) -> None:
+        self.assertEqual(
+            [
+                os.path.exists(self.filepaths.local_media_filepath(media_id))
+                for media_id in media_ids
+            ],
+            expected,
+        )
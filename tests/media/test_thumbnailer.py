@@ -0,0 +1,80 @@
+#
+# This file is licensed under the Affero General Public License (AGPL) version 3.
+#
+# Copyright (C) 2024 New Vector, Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# See the GNU Affero General Public License for more details:
+# <https://www.gnu.org/licenses/agpl-3.0.html>.
+#
+import os
+import shutil
+import tempfile
+
+from PIL import Image
+
+from synapse.config.repository import ThumbnailRequirement
+from synapse.media.thumbnailer import Thumbnailer
+
+from tests import unittest
+
+REQUIREMENTS = [
+    ThumbnailRequirement(32, 32, "crop", "image/jpeg"),
+    ThumbnailRequirement(96, 96, "crop", "image/png"),
+    ThumbnailRequirement(320, 240, "scale", "image/jpeg"),
+    ThumbnailRequirement(800, 600, "scale", "image/jpeg"),
+    # Cropped thumbnails with the same size as a scaled one are not generated.
+    ThumbnailRequirement(320, 160, "crop", "image/jpeg"),
+]
+
+
+class ThumbnailerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def _make_image(self, name: str, size: tuple, format: str) -> str:
+        path = os.path.join(self.tmpdir, name)
+        with Image.linear_gradient("L") as gradient:
+            with gradient.resize(size) as image:
+                image.convert("RGB").save(path, format)
+        return path
+
+    def _assert_thumbnails(self, path: str) -> None:
+        with Thumbnailer(path) as thumbnailer:
+            size, thumbnails = thumbnailer.generate_thumbnails(REQUIREMENTS)
+
+        self.assertEqual(size, (4000, 2000))
+        self.assertEqual(
+            set(thumbnails),
+            {
+                (32, 32, "image/jpeg", "crop"),
+                (96, 96, "image/png", "crop"),
+                (320, 160, "image/jpeg", "scale"),
+                (800, 400, "image/jpeg", "scale"),
+            },
+        )
+
+        for (width, height, media_type, _), thumbnail in thumbnails.items():
+            thumbnail.seek(0)
+            with Image.open(thumbnail) as image:
+                self.assertEqual(image.size, (width, height))
+                self.assertEqual(image.format, Thumbnailer.FORMATS[media_type])
+
+    def test_generate_thumbnails_jpeg(self) -> None:
+        """JPEGs are decoded at a reduced size that is still large enough for
+        all of the thumbnails."""
+        path = self._make_image("image.jpg", (4000, 2000), "JPEG")
+        self._assert_thumbnails(path)
+
+        with Thumbnailer(path) as thumbnailer:
+            thumbnailer.draft(800, 400)
+            self.assertEqual((thumbnailer.width, thumbnailer.height), (2000, 1000))
+
+    def test_generate_thumbnails_png(self) -> None:
+        path = self._make_image("image.png", (4000, 2000), "PNG")
+        self._assert_thumbnails(path)
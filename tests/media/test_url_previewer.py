@@ -20,9 +20,11 @@
 #
 import os
 
+from twisted.internet import defer
 from twisted.test.proto_helpers import MemoryReactor
 
 from synapse.server import HomeServer
+from synapse.types import UserID
 from synapse.util import Clock
 
 from tests import unittest
@@ -118,3 +120,30 @@ class URLPreviewTests(unittest.HomeserverTestCase):
 
         # The TLD is not blocked.
         self.assertFalse(self.url_previewer._is_url_blocked("https://example.com"))
+
+    def test_preview_shared_with_other_worker(self) -> None:
+        """A URL which another worker is previewing is not fetched again, and the
+        preview that worker stores is used instead."""
+        store = self.hs.get_datastores().main
+        url = "http://matrix.org"
+
+        lock = self.get_success(store.try_acquire_lock("url_preview", url))
+        assert lock is not None
+
+        ts = self.clock.time_msec()
+        d = defer.ensureDeferred(
+            self.url_previewer.preview(url, UserID.from_string("@user:test"), ts)
+        )
+        self.pump()
+        self.assertNoResult(d)
+
+        self.get_success(
+            store.store_url_cache(
+                url, 200, None, ts + 60000, '{"og:title": "Matrix"}', "media_id", ts
+            )
+        )
+        self.get_success(lock.release())
+        self.reactor.advance(5)
+
+        self.assertEqual(self.get_success(d), b'{"og:title": "Matrix"}')
+        self.assertEqual(self.reactor.tcpClients, [])
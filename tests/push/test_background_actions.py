@@ -0,0 +1,172 @@
+#
+# This file is licensed under the Affero General Public License (AGPL) version 3.
+#
+# Copyright (C) 2024 New Vector, Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# See the GNU Affero General Public License for more details:
+# <https://www.gnu.org/licenses/agpl-3.0.html>.
+#
+
+from typing import List
+
+from twisted.test.proto_helpers import MemoryReactor
+
+from synapse.rest import admin
+from synapse.rest.client import login, room
+from synapse.server import HomeServer
+from synapse.types import JsonDict
+from synapse.util import Clock
+
+from tests.unittest import HomeserverTestCase, override_config
+
+
+class BackgroundPushActionsTestCase(HomeserverTestCase):
+    servlets = [
+        admin.register_servlets,
+        room.register_servlets,
+        login.register_servlets,
+    ]
+
+    def default_config(self) -> JsonDict:
+        config = super().default_config()
+        config.setdefault("push", {"calculate_actions_in_background": True})
+        return config
+
+    def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
+        self.store = hs.get_datastores().main
+
+        self.user_id = self.register_user("user", "pass")
+        self.token = self.login("user", "pass")
+        self.other_id = self.register_user("other", "pass")
+        self.other_token = self.login("other", "pass")
+
+        self.room_id = self.helper.create_room_as(self.user_id, tok=self.token)
+        self.helper.join(self.room_id, self.other_id, tok=self.other_token)
+
+    def _get_push_action_users(self, event_id: str) -> List[str]:
+        return self.get_success(
+            self.store.db_pool.simple_select_onecol(
+                table="event_push_actions",
+                keyvalues={"event_id": event_id},
+                retcol="user_id",
+            )
+        )
+
+    def test_push_actions_calculated_after_persisting(self) -> None:
+        """Push actions for messages are only calculated once the pushers have
+        started, and only for messages sent after they first started."""
+        event_id = self.helper.send(self.room_id, body="Hello", tok=self.other_token)[
+            "event_id"
+        ]
+
+        # Nothing has calculated push actions for the message yet.
+        self.assertEqual(self._get_push_action_users(event_id), [])
+
+        # The first time the pushers start, they start from the current position.
+        pusher_pool = self.hs.get_pusherpool()
+        pusher_pool.start()
+        self.pump()
+        self.assertEqual(self._get_push_action_users(event_id), [])
+
+        event_id = self.helper.send(self.room_id, body="Hello", tok=self.other_token)[
+            "event_id"
+        ]
+        self.pump()
+        self.assertEqual(self._get_push_action_users(event_id), [self.user_id])
+
+        position = self.get_success(self.store.get_background_push_actions_position())
+        self.assertEqual(position, self.store.get_room_max_stream_ordering())
+        self.assertEqual(pusher_pool.get_max_push_stream_ordering(), position)
+
+    def test_state_events_calculated_before_persisting(self) -> None:
+        """Push actions for state events are still calculated before they are
+        persisted."""
+        invitee = self.register_user("invitee", "pass")
+        self.helper.invite(self.room_id, self.user_id, invitee, tok=self.token)
+
+        invite_event_id = self.get_success(
+            self.hs.get_storage_controllers().state.get_current_state_ids(self.room_id)
+        )[("m.room.member", invitee)]
+        self.assertEqual(self._get_push_action_users(invite_event_id), [invitee])
+
+    def test_max_push_stream_ordering_before_start(self) -> None:
+        """Pushers added before we've loaded our position look for push actions
+        up to the current position of the events stream."""
+        self.assertEqual(
+            self.hs.get_pusherpool().get_max_push_stream_ordering(),
+            self.store.get_room_max_stream_ordering(),
+        )
+
+    def test_existing_push_actions_skipped(self) -> None:
+        """Adding push actions for events which already have them doesn't fail or
+        count them twice."""
+        self.hs.get_pusherpool().start()
+        self.pump()
+
+        event_id = self.helper.send(self.room_id, body="Hello", tok=self.other_token)[
+            "event_id"
+        ]
+        self.pump()
+        self.assertEqual(self._get_push_action_users(event_id), [self.user_id])
+
+        event = self.get_success(self.store.get_event(event_id))
+        self.get_success(
+            self.store.add_background_push_actions(
+                [(event, {self.user_id: ["notify"]}, True, "main")],
+                self.store.get_room_max_stream_ordering(),
+            )
+        )
+        self.assertEqual(self._get_push_action_users(event_id), [self.user_id])
+
+        counts = self.get_success(
+            self.store.get_unread_event_push_actions_by_room_for_user(
+                self.room_id, self.user_id
+            )
+        )
+        self.assertEqual(counts.main_timeline.notify_count, 1)
+
+    def test_unread_counts_invalidated(self) -> None:
+        """Unread counts read before push actions are calculated in the
+        background aren't served from the cache afterwards."""
+        event_id = self.helper.send(self.room_id, body="Hello", tok=self.other_token)[
+            "event_id"
+        ]
+        counts = self.get_success(
+            self.store.get_unread_event_push_actions_by_room_for_user(
+                self.room_id, self.user_id
+            )
+        )
+        self.assertEqual(counts.main_timeline.notify_count, 0)
+
+        event = self.get_success(self.store.get_event(event_id))
+        self.get_success(
+            self.store.add_background_push_actions(
+                [(event, {self.user_id: ["notify"]}, True, "main")],
+                self.store.get_room_max_stream_ordering(),
+            )
+        )
+
+        counts = self.get_success(
+            self.store.get_unread_event_push_actions_by_room_for_user(
+                self.room_id, self.user_id
+            )
+        )
+        self.assertEqual(counts.main_timeline.notify_count, 1)
+
+    @override_config({"push": {"calculate_actions_in_background": False}})
+    def test_position_reset_when_disabled(self) -> None:
+        """Our position is forgotten when push actions are calculated before
+        persisting, so re-enabling starts from the current position."""
+        self.get_success(self.store.add_background_push_actions([], 1))
+
+        self.hs.get_pusherpool().start()
+        self.pump()
+
+        self.assertIsNone(
+            self.get_success(self.store.get_background_push_actions_position())
+        )
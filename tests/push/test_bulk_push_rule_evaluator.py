@@ -28,10 +28,14 @@ from twisted.test.proto_helpers import MemoryReactor
 
 from synapse.api.constants import EventContentFields, RelationTypes
 from synapse.api.room_versions import RoomVersions
-from synapse.push.bulk_push_rule_evaluator import BulkPushRuleEvaluator
+from synapse.push.bulk_push_rule_evaluator import (
+    BulkPushRuleEvaluator,
+    _SharedRuleSetEvaluator,
+)
 from synapse.rest import admin
 from synapse.rest.client import login, register, room
 from synapse.server import HomeServer
+from synapse.synapse_rust.push import PushRuleEvaluator
 from synapse.types import JsonDict, create_requester
 from synapse.util import Clock
 
@@ -234,6 +238,43 @@ class TestBulkPushRuleEvaluator(HomeserverTestCase):
         )
         return len(result) > 0
 
+    def test_shared_rule_sets(self) -> None:
+        """Users with identical push rules share their evaluation, unless the
+        event may mention them."""
+        store = self.hs.get_datastores().main
+        users = [self.register_user(name, "pass") for name in ("bob", "charlie")]
+        dave = self.register_user("dave", "pass")
+
+        rules_by_user = self.get_success(store.bulk_get_push_rules(users + [dave]))
+        # The users all have the default rules, so share a rules object.
+        self.assertIs(rules_by_user[users[0]], rules_by_user[users[1]])
+        self.assertIs(rules_by_user[users[0]], rules_by_user[dave])
+
+        flattened_event = {
+            "type": "m.room.message",
+            "sender": self.alice,
+            "content.msgtype": "m.text",
+            "content.body": "Hello Dave",
+        }
+        shared_evaluator = _SharedRuleSetEvaluator(
+            PushRuleEvaluator(
+                flattened_event, False, 10, 0, {}, {}, False, (), False, False
+            ),
+            flattened_event,
+            {},
+        )
+
+        actions = {
+            user_id: shared_evaluator.run(rules, user_id, user_id[1:].split(":")[0])
+            for user_id, rules in rules_by_user.items()
+        }
+
+        # Bob and Charlie shared an evaluation, while Dave was mentioned.
+        self.assertEqual(shared_evaluator.evaluations, 2)
+        self.assertEqual(actions[users[0]], actions[users[1]])
+        self.assertIn({"set_tweak": "highlight"}, actions[dave])
+        self.assertNotIn({"set_tweak": "highlight"}, actions[users[0]])
+
     def test_user_mentions(self) -> None:
         """Test the behavior of an event which includes invalid user mentions."""
         bulk_evaluator = BulkPushRuleEvaluator(self.hs)
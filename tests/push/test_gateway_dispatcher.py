@@ -0,0 +1,146 @@
+#
+# This file is licensed under the Affero General Public License (AGPL) version 3.
+#
+# Copyright (C) 2024 New Vector, Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# See the GNU Affero General Public License for more details:
+# <https://www.gnu.org/licenses/agpl-3.0.html>.
+#
+
+from typing import List, Tuple
+from unittest.mock import Mock
+
+from twisted.internet.defer import Deferred
+from twisted.test.proto_helpers import MemoryReactor
+
+from synapse.logging.context import make_deferred_yieldable
+from synapse.server import HomeServer
+from synapse.types import JsonDict
+from synapse.util import Clock
+
+from tests.unittest import HomeserverTestCase, override_config
+
+URL = "http://gateway.example.com/_matrix/push/v1/notify"
+USER = "@user:test"
+
+
+class PushGatewayDispatcherTestCase(HomeserverTestCase):
+    def make_homeserver(self, reactor: MemoryReactor, clock: Clock) -> HomeServer:
+        self.push_attempts: List[Tuple[Deferred, str, JsonDict]] = []
+
+        m = Mock()
+
+        def post_json_get_json(url: str, body: JsonDict) -> Deferred:
+            d: Deferred = Deferred()
+            self.push_attempts.append((d, url, body))
+            return make_deferred_yieldable(d)
+
+        m.post_json_get_json = post_json_get_json
+
+        return self.setup_test_homeserver(proxied_blocklisted_http_client=m)
+
+    def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
+        self.dispatcher = hs.get_push_gateway_dispatcher()
+
+    def test_batches_identical_notifications(self) -> None:
+        """Identical notifications to different devices of a user are sent in one
+        request, and each device only sees its own rejected pushkey."""
+        notification = {"id": "$event", "room_id": "!room:test"}
+        d1 = Deferred.fromCoroutine(
+            self.dispatcher.send_notification(URL, USER, notification, {"pushkey": "a"})
+        )
+        d2 = Deferred.fromCoroutine(
+            self.dispatcher.send_notification(URL, USER, notification, {"pushkey": "b"})
+        )
+        d3 = Deferred.fromCoroutine(
+            self.dispatcher.send_notification(
+                URL, USER, {"id": "$other", "room_id": "!room:test"}, {"pushkey": "a"}
+            )
+        )
+        self.pump()
+
+        self.assertEqual(len(self.push_attempts), 2)
+        self.assertEqual(
+            self.push_attempts[0][2]["notification"]["devices"],
+            [{"pushkey": "a"}, {"pushkey": "b"}],
+        )
+        self.assertEqual(
+            self.push_attempts[1][2]["notification"]["devices"], [{"pushkey": "a"}]
+        )
+
+        self.push_attempts[0][0].callback({"rejected": ["b"]})
+        self.push_attempts[1][0].errback(Exception("Gateway unavailable"))
+
+        self.assertEqual(self.successResultOf(d1), [])
+        self.assertEqual(self.successResultOf(d2), ["b"])
+        self.assertEqual(self.successResultOf(d3), False)
+
+    def test_does_not_batch_different_users(self) -> None:
+        """Identical notifications for different users are sent in separate
+        requests, so that a failed request doesn't cause other users' devices to
+        be notified again."""
+        notification = {"id": "$event", "room_id": "!room:test"}
+        d1 = Deferred.fromCoroutine(
+            self.dispatcher.send_notification(
+                URL, "@user1:test", notification, {"pushkey": "a"}
+            )
+        )
+        d2 = Deferred.fromCoroutine(
+            self.dispatcher.send_notification(
+                URL, "@user2:test", notification, {"pushkey": "b"}
+            )
+        )
+        self.pump()
+
+        self.assertEqual(len(self.push_attempts), 2)
+        self.assertEqual(
+            self.push_attempts[0][2]["notification"]["devices"], [{"pushkey": "a"}]
+        )
+        self.assertEqual(
+            self.push_attempts[1][2]["notification"]["devices"], [{"pushkey": "b"}]
+        )
+
+        self.push_attempts[0][0].errback(Exception("Gateway unavailable"))
+        self.push_attempts[1][0].callback({})
+
+        self.assertEqual(self.successResultOf(d1), False)
+        self.assertEqual(self.successResultOf(d2), [])
+
+    @override_config({"push": {"max_concurrent_gateway_requests": 1}})
+    def test_limits_concurrent_requests(self) -> None:
+        """Only the configured number of requests are made to each gateway at
+        once, and notifications queued up behind them are still batched."""
+        first = Deferred.fromCoroutine(
+            self.dispatcher.send_notification(URL, USER, {"id": "$1"}, {"pushkey": "a"})
+        )
+        self.pump()
+        self.assertEqual(len(self.push_attempts), 1)
+
+        second = [
+            Deferred.fromCoroutine(
+                self.dispatcher.send_notification(
+                    URL, USER, {"id": "$2"}, {"pushkey": key}
+                )
+            )
+            for key in ("a", "b")
+        ]
+        self.pump()
+        self.assertEqual(len(self.push_attempts), 1)
+
+        self.push_attempts[0][0].callback({})
+        self.pump()
+        self.assertEqual(self.successResultOf(first), [])
+        self.assertEqual(len(self.push_attempts), 2)
+        self.assertEqual(
+            self.push_attempts[1][2]["notification"]["devices"],
+            [{"pushkey": "a"}, {"pushkey": "b"}],
+        )
+
+        self.push_attempts[1][0].callback({})
+        for d in second:
+            self.assertEqual(self.successResultOf(d), [])
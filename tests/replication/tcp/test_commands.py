@@ -19,6 +19,7 @@
 #
 #
 from synapse.replication.tcp.commands import (
+    RdataBatchCommand,
     RdataCommand,
     ReplicateCommand,
     parse_command_from_line,
@@ -48,3 +49,25 @@ class ParseCommandTestCase(TestCase):
         self.assertEqual(cmd.stream_name, "presence")
         self.assertEqual(cmd.instance_name, "master")
         self.assertIsNone(cmd.token)
+
+    def test_parse_rdata_batch_command(self) -> None:
+        line = 'RDATA_BATCH caches master [[5, ["get_user_by_id", ["@foo:example.com"], 1]], [6, ["get_user_by_id", null, 2]]]'
+        cmd = parse_command_from_line(line)
+        assert isinstance(cmd, RdataBatchCommand)
+        self.assertEqual(cmd.stream_name, "caches")
+        self.assertEqual(cmd.instance_name, "master")
+        self.assertEqual(
+            cmd.updates,
+            [
+                (5, ["get_user_by_id", ["@foo:example.com"], 1]),
+                (6, ["get_user_by_id", None, 2]),
+            ],
+        )
+
+    def test_rdata_batch_round_trip(self) -> None:
+        cmd = RdataBatchCommand(
+            "events", "master", [(1, ("ev", ("$a",))), (1, ("ev", ("$b",)))]
+        )
+        parsed = parse_command_from_line(f"{cmd.NAME} {cmd.to_line()}")
+        assert isinstance(parsed, RdataBatchCommand)
+        self.assertEqual(parsed.updates, [(1, ["ev", ["$a"]]), (1, ["ev", ["$b"]])])
@@ -18,12 +18,24 @@
 # [This file includes modifications made by New Vector Limited]
 #
 #
+from typing import List, Tuple, Union
+from unittest.mock import Mock, patch
 
 from twisted.internet import defer
-
-from synapse.replication.tcp.commands import PositionCommand
+from twisted.test.proto_helpers import MemoryReactor
+
+from synapse.replication.tcp.commands import (
+    PositionCommand,
+    RdataBatchCommand,
+    RdataCommand,
+)
+from synapse.replication.tcp.protocol import IReplicationConnection
+from synapse.replication.tcp.streams import CachesStream
+from synapse.server import HomeServer
+from synapse.util import Clock
 
 from tests.replication._base import BaseMultiWorkerStreamTestCase
+from tests.unittest import HomeserverTestCase, override_config
 
 
 class ChannelsTestCase(BaseMultiWorkerStreamTestCase):
@@ -209,3 +221,185 @@ class ChannelsTestCase(BaseMultiWorkerStreamTestCase):
         # Master should get told about `next_token2`, so the deferred should
         # resolve.
         self.assertTrue(d.called)
+
+
+class StreamProcessingSchedulerTestCase(HomeserverTestCase):
+    @override_config(
+        {
+            "replication_stream_processing": {
+                "max_concurrent_streams": 1,
+                "stream_priorities": {"caches": 5},
+            }
+        }
+    )
+    def test_priorities(self) -> None:
+        """When streams have to wait to be processed, higher priority streams are
+        processed first."""
+        cmd_handler = self.hs.get_replication_command_handler()
+
+        processed: List[str] = []
+        blocker: "defer.Deferred[None]" = defer.Deferred()
+
+        async def _process_command(
+            cmd: Union[PositionCommand, RdataCommand, RdataBatchCommand],
+            conn: IReplicationConnection,
+            stream_name: str,
+        ) -> None:
+            processed.append(stream_name)
+            if stream_name == "events":
+                await blocker
+
+        cmd_handler._process_command = _process_command  # type: ignore[method-assign]
+
+        conn = Mock()
+        for stream_name in ("events", "account_data", "caches", "typing", "events"):
+            cmd_handler._add_command_to_stream_queue(
+                conn, PositionCommand(stream_name, "master", 1, 2)
+            )
+
+        # Only the first command can be processed, as only one stream can be
+        # processed at once.
+        self.assertEqual(processed, ["events"])
+
+        # Once it finishes, the typing stream has the highest (default) priority,
+        # then caches, then account_data and events, which both have the default
+        # priority.
+        blocker.callback(None)
+        self.assertEqual(processed[:3], ["events", "typing", "caches"])
+        self.assertCountEqual(processed[3:], ["account_data", "events"])
+
+    @override_config(
+        {
+            "replication_stream_processing": {
+                "max_concurrent_streams": 1,
+                "max_wait": "5s",
+            }
+        }
+    )
+    def test_no_starvation(self) -> None:
+        """A constant flow of updates to a high priority stream doesn't stop lower
+        priority streams from being processed."""
+        cmd_handler = self.hs.get_replication_command_handler()
+        conn = Mock()
+
+        processed: List[str] = []
+
+        async def _process_command(
+            cmd: Union[PositionCommand, RdataCommand, RdataBatchCommand],
+            conn: IReplicationConnection,
+            stream_name: str,
+        ) -> None:
+            processed.append(stream_name)
+            await self.clock.sleep(1)
+            if stream_name == "typing":
+                # There's always another typing update.
+                cmd_handler._add_command_to_stream_queue(
+                    conn, PositionCommand("typing", "master", 1, 2)
+                )
+
+        cmd_handler._process_command = _process_command  # type: ignore[method-assign]
+
+        cmd_handler._add_command_to_stream_queue(
+            conn, PositionCommand("typing", "master", 1, 2)
+        )
+        cmd_handler._add_command_to_stream_queue(
+            conn, PositionCommand("events", "master", 1, 2)
+        )
+
+        # The typing stream has a higher priority, so is processed first...
+        self.reactor.advance(3)
+        self.assertNotIn("events", processed)
+
+        # ... but once the events stream has waited long enough it gets processed.
+        self.reactor.advance(3)
+        self.assertIn("events", processed)
+
+        # After which the typing stream carries on.
+        self.reactor.advance(3)
+        self.assertEqual(processed[-1], "typing")
+
+
+class RdataBatchTestCase(HomeserverTestCase):
+    def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
+        self.cmd_handler = hs.get_replication_command_handler()
+        self.conn = Mock()
+
+        # Record the rows handed on by the command handler.
+        self.received: List[Tuple[int, List[str]]] = []
+
+        async def on_rdata(
+            stream_name: str, instance_name: str, token: int, rows: list
+        ) -> None:
+            self.received.append((token, [row.cache_func for row in rows]))
+
+        patcher = patch.object(self.cmd_handler, "on_rdata", new=on_rdata)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.token = self.cmd_handler._streams[CachesStream.NAME].current_token("other")
+
+    def _connect(self) -> None:
+        """Mark the caches stream as connected, as if we had processed a POSITION."""
+        self.cmd_handler._streams_by_connection[self.conn] = {CachesStream.NAME}
+
+    def _process(self, updates: List[Tuple[int, str]]) -> None:
+        cmd = RdataBatchCommand(
+            CachesStream.NAME,
+            "other",
+            [(token, (func, None, 0)) for token, func in updates],
+        )
+        self.get_success(
+            self.cmd_handler._process_rdata_batch(CachesStream.NAME, self.conn, cmd)
+        )
+
+    def test_rows_grouped_by_token(self) -> None:
+        """Rows which share a token are handed on together."""
+        self._connect()
+        self._process(
+            [
+                (self.token + 1, "a"),
+                (self.token + 1, "b"),
+                (self.token + 2, "c"),
+                (self.token + 3, "d"),
+                (self.token + 3, "e"),
+            ]
+        )
+
+        self.assertEqual(
+            self.received,
+            [
+                (self.token + 1, ["a", "b"]),
+                (self.token + 2, ["c"]),
+                (self.token + 3, ["d", "e"]),
+            ],
+        )
+
+    def test_discarded_before_position(self) -> None:
+        """Rows are dropped until we've processed a POSITION on the connection."""
+        self.cmd_handler._pending_batches[CachesStream.NAME] = [Mock()]
+        self._process([(self.token + 1, "a")])
+
+        self.assertEqual(self.received, [])
+        # The pending rows from earlier RDATA are left for when we do connect.
+        self.assertEqual(len(self.cmd_handler._pending_batches[CachesStream.NAME]), 1)
+
+    def test_merged_with_pending_rdata(self) -> None:
+        """Rows from earlier RDATA commands without a token are handed on with the
+        first token of the batch."""
+        self._connect()
+        self.get_success(
+            self.cmd_handler._process_rdata(
+                CachesStream.NAME,
+                self.conn,
+                RdataCommand(CachesStream.NAME, "other", None, ("a", None, 0)),
+            )
+        )
+        self.assertEqual(self.received, [])
+
+        self._process([(self.token + 1, "b"), (self.token + 2, "c")])
+
+        self.assertEqual(
+            self.received,
+            [(self.token + 1, ["a", "b"]), (self.token + 2, ["c"])],
+        )
+        self.assertNotIn(CachesStream.NAME, self.cmd_handler._pending_batches)
@@ -0,0 +1,113 @@
+#
+# This file is licensed under the Affero General Public License (AGPL) version 3.
+#
+# Copyright (C) 2024 New Vector, Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# See the GNU Affero General Public License for more details:
+# <https://www.gnu.org/licenses/agpl-3.0.html>.
+#
+from typing import Any, List
+from unittest.mock import Mock, patch
+
+from twisted.test.proto_helpers import MemoryReactor
+
+from synapse.replication.tcp.commands import Command, RdataBatchCommand, RdataCommand
+from synapse.replication.tcp.resource import _chunk_updates
+from synapse.replication.tcp.streams import AccountDataStream
+from synapse.server import HomeServer
+from synapse.util import Clock
+
+from tests.unittest import HomeserverTestCase, TestCase, override_config
+
+
+class ChunkUpdatesTestCase(TestCase):
+    def test_chunks(self) -> None:
+        """Updates are split into chunks of at least the given size."""
+        updates = [(1, "a"), (2, "b"), (3, "c"), (4, "d"), (5, "e")]
+        self.assertEqual(
+            _chunk_updates(updates, 2),
+            [[(1, "a"), (2, "b")], [(3, "c"), (4, "d")], [(5, "e")]],
+        )
+
+    def test_does_not_split_tokens(self) -> None:
+        """Updates which share a token are kept in the same chunk."""
+        updates = [(1, "a"), (1, "b"), (1, "c"), (2, "d"), (3, "e"), (3, "f")]
+        self.assertEqual(
+            _chunk_updates(updates, 2),
+            [[(1, "a"), (1, "b"), (1, "c")], [(2, "d"), (3, "e"), (3, "f")]],
+        )
+
+    def test_empty(self) -> None:
+        self.assertEqual(_chunk_updates([], 2), [])
+
+
+class ReplicationStreamerTestCase(HomeserverTestCase):
+    def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
+        self.store = hs.get_datastores().main
+        self.streamer = hs.get_replication_streamer()
+
+        # Pretend something is listening, and record what gets sent.
+        self.sent: List[Command] = []
+        cmd_handler = hs.get_replication_command_handler()
+        for name, value in (
+            ("connected", Mock(return_value=True)),
+            ("should_announce_positions", Mock(return_value=False)),
+            ("send_command", self.sent.append),
+        ):
+            patcher = patch.object(cmd_handler, name, new=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _add_account_data(self, count: int) -> None:
+        # Stop the streamer from sending the updates as they're added, so that
+        # they all get sent together.
+        self.streamer.is_looping = True
+        for i in range(count):
+            self.get_success(
+                self.store.add_account_data_for_user("@user:test", f"m.test.{i}", {})
+            )
+        self.streamer.is_looping = False
+
+    def _sent_for_stream(self, stream_name: str) -> List[Any]:
+        return [
+            cmd
+            for cmd in self.sent
+            if isinstance(cmd, (RdataCommand, RdataBatchCommand))
+            and cmd.stream_name == stream_name
+        ]
+
+    def test_sends_rdata_by_default(self) -> None:
+        """Without `batch_rdata` each row is sent as its own RDATA."""
+        self._add_account_data(3)
+        self.streamer.on_notifier_poke()
+        self.pump()
+
+        commands = self._sent_for_stream(AccountDataStream.NAME)
+        self.assertEqual(len(commands), 3)
+        self.assertTrue(all(isinstance(cmd, RdataCommand) for cmd in commands))
+
+    @override_config({"redis": {"batch_rdata": True}})
+    def test_sends_rdata_batches(self) -> None:
+        """With `batch_rdata` the rows are sent in RDATA_BATCH commands."""
+        self._add_account_data(5)
+
+        with patch("synapse.replication.tcp.resource._RDATA_BATCH_SIZE", 2):
+            self.streamer.on_notifier_poke()
+            self.pump()
+
+        commands = self._sent_for_stream(AccountDataStream.NAME)
+        self.assertTrue(all(isinstance(cmd, RdataBatchCommand) for cmd in commands))
+        self.assertEqual([len(cmd.updates) for cmd in commands], [2, 2, 1])
+
+        # The updates are in order, and are the rows we added.
+        tokens = [token for cmd in commands for token, _ in cmd.updates]
+        self.assertEqual(tokens, sorted(tokens))
+        self.assertEqual(
+            [row[2] for cmd in commands for _, row in cmd.updates],
+            [f"m.test.{i}" for i in range(5)],
+        )
@@ -21,6 +21,7 @@
 #
 import os
 from typing import Dict
+from unittest.mock import patch
 
 from parameterized import parameterized
 
@@ -874,3 +875,66 @@ class PurgeMediaCacheTestCase(_AdminMediaTests):
             + "Double check that you are providing a timestamp in milliseconds.",
             channel.json_body["error"],
         )
+
+    def test_purge_in_batches(self) -> None:
+        """
+        Remote media is purged in batches, and the progress of the purge is
+        reported.
+        """
+        store = self.hs.get_datastores().main
+        # The API rejects timestamps from 1970.
+        self.reactor.advance(40_000_000)
+        now_ms = self.clock.time_msec()
+
+        paths = []
+        for i in range(5):
+            self.get_success(
+                store.store_cached_remote_media(
+                    origin="example.com",
+                    media_id=f"media{i}",
+                    media_type="text/plain",
+                    media_length=4,
+                    time_now_ms=now_ms + i,
+                    upload_name=None,
+                    filesystem_id=f"file{i}",
+                )
+            )
+            path = self.filepaths.remote_media_filepath("example.com", f"file{i}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(b"test")
+            paths.append(path)
+
+        self.reactor.advance(60)
+
+        with patch("synapse.media.media_repository.MEDIA_PURGE_BATCH_SIZE", 2):
+            channel = self.make_request(
+                "POST",
+                self.url + f"?before_ts={self.clock.time_msec()}",
+                access_token=self.admin_user_tok,
+            )
+
+        self.assertEqual(200, channel.code, msg=channel.json_body)
+        self.assertEqual({"deleted": 5}, channel.json_body)
+
+        for i, path in enumerate(paths):
+            self.assertFalse(os.path.exists(path))
+            self.assertIsNone(
+                self.get_success(
+                    store.get_cached_remote_media("example.com", f"media{i}")
+                )
+            )
+
+        channel = self.make_request(
+            "GET",
+            self.url + "/status",
+            access_token=self.admin_user_tok,
+        )
+
+        self.assertEqual(200, channel.code, msg=channel.json_body)
+        self.assertIsNone(channel.json_body["local"])
+        remote = channel.json_body["remote"]
+        self.assertFalse(remote["running"])
+        self.assertEqual(remote["deleted"], 5)
+        self.assertEqual(remote["failed"], 0)
+        self.assertEqual(remote["last_access_ts"], now_ms + 4)
@@ -1617,6 +1617,130 @@ class MediaConfigTest(unittest.HomeserverTestCase):
         )
 
 
+class MediaRangeTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        media.register_servlets,
+        login.register_servlets,
+        admin.register_servlets,
+    ]
+
+    def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
+        self.repo = hs.get_media_repository()
+        self.register_user("user", "pass")
+        self.tok = self.login("user", "pass")
+
+        self.content = bytes(range(100))
+        content_uri = self.get_success(
+            self.repo.create_content(
+                "video/mp4",
+                "video.mp4",
+                io.BytesIO(self.content),
+                len(self.content),
+                UserID.from_string("@user:test"),
+            )
+        )
+        self.media_id = content_uri.media_id
+
+    def _download(self, headers: Dict[str, str]) -> FakeChannel:
+        channel = self.make_request(
+            "GET",
+            f"/_matrix/client/v1/media/download/test/{self.media_id}",
+            shorthand=False,
+            access_token=self.tok,
+            custom_headers=list(headers.items()),
+        )
+        self.pump()
+        return channel
+
+    def test_range(self) -> None:
+        """A range of bytes can be requested."""
+        channel = self._download({"Range": "bytes=10-19"})
+        self.assertEqual(206, channel.code)
+        self.assertEqual(channel.result["body"], self.content[10:20])
+        self.assertEqual(
+            channel.headers.getRawHeaders("Content-Range"), ["bytes 10-19/100"]
+        )
+        self.assertEqual(channel.headers.getRawHeaders("Content-Length"), ["10"])
+
+        channel = self._download({"Range": "bytes=-5"})
+        self.assertEqual(206, channel.code)
+        self.assertEqual(channel.result["body"], self.content[95:])
+
+    def test_no_range(self) -> None:
+        """The whole file is sent if no range, or an invalid range, is
+        requested, or if an If-Range header is included."""
+        for headers in (
+            {},
+            {"Range": "bytes=19-10"},
+            {"Range": "bytes=10-19", "If-Range": '"abcd"'},
+        ):
+            channel = self._download(headers)
+            self.assertEqual(200, channel.code, headers)
+            self.assertEqual(channel.result["body"], self.content, headers)
+            self.assertEqual(
+                channel.headers.getRawHeaders("Accept-Ranges"), ["bytes"], headers
+            )
+
+    def test_unsatisfiable_range(self) -> None:
+        channel = self._download({"Range": "bytes=100-"})
+        self.assertEqual(416, channel.code)
+        self.assertEqual(
+            channel.headers.getRawHeaders("Content-Range"), ["bytes */100"]
+        )
+
+
+class MediaSendfileTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        media.register_servlets,
+        login.register_servlets,
+        admin.register_servlets,
+    ]
+
+    def default_config(self) -> JsonDict:
+        config = super().default_config()
+        config["media_sendfile"] = {
+            "header": "X-Accel-Redirect",
+            "path_prefix": "/_synapse_media_store/",
+        }
+        return config
+
+    def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
+        self.repo = hs.get_media_repository()
+        self.register_user("user", "pass")
+        self.tok = self.login("user", "pass")
+
+    def test_local_download_delegated_to_proxy(self) -> None:
+        """Local media downloads are sent by the reverse proxy, with an empty
+        body from Synapse."""
+        content_uri = self.get_success(
+            self.repo.create_content(
+                "text/plain",
+                "test_upload",
+                io.BytesIO(b"file_to_stream"),
+                14,
+                UserID.from_string("@user:test"),
+            )
+        )
+
+        channel = self.make_request(
+            "GET",
+            f"/_matrix/client/v1/media/download/test/{content_uri.media_id}",
+            shorthand=False,
+            access_token=self.tok,
+        )
+        self.pump()
+        self.assertEqual(200, channel.code)
+        self.assertEqual(
+            channel.headers.getRawHeaders("X-Accel-Redirect"),
+            [
+                "/_synapse_media_store/"
+                + self.repo.filepaths.local_media_filepath_rel(content_uri.media_id)
+            ],
+        )
+        self.assertEqual(channel.headers.getRawHeaders("Content-Length"), ["0"])
+        self.assertEqual(channel.result.get("body", b""), b"")
+
+
 class RemoteDownloadLimiterTestCase(unittest.HomeserverTestCase):
     servlets = [
         media.register_servlets,
@@ -2065,7 +2189,7 @@ class DownloadAndThumbnailTestCase(unittest.HomeserverTestCase):
         )
         self.assertEqual(
             self.fetches[0][3],
-            {"timeout_ms": "20000"},
+            {"timeout_ms": "60000"},
         )
 
         headers = {
@@ -1173,6 +1173,88 @@ class URLPreviewTests(unittest.HomeserverTestCase):
         )
         self._assert_small_png(body)
 
+    def test_oembed_autodiscovery_fetches_image_in_parallel(self) -> None:
+        """
+        The image from the HTML is requested at the same time as the discovered
+        oEmbed URL, and used if the oEmbed response doesn't replace it.
+        """
+        self.lookups["www.twitter.com"] = [(IPv4Address, "10.1.2.3")]
+        self.lookups["publish.twitter.com"] = [(IPv4Address, "10.1.2.3")]
+        self.lookups["cdn.twitter.com"] = [(IPv4Address, "10.1.2.3")]
+
+        result = b"""
+        <meta property="og:image" content="http://cdn.twitter.com/matrixdotorg" />
+        <link rel="alternate" type="application/json+oembed"
+            href="http://publish.twitter.com/oembed?url=http%3A%2F%2Fcdn.twitter.com%2Fmatrixdotorg%2Fstatus%2F12345&format=json"
+            title="matrixdotorg" />
+        """
+
+        channel = self.make_request(
+            "GET",
+            "/_matrix/media/v3/preview_url?url=http://www.twitter.com/matrixdotorg/status/12345",
+            shorthand=False,
+            await_result=False,
+        )
+        self.pump()
+
+        client = self.reactor.tcpClients[0][2].buildProtocol(None)
+        server = AccumulatingProtocol()
+        server.makeConnection(FakeTransport(client, self.reactor))
+        client.makeConnection(FakeTransport(server, self.reactor))
+        client.dataReceived(
+            (
+                b"HTTP/1.0 200 OK\r\nContent-Length: %d\r\n"
+                b'Content-Type: text/html; charset="utf8"\r\n\r\n'
+            )
+            % (len(result),)
+            + result
+        )
+        self.pump()
+
+        # Both the oEmbed URL and the image are requested before either responds.
+        self.assertEqual(len(self.reactor.tcpClients), 3)
+        connections = []
+        for _, _, factory, _, _ in self.reactor.tcpClients[1:]:
+            client = factory.buildProtocol(None)
+            server = AccumulatingProtocol()
+            server.makeConnection(FakeTransport(client, self.reactor))
+            client.makeConnection(FakeTransport(server, self.reactor))
+            connections.append((client, server))
+        self.pump()
+
+        oembed_content = json.dumps(
+            {"version": "1.0", "type": "rich", "title": "Some Title"}
+        ).encode("utf-8")
+        for client, server in connections:
+            if b"/oembed?" in server.data:
+                client.dataReceived(
+                    (
+                        b"HTTP/1.0 200 OK\r\nContent-Length: %d\r\n"
+                        b'Content-Type: application/json; charset="utf8"\r\n\r\n'
+                    )
+                    % (len(oembed_content),)
+                    + oembed_content
+                )
+            else:
+                self.assertIn(b"/matrixdotorg", server.data)
+                client.dataReceived(
+                    (
+                        b"HTTP/1.0 200 OK\r\nContent-Length: %d\r\n"
+                        b"Content-Type: image/png\r\n\r\n"
+                    )
+                    % (len(SMALL_PNG),)
+                    + SMALL_PNG
+                )
+        self.pump()
+
+        # The image isn't requested again.
+        self.assertEqual(len(self.reactor.tcpClients), 3)
+
+        self.assertEqual(channel.code, 200)
+        body = channel.json_body
+        self.assertEqual(body["og:title"], "Some Title")
+        self._assert_small_png(body)
+
     @unittest.override_config(
         {"url_preview_url_blacklist": [{"netloc": "publish.twitter.com"}]}
     )
@@ -20,10 +20,18 @@
 #
 from unittest.mock import Mock, call
 
+from synapse.replication.tcp.streams import CachesStream
 from synapse.storage.database import LoggingTransaction
+from synapse.storage.databases.main.cache import (
+    BULK_INVALIDATION_CACHE_NAME,
+    BULK_INVALIDATION_MAX_KEYS_PER_ROW,
+    _coalesce_key_tuples,
+    _decode_bulk_invalidation,
+    _encode_bulk_invalidation,
+)
 
 from tests.replication._base import BaseMultiWorkerStreamTestCase
-from tests.unittest import HomeserverTestCase
+from tests.unittest import HomeserverTestCase, TestCase, override_config
 
 
 class CacheInvalidationTestCase(HomeserverTestCase):
@@ -64,6 +72,66 @@ class CacheInvalidationTestCase(HomeserverTestCase):
             any_order=True,
         )
 
+    def test_process_bulk_invalidation_rows(self) -> None:
+        """Bulk invalidation rows received over replication invalidate each of the
+        key-tuples they contain, alongside any individual invalidations."""
+        invalidate = Mock()
+        self.store._get_cached_user_device.invalidate = invalidate
+
+        rows = [
+            CachesStream.CachesStreamRow(
+                cache_func=BULK_INVALIDATION_CACHE_NAME,
+                keys=["_get_cached_user_device", "2", "a", "b", "2", "c", "d"],
+                invalidation_ts=0,
+            ),
+            CachesStream.CachesStreamRow(
+                cache_func="_get_cached_user_device",
+                keys=["e", "f"],
+                invalidation_ts=0,
+            ),
+        ]
+        self.store.process_replication_rows(CachesStream.NAME, "master", 1, rows)
+
+        invalidate.assert_has_calls(
+            [call(("a", "b")), call(("c", "d")), call(("e", "f"))]
+        )
+
+
+class BulkInvalidationEncodingTestCase(TestCase):
+    def test_coalesce(self) -> None:
+        """Duplicate key-tuples, and those covered by a prefix, are dropped."""
+        self.assertEqual(
+            _coalesce_key_tuples(
+                [("a", "b"), ("c", "d"), ("a", "b"), ("c",), ("c", "e"), ("f", "g")]
+            ),
+            [("a", "b"), ("c",), ("f", "g")],
+        )
+
+    def test_round_trip(self) -> None:
+        key_tuples = [("a", "b"), ("c",), ("d", "e", "f")]
+        rows = list(_encode_bulk_invalidation("cache", key_tuples))
+        self.assertEqual(rows, [["cache", "2", "a", "b", "1", "c", "3", "d", "e", "f"]])
+        self.assertEqual(_decode_bulk_invalidation(rows[0]), ("cache", key_tuples))
+
+    def test_chunking(self) -> None:
+        """Large numbers of key-tuples are split across rows, without splitting
+        any key-tuple."""
+        key_tuples = [(str(i), str(i)) for i in range(100)]
+        rows = list(_encode_bulk_invalidation("cache", key_tuples))
+        self.assertGreater(len(rows), 1)
+
+        decoded = []
+        for row in rows:
+            # The cache name, plus a length prefix and two components per key.
+            self.assertLessEqual(
+                len(row), 1 + BULK_INVALIDATION_MAX_KEYS_PER_ROW * 3 // 2
+            )
+            cache_name, row_key_tuples = _decode_bulk_invalidation(row)
+            self.assertEqual(cache_name, "cache")
+            decoded.extend(row_key_tuples)
+
+        self.assertEqual(decoded, key_tuples)
+
 
 class CacheInvalidationOverReplicationTestCase(BaseMultiWorkerStreamTestCase):
     def setUp(self) -> None:
@@ -72,6 +140,16 @@ class CacheInvalidationOverReplicationTestCase(BaseMultiWorkerStreamTestCase):
 
     def test_bulk_invalidation_replicates(self) -> None:
         """Like test_bulk_invalidation, but also checks the invalidations replicate."""
+        # By default, each key-tuple is sent in its own row.
+        self._test_bulk_invalidation_replicates(expected_rows=4)
+
+    @override_config({"redis": {"enabled": True, "batch_cache_invalidations": True}})
+    def test_batched_bulk_invalidation_replicates(self) -> None:
+        """Like test_bulk_invalidation_replicates, but with the invalidations
+        packed into a single row."""
+        self._test_bulk_invalidation_replicates(expected_rows=1)
+
+    def _test_bulk_invalidation_replicates(self, expected_rows: int) -> None:
         master_invalidate = Mock()
         worker_invalidate = Mock()
 
@@ -106,7 +184,7 @@ class CacheInvalidationOverReplicationTestCase(BaseMultiWorkerStreamTestCase):
         )
         second_token = self.store._cache_id_gen.get_current_token()
 
-        self.assertGreaterEqual(second_token, initial_token + len(keys_to_invalidate))
+        self.assertEqual(second_token, initial_token + expected_rows)
 
         self.get_success(
             worker.get_replication_data_handler().wait_for_stream_position(
@@ -19,19 +19,24 @@
 #
 #
 
-from typing import Optional, Tuple
+import threading
+import time
+from typing import List, Optional, Tuple
 
 from twisted.test.proto_helpers import MemoryReactor
 
-from synapse.api.constants import MAIN_TIMELINE, RelationTypes
+from synapse.api.constants import MAIN_TIMELINE, ReceiptTypes, RelationTypes
 from synapse.rest import admin
 from synapse.rest.client import login, room
 from synapse.server import HomeServer
+from synapse.storage.database import LoggingDatabaseConnection, make_conn
 from synapse.storage.databases.main.event_push_actions import NotifCounts
+from synapse.storage.engines._base import IsolationLevel
 from synapse.types import JsonDict
 from synapse.util import Clock
 
-from tests.unittest import HomeserverTestCase
+from tests.unittest import HomeserverTestCase, skip_unless
+from tests.utils import USE_POSTGRES_FOR_TESTS
 
 
 class EventPushActionsStoreTestCase(HomeserverTestCase):
@@ -747,6 +752,344 @@ class EventPushActionsStoreTestCase(HomeserverTestCase):
         )
         _assert_counts(1, 2)
 
+    def test_materialized_counts(self) -> None:
+        """The unread counts are materialized after they are first calculated, and
+        are then kept up to date as push actions and receipts arrive."""
+        user_id, token, _, other_token, room_id = self._create_users_and_room()
+
+        def _get_counts() -> Tuple[NotifCounts, NotifCounts]:
+            """Returns the materialized counts, and the counts calculated from
+            the summary and push actions."""
+            materialized = self.get_success(
+                self.store.db_pool.runInteraction(
+                    "get-unread-counts",
+                    self.store._get_event_push_counts_txn,
+                    room_id,
+                    user_id,
+                )
+            )
+            assert materialized is not None
+            self.get_success(
+                self.store.db_pool.simple_delete(
+                    "event_push_counts_rooms",
+                    keyvalues={"user_id": user_id, "room_id": room_id},
+                    desc="",
+                )
+            )
+            calculated = self.get_success(
+                self.store.db_pool.runInteraction(
+                    "get-unread-counts",
+                    self.store._get_unread_counts_by_receipt_txn,
+                    room_id,
+                    user_id,
+                )
+            )
+            return materialized.main_timeline, calculated.main_timeline
+
+        def _assert_counts(notif_count: int, highlight_count: int) -> None:
+            materialized, calculated = _get_counts()
+            expected = NotifCounts(
+                notify_count=notif_count,
+                unread_count=0,
+                highlight_count=highlight_count,
+            )
+            self.assertEqual(materialized, expected)
+            self.assertEqual(calculated, expected)
+
+        def _create_event(highlight: bool = False) -> str:
+            return self.helper.send_event(
+                room_id,
+                type="m.room.message",
+                content={"msgtype": "m.text", "body": user_id if highlight else "msg"},
+                tok=other_token,
+            )["event_id"]
+
+        def _mark_read(event_id: str) -> None:
+            self.get_success(
+                self.store.insert_receipt(
+                    room_id,
+                    "m.read",
+                    user_id=user_id,
+                    event_ids=[event_id],
+                    thread_id=None,
+                    data={},
+                )
+            )
+            # The counts calculated from the summary are only correct once the
+            # receipt has been processed.
+            self.get_success(self.store._rotate_notifs())
+
+        # Nothing is materialized until the counts are first calculated.
+        _create_event()
+        self.assertIsNone(
+            self.get_success(
+                self.store.db_pool.simple_select_one_onecol(
+                    "event_push_counts_rooms",
+                    keyvalues={"user_id": user_id, "room_id": room_id},
+                    retcol="receipt_stream_ordering",
+                    allow_none=True,
+                )
+            )
+        )
+        self.assertEqual(self._get_event_push_counts_users(room_id), [])
+        self.get_success(
+            self.store.get_unread_event_push_actions_by_room_for_user(room_id, user_id)
+        )
+        _assert_counts(1, 0)
+
+        # New push actions are counted.
+        first_event_id = _create_event()
+        _create_event(True)
+        _assert_counts(3, 1)
+
+        # A receipt for an older event only clears the counts before it, even once
+        # the push actions have been rotated into the summary.
+        self.get_success(self.store._rotate_notifs())
+        _mark_read(first_event_id)
+        _assert_counts(1, 1)
+
+        # Redacting an unread event removes it from the counts.
+        highlight_event_id = _create_event(True)
+        _assert_counts(2, 2)
+        channel = self.make_request(
+            "POST",
+            f"/rooms/{room_id}/redact/{highlight_event_id}",
+            content={},
+            access_token=token,
+        )
+        self.assertEqual(channel.code, 200, channel.json_body)
+        _assert_counts(1, 1)
+
+        # A receipt for the latest event clears the counts.
+        _mark_read(_create_event())
+        _assert_counts(0, 0)
+
+        # The materialized counts are used for the badge count too.
+        _create_event()
+        _get_counts()
+        aggregate_counts = self.get_success(
+            self.store.db_pool.runInteraction(
+                "get-aggregate-unread-counts",
+                self.store._get_event_push_counts_by_room_txn,
+                user_id,
+            )
+        )
+        assert aggregate_counts is not None
+        self.assertEqual(aggregate_counts[room_id], 1)
+
+    def _get_event_push_counts_users(self, room_id: str) -> List[str]:
+        """Get the users who have materialized counts in the room."""
+        return self.get_success(
+            self.store.db_pool.simple_select_onecol(
+                "event_push_counts",
+                keyvalues={"room_id": room_id},
+                retcol="user_id",
+            )
+        )
+
+    def _materialize_counts(self, room_id: str, user_id: str) -> None:
+        self.get_success(
+            self.store.get_unread_event_push_actions_by_room_for_user(room_id, user_id)
+        )
+        self.assertEqual(self._get_event_push_counts_users(room_id), [user_id])
+
+    def test_materialized_counts_only_updated_for_materialized_users(self) -> None:
+        """New push actions only update the counts of users whose counts have been
+        materialized."""
+        user_id, _, other_id, other_token, room_id = self._create_users_and_room()
+        third_id = self.register_user("third", "pass")
+        third_token = self.login("third", "pass")
+        self.helper.join(room_id, third_id, tok=third_token)
+
+        self._materialize_counts(room_id, user_id)
+
+        self.helper.send(room_id, body="msg", tok=other_token)
+        self.assertEqual(self._get_event_push_counts_users(room_id), [user_id])
+
+        counts = self.get_success(
+            self.store.get_unread_event_push_actions_by_room_for_user(room_id, user_id)
+        )
+        self.assertEqual(counts.main_timeline.notify_count, 1)
+
+    def test_materialized_counts_wait_for_receipts_to_be_processed(self) -> None:
+        """The counts aren't materialized until the summary is up to date with the
+        user's receipts."""
+        user_id, _, _, other_token, room_id = self._create_users_and_room()
+        event_id = self.helper.send(room_id, body="msg", tok=other_token)["event_id"]
+        self.helper.send(room_id, body="msg", tok=other_token)
+        self.get_success(self.store._rotate_notifs())
+        self.get_success(
+            self.store.insert_receipt(
+                room_id,
+                "m.read",
+                user_id=user_id,
+                event_ids=[event_id],
+                thread_id=None,
+                data={},
+            )
+        )
+
+        def _is_pending() -> Optional[bool]:
+            return self.get_success(
+                self.store.db_pool.simple_select_one_onecol(
+                    "event_push_counts_rooms",
+                    keyvalues={"user_id": user_id, "room_id": room_id},
+                    retcol="pending",
+                    allow_none=True,
+                )
+            )
+
+        self.get_success(
+            self.store.get_unread_event_push_actions_by_room_for_user(room_id, user_id)
+        )
+        self.assertTrue(_is_pending())
+
+        # Once the receipt has been processed, the counts are materialized.
+        self.get_success(self.store._rotate_notifs())
+        self.reactor.advance(30)
+        self.assertFalse(_is_pending())
+
+        counts = self.get_success(
+            self.store.db_pool.runInteraction(
+                "get-unread-counts",
+                self.store._get_event_push_counts_txn,
+                room_id,
+                user_id,
+            )
+        )
+        assert counts is not None
+        self.assertEqual(counts.main_timeline.notify_count, 1)
+
+    def test_materialized_counts_pruned_after_leaving(self) -> None:
+        """The counts stop being maintained once the user leaves the room."""
+        user_id, token, _, other_token, room_id = self._create_users_and_room()
+        self._materialize_counts(room_id, user_id)
+
+        self.helper.leave(room_id, user_id, tok=token)
+        self.get_success(self.store._prune_event_push_counts())
+        self.assertEqual(self._get_event_push_counts_users(room_id), [])
+
+        self.helper.send(room_id, body="msg", tok=other_token)
+        self.assertEqual(self._get_event_push_counts_users(room_id), [])
+
+    def test_materialized_counts_removed_on_purge(self) -> None:
+        """Purging history in the room stops the counts being maintained, as they
+        may include push actions that have been purged."""
+        user_id, _, _, other_token, room_id = self._create_users_and_room()
+        self.helper.send(room_id, body="msg", tok=other_token)
+        self._materialize_counts(room_id, user_id)
+
+        last_event_id = self.helper.send(room_id, body="msg", tok=other_token)[
+            "event_id"
+        ]
+        token = self.get_success(
+            self.store.get_topological_token_for_event(last_event_id)
+        )
+        self.get_success(
+            self.hs.get_storage_controllers().purge_events.purge_history(
+                room_id, self.get_success(token.to_string(self.store)), True
+            )
+        )
+
+        self.assertEqual(self._get_event_push_counts_users(room_id), [])
+
+    @skip_unless(bool(USE_POSTGRES_FOR_TESTS), "Requires Postgres")
+    def test_concurrent_receipts_while_persisting_events(self) -> None:
+        """Read receipts sent while an event is being persisted in the room don't
+        deadlock with each other once it has been persisted."""
+        user_id, _, _, other_token, room_id = self._create_users_and_room()
+        third_id = self.register_user("third", "pass")
+        third_token = self.login("third", "pass")
+        self.helper.join(room_id, third_id, tok=third_token)
+
+        event_id = self.helper.send(room_id, body="msg", tok=other_token)["event_id"]
+        for receipt_user_id in (user_id, third_id):
+            self.get_success(
+                self.store.get_unread_event_push_actions_by_room_for_user(
+                    room_id, receipt_user_id
+                )
+            )
+
+        db_pool = self.store.db_pool
+
+        def connect() -> LoggingDatabaseConnection:
+            conn = make_conn(db_pool._database_config, db_pool.engine, "test")
+            db_pool.engine.attempt_to_set_isolation_level(
+                conn.conn, IsolationLevel.READ_COMMITTED
+            )
+            self.addCleanup(conn.close)
+            return conn
+
+        # Take the lock that persisting an event in the room takes.
+        persist_conn = connect()
+        persist_conn.cursor().execute(
+            "SELECT room_version FROM rooms WHERE room_id = ? FOR SHARE", (room_id,)
+        )
+
+        errors: List[Exception] = []
+
+        def send_receipt(
+            conn: LoggingDatabaseConnection, receipt_user_id: str, stream_id: int
+        ) -> None:
+            txn = conn.cursor(
+                after_callbacks=[], async_after_callbacks=[], exception_callbacks=[]
+            )
+            try:
+                self.store._insert_linearized_receipt_txn(
+                    txn,
+                    room_id,
+                    ReceiptTypes.READ,
+                    receipt_user_id,
+                    event_id,
+                    None,
+                    {},
+                    stream_id,
+                )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                errors.append(e)
+
+        stream_id = self.store.get_max_receipt_stream_id().stream
+        threads = [
+            threading.Thread(
+                target=send_receipt, args=(connect(), receipt_user_id, stream_id + i)
+            )
+            for i, receipt_user_id in enumerate((user_id, third_id), start=1)
+        ]
+        for thread in threads:
+            thread.start()
+
+        # Wait for both receipts to be waiting for the lock.
+        txn = persist_conn.cursor()
+        for _ in range(100):
+            txn.execute("SELECT COUNT(*) FROM pg_locks WHERE NOT granted")
+            row = txn.fetchone()
+            assert row is not None
+            if row[0] >= 2:
+                break
+            time.sleep(0.1)
+        else:
+            self.fail("Receipts did not wait for the lock")
+
+        persist_conn.commit()
+        for thread in threads:
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(errors, [])
+
+        for receipt_user_id in (user_id, third_id):
+            counts = self.get_success(
+                db_pool.runInteraction(
+                    "get-unread-counts",
+                    self.store._get_event_push_counts_txn,
+                    room_id,
+                    receipt_user_id,
+                )
+            )
+            assert counts is not None
+            self.assertEqual(counts.main_timeline.notify_count, 0)
+
     def test_find_first_stream_ordering_after_ts(self) -> None:
         def add_event(so: int, ts: int) -> None:
             self.get_success(
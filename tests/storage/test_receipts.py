@@ -23,8 +23,9 @@ from typing import Collection, Optional
 
 from twisted.test.proto_helpers import MemoryReactor
 
-from synapse.api.constants import ReceiptTypes
+from synapse.api.constants import EduTypes, ReceiptTypes
 from synapse.server import HomeServer
+from synapse.storage.databases.main.receipts import RECENT_RECEIPTS_PRUNE_MS
 from synapse.types import UserID, create_requester
 from synapse.util import Clock
 
@@ -307,3 +308,76 @@ class ReceiptTestCase(HomeserverTestCase):
             [ReceiptTypes.READ, ReceiptTypes.READ_PRIVATE], room_id=self.room_id2
         )
         self.assertEqual(res, event2_1_id)
+
+    def test_get_linearized_receipts_for_rooms_from_snapshot(self) -> None:
+        """Incremental receipts are served from the in-memory snapshot, which
+        only keeps the latest receipt per user, and fall back to the database
+        once the snapshot has been pruned."""
+        event1_id = self.create_and_send_event(
+            self.room_id1, UserID.from_string(OTHER_USER_ID)
+        )
+        event2_id = self.create_and_send_event(
+            self.room_id1, UserID.from_string(OTHER_USER_ID)
+        )
+
+        from_key = self.store.get_max_receipt_stream_id()
+
+        for event_id in (event1_id, event2_id):
+            self.get_success(
+                self.store.insert_receipt(
+                    self.room_id1, ReceiptTypes.READ, OUR_USER_ID, [event_id], None, {}
+                )
+            )
+        self.get_success(
+            self.store.insert_receipt(
+                self.room_id1,
+                ReceiptTypes.READ,
+                OTHER_USER_ID,
+                [event2_id],
+                "thread",
+                {},
+            )
+        )
+
+        to_key = self.store.get_max_receipt_stream_id()
+        expected = [
+            {
+                "type": EduTypes.RECEIPT,
+                "room_id": self.room_id1,
+                "content": {
+                    event2_id: {
+                        ReceiptTypes.READ: {
+                            OUR_USER_ID: {},
+                            OTHER_USER_ID: {"thread_id": "thread"},
+                        }
+                    }
+                },
+            }
+        ]
+
+        self.assertIn(self.room_id1, self.store._recent_receipts)
+        res = self.get_success(
+            self.store.get_linearized_receipts_for_rooms(
+                [self.room_id1, self.room_id2], to_key, from_key
+            )
+        )
+        self.assertEqual(res, expected)
+
+        # Receipts before `from_key` are not included.
+        res = self.get_success(
+            self.store.get_linearized_receipts_for_rooms(
+                [self.room_id1, self.room_id2], to_key, to_key
+            )
+        )
+        self.assertEqual(res, [])
+
+        # Once the snapshot has been pruned the receipts come from the database.
+        self.reactor.advance(RECENT_RECEIPTS_PRUNE_MS / 1000)
+        self.reactor.advance(RECENT_RECEIPTS_PRUNE_MS / 1000)
+        self.assertEqual(self.store._recent_receipts, {})
+        res = self.get_success(
+            self.store.get_linearized_receipts_for_rooms(
+                [self.room_id1, self.room_id2], to_key, from_key
+            )
+        )
+        self.assertEqual(res, expected)
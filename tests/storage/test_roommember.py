@@ -90,6 +90,27 @@ class RoomMemberStoreTestCase(unittest.HomeserverTestCase):
         servers = self.get_success(self.store._count_known_servers())
         self.assertEqual(servers, 2)
 
+    def test_do_users_share_a_room(self) -> None:
+        """Only users currently joined to a room with the user are returned, and
+        this is kept up to date as memberships change."""
+        u_dave = self.register_user("dave", "pass")
+
+        self.room = self.helper.create_room_as(self.u_alice, tok=self.t_alice)
+        self.inject_room_member(self.room, self.u_bob, Membership.JOIN)
+        self.inject_room_member(self.room, self.u_charlie.to_string(), Membership.JOIN)
+
+        other_user_ids = [self.u_bob, self.u_charlie.to_string(), u_dave]
+        shared = self.get_success(
+            self.store.do_users_share_a_room(self.u_alice, other_user_ids)
+        )
+        self.assertEqual(shared, {self.u_bob, self.u_charlie.to_string()})
+
+        self.inject_room_member(self.room, self.u_bob, Membership.LEAVE)
+        shared = self.get_success(
+            self.store.do_users_share_a_room(self.u_alice, other_user_ids)
+        )
+        self.assertEqual(shared, {self.u_charlie.to_string()})
+
     def test_count_known_servers_stat_counter_disabled(self) -> None:
         """
         If enabled, the metrics for how many servers are known will be counted.
@@ -21,7 +21,11 @@ import logging
 from typing import Optional
 from unittest.mock import patch
 
-from synapse.api.constants import EventUnsignedContentFields
+from synapse.api.constants import (
+    AccountDataTypes,
+    EventTypes,
+    EventUnsignedContentFields,
+)
 from synapse.api.room_versions import RoomVersions
 from synapse.events import EventBase, make_event_from_dict
 from synapse.events.snapshot import EventContext
@@ -29,10 +33,18 @@ from synapse.rest import admin
 from synapse.rest.client import login, room
 from synapse.server import HomeServer
 from synapse.types import create_requester
-from synapse.visibility import filter_events_for_client, filter_events_for_server
+from synapse.visibility import (
+    filter_event_for_clients_with_state,
+    filter_events_for_client,
+    filter_events_for_server,
+)
 
 from tests import unittest
-from tests.test_utils.event_injection import inject_event, inject_member_event
+from tests.test_utils.event_injection import (
+    create_event,
+    inject_event,
+    inject_member_event,
+)
 from tests.unittest import HomeserverTestCase
 from tests.utils import create_room
 
@@ -382,6 +394,53 @@ class FilterEventsForClientTestCase(HomeserverTestCase):
             ],
         )
 
+    def test_visibility_state_cached_by_state_group(self) -> None:
+        """Filtering events again should not refetch the state at the events."""
+        self.register_user("resident", "p1")
+        resident_token = self.login("resident", "p1")
+        room_id = self.helper.create_room_as("resident", tok=resident_token)
+
+        self.get_success(
+            inject_visibility_event(self.hs, room_id, "@resident:test", "joined")
+        )
+        events = [
+            self.get_success(
+                inject_message_event(self.hs, room_id, "@resident:test", body=body)
+            )
+            for body in ("one", "two")
+        ]
+
+        storage = self.hs.get_storage_controllers()
+        state_store = storage.state.stores.state
+        with patch.object(
+            state_store,
+            "_get_state_for_groups",
+            wraps=state_store._get_state_for_groups,
+        ) as get_state_for_groups:
+            filtered = self.get_success(
+                filter_events_for_client(storage, "@resident:test", events)
+            )
+            self.assertEqual(len(filtered), 2)
+            self.assertEqual(get_state_for_groups.call_count, 1)
+
+            # The state at the events is now cached, for this user...
+            filtered = self.get_success(
+                filter_events_for_client(storage, "@resident:test", events)
+            )
+            self.assertEqual(len(filtered), 2)
+            self.assertEqual(
+                [e.unsigned[EventUnsignedContentFields.MEMBERSHIP] for e in filtered],
+                ["join", "join"],
+            )
+            self.assertEqual(get_state_for_groups.call_count, 1)
+
+            # ... but not for other users.
+            filtered = self.get_success(
+                filter_events_for_client(storage, "@other:test", events)
+            )
+            self.assertEqual(filtered, [])
+            self.assertEqual(get_state_for_groups.call_count, 2)
+
 
 class FilterEventsOutOfBandEventsForClientTestCase(
     unittest.FederatingHomeserverTestCase
@@ -466,6 +525,87 @@ class FilterEventsOutOfBandEventsForClientTestCase(
         )
 
 
+class FilterEventForClientsWithStateTestCase(HomeserverTestCase):
+    servlets = [
+        admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+    ]
+
+    def test_filter_users(self) -> None:
+        """Check which of a set of users can see an event, based on their
+        membership and ignore lists.
+        """
+        self.register_user("resident", "p1")
+        resident_token = self.login("resident", "p1")
+        room_id = self.helper.create_room_as("resident", tok=resident_token)
+
+        self.get_success(
+            inject_visibility_event(self.hs, room_id, "@resident:test", "invited")
+        )
+        for user_id, membership in (
+            ("@invitee:test", "invite"),
+            ("@leaver:test", "join"),
+            ("@leaver:test", "leave"),
+            ("@ignorer:test", "join"),
+        ):
+            self.get_success(inject_member_event(self.hs, room_id, user_id, membership))
+
+        self.get_success(
+            self.hs.get_account_data_handler().add_account_data_for_user(
+                "@ignorer:test",
+                AccountDataTypes.IGNORED_USER_LIST,
+                {"ignored_users": {"@resident:test": {}}},
+            )
+        )
+
+        user_ids = [
+            "@resident:test",
+            "@invitee:test",
+            "@leaver:test",
+            "@ignorer:test",
+            "@stranger:test",
+        ]
+
+        event, context = self.get_success(
+            create_event(
+                self.hs,
+                type="m.room.message",
+                sender="@resident:test",
+                room_id=room_id,
+                content={"body": "hello", "msgtype": "m.text"},
+            )
+        )
+        allowed = self.get_success(
+            filter_event_for_clients_with_state(
+                self.hs.get_datastores().main, user_ids, event, context
+            )
+        )
+        self.assertEqual(set(allowed), {"@resident:test", "@invitee:test"})
+
+        # A user can see their own membership event, even though they couldn't see
+        # other events at that point.
+        event, context = self.get_success(
+            create_event(
+                self.hs,
+                type=EventTypes.Member,
+                sender="@stranger:test",
+                state_key="@stranger:test",
+                room_id=room_id,
+                content={"membership": "join"},
+            )
+        )
+        allowed = self.get_success(
+            filter_event_for_clients_with_state(
+                self.hs.get_datastores().main, user_ids, event, context
+            )
+        )
+        self.assertEqual(
+            set(allowed),
+            {"@resident:test", "@invitee:test", "@ignorer:test", "@stranger:test"},
+        )
+
+
 async def inject_visibility_event(
     hs: HomeServer,
     room_id: str,
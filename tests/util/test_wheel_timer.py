@@ -78,3 +78,32 @@ class WheelTimerTestCase(unittest.TestCase):
         self.assertListEqual(wheel.fetch(147), [obj2])
         self.assertListEqual(wheel.fetch(200), [obj1])
         self.assertListEqual(wheel.fetch(240), [])
+
+    def test_insert_far_future(self) -> None:
+        """Objects which expire beyond the bottom level of the wheel are moved
+        down as they come into range, and returned at the right time."""
+        wheel: WheelTimer[object] = WheelTimer(bucket_size=5, wheel_size=4, levels=2)
+
+        obj1 = object()
+        obj2 = object()
+        wheel.insert(100, obj1, 200)
+        # Beyond the end of the wheel.
+        wheel.insert(100, obj2, 400)
+        self.assertEqual(len(wheel), 2)
+
+        self.assertListEqual(wheel.fetch(199), [])
+        self.assertListEqual(wheel.fetch(205), [obj1])
+        self.assertListEqual(wheel.fetch(399), [])
+        self.assertListEqual(wheel.fetch(405), [obj2])
+        self.assertEqual(len(wheel), 0)
+
+    def test_fetch_after_gap(self) -> None:
+        """Fetching long after objects expire returns all of them at once."""
+        wheel: WheelTimer[object] = WheelTimer(bucket_size=5, wheel_size=4, levels=2)
+
+        objs = [object() for _ in range(10)]
+        for i, obj in enumerate(objs):
+            wheel.insert(100, obj, 100 + 50 * i)
+
+        self.assertCountEqual(wheel.fetch(10000), objs)
+        self.assertListEqual(wheel.fetch(20000), [])